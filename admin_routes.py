@@ -11,7 +11,7 @@ Requiere permisos de superadmin o admin_empresa
 import sqlite3
 import hashlib
 from flask import Blueprint, jsonify, request, session
-from auth_middleware import login_required, require_admin, hash_password
+from auth_middleware import login_required, require_admin, hash_password, invalidar_cache_permisos
 from multiempresa_config import DB_USUARIOS_PATH
 from logger_config import get_logger
 from database_pool import get_database_pool
@@ -27,6 +27,9 @@ def asignar_permisos_segun_rol(usuario_id, empresa_id, rol, cursor):
     - admin: Todos los permisos
     - editor: Todos los permisos
     - consultor: Solo puede ver
+    
+    Usa el cursor del llamador; tras el commit hay que invalidar la cache de
+    permisos con invalidar_cache_permisos(usuario_id, empresa_id).
     """
     # Obtener todos los módulos activos
     cursor.execute('SELECT codigo FROM modulos WHERE activo = 1')
@@ -178,6 +181,9 @@ def crear_usuario():
             
             conn.commit()
         
+        if asignar_empresa and empresa_id_creador:
+            invalidar_cache_permisos(usuario_id, empresa_id_creador)
+        
         logger.info(f"Usuario creado: {username} (ID: {usuario_id})")
         
         return jsonify({'success': True, 'id': usuario_id, 'mensaje': f'Usuario {username} creado correctamente'}), 201
@@ -265,6 +271,9 @@ def actualizar_usuario(usuario_id):
             
             conn.commit()
         
+        if 'rol' in data:
+            invalidar_cache_permisos(usuario_id=usuario_id)
+        
         logger.info(f"Usuario actualizado: ID {usuario_id}")
         
         return jsonify({'success': True, 'mensaje': 'Usuario actualizado correctamente'}), 200
@@ -523,6 +532,9 @@ def actualizar_permisos_usuario(usuario_id):
             
             conn.commit()
         
+        # empresa_id llega del JSON (puede ser texto): invalidar todas las empresas del usuario
+        invalidar_cache_permisos(usuario_id=usuario_id)
+        
         logger.info(f"Permisos actualizados: usuario {usuario_id}, empresa {empresa_id}, módulo {modulo_codigo}")
         
         return jsonify({'success': True, 'mensaje': 'Permisos actualizados correctamente'}), 200
@@ -21,6 +21,7 @@ from logger_config import get_logger
 
 # Sistema Multiempresa
 from multiempresa_config import SESSION_CONFIG, inicializar_bd_usuarios
+from perfiles_conexion import iniciar_benchmark_al_arrancar
 
 # Importar todos los blueprints
 from auth_routes import auth_bp
@@ -92,6 +93,9 @@ def create_app():
     # Configurar manejo de errores
     setup_error_handlers(application)
     
+    # Benchmark de perfiles de conexión en segundo plano (si está activado)
+    iniciar_benchmark_al_arrancar()
+    
     logger.info(f"🚀 Aplicación Flask inicializada - Versión {APP_VERSION}")
     
     return application
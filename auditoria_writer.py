@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ESCRITOR ASÍNCRONO DE AUDITORÍA
+===============================
+Cola acotada + hilo escritor que vuelca los registros de auditoría en lotes
+(executemany en una sola transacción) cada N registros o T milisegundos,
+para que registrar una acción no añada un commit/fsync a la petición.
+"""
+
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, Any
+
+from logger_config import get_logger
+from multiempresa_config import DB_USUARIOS_PATH, AUDITORIA_CONFIG
+
+logger = get_logger(__name__)
+
+INSERT_AUDITORIA = '''
+    INSERT INTO auditoria
+    (usuario_id, empresa_id, accion, modulo, descripcion, ip_address, user_agent)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+@dataclass
+class AuditoriaMetrics:
+    """Métricas del escritor de auditoría"""
+    encolados: int = 0
+    escritos: int = 0
+    descartados: int = 0
+    lotes: int = 0
+    errores_escritura: int = 0
+    max_profundidad: int = 0
+
+class AuditoriaWriter:
+    """
+    Sumidero de auditoría en segundo plano:
+    - Cola acotada (si se llena, el registro se descarta y se contabiliza)
+    - Un hilo escritor por proceso, arrancado en el primer registro
+    - Lotes de hasta TAMANO_LOTE filas o INTERVALO_FLUSH_MS de espera
+    - Vaciado final al apagar el proceso
+    """
+
+    def __init__(self, db_path: str, max_cola: int = AUDITORIA_CONFIG['MAX_COLA'],
+                 tamano_lote: int = AUDITORIA_CONFIG['TAMANO_LOTE'],
+                 intervalo_flush_ms: int = AUDITORIA_CONFIG['INTERVALO_FLUSH_MS']):
+        self.db_path = db_path
+        self.max_cola = max_cola
+        self.tamano_lote = tamano_lote
+        self.intervalo_flush = intervalo_flush_ms / 1000.0
+        self.metrics = AuditoriaMetrics()
+
+        self._cola: queue.Queue = queue.Queue(maxsize=max_cola)
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._shutdown = False
+
+    def registrar(self, registro: tuple) -> bool:
+        """
+        Encola un registro (usuario_id, empresa_id, accion, modulo, descripcion,
+        ip_address, user_agent) sin bloquear. Retorna False si se descartó.
+        """
+        if self._shutdown:
+            return False
+
+        self._iniciar()
+
+        try:
+            self._cola.put_nowait(registro)
+        except queue.Full:
+            with self._lock:
+                self.metrics.descartados += 1
+            return False
+
+        with self._lock:
+            self.metrics.encolados += 1
+            profundidad = self._cola.qsize()
+            if profundidad > self.metrics.max_profundidad:
+                self.metrics.max_profundidad = profundidad
+        return True
+
+    def _iniciar(self):
+        """Arranca el hilo escritor (también tras un fork de gunicorn)"""
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                # Proceso hijo: la cola heredada puede tener un lock tomado por otro hilo
+                self._cola = queue.Queue(maxsize=self.max_cola)
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._bucle, name='auditoria-writer', daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        """Bucle del hilo escritor: agrupa registros y los escribe por lotes"""
+        conn = None
+        while True:
+            try:
+                primero = self._cola.get(timeout=self.intervalo_flush)
+            except queue.Empty:
+                if self._shutdown:
+                    break
+                continue
+
+            if primero is None:
+                self._cola.task_done()
+                break
+
+            lote = [primero]
+            limite = time.monotonic() + self.intervalo_flush
+            fin = False
+            while len(lote) < self.tamano_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    registro = self._cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if registro is None:
+                    fin = True
+                    self._cola.task_done()
+                    break
+                lote.append(registro)
+
+            conn = self._escribir_lote(conn, lote)
+            for _ in lote:
+                self._cola.task_done()
+            if fin:
+                break
+
+        if conn is not None:
+            conn.close()
+
+    def _escribir_lote(self, conn: Optional[sqlite3.Connection], lote: list) -> Optional[sqlite3.Connection]:
+        """Inserta el lote en una única transacción; retorna la conexión a reutilizar"""
+        try:
+            if conn is None:
+                conn = sqlite3.connect(self.db_path, timeout=30.0)
+            with conn:
+                conn.executemany(INSERT_AUDITORIA, lote)
+            with self._lock:
+                self.metrics.escritos += len(lote)
+                self.metrics.lotes += 1
+        except Exception as e:
+            logger.error(f"Error escribiendo lote de auditoría ({len(lote)} registros): {e}", exc_info=True)
+            with self._lock:
+                self.metrics.errores_escritura += 1
+                self.metrics.descartados += len(lote)
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            conn = None
+        return conn
+
+    def flush(self):
+        """Bloquea hasta que todos los registros encolados estén escritos"""
+        if self._hilo is not None and self._hilo.is_alive():
+            self._cola.join()
+
+    def shutdown(self, timeout: float = 5.0):
+        """Vacía la cola y detiene el hilo escritor"""
+        if self._shutdown:
+            return
+        self._shutdown = True
+
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            try:
+                self._cola.put(None, timeout=timeout)
+            except queue.Full:
+                logger.warning("Cola de auditoría llena al apagar, se esperará al vaciado por timeout")
+            self._hilo.join(timeout)
+
+        logger.info(f"Escritor de auditoría detenido: {self.get_metrics()}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Devuelve profundidad de cola y contadores del escritor"""
+        with self._lock:
+            return {
+                'profundidad_cola': self._cola.qsize(),
+                'max_cola': self.max_cola,
+                'max_profundidad': self.metrics.max_profundidad,
+                'encolados': self.metrics.encolados,
+                'escritos': self.metrics.escritos,
+                'descartados': self.metrics.descartados,
+                'lotes': self.metrics.lotes,
+                'errores_escritura': self.metrics.errores_escritura,
+                'hilo_activo': self._hilo is not None and self._hilo.is_alive()
+            }
+
+# =====================================================
+# INSTANCIA GLOBAL
+# =====================================================
+
+_auditoria_writer: Optional[AuditoriaWriter] = None
+_writer_lock = threading.Lock()
+
+def get_auditoria_writer() -> AuditoriaWriter:
+    """
+    Obtiene el escritor de auditoría del proceso (se vacía automáticamente al salir)
+    """
+    global _auditoria_writer
+    with _writer_lock:
+        if _auditoria_writer is None:
+            _auditoria_writer = AuditoriaWriter(DB_USUARIOS_PATH)
+            atexit.register(_auditoria_writer.shutdown)
+        return _auditoria_writer
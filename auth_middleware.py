@@ -11,9 +11,12 @@ Fecha: 2025-10-21
 
 import sqlite3
 import hashlib
+import threading
+import time
 from functools import wraps
 from flask import session, request, jsonify, redirect
 from logger_config import get_logger
+from auditoria_writer import get_auditoria_writer
 from multiempresa_config import (
     DB_USUARIOS_PATH, PUBLIC_ROUTES, ADMIN_ROUTES,
     SECURITY_CONFIG, obtener_db_empresa
@@ -63,20 +66,14 @@ def es_ruta_admin(ruta):
 
 def registrar_auditoria(accion, modulo=None, descripcion=None):
     """
-    Registra una acción en el log de auditoría
+    Registra una acción en el log de auditoría.
+    La escritura se hace en segundo plano por lotes (ver auditoria_writer).
     """
     try:
         usuario_id = session.get('user_id')
         empresa_id = session.get('empresa_id')
         
-        conn = sqlite3.connect(DB_USUARIOS_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO auditoria 
-            (usuario_id, empresa_id, accion, modulo, descripcion, ip_address, user_agent)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        get_auditoria_writer().registrar((
             usuario_id,
             empresa_id,
             accion,
@@ -86,12 +83,61 @@ def registrar_auditoria(accion, modulo=None, descripcion=None):
             request.headers.get('User-Agent', '')[:200]
         ))
         
-        conn.commit()
-        conn.close()
-        
     except Exception as e:
         logger.error(f"Error registrando auditoría: {e}", exc_info=True)
 
+# ============================================================================
+# CACHE DE PERMISOS
+# ============================================================================
+
+# (usuario_id, empresa_id) -> (instante de expiración, {modulo_codigo: {campo: valor}})
+_permisos_cache = {}
+_permisos_cache_lock = threading.Lock()
+
+def obtener_permisos_usuario_empresa(usuario_id, empresa_id):
+    """
+    Retorna la matriz de permisos módulo/acción de un usuario en una empresa.
+    Se carga con una única consulta y se reutiliza en el proceso durante
+    SECURITY_CONFIG['PERMISOS_CACHE_TTL'] segundos.
+    """
+    clave = (usuario_id, empresa_id)
+    ahora = time.monotonic()
+    
+    with _permisos_cache_lock:
+        entrada = _permisos_cache.get(clave)
+    if entrada and entrada[0] > ahora:
+        return entrada[1]
+    
+    conn = sqlite3.connect(DB_USUARIOS_PATH)
+    try:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT *
+            FROM permisos_usuario_modulo
+            WHERE usuario_id = ? 
+            AND empresa_id = ?
+        ''', (usuario_id, empresa_id))
+        permisos = {row['modulo_codigo']: dict(row) for row in cursor.fetchall()}
+    finally:
+        conn.close()
+    
+    with _permisos_cache_lock:
+        _permisos_cache[clave] = (ahora + SECURITY_CONFIG['PERMISOS_CACHE_TTL'], permisos)
+    return permisos
+
+def invalidar_cache_permisos(usuario_id=None, empresa_id=None):
+    """
+    Descarta permisos cacheados. Sin argumentos vacía la cache completa;
+    con usuario_id y/o empresa_id descarta solo las entradas que coinciden.
+    Llamar después del commit que modifica permisos_usuario_modulo.
+    """
+    with _permisos_cache_lock:
+        for clave in list(_permisos_cache):
+            if ((usuario_id is None or clave[0] == usuario_id) and
+                    (empresa_id is None or clave[1] == empresa_id)):
+                del _permisos_cache[clave]
+
 # ============================================================================
 # DECORADORES DE AUTENTICACIÓN
 # ============================================================================
@@ -176,22 +222,10 @@ def require_permission(modulo, accion):
                 return jsonify({'error': 'Sesión inválida'}), 401
             
             try:
-                conn = sqlite3.connect(DB_USUARIOS_PATH)
-                cursor = conn.cursor()
+                permisos_modulo = obtener_permisos_usuario_empresa(usuario_id, empresa_id).get(modulo)
                 
                 campo_permiso = f'puede_{accion}'
-                cursor.execute(f'''
-                    SELECT {campo_permiso}
-                    FROM permisos_usuario_modulo
-                    WHERE usuario_id = ? 
-                    AND empresa_id = ?
-                    AND modulo_codigo = ?
-                ''', (usuario_id, empresa_id, modulo))
-                
-                resultado = cursor.fetchone()
-                conn.close()
-                
-                if not resultado or not resultado[0]:
+                if not permisos_modulo or not permisos_modulo[campo_permiso]:
                     logger.warning(
                         f"Permiso denegado: usuario={session.get('username')}, "
                         f"modulo={modulo}, accion={accion}"
@@ -12,7 +12,9 @@ import factura as factura_module  # Importar el módulo factura con un alias par
 from constantes import *
 from contactos import get_db_connection
 from email_utils import enviar_factura_por_email
+from motor_plantillas import PLANTILLA_FACTURA, contexto_emisor, get_motor_plantillas
 from proforma import app as proforma_app
+from utils_emisor import cargar_datos_emisor
 
 # Configurar logging solo con salida a la consola
 logging.basicConfig(
@@ -27,6 +29,9 @@ logger = logging.getLogger("batchFacturas")
 # Variable global para controlar si se intenta generar PDFs
 GENERAR_PDFS = False  # Desactivamos la generación de PDFs por defecto
 
+# Márgenes que usaba wkhtmltopdf (precargada en los trabajadores de PDF)
+ESTILO_PAGINA_BATCH = '@page { size: A4; margin: 10mm }'
+
 def obtener_contactos_tipo_1():
     """
     Obtiene todos los contactos de tipo 1.
@@ -175,17 +180,16 @@ def generar_factura_pdf(id_factura):
         ruta_archivo = os.path.join(dir_pdf, f'factura_{numero_factura}.pdf')
         
         try:
-            # Leer la plantilla HTML de factura usada en la interfaz web
-            html_path = '/var/www/html/frontend/IMPRIMIR_FACTURA.html'
+            # Plantilla HTML de factura usada en la interfaz web (compilada una vez por proceso)
+            motor = get_motor_plantillas()
+            html_path = motor.ruta_plantilla(PLANTILLA_FACTURA)
             if os.path.exists(html_path):
                 logger.info(f"Utilizando plantilla HTML de factura: {html_path}")
                 
-                with open(html_path, 'r', encoding='utf-8') as f:
-                    html_template = f.read()
-                
-                # Manejar el logo: copiar el archivo a una ubicación local para que wkhtmltopdf pueda acceder a él
+                # Manejar el logo: copiar el archivo a una ubicación local para que WeasyPrint pueda acceder a él
                 logo_path = '/var/www/html/static/img/logo.png'
                 logo_local = os.path.join(dir_pdf, 'logo.png')
+                logo_src = None  # sin logo se usa un marcador de posición
                 
                 try:
                     # Verificar si el logo original existe
@@ -194,19 +198,11 @@ def generar_factura_pdf(id_factura):
                         import shutil
                         shutil.copy2(logo_path, logo_local)
                         logger.info(f"Logo copiado a {logo_local}")
-                        
-                        # Modificar la ruta del logo en el HTML para que sea absoluta
-                        html_template = html_template.replace('src="/static/img/logo.png"', f'src="file://{logo_local}"')
+                        logo_src = f'file://{logo_local}'
                     else:
                         logger.warning(f"Logo no encontrado en {logo_path}")
-                        # Usar un marcador de posición para el logo
-                        logo_pattern = re.compile(r'<img[^>]*?src="[^"]*?logo\.png"[^>]*?>')
-                        html_template = logo_pattern.sub('<div style="font-size: 28px; font-weight: bold; margin: 20px 0; color: #2c3e50; text-align: center;">ALEPH70</div>', html_template)
                 except Exception as e:
                     logger.error(f"Error al manejar el logo: {str(e)}")
-                    # Usar un marcador de posición para el logo
-                    logo_pattern = re.compile(r'<img[^>]*?src="[^"]*?logo\.png"[^>]*?>')
-                    html_template = logo_pattern.sub('<div style="font-size: 28px; font-weight: bold; margin: 20px 0; color: #2c3e50; text-align: center;">ALEPH70</div>', html_template)
                 
                 # Leer el CSS asociado si existe
                 css_content = ""
@@ -228,112 +224,48 @@ def generar_factura_pdf(id_factura):
                     iva = base_imponible * 0.21  # 21% IVA
                     total = base_imponible + iva
                 
-                # Generar HTML de los detalles
-                detalles_html = ""
-                for detalle in detalles_list:
-                    descripcion_html = f"<span class='detalle-descripcion'>{detalle.get('descripcion', '')}</span>" if detalle.get('descripcion') else ''
-                    detalles_html += f"""
-                        <tr>
-                            <td>
-                                <div class="detalle-concepto">
-                                    <span>{detalle.get('concepto', '')}</span>
-                                    {descripcion_html}
-                                </div>
-                            </td>
-                            <td class="cantidad">{detalle.get('cantidad', 0)}</td>
-                            <td class="precio">{"{:.2f}".format(float(detalle.get('precio', 0))).replace('.', ',')}€</td>
-                            <td class="precio">{detalle.get('impuestos', 21)}%</td>
-                            <td class="total">{"{:.2f}".format(float(detalle.get('total', 0))).replace('.', ',')}€</td>
-                        </tr>
-                    """
+                # Líneas de detalle (con columna de IVA)
+                lineas = [{
+                    'concepto': detalle.get('concepto', ''),
+                    'descripcion': detalle.get('descripcion'),
+                    'cantidad': detalle.get('cantidad', 0),
+                    'precio': "{:.2f}".format(float(detalle.get('precio', 0))).replace('.', ','),
+                    'impuestos': detalle.get('impuestos', 21),
+                    'subtotal': "{:.2f}".format(float(detalle.get('total', 0))).replace('.', ',')
+                } for detalle in detalles_list]
                 
-                # Reemplazar placeholders con datos reales
                 # Obtener datos del emisor desde JSON de la empresa
-                from utils_emisor import cargar_datos_emisor
                 emisor = cargar_datos_emisor()
-                
-                replacements = {
-                    'id="numero"></span>': f'id="numero">{factura_dict["numero"]}</span>',
-                    'id="fecha"></span>': f'id="fecha">{fecha_formateada}</span>',
-                    '<p id="emisor-nombre"></p>': f'<p>{emisor.get("nombre", "")}</p>',
-                    '<p id="emisor-direccion"></p>': f'<p>{emisor.get("direccion", "")}</p>',
-                    '<p id="emisor-cp-ciudad"></p>': f'<p>{emisor.get("ciudad", "")} ({emisor.get("cp", "")}), {emisor.get("provincia", "")}, {emisor.get("pais", "España")}</p>',
-                    '<p id="emisor-nif"></p>': f'<p>{emisor.get("nif", "")}</p>',
-                    '<p id="emisor-email"></p>': f'<p>{emisor.get("email", "")}</p>',
-                    '<p id="razonsocial"></p>': f'<p>{factura_dict["razonsocial"]}</p>',
-                    '<p id="direccion"></p>': f'<p>{factura_dict["direccion"] or ""}</p>',
-                    '<p id="cp-localidad"></p>': f'<p>{", ".join(filter(None, [factura_dict["cp"], factura_dict["localidad"], factura_dict["provincia"]]))}</p>',
-                    '<p id="nif"></p>': f'<p>{factura_dict["identificador"] or ""}</p>',
-                    '<!-- Los detalles se insertarán aquí dinámicamente -->': detalles_html,
-                    'id="base"></span>': f'id="base">{"{:.2f}".format(base_imponible).replace(".", ",")}€</span>',
-                    'id="iva"></span>': f'id="iva">{"{:.2f}".format(iva).replace(".", ",")}€</span>',
-                    'id="total"></span>': f'id="total">{"{:.2f}".format(total).replace(".", ",")}€</span>',
-                }
-                
-                # Añadir reemplazo para la forma de pago
                 logger.info(f"Forma de pago: {forma_pago}")
-                if forma_pago == 'R':
-                    replacements['<p id="forma-pago">Tarjeta</p>'] = '<p id="forma-pago">Pago por transferencia bancaria al siguiente número de cuenta ES4200494752902216156784</p>'
-                else:
-                    forma_pago_texto = obtener_forma_pago(forma_pago)
-                    replacements['<p id="forma-pago">Tarjeta</p>'] = f'<p id="forma-pago">{forma_pago_texto}</p>'
-                
-                # Aplicar todos los reemplazos
-                for old, new in replacements.items():
-                    html_template = html_template.replace(old, new)
-                
-                # Agregar CSS
-                head_end = html_template.find('</head>')
-                if head_end > 0:
-                    html_template = html_template[:head_end] + f'<style>{css_content}</style>' + html_template[head_end:]
                 
-                # Eliminar scripts y dependencias externas
-                html_template = html_template.replace('<script type="module" src="/static/imprimir-factura.js"></script>', '')
+                html_template = motor.renderizar_factura(dict(
+                    contexto_emisor(emisor),
+                    logo_src=logo_src,
+                    logo_alternativo='<div style="font-size: 28px; font-weight: bold; margin: 20px 0; color: #2c3e50; text-align: center;">ALEPH70</div>',
+                    estilos_extra=f'<style>{css_content}</style>',
+                    numero=factura_dict['numero'],
+                    fecha=fecha_formateada,
+                    razonsocial=factura_dict['razonsocial'],
+                    direccion=factura_dict['direccion'],
+                    cp_localidad=", ".join(filter(None, [factura_dict["cp"], factura_dict["localidad"], factura_dict["provincia"]])),
+                    nif=factura_dict['identificador'],
+                    lineas=lineas,
+                    base=f'{"{:.2f}".format(base_imponible).replace(".", ",")}€',
+                    iva=f'{"{:.2f}".format(iva).replace(".", ",")}€',
+                    total=f'{"{:.2f}".format(total).replace(".", ",")}€',
+                    forma_pago=obtener_forma_pago(forma_pago),
+                    mostrar_verifactu=True,
+                    hash=factura_dict.get('hash_factura')
+                ))
 
-                # Crear HTML temporal
-                html_tmp = os.path.join(dir_pdf, f'factura_{numero_factura}.html')
-                with open(html_tmp, 'w', encoding='utf-8') as f:
-                    f.write(html_template)
-                
-                logger.info(f"HTML generado en {html_tmp}")
-                
-                # Intentar convertir a PDF usando wkhtmltopdf
+                # Convertir a PDF con los trabajadores WeasyPrint (servicio_pdf); una factura
+                # sin cambios desde la última ejecución sale de la cache sin volver a generarse
                 try:
-                    import subprocess
-                    if subprocess.run(['which', 'wkhtmltopdf'], capture_output=True).returncode == 0:
-                        logger.info("Utilizando wkhtmltopdf para generar PDF")
-                        
-                        # Opción para incluir el CSS interno
-                        css_option = []
-                        if css_content:
-                            css_tmp = os.path.join(dir_pdf, 'factura-pdf.css')
-                            with open(css_tmp, 'w', encoding='utf-8') as f:
-                                f.write(css_content)
-                            css_option = ['--user-style-sheet', css_tmp]
-                        
-                        # Opciones para que se vea correctamente
-                        options = [
-                            '--encoding', 'utf-8',
-                            '--page-size', 'A4',
-                            '--margin-top', '10mm',
-                            '--margin-bottom', '10mm',
-                            '--margin-left', '10mm',
-                            '--margin-right', '10mm',
-                            '--print-media-type',
-                            '--enable-local-file-access'  # Permitir acceso a archivos locales
-                        ]
-                        
-                        cmd = ['wkhtmltopdf'] + options + css_option + [html_tmp, ruta_archivo]
-                        logger.info(f"Ejecutando comando: {' '.join(cmd)}")
-                        
-                        result = subprocess.run(cmd, capture_output=True, text=True)
-                        if result.returncode == 0:
-                            logger.info(f"PDF generado correctamente en {ruta_archivo}")
-                            return ruta_archivo
-                        else:
-                            logger.error(f"Error al generar PDF: {result.stderr}")
+                    motor.html_a_pdf(html_template, ruta_archivo, estilos=ESTILO_PAGINA_BATCH)
+                    logger.info(f"PDF generado correctamente en {ruta_archivo}")
+                    return ruta_archivo
                 except Exception as e:
-                    logger.error(f"Error al generar PDF con wkhtmltopdf: {str(e)}")
+                    logger.error(f"Error al generar PDF: {str(e)}")
                 
                 # Si no funcionó, intentar usar el módulo factura
                 logger.info("Intentando generar PDF con el módulo factura")
@@ -6,11 +6,11 @@ import sqlite3
 import sys
 import os
 from datetime import datetime, timedelta
-from weasyprint import HTML
 
 from constantes import *
 from db_utils import get_db_connection
 from notificaciones_utils import guardar_notificacion
+from servicio_pdf import get_servicio_pdf
 
 # Configurar logging
 from logger_config import get_logger
@@ -176,7 +176,7 @@ def generar_carta_reclamacion(factura_data, dias_vencidos):
         pdf_filename = f"carta_reclamacion_{factura_data['numero']}_{datetime.now().strftime('%Y%m%d')}.pdf"
         pdf_path = os.path.join(cartas_dir, pdf_filename)
         
-        HTML(string=html_content).write_pdf(pdf_path)
+        get_servicio_pdf().generar(html_content, pdf_path)
         logger.info(f"Carta de reclamación generada: {pdf_path}")
         
         return pdf_path
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CACHE DE RESPUESTAS DE ESTADÍSTICAS
+===================================
+Los informes de estadísticas (informe de situación, evolución mensual, gastos
+por categoría, top 10...) devuelven lo mismo mientras no cambien gastos,
+facturas o tickets. Se cachea la respuesta JSON por proceso con la clave
+(BD de la empresa, endpoint, parámetros) y se sirve mientras coincida la
+versión de datos de la empresa.
+
+La versión vive en la tabla data_version (una fila por tabla vigilada) y la
+incrementan triggers en la misma transacción que cada alta, baja o cambio
+real de fila, así que cualquier escritura (también desde scripts u otros
+procesos) invalida las respuestas de esa empresa.
+
+Excepción: en gastos, el paso automático de puntual entre 0 y 1 no cuenta
+como cambio. Lo recalculan los propios endpoints de estadísticas para el
+periodo consultado y depende solo del resto de columnas; la marca manual
+(puntual = 2) sí invalida. Tampoco cuenta concepto_normalizado, que se
+deriva de concepto (normalizador_conceptos.py); cuando se recalcula en
+bloque por un cambio de reglas, el normalizador incrementa la versión con
+incrementar_version_datos().
+"""
+
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from functools import wraps
+from typing import Any, Dict
+
+from flask import current_app, make_response, request
+
+from db_utils import get_db_connection
+from logger_config import get_logger
+from multiempresa_config import CACHE_ESTADISTICAS_CONFIG
+
+logger = get_logger(__name__)
+
+# Tablas cuyas escrituras invalidan las estadísticas
+TABLAS_VERSIONADAS = ('gastos', 'factura', 'tickets')
+
+# Parámetros que no forman parte de la clave (anti-caché del navegador)
+PARAMETROS_IGNORADOS = frozenset({'t', '_'})
+
+ESQUEMA_VERSION = '''
+    CREATE TABLE IF NOT EXISTS data_version (
+        tabla TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+'''
+
+
+def _condicion_cambio(tabla, columnas):
+    """Cláusula WHEN del trigger de UPDATE: alguna columna cambia realmente de valor"""
+    condiciones = [f'OLD."{col}" IS NOT NEW."{col}"' for col in columnas
+                   if not (tabla == 'gastos' and col in ('puntual', 'concepto_normalizado'))]
+    if tabla == 'gastos' and 'puntual' in columnas:
+        condiciones.append('(OLD.puntual IS NOT NEW.puntual AND (OLD.puntual = 2 OR NEW.puntual = 2))')
+    return ' OR '.join(condiciones)
+
+
+def _sql_triggers(tabla, columnas):
+    """Triggers que incrementan la versión de una tabla: {nombre: CREATE TRIGGER}"""
+    incremento = f"UPDATE data_version SET version = version + 1 WHERE tabla = '{tabla}';"
+    return {
+        f'trg_dv_{tabla}_insert': f'CREATE TRIGGER trg_dv_{tabla}_insert AFTER INSERT ON {tabla} BEGIN {incremento} END',
+        f'trg_dv_{tabla}_update': f'CREATE TRIGGER trg_dv_{tabla}_update AFTER UPDATE ON {tabla} '
+                                  f'WHEN {_condicion_cambio(tabla, columnas)} BEGIN {incremento} END',
+        f'trg_dv_{tabla}_delete': f'CREATE TRIGGER trg_dv_{tabla}_delete AFTER DELETE ON {tabla} BEGIN {incremento} END',
+    }
+
+
+def _cambios_version(cursor, tablas):
+    """
+    Sentencias que faltan para dejar data_version y sus triggers al día con
+    las columnas actuales. Un trigger solo se rehace si su texto en
+    sqlite_master difiere: cambiar el esquema invalida las sentencias
+    preparadas de las demás conexiones.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'data_version'")
+    if cursor.fetchone():
+        sentencias = []
+        marcas = ','.join('?' * len(tablas))
+        cursor.execute(f'SELECT tabla FROM data_version WHERE tabla IN ({marcas})', tablas)
+        con_version = {fila[0] for fila in cursor.fetchall()}
+    else:
+        sentencias = [ESQUEMA_VERSION]
+        con_version = set()
+
+    for tabla in tablas:
+        cursor.execute('PRAGMA table_info(%s)' % tabla)
+        columnas = [fila[1] for fila in cursor.fetchall()]
+        if not columnas:
+            continue  # BD sin esa tabla
+        if tabla not in con_version:
+            sentencias.append(f"INSERT OR IGNORE INTO data_version (tabla, version) VALUES ('{tabla}', 0)")
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (tabla,))
+        existentes = dict(cursor.fetchall())
+        for nombre, sql in _sql_triggers(tabla, columnas).items():
+            if existentes.get(nombre) != sql:
+                sentencias += [f'DROP TRIGGER IF EXISTS {nombre}', sql]
+    return sentencias
+
+
+def instalar_version_datos(conn, tablas=TABLAS_VERSIONADAS):
+    """
+    Crea data_version y (re)crea sus triggers con las columnas actuales de
+    cada tabla vigilada, solo si falta algo o ha cambiado: si ya está al
+    día no se escribe nada ni se toma el bloqueo de escritura. Hace commit.
+    """
+    cursor = conn.cursor()
+    if conn.in_transaction:
+        conn.commit()
+    if not _cambios_version(cursor, tablas):
+        return
+
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        # Otro proceso puede haberlo instalado mientras se esperaba el bloqueo
+        for sentencia in _cambios_version(cursor, tablas):
+            cursor.execute(sentencia)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def incrementar_version_datos(conn, tabla):
+    """
+    Invalida las respuestas que dependen de `tabla` por un cambio que sus
+    triggers no ven (columnas derivadas). Va en la transacción abierta en
+    conn; el commit es del llamante.
+    """
+    try:
+        conn.execute('UPDATE data_version SET version = version + 1 WHERE tabla = ?', (tabla,))
+    except sqlite3.OperationalError:
+        pass  # BD sin data_version: no hay respuestas cacheadas que invalidar
+
+
+_bases_preparadas = set()
+_preparar_lock = threading.Lock()
+
+
+def obtener_version_datos(conn, tablas=TABLAS_VERSIONADAS):
+    """
+    Ruta de la BD y versión de los datos de las tablas indicadas, instalando
+    la tabla y los triggers la primera vez que el proceso las usa en esa BD.
+    Otros módulos vigilan sus propias tablas con la misma data_version.
+
+    Returns:
+        tuple: (db_path, ((tabla, version), ...))
+    """
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA database_list')
+    db_path = cursor.fetchone()[2]
+    if (db_path, tablas) not in _bases_preparadas:
+        with _preparar_lock:
+            if (db_path, tablas) not in _bases_preparadas:
+                instalar_version_datos(conn, tablas)
+                if db_path:  # las BD en memoria no tienen ruta y no se recuerdan
+                    _bases_preparadas.add((db_path, tablas))
+
+    marcas = ','.join('?' * len(tablas))
+    cursor.execute(f'SELECT tabla, version FROM data_version WHERE tabla IN ({marcas}) ORDER BY tabla', tablas)
+    return db_path, tuple((fila[0], fila[1]) for fila in cursor.fetchall())
+
+
+@dataclass
+class CacheEstadisticasMetrics:
+    """Métricas de la cache de estadísticas"""
+    aciertos: int = 0
+    fallos: int = 0
+    obsoletas: int = 0
+    expulsiones: int = 0
+    almacenadas: int = 0
+    errores_version: int = 0
+
+
+class CacheEstadisticas:
+    """
+    LRU de respuestas JSON por proceso:
+    - Clave (db_path, endpoint, parámetros); cada entrada guarda la versión
+      de datos con la que se calculó
+    - Una versión distinta descarta la entrada (obsoleta) y se recalcula
+    - Al superar max_entradas se expulsa la menos usada recientemente
+    """
+
+    def __init__(self, max_entradas: int = CACHE_ESTADISTICAS_CONFIG['MAX_ENTRADAS']):
+        self.max_entradas = max_entradas
+        self.metrics = CacheEstadisticasMetrics()
+        self._entradas: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, version):
+        """Cuerpo cacheado para la clave si se calculó con esta versión; None si no"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.metrics.fallos += 1
+                return None
+            if entrada[0] != version:
+                del self._entradas[clave]
+                self.metrics.obsoletas += 1
+                self.metrics.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.metrics.aciertos += 1
+            return entrada[1], entrada[2]
+
+    def guardar(self, clave, version, cuerpo, mimetype):
+        with self._lock:
+            self._entradas[clave] = (version, cuerpo, mimetype)
+            self._entradas.move_to_end(clave)
+            self.metrics.almacenadas += 1
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.metrics.expulsiones += 1
+
+    def invalidar(self, db_path=None):
+        """Vacía la cache completa o solo las entradas de una BD"""
+        with self._lock:
+            for clave in list(self._entradas):
+                if db_path is None or clave[0] == db_path:
+                    del self._entradas[clave]
+
+    def registrar_error_version(self):
+        with self._lock:
+            self.metrics.errores_version += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Tamaño y contadores de la cache"""
+        with self._lock:
+            consultas = self.metrics.aciertos + self.metrics.fallos
+            return {
+                'entradas': len(self._entradas),
+                'max_entradas': self.max_entradas,
+                'aciertos': self.metrics.aciertos,
+                'fallos': self.metrics.fallos,
+                'obsoletas': self.metrics.obsoletas,
+                'expulsiones': self.metrics.expulsiones,
+                'almacenadas': self.metrics.almacenadas,
+                'errores_version': self.metrics.errores_version,
+                'ratio_aciertos': round(self.metrics.aciertos / consultas, 4) if consultas else 0.0
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache_estadisticas() -> CacheEstadisticas:
+    """Cache única por proceso"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheEstadisticas()
+    return _cache
+
+
+def cachear_respuesta(endpoint):
+    """
+    Decorador para rutas GET de estadísticas: sirve la respuesta cacheada si
+    los datos de la empresa no han cambiado desde que se calculó.
+
+    Solo se cachean respuestas 200 en JSON. Si no se puede leer la versión de
+    datos la ruta se ejecuta normalmente.
+    """
+    def decorador(f):
+        @wraps(f)
+        def envoltura(*args, **kwargs):
+            if not CACHE_ESTADISTICAS_CONFIG['ACTIVA']:
+                return f(*args, **kwargs)
+
+            cache = get_cache_estadisticas()
+            try:
+                with get_db_connection() as conn:
+                    db_path, version = obtener_version_datos(conn)
+            except Exception as e:
+                logger.error(f"No se pudo leer la versión de datos para {endpoint}: {e}", exc_info=True)
+                cache.registrar_error_version()
+                return f(*args, **kwargs)
+
+            parametros = tuple(sorted(
+                (k, v) for k, v in request.args.items(multi=True) if k not in PARAMETROS_IGNORADOS
+            ))
+            # El día entra en la clave: los valores por defecto dependen de la fecha actual
+            clave = (db_path, endpoint, parametros, tuple(sorted(kwargs.items())), date.today().isoformat())
+            cacheada = cache.obtener(clave, version)
+            if cacheada is not None:
+                cuerpo, mimetype = cacheada
+                return current_app.response_class(cuerpo, mimetype=mimetype)
+
+            respuesta = make_response(f(*args, **kwargs))
+            if respuesta.status_code == 200 and respuesta.is_json:
+                cache.guardar(clave, version, respuesta.get_data(), respuesta.mimetype)
+            return respuesta
+        return envoltura
+    return decorador
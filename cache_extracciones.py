@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CACHE DE EXTRACCIONES POR CONTENIDO
+===================================
+Las extracciones con GPT-4 Vision (facturas subidas, facturas recibidas por
+email y tarjetas de contacto) se repiten con el mismo documento cuando el
+usuario reintenta una subida o el mismo adjunto llega dos veces. Cada una
+cuesta una llamada a la API y varios segundos.
+
+Los resultados se guardan en un AlmacenLRU (cache_lru), una BD SQLite local
+compartida por todos los procesos, con la clave:
+- tipo de extracción ('factura', 'factura_email', 'contacto')
+- versión del prompt: cada módulo la declara junto a su prompt y al
+  cambiarla las entradas anteriores dejan de usarse
+- SHA-256 del documento
+- parámetros que cambian el resultado (p. ej. el NIF del cliente a ignorar)
+
+El almacén está acotado en entradas y en bytes: al superar cualquiera de los
+dos límites se expulsan las entradas usadas hace más tiempo. Solo se guardan
+resultados correctos; los errores y los None se vuelven a intentar.
+
+Si dos hilos piden a la vez el mismo documento, el segundo espera al
+primero en lugar de repetir la llamada.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from cache_lru import AlmacenLRU, ProduccionUnica
+from logger_config import get_logger
+from multiempresa_config import CACHE_EXTRACCIONES_CONFIG
+
+logger = get_logger(__name__)
+
+
+def huella(contenido: bytes) -> str:
+    """SHA-256 del documento"""
+    return hashlib.sha256(contenido).hexdigest()
+
+
+@dataclass
+class CacheExtraccionesMetrics:
+    """Métricas de la cache de extracciones"""
+    aciertos: int = 0
+    fallos: int = 0
+    almacenadas: int = 0
+    expulsiones: int = 0
+    esperas: int = 0  # peticiones que esperaron a una extracción en curso
+    errores: int = 0
+    segundos_ahorrados: float = 0.0
+
+
+class CacheExtracciones:
+    """
+    Resultados de extracción en JSON sobre un AlmacenLRU, con la clave
+    'tipo:versión:huella:parámetros'. Un fallo de la cache nunca impide la
+    extracción: se registra y se extrae como si no existiera.
+    """
+
+    def __init__(self, ruta: str = None, max_entradas: int = None, max_bytes: int = None):
+        self.almacen = AlmacenLRU(ruta or CACHE_EXTRACCIONES_CONFIG['RUTA'],
+                                  max_entradas or CACHE_EXTRACCIONES_CONFIG['MAX_ENTRADAS'],
+                                  max_bytes or CACHE_EXTRACCIONES_CONFIG['MAX_BYTES'])
+        self.metrics = CacheExtraccionesMetrics()
+        self._lock = threading.Lock()
+        self._produccion = ProduccionUnica()
+
+    def _contar(self, campo, cantidad=1):
+        with self._lock:
+            setattr(self.metrics, campo, getattr(self.metrics, campo) + cantidad)
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        """Resultado guardado para la clave o None"""
+        try:
+            guardado = self.almacen.obtener(clave)
+        except sqlite3.Error as e:
+            self._contar('errores')
+            logger.error(f"Error leyendo la cache de extracciones: {e}")
+            return None
+        if guardado is None:
+            return None
+        self._contar('segundos_ahorrados', guardado[1])
+        return json.loads(guardado[0].decode('utf-8'))
+
+    def guardar(self, clave: str, resultado: Any, segundos: float):
+        """Guarda el resultado y expulsa las entradas menos usadas si se superan los límites"""
+        try:
+            texto = json.dumps(resultado, ensure_ascii=False, default=str)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Resultado de extracción no serializable, no se cachea: {e}")
+            return
+        try:
+            expulsadas = self.almacen.guardar(clave, texto.encode('utf-8'), segundos)
+        except sqlite3.Error as e:
+            self._contar('errores')
+            logger.error(f"Error guardando en la cache de extracciones: {e}")
+            return
+        self._contar('almacenadas')
+        if expulsadas:
+            self._contar('expulsiones', expulsadas)
+
+    def obtener_o_extraer(self, tipo: str, version: str, contenido: bytes, extraer: Callable[[], Any],
+                          parametros: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Resultado cacheado del documento o, si no lo hay, el de extraer(),
+        que se guarda si no es None. Las excepciones de extraer() se propagan.
+        """
+        clave = ':'.join((tipo, version, huella(contenido), json.dumps(parametros or {}, sort_keys=True, default=str)))
+
+        def buscar():
+            resultado = self.obtener(clave)
+            if resultado is not None:
+                self._contar('aciertos')
+            return resultado
+
+        def generar():
+            self._contar('fallos')
+            inicio = time.perf_counter()
+            resultado = extraer()
+            if resultado is not None:
+                self.guardar(clave, resultado, time.perf_counter() - inicio)
+            return resultado
+
+        return self._produccion.ejecutar(clave, buscar, generar, lambda: self._contar('esperas'))
+
+    def invalidar(self, tipo: Optional[str] = None) -> int:
+        """Borra todas las entradas o las de un tipo; devuelve cuántas"""
+        try:
+            return self.almacen.borrar(None if tipo is None else f'{tipo}:')
+        except sqlite3.Error as e:
+            logger.error(f"Error vaciando la cache de extracciones: {e}")
+            return 0
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Tamaño y contadores de la cache"""
+        try:
+            entradas, total = self.almacen.tamaño()
+        except sqlite3.Error:
+            entradas, total = None, None
+        with self._lock:
+            consultas = self.metrics.aciertos + self.metrics.fallos
+            return {
+                'entradas': entradas,
+                'bytes': total,
+                'max_entradas': self.almacen.max_entradas,
+                'max_bytes': self.almacen.max_bytes,
+                'aciertos': self.metrics.aciertos,
+                'fallos': self.metrics.fallos,
+                'almacenadas': self.metrics.almacenadas,
+                'expulsiones': self.metrics.expulsiones,
+                'esperas': self.metrics.esperas,
+                'errores': self.metrics.errores,
+                'segundos_ahorrados': round(self.metrics.segundos_ahorrados, 1),
+                'ratio_aciertos': round(self.metrics.aciertos / consultas, 4) if consultas else 0.0
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache_extracciones() -> CacheExtracciones:
+    """Cache única por proceso"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheExtracciones()
+    return _cache
+
+
+def cachear_extraccion(tipo: str, version: str):
+    """
+    Decorador para funciones de extracción f(contenido, *args, **kwargs): el
+    resto de argumentos forma parte de la clave. Devuelve una copia nueva del
+    resultado en cada llamada, así que el llamante puede modificarla.
+    """
+    def decorador(f):
+        @wraps(f)
+        def envoltura(contenido, *args, **kwargs):
+            if not CACHE_EXTRACCIONES_CONFIG['ACTIVA'] or not contenido:
+                return f(contenido, *args, **kwargs)
+            parametros = {'args': list(args), **kwargs} if args else kwargs
+            resultado = get_cache_extracciones().obtener_o_extraer(
+                tipo, version, contenido, lambda: f(contenido, *args, **kwargs), parametros
+            )
+            # La primera vez extraer() devuelve el objeto original: copiarlo también
+            return json.loads(json.dumps(resultado, ensure_ascii=False, default=str))
+        return envoltura
+    return decorador
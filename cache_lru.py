@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ALMACÉN LRU EN SQLITE
+=====================
+Base común de las caches por contenido (cache_extracciones, servicio_pdf):
+
+- AlmacenLRU: valores binarios por clave en una BD SQLite local compartida
+  por todos los procesos (WAL), acotada en entradas y en bytes. Al superar
+  cualquiera de los dos límites se expulsan las entradas usadas hace más
+  tiempo. Los errores de SQLite se propagan: cada cache decide cómo
+  registrarlos y sigue trabajando sin ella
+- ProduccionUnica: si dos hilos del proceso piden a la vez un valor que no
+  está guardado, el segundo espera al primero y vuelve a mirar la cache en
+  lugar de generarlo otra vez
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+ESQUEMA = '''
+    CREATE TABLE IF NOT EXISTS entradas (
+        clave TEXT PRIMARY KEY,
+        valor BLOB NOT NULL,
+        tamaño INTEGER NOT NULL,
+        segundos REAL NOT NULL,
+        creado REAL NOT NULL,
+        usado REAL NOT NULL,
+        aciertos INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_entradas_usado ON entradas (usado);
+'''
+
+
+class AlmacenLRU:
+    """Valores por clave en SQLite con expulsión LRU por número de entradas y bytes"""
+
+    def __init__(self, ruta: str, max_entradas: int, max_bytes: int):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._esquema_creado = False
+
+    def _conectar(self):
+        if not self._esquema_creado:
+            os.makedirs(os.path.dirname(os.path.abspath(self.ruta)), exist_ok=True)
+        conn = sqlite3.connect(self.ruta, timeout=10)
+        if not self._esquema_creado:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(ESQUEMA)
+            self._esquema_creado = True
+        return conn
+
+    def obtener(self, clave: str) -> Optional[Tuple[bytes, float]]:
+        """(valor, segundos que costó generarlo) o None; marca la entrada como usada"""
+        conn = self._conectar()
+        try:
+            fila = conn.execute('SELECT valor, segundos FROM entradas WHERE clave = ?', (clave,)).fetchone()
+            if fila is None:
+                return None
+            conn.execute('UPDATE entradas SET usado = ?, aciertos = aciertos + 1 WHERE clave = ?', (time.time(), clave))
+            conn.commit()
+        finally:
+            conn.close()
+        return bytes(fila[0]), fila[1]
+
+    def guardar(self, clave: str, valor: bytes, segundos: float) -> int:
+        """Guarda el valor; devuelve las entradas expulsadas para no superar los límites"""
+        ahora = time.time()
+        conn = self._conectar()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO entradas (clave, valor, tamaño, segundos, creado, usado)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (clave, sqlite3.Binary(valor), len(valor), segundos, ahora, ahora)
+            )
+            expulsadas = self._expulsar(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        return expulsadas
+
+    def _expulsar(self, conn) -> int:
+        entradas, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(tamaño), 0) FROM entradas').fetchone()
+        if entradas <= self.max_entradas and total <= self.max_bytes:
+            return 0
+        sobrantes = []
+        for clave, tamaño in conn.execute('SELECT clave, tamaño FROM entradas ORDER BY usado'):
+            if entradas <= self.max_entradas and total <= self.max_bytes:
+                break
+            sobrantes.append((clave,))
+            entradas -= 1
+            total -= tamaño
+        conn.executemany('DELETE FROM entradas WHERE clave = ?', sobrantes)
+        return len(sobrantes)
+
+    def borrar(self, prefijo: Optional[str] = None) -> int:
+        """Borra todas las entradas o las cuya clave empieza por `prefijo`; devuelve cuántas"""
+        conn = self._conectar()
+        try:
+            if prefijo is None:
+                borradas = conn.execute('DELETE FROM entradas').rowcount
+            else:
+                borradas = conn.execute(
+                    'DELETE FROM entradas WHERE substr(clave, 1, ?) = ?', (len(prefijo), prefijo)
+                ).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return borradas
+
+    def tamaño(self) -> Tuple[int, int]:
+        """(entradas, bytes) guardados"""
+        conn = self._conectar()
+        try:
+            return conn.execute('SELECT COUNT(*), COALESCE(SUM(tamaño), 0) FROM entradas').fetchone()
+        finally:
+            conn.close()
+
+
+class ProduccionUnica:
+    """Una sola generación a la vez de cada clave dentro del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_curso: Dict[Any, threading.Event] = {}
+
+    def ejecutar(self, clave, buscar: Callable[[], Optional[Any]], generar: Callable[[], Any],
+                 al_esperar: Optional[Callable[[], None]] = None) -> Any:
+        """
+        Valor de buscar() o, si devuelve None, el de generar(). Si otro hilo
+        genera ya la misma clave se espera a que termine (llamando antes a
+        al_esperar) y se vuelve a buscar; si su generación falló, este hilo
+        pasa a generar. Las excepciones de generar() se propagan.
+        """
+        while True:
+            valor = buscar()
+            if valor is not None:
+                return valor
+
+            with self._lock:
+                evento = self._en_curso.get(clave)
+                if evento is None:
+                    evento = self._en_curso[clave] = threading.Event()
+                    break
+            if al_esperar is not None:
+                al_esperar()
+            evento.wait()
+
+        try:
+            return generar()
+        finally:
+            with self._lock:
+                if self._en_curso.get(clave) is evento:
+                    del self._en_curso[clave]
+            evento.set()
@@ -4,7 +4,7 @@ import sqlite3
 from datetime import datetime, timedelta
 from flask import Blueprint, jsonify, request
 from constantes import DB_NAME
-from db_utils import get_db_connection
+from db_utils import get_db_connection, get_db_write_connection
 from logger_config import get_logger
 
 # Inicializar logger
@@ -16,97 +16,67 @@ conciliacion_bp = Blueprint('conciliacion', __name__)
 # CONFIGURACIÓN CENTRALIZADA (JSON)
 # ============================================================================
 
-from config_conciliacion import get_tolerancia_conciliacion, set_tolerancia_conciliacion
+from config_conciliacion import get_tolerancia_conciliacion, set_tolerancia_conciliacion, get_presupuesto_combinaciones
+from conciliacion_combinaciones import buscar_combinaciones
+from conciliacion_indice import IndiceDocumentosConciliacion
+from conciliacion_puntuacion import calcular_scores_lote
 
-def encontrar_mejor_combinacion_documentos(documentos, importe_objetivo, tolerancia=1.0):
+def encontrar_combinaciones_documentos(documentos, importe_objetivo, tolerancia=None, top_k=None):
     """
-    Encuentra la mejor combinación de documentos que se aproxime al importe objetivo.
-    Usa programación dinámica para encontrar la combinación óptima.
+    Encuentra las combinaciones de documentos que mejor se aproximan al importe objetivo.
+    Resuelve un subset-sum acotado en céntimos (meet-in-the-middle o DP de bitset)
+    dentro del presupuesto de documentos/tiempo configurado en config_conciliacion.
     
     Args:
         documentos: Lista de dicts con 'id', 'tipo', 'importe'
         importe_objetivo: Importe a alcanzar
-        tolerancia: Diferencia máxima aceptable
+        tolerancia: Diferencia máxima aceptable (por defecto, la configurada)
+        top_k: Número de combinaciones a devolver (por defecto, el configurado)
     
     Returns:
-        (mejor_combinacion, diferencia) o (None, None) si no encuentra combinación válida
+        Lista de (combinacion, diferencia) ordenada de mejor a peor; vacía si no hay
+        ninguna combinación dentro de tolerancia
     """
     if not documentos:
-        return None, None
-    
-    # Convertir importes a centavos para evitar problemas de punto flotante
-    objetivo_centavos = int(round(importe_objetivo * 100))
-    tolerancia_centavos = int(round(tolerancia * 100))
-    
-    # Preparar documentos con importes en centavos
-    docs_centavos = []
-    for doc in documentos:
-        importe_centavos = int(round(doc['importe'] * 100))
-        if importe_centavos > 0:  # Solo documentos con importe positivo
-            docs_centavos.append({
-                'id': doc['id'],
-                'tipo': doc['tipo'],
-                'importe': doc['importe'],
-                'importe_centavos': importe_centavos
-            })
+        return []
     
-    if not docs_centavos:
-        return None, None
+    if tolerancia is None:
+        tolerancia = get_tolerancia_conciliacion()
+    presupuesto = get_presupuesto_combinaciones()
+    if top_k is None:
+        top_k = presupuesto['top_k']
     
-    # Intentar encontrar combinación exacta o muy cercana
-    mejor_combinacion = None
-    mejor_diferencia = float('inf')
+    # Convertir importes a centavos para evitar problemas de punto flotante
+    documentos = documentos[:presupuesto['max_documentos']]
+    importes_centavos = [int(round(doc['importe'] * 100)) for doc in documentos]
     
-    # Programación dinámica: dp[i] = (suma, lista de índices)
-    # Limitamos a combinaciones de hasta 50 documentos para evitar explosión combinatoria
-    max_docs = min(len(docs_centavos), 50)
+    combinaciones, completo = buscar_combinaciones(
+        importes_centavos,
+        int(round(importe_objetivo * 100)),
+        int(round(tolerancia * 100)),
+        top_k=top_k,
+        timeout_ms=presupuesto['timeout_ms']
+    )
     
-    # Probar con diferentes tamaños de combinación (empezar con pocas para ser más rápido)
-    for max_size in [1, 2, 3, 5, 10, 20, max_docs]:
-        if max_size > len(docs_centavos):
-            continue
-            
-        # Generar combinaciones de forma greedy
-        # Ordenar por cercanía al objetivo
-        docs_ordenados = sorted(docs_centavos, 
-                               key=lambda d: abs(d['importe_centavos'] - objetivo_centavos))
-        
-        # Probar combinación greedy
-        combinacion_actual = []
-        suma_actual = 0
-        
-        for doc in docs_ordenados:
-            if len(combinacion_actual) >= max_size:
-                break
-            
-            # Agregar documento si mejora la aproximación o si aún no llegamos al objetivo
-            nueva_suma = suma_actual + doc['importe_centavos']
-            diferencia_con_doc = abs(objetivo_centavos - nueva_suma)
-            diferencia_sin_doc = abs(objetivo_centavos - suma_actual)
-            
-            # Agregar si:
-            # 1. Mejora la diferencia, O
-            # 2. Aún no hemos llegado al objetivo y no nos pasamos demasiado
-            if (diferencia_con_doc < diferencia_sin_doc or 
-                (suma_actual < objetivo_centavos and nueva_suma <= objetivo_centavos + tolerancia_centavos * 2)):
-                combinacion_actual.append(doc)
-                suma_actual = nueva_suma
-        
-        diferencia_actual = abs(objetivo_centavos - suma_actual)
-        
-        if diferencia_actual < mejor_diferencia:
-            mejor_diferencia = diferencia_actual
-            mejor_combinacion = combinacion_actual[:]
-            
-            # Si encontramos combinación dentro de tolerancia, retornar
-            if diferencia_actual <= tolerancia_centavos:
-                return mejor_combinacion, mejor_diferencia / 100.0
+    if not completo:
+        logger.warning(f"Búsqueda de combinaciones incompleta para {importe_objetivo}€ ({len(documentos)} documentos)")
     
-    # Retornar mejor combinación encontrada si está dentro de tolerancia
-    if mejor_diferencia <= tolerancia_centavos:
-        return mejor_combinacion, mejor_diferencia / 100.0
+    return [
+        ([documentos[idx] for idx in sorted(indices)], diferencia_centavos / 100.0)
+        for diferencia_centavos, indices in combinaciones
+    ]
+
+def encontrar_mejor_combinacion_documentos(documentos, importe_objetivo, tolerancia=None):
+    """
+    Encuentra la mejor combinación de documentos que se aproxime al importe objetivo.
     
-    return None, None
+    Returns:
+        (mejor_combinacion, diferencia) o (None, None) si no encuentra combinación válida
+    """
+    combinaciones = encontrar_combinaciones_documentos(documentos, importe_objetivo, tolerancia, top_k=1)
+    if not combinaciones:
+        return None, None
+    return combinaciones[0]
 
 def crear_tabla_conciliacion():
     """Crear tabla para almacenar conciliaciones si no existe"""
@@ -372,6 +342,68 @@ def buscar_coincidencias_automaticas(gasto):
     
     return coincidencias
 
+def buscar_coincidencias_lote(gastos, indice, tolerancia):
+    """
+    Buscar coincidencias automáticas para una lista de gastos usando un índice precargado.
+    Mismos criterios y formato de resultado que buscar_coincidencias_automaticas,
+    sin consultas a la base de datos; todos los pares se puntúan de una vez.
+    
+    Returns:
+        Lista paralela a gastos con las coincidencias de cada uno ordenadas por score
+    """
+    documentos = []
+    posicion_documento = {}
+    pares = []
+    candidatos_por_gasto = []
+    
+    for indice_gasto, gasto in enumerate(gastos):
+        candidatos, por_numero = indice.candidatos(gasto, tolerancia)
+        candidatos_por_gasto.append((candidatos, por_numero))
+        for documento in candidatos:
+            clave = (documento['tipo'], documento['id'])
+            if clave not in posicion_documento:
+                posicion_documento[clave] = len(documentos)
+                documentos.append(documento)
+            pares.append((indice_gasto, posicion_documento[clave]))
+    
+    scores = iter(calcular_scores_lote(gastos, documentos, pares))
+    
+    resultado = []
+    for gasto, (candidatos, por_numero) in zip(gastos, candidatos_por_gasto):
+        importe = abs(gasto['importe_eur'])
+        coincidencias = []
+        for documento in candidatos:
+            coincidencia = {
+                'tipo': documento['tipo'],
+                'id': documento['id'],
+                'numero': documento['numero'],
+                'fecha': documento['fecha'],
+                'importe': documento['total'],
+                'diferencia': abs(documento['total'] - importe),
+                'score': next(scores)
+            }
+            if por_numero:
+                coincidencia['estado'] = documento['estado']
+            coincidencias.append(coincidencia)
+        
+        # Ordenar por score (mayor score = mejor coincidencia)
+        coincidencias.sort(key=lambda x: x['score'], reverse=True)
+        resultado.append(coincidencias)
+    
+    return resultado
+
+def buscar_coincidencias_en_indice(gasto, indice, tolerancia):
+    """Buscar coincidencias automáticas para un gasto usando un índice precargado"""
+    return buscar_coincidencias_lote([gasto], indice, tolerancia)[0]
+
+def cargar_indice_conciliacion():
+    """Cargar en memoria los documentos pendientes de conciliar (una conexión para todo el lote)"""
+    conn = get_db_connection()
+    try:
+        return IndiceDocumentosConciliacion.cargar(conn)
+    finally:
+        conn.close()
+
 def calcular_score(gasto, documento):
     """
     Calcular score de coincidencia (0-120, luego normalizado a 100)
@@ -472,10 +504,11 @@ def calcular_score(gasto, documento):
 
 def conciliar_automaticamente(gasto_id, tipo_documento, documento_id, metodo='automatico'):
     """Crear una conciliación entre un gasto y un documento"""
-    conn = get_db_connection()
+    conn = get_db_write_connection()
     cursor = conn.cursor()
     
     try:
+        cursor.execute('BEGIN IMMEDIATE')
         # Obtener datos del gasto
         cursor.execute('SELECT * FROM gastos WHERE id = ?', (gasto_id,))
         gasto = dict(cursor.fetchone())
@@ -1249,11 +1282,15 @@ def procesar_automatico():
             'detalles': []
         }
         
-        for gasto in gastos_pendientes:
+        # Cargar documentos pendientes una sola vez y puntuar todo el lote
+        indice = cargar_indice_conciliacion()
+        coincidencias_lote = buscar_coincidencias_lote(gastos_pendientes, indice, get_tolerancia_conciliacion())
+        
+        for gasto, coincidencias in zip(gastos_pendientes, coincidencias_lote):
             resultados['procesados'] += 1
             
-            # Buscar coincidencias
-            coincidencias = buscar_coincidencias_automaticas(gasto)
+            # Descartar documentos conciliados con gastos anteriores del lote
+            coincidencias = [c for c in coincidencias if not indice.esta_descartado(c['tipo'], c['id'])]
             
             if coincidencias and len(coincidencias) > 0:
                 mejor = coincidencias[0]
@@ -1268,6 +1305,7 @@ def procesar_automatico():
                     )
                     
                     if success:
+                        indice.descartar(mejor['tipo'], mejor['id'])
                         resultados['conciliados'] += 1
                         resultados['detalles'].append({
                             'gasto_id': gasto['id'],
@@ -1334,9 +1372,13 @@ def ejecutar_cron():
         
         conciliados = 0
         
-        for gasto in gastos_pendientes:
-            # Buscar coincidencias
-            coincidencias = buscar_coincidencias_automaticas(gasto)
+        # Cargar documentos pendientes una sola vez y puntuar todo el lote
+        indice = cargar_indice_conciliacion()
+        coincidencias_lote = buscar_coincidencias_lote(gastos_pendientes, indice, get_tolerancia_conciliacion())
+        
+        for gasto, coincidencias in zip(gastos_pendientes, coincidencias_lote):
+            # Descartar documentos conciliados con gastos anteriores del lote
+            coincidencias = [c for c in coincidencias if not indice.esta_descartado(c['tipo'], c['id'])]
             
             # Solo conciliar si hay una coincidencia con score >= 90%
             if coincidencias and coincidencias[0]['score'] >= 90:
@@ -1349,6 +1391,7 @@ def ejecutar_cron():
                 )
                 
                 if success:
+                    indice.descartar(mejor['tipo'], mejor['id'])
                     conciliados += 1
         
         return jsonify({
@@ -2028,7 +2071,7 @@ def obtener_ingresos_efectivo():
                 f.flush()
             
             mejor_combinacion, diferencia_combinacion = encontrar_mejor_combinacion_documentos(
-                todos_documentos, total_ing, tolerancia=1.0
+                todos_documentos, total_ing, tolerancia=tolerancia_config
             )
             
             with open('/var/www/html/conciliacion_debug.log', 'a', encoding='utf-8') as f:
@@ -2230,6 +2273,7 @@ def obtener_documentos_efectivo():
 @conciliacion_bp.route('/api/conciliacion/conciliar-ingreso-efectivo', methods=['POST'])
 def conciliar_ingreso_efectivo():
     """Conciliar un ingreso en efectivo con facturas/tickets seleccionados"""
+    conn = None
     try:
         data = request.json
         ids_gastos = data.get('ids_gastos', '').split(',')
@@ -2242,7 +2286,7 @@ def conciliar_ingreso_efectivo():
         if not documentos_seleccionados:
             return jsonify({'success': False, 'error': 'No hay documentos seleccionados'}), 400
         
-        conn = get_db_connection()
+        conn = get_db_write_connection()
         cursor = conn.cursor()
         
         # Calcular total de documentos seleccionados
@@ -2302,11 +2346,15 @@ def conciliar_ingreso_efectivo():
             'mensaje': f'Ingreso conciliado: {conciliados} registros'
         })
     except Exception as e:
+        # Devolver la conexión de escritura: si no, el carril queda ocupado
+        if conn:
+            conn.close()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @conciliacion_bp.route('/api/conciliacion/conciliar-liquidacion', methods=['POST'])
 def conciliar_liquidacion():
     """Conciliar una liquidación TPV con sus tickets/facturas"""
+    conn = None
     try:
         data = request.json
         fecha = data.get('fecha')
@@ -2316,9 +2364,6 @@ def conciliar_liquidacion():
         if not fecha:
             return jsonify({'success': False, 'error': 'Fecha requerida'}), 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         # Convertir fecha a formato YYYY-MM-DD
         try:
             if '/' in fecha:
@@ -2330,6 +2375,9 @@ def conciliar_liquidacion():
             logger.error(f"Error: {e}", exc_info=True)
             return jsonify({'success': False, 'error': 'Formato de fecha inválido'}), 400
         
+        conn = get_db_write_connection()
+        cursor = conn.cursor()
+        
         # Obtener IDs de liquidaciones bancarias de esa fecha
         if ids_gastos_str:
             ids_gastos = ids_gastos_str.split(',')
@@ -2461,6 +2509,9 @@ def conciliar_liquidacion():
             'mensaje': f'Liquidación conciliada: {conciliados} registros'
         })
     except Exception as e:
+        # Devolver la conexión de escritura: si no, el carril queda ocupado
+        if conn:
+            conn.close()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @conciliacion_bp.route('/api/conciliacion/documentos_tarjeta', methods=['GET'])
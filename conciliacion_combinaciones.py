@@ -0,0 +1,205 @@
+"""
+Buscador exacto de combinaciones de documentos (subset-sum acotado) para conciliación.
+
+Trabaja siempre en céntimos enteros. Para pocos documentos usa meet-in-the-middle;
+para el resto, una DP de bitset sobre enteros de Python (un bit por céntimo alcanzable)
+limitada a objetivo + tolerancia. No depende de Flask, puede usarse desde scripts cron.
+"""
+import time
+from bisect import bisect_left, bisect_right
+from math import isqrt
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+# Hasta este número de documentos meet-in-the-middle enumera 2^(n/2) sumas por mitad
+MITM_MAX_DOCUMENTOS = 24
+
+# Límites por defecto (sobrescribibles desde config_conciliacion)
+MAX_DOCUMENTOS_DEFECTO = 500
+TIMEOUT_MS_DEFECTO = 250
+TOP_K_DEFECTO = 5
+# Bits totales que pueden ocupar los bitsets guardados de la DP: ~25 MB
+MAX_CELDAS_DEFECTO = 200_000_000
+
+
+def buscar_combinaciones(importes_centavos, objetivo_centavos, tolerancia_centavos,
+                         top_k=TOP_K_DEFECTO, timeout_ms=TIMEOUT_MS_DEFECTO,
+                         max_celdas=MAX_CELDAS_DEFECTO):
+    """
+    Busca subconjuntos cuya suma quede dentro de objetivo ± tolerancia.
+
+    Devuelve una combinación por cada suma alcanzable distinta, ordenadas por
+    diferencia absoluta con el objetivo (y, a igualdad, por menos documentos).
+
+    Args:
+        importes_centavos: Lista de importes positivos en céntimos
+        objetivo_centavos: Importe a alcanzar en céntimos
+        tolerancia_centavos: Diferencia máxima aceptable en céntimos
+        top_k: Número máximo de combinaciones a devolver
+        timeout_ms: Presupuesto de tiempo; al agotarse se usa lo calculado hasta ese punto
+        max_celdas: Presupuesto de memoria de la DP (documentos x céntimos)
+
+    Returns:
+        (combinaciones, completo): combinaciones es una lista de
+        (diferencia_centavos, [indices]) y completo indica si se exploraron
+        todos los documentos dentro del presupuesto
+    """
+    limite_inferior = max(0, objetivo_centavos - tolerancia_centavos)
+    limite_superior = objetivo_centavos + tolerancia_centavos
+    if limite_superior <= 0 or top_k <= 0:
+        return [], True
+
+    # Descartar importes no positivos o que por sí solos superan el límite
+    candidatos = [i for i, importe in enumerate(importes_centavos)
+                  if 0 < importe <= limite_superior]
+    if not candidatos:
+        return [], True
+
+    fin = time.monotonic() + timeout_ms / 1000.0
+
+    if len(candidatos) <= MITM_MAX_DOCUMENTOS:
+        return _meet_in_the_middle(importes_centavos, candidatos, objetivo_centavos,
+                                   limite_inferior, limite_superior, top_k, fin)
+
+    # Si el objetivo supera la mitad del total, buscar el complemento (documentos que
+    # sobran) reduce el tamaño del bitset
+    total = sum(importes_centavos[i] for i in candidatos)
+    if objetivo_centavos - tolerancia_centavos > total // 2 and limite_inferior <= total:
+        objetivo_complemento = total - objetivo_centavos
+        combinaciones, completo = _bitset_dp(
+            importes_centavos, candidatos, objetivo_complemento,
+            max(0, objetivo_complemento - tolerancia_centavos),
+            objetivo_complemento + tolerancia_centavos,
+            top_k, fin, max_celdas, admitir_vacio=True
+        )
+        if completo:
+            return [(diferencia, tuple(sorted(set(candidatos) - set(indices))))
+                    for diferencia, indices in combinaciones], completo
+
+    return _bitset_dp(importes_centavos, candidatos, objetivo_centavos,
+                      limite_inferior, limite_superior, top_k, fin, max_celdas)
+
+
+def _ordenar_resultados(mejores, objetivo_centavos, top_k):
+    """Convierte {suma: indices} en la lista ordenada de (diferencia, indices)"""
+    resultados = sorted(
+        ((abs(suma - objetivo_centavos), indices) for suma, indices in mejores.items()),
+        key=lambda r: (r[0], len(r[1]))
+    )
+    return resultados[:top_k]
+
+
+def _enumerar_sumas(importes_centavos, indices, limite_superior):
+    """Enumera las sumas de todos los subconjuntos de una mitad (menos documentos por suma)"""
+    sumas = {0: ()}
+    for idx in indices:
+        importe = importes_centavos[idx]
+        nuevas = {}
+        for suma, subconjunto in sumas.items():
+            nueva_suma = suma + importe
+            if nueva_suma > limite_superior:
+                continue
+            existente = sumas.get(nueva_suma) or nuevas.get(nueva_suma)
+            if existente is None or len(existente) > len(subconjunto) + 1:
+                nuevas[nueva_suma] = subconjunto + (idx,)
+        sumas.update(nuevas)
+    return sumas
+
+
+def _meet_in_the_middle(importes_centavos, candidatos, objetivo_centavos,
+                        limite_inferior, limite_superior, top_k, fin):
+    """Combina las sumas de dos mitades buscando por bisección en la ventana de tolerancia"""
+    mitad = len(candidatos) // 2
+    sumas_a = _enumerar_sumas(importes_centavos, candidatos[:mitad], limite_superior)
+    sumas_b = _enumerar_sumas(importes_centavos, candidatos[mitad:], limite_superior)
+    claves_b = sorted(sumas_b)
+
+    mejores = {}
+    completo = True
+    for contador, (suma_a, subconjunto_a) in enumerate(sumas_a.items()):
+        if contador % 256 == 0 and time.monotonic() > fin:
+            completo = False
+            break
+        desde = bisect_left(claves_b, limite_inferior - suma_a)
+        hasta = bisect_right(claves_b, limite_superior - suma_a)
+        for suma_b in claves_b[desde:hasta]:
+            total = suma_a + suma_b
+            if total == 0:
+                continue
+            subconjunto = subconjunto_a + sumas_b[suma_b]
+            existente = mejores.get(total)
+            if existente is None or len(existente) > len(subconjunto):
+                mejores[total] = subconjunto
+
+    return _ordenar_resultados(mejores, objetivo_centavos, top_k), completo
+
+
+def _bitset_dp(importes_centavos, candidatos, objetivo_centavos,
+               limite_inferior, limite_superior, top_k, fin, max_celdas, admitir_vacio=False):
+    """
+    DP de subset-sum con un entero como bitset: el bit s indica que la suma s es alcanzable.
+
+    Para reconstruir un subconjunto por suma se guarda el bitset cada ~raíz(n)
+    documentos y los bloques se recalculan al retroceder, así la memoria crece con
+    raíz(n) y no con n. Los documentos se procesan de mayor a menor importe y la
+    reconstrucción descarta primero los pequeños, favoreciendo combinaciones cortas.
+    Con admitir_vacio la suma 0 (ningún documento) es un resultado válido, lo que
+    necesita la búsqueda por complemento.
+    """
+    candidatos = sorted(candidatos, key=lambda i: importes_centavos[i], reverse=True)
+    mascara = (1 << (limite_superior + 1)) - 1
+    bloque = max(1, isqrt(len(candidatos)))
+    max_checkpoints = max(1, max_celdas // (limite_superior + 1) - bloque)
+
+    alcanzables = 1
+    checkpoints = []
+    procesados = 0
+    for posicion, idx in enumerate(candidatos):
+        if posicion % bloque == 0:
+            if len(checkpoints) >= max_checkpoints or time.monotonic() > fin:
+                break
+            checkpoints.append(alcanzables)
+        alcanzables = (alcanzables | (alcanzables << importes_centavos[idx])) & mascara
+        procesados += 1
+
+    completo = procesados == len(candidatos)
+    if not completo:
+        logger.info(f"Subset-sum truncado a {procesados} de {len(candidatos)} documentos por presupuesto")
+
+    # Recorrer sumas alcanzables desde el objetivo hacia fuera
+    sumas = []
+    for diferencia in range(0, limite_superior - limite_inferior + 1):
+        for suma in (objetivo_centavos - diferencia, objetivo_centavos + diferencia):
+            if (limite_inferior <= suma <= limite_superior and (suma > 0 or admitir_vacio)
+                    and (alcanzables >> suma) & 1):
+                if suma not in sumas:
+                    sumas.append(suma)
+        if len(sumas) >= top_k:
+            break
+
+    mejores = {}
+    for suma in sumas[:top_k]:
+        indices = []
+        restante = suma
+        for numero_bloque in range(len(checkpoints) - 1, -1, -1):
+            if restante == 0:
+                break
+            inicio = numero_bloque * bloque
+            final = min(inicio + bloque, procesados)
+            # Bitsets previos a cada documento del bloque
+            previos = [checkpoints[numero_bloque]]
+            for posicion in range(inicio, final - 1):
+                previos.append((previos[-1] | (previos[-1] << importes_centavos[candidatos[posicion]])) & mascara)
+            for posicion in range(final - 1, inicio - 1, -1):
+                if restante == 0:
+                    break
+                if (previos[posicion - inicio] >> restante) & 1:
+                    continue
+                idx = candidatos[posicion]
+                indices.append(idx)
+                restante -= importes_centavos[idx]
+        mejores[suma] = tuple(indices)
+
+    return _ordenar_resultados(mejores, objetivo_centavos, top_k), completo
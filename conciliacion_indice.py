@@ -0,0 +1,174 @@
+"""
+Índice en memoria de documentos pendientes de conciliar (facturas, tickets y proformas).
+
+Permite emparejar todos los gastos pendientes de una pasada: los documentos se cargan
+una sola vez y se indexan por céntimo de importe (con la fecha ordenada dentro de cada
+cubo) y por número de documento según su prefijo F/T/P. Aplica los mismos criterios
+que conciliacion.buscar_coincidencias_automaticas.
+"""
+import re
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+# Número de factura, ticket o proforma en el concepto bancario: F250046, T255678, P250047
+PATRON_NUMERO_DOCUMENTO = re.compile(r'[FTP](\d{6})')
+
+TIPOS_POR_PREFIJO = {'F': 'factura', 'T': 'ticket', 'P': 'proforma'}
+
+# Días de margen alrededor de la fecha del gasto cuando no hay número en el concepto
+DIAS_VENTANA = 15
+
+CONSULTAS_DOCUMENTOS = {
+    'factura': '''
+        SELECT 'factura' as tipo, id, numero, fecha, total, estado, importe_cobrado, fechaCobro
+        FROM factura f
+        WHERE estado IN ('C', 'P', 'V')
+        AND NOT EXISTS (
+            SELECT 1 FROM conciliacion_gastos cg
+            WHERE cg.tipo_documento = 'factura' AND cg.documento_id = f.id
+        )
+    ''',
+    'ticket': '''
+        SELECT 'ticket' as tipo, id, numero, fecha, total, estado, importe_cobrado
+        FROM tickets t
+        WHERE estado = 'C'
+        AND NOT EXISTS (
+            SELECT 1 FROM conciliacion_gastos cg
+            WHERE cg.tipo_documento = 'ticket' AND cg.documento_id = t.id
+        )
+    ''',
+    'proforma': '''
+        SELECT 'proforma' as tipo, id, numero, fecha, total, estado, importe_cobrado
+        FROM proforma p
+        WHERE estado = 'A'
+        AND NOT EXISTS (
+            SELECT 1 FROM conciliacion_gastos cg
+            WHERE cg.tipo_documento = 'proforma' AND cg.documento_id = p.id
+        )
+    '''
+}
+
+
+def parsear_fecha_gasto(fecha_gasto_str):
+    """Convierte la fecha de operación del banco (DD/MM/YYYY o YYYY-MM-DD) a datetime"""
+    if '/' in fecha_gasto_str:
+        return datetime.strptime(fecha_gasto_str, '%d/%m/%Y')
+    return datetime.strptime(fecha_gasto_str, '%Y-%m-%d')
+
+
+def _fecha_busqueda(documento):
+    """Fecha usada en la ventana: fechaCobro (si existe) para facturas cobradas, fecha en el resto"""
+    if documento['tipo'] == 'factura' and documento['estado'] == 'C':
+        return documento.get('fechaCobro') or documento['fecha']
+    return documento['fecha']
+
+
+class IndiceDocumentosConciliacion:
+    """
+    Documentos sin conciliar cargados una vez para emparejar gastos en lote.
+
+    - por_centimo: {tipo: {céntimos: [(fecha_busqueda, documento), ...] ordenado por fecha}}
+    - por_numero: {prefijo F/T/P: {numero: [documento, ...]}}
+    """
+
+    def __init__(self, documentos):
+        self.por_centimo = {tipo: {} for tipo in CONSULTAS_DOCUMENTOS}
+        self.por_numero = {prefijo: {} for prefijo in TIPOS_POR_PREFIJO}
+        self.descartados = set()
+
+        for documento in documentos:
+            if documento['total'] is None:
+                continue
+            centimos = int(round(documento['total'] * 100))
+            fecha = _fecha_busqueda(documento)
+            if fecha is not None:
+                self.por_centimo[documento['tipo']].setdefault(centimos, []).append((fecha, documento))
+            numero = documento.get('numero')
+            if numero:
+                prefijo = _prefijo_tipo(documento['tipo'])
+                self.por_numero[prefijo].setdefault(numero, []).append(documento)
+
+        for cubos in self.por_centimo.values():
+            for entradas in cubos.values():
+                entradas.sort(key=lambda entrada: entrada[0])
+
+        self.total_documentos = len(documentos)
+
+    @classmethod
+    def cargar(cls, conn):
+        """Carga todos los documentos pendientes de conciliar con una consulta por tabla"""
+        cursor = conn.cursor()
+        documentos = []
+        for consulta in CONSULTAS_DOCUMENTOS.values():
+            cursor.execute(consulta)
+            documentos.extend(dict(row) for row in cursor.fetchall())
+        logger.info(f"Índice de conciliación cargado: {len(documentos)} documentos pendientes")
+        return cls(documentos)
+
+    def descartar(self, tipo, documento_id):
+        """Excluye un documento recién conciliado de búsquedas posteriores del mismo lote"""
+        self.descartados.add((tipo, documento_id))
+
+    def esta_descartado(self, tipo, documento_id):
+        """Indica si el documento ya se concilió durante el lote"""
+        return (tipo, documento_id) in self.descartados
+
+    def candidatos(self, gasto, tolerancia):
+        """
+        Documentos candidatos para un gasto, con los mismos criterios que la búsqueda SQL.
+
+        Returns:
+            (candidatos, por_numero): lista de dicts de documento y si se buscó por
+            número de documento en el concepto
+        """
+        importe = abs(gasto['importe_eur'])
+        concepto = (gasto.get('concepto') or '').upper()
+        patron_numero = PATRON_NUMERO_DOCUMENTO.search(concepto)
+
+        if patron_numero:
+            # Con número de documento: solo número e importe (sin filtro de fecha)
+            numero_buscado = patron_numero.group(0)
+            candidatos = [
+                documento
+                for documento in self.por_numero[numero_buscado[0]].get(numero_buscado, [])
+                if abs(documento['total'] - importe) <= tolerancia
+                and not self.esta_descartado(documento['tipo'], documento['id'])
+            ]
+            return candidatos, True
+
+        fecha_gasto = parsear_fecha_gasto(gasto['fecha_operacion'])
+        fecha_inicio = (fecha_gasto - timedelta(days=DIAS_VENTANA)).strftime('%Y-%m-%d')
+        fecha_fin = (fecha_gasto + timedelta(days=DIAS_VENTANA)).strftime('%Y-%m-%d')
+
+        # Cubos de ±1 céntimo extra; el filtro exacto se aplica después en coma flotante
+        centimo_min = int((importe - tolerancia) * 100) - 1
+        centimo_max = int((importe + tolerancia) * 100) + 1
+
+        candidatos = []
+        for tipo in ('factura', 'ticket', 'proforma'):
+            cubos = self.por_centimo[tipo]
+            if len(cubos) < centimo_max - centimo_min:
+                claves = [c for c in cubos if centimo_min <= c <= centimo_max]
+            else:
+                claves = [c for c in range(centimo_min, centimo_max + 1) if c in cubos]
+            for centimos in sorted(claves):
+                entradas = cubos[centimos]
+                desde = bisect_left(entradas, fecha_inicio, key=lambda entrada: entrada[0])
+                hasta = bisect_right(entradas, fecha_fin, key=lambda entrada: entrada[0])
+                for _, documento in entradas[desde:hasta]:
+                    if (abs(documento['total'] - importe) <= tolerancia
+                            and not self.esta_descartado(documento['tipo'], documento['id'])):
+                        candidatos.append(documento)
+        return candidatos, False
+
+
+def _prefijo_tipo(tipo):
+    """Prefijo de número (F/T/P) correspondiente a un tipo de documento"""
+    for prefijo, tipo_prefijo in TIPOS_POR_PREFIJO.items():
+        if tipo_prefijo == tipo:
+            return prefijo
+    raise ValueError(f'Tipo de documento no válido: {tipo}')
@@ -0,0 +1,106 @@
+"""
+Cálculo vectorizado del score de conciliación para lotes de pares (gasto, documento).
+
+Reproduce exactamente conciliacion.calcular_score: las fechas y los dígitos de los
+números de documento se preparan una sola vez por gasto/documento y las puntuaciones
+de importe, fecha y exactitud se calculan con arrays de NumPy.
+"""
+import re
+from datetime import datetime
+
+import numpy as np
+
+from conciliacion_indice import parsear_fecha_gasto
+
+PATRON_NO_DIGITOS = re.compile(r'[^0-9]')
+
+# Umbrales de días y puntos de la puntuación por fecha (30 puntos)
+UMBRALES_DIAS = (0, 1, 3, 7, 15)
+PUNTOS_DIAS = (30, 25, 20, 15, 10)
+
+
+def _preparar_gastos(gastos):
+    """Importe absoluto, ordinal de fecha y concepto en mayúsculas por gasto"""
+    importes = np.array([abs(gasto['importe_eur']) for gasto in gastos], dtype=np.float64)
+    fechas = np.array([parsear_fecha_gasto(gasto['fecha_operacion']).toordinal() for gasto in gastos],
+                      dtype=np.int64)
+    conceptos = [(gasto.get('concepto') or '').upper() for gasto in gastos]
+    return importes, fechas, conceptos
+
+
+def _preparar_documentos(documentos):
+    """Total, ordinal de fecha (fechaCobro si existe), número en mayúsculas y sus dígitos"""
+    totales = np.array([documento['total'] for documento in documentos], dtype=np.float64)
+    fechas = np.array([
+        datetime.strptime(documento.get('fechaCobro') or documento['fecha'], '%Y-%m-%d').toordinal()
+        for documento in documentos
+    ], dtype=np.int64)
+    numeros = [(documento.get('numero') or '').upper() for documento in documentos]
+    digitos = [PATRON_NO_DIGITOS.sub('', numero) for numero in numeros]
+    return totales, fechas, numeros, digitos
+
+
+def _puntos_concepto(concepto_gasto, numero_documento, digitos_doc):
+    """Puntos por aparición del número de documento en el concepto (30/25/20/0)"""
+    if not numero_documento or not concepto_gasto:
+        return 0
+    if numero_documento in concepto_gasto:
+        return 30
+    if len(digitos_doc) >= 4:
+        if digitos_doc in concepto_gasto:
+            return 25
+        if digitos_doc[-4:] in concepto_gasto:
+            return 20
+    return 0
+
+
+def calcular_scores_lote(gastos, documentos, pares):
+    """
+    Calcula el score (0-100) de muchos pares (gasto, documento) a la vez.
+
+    Args:
+        gastos: Lista de dicts de gasto ('importe_eur', 'fecha_operacion', 'concepto')
+        documentos: Lista de dicts de documento ('total', 'fecha', 'fechaCobro', 'numero')
+        pares: Lista de (indice_gasto, indice_documento)
+
+    Returns:
+        list: Scores enteros en el mismo orden que pares, idénticos a calcular_score
+    """
+    if not pares:
+        return []
+
+    importes_gasto, fechas_gasto, conceptos = _preparar_gastos(gastos)
+    totales, fechas_doc, numeros, digitos = _preparar_documentos(documentos)
+
+    indices = np.array(pares, dtype=np.int64)
+    idx_gasto = indices[:, 0]
+    idx_doc = indices[:, 1]
+
+    # Score por diferencia de importe (40 puntos)
+    diferencia = np.abs(importes_gasto[idx_gasto] - totales[idx_doc])
+    exacto = diferencia == 0
+    score = np.where(
+        exacto, 40.0,
+        np.where(diferencia <= 0.01, 35.0,
+                 np.where(diferencia <= 0.02, 30.0, np.maximum(0, 40 - (diferencia * 100))))
+    )
+
+    # Score por diferencia de fecha (30 puntos)
+    dias = np.abs(fechas_gasto[idx_gasto] - fechas_doc[idx_doc])
+    score = score + np.select([dias <= umbral for umbral in UMBRALES_DIAS], PUNTOS_DIAS, default=0)
+
+    # Score por exactitud del importe (20 puntos)
+    score = score + np.where(exacto, 20, np.where(diferencia <= 0.01, 15, 0))
+
+    # Score por coincidencia en concepto (30 puntos)
+    puntos_concepto = np.fromiter(
+        (_puntos_concepto(conceptos[g], numeros[d], digitos[d]) for g, d in pares),
+        dtype=np.int64, count=len(pares)
+    )
+    score = score + puntos_concepto
+
+    # Normalizar a escala 0-100 (máximo posible 120); número en concepto + importe exacto = 100
+    normalizado = np.minimum(100, np.floor((score / 120) * 100)).astype(np.int64)
+    normalizado = np.where((puntos_concepto > 0) & exacto, 100, normalizado)
+
+    return [int(valor) for valor in normalizado]
@@ -55,3 +55,25 @@ def set_tolerancia_conciliacion(nueva_tolerancia):
     except Exception as e:
         print(f"Error actualizando tolerancia: {e}")
         raise
+
+def get_presupuesto_combinaciones():
+    """Obtener límites del buscador de combinaciones de documentos desde archivo JSON"""
+    presupuesto = {
+        'max_documentos': 500,
+        'timeout_ms': 250,
+        'top_k': 5
+    }
+    try:
+        if not os.path.exists(CONFIG_FILE):
+            inicializar_config_conciliacion()
+        
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        
+        presupuesto['max_documentos'] = int(config.get('combinaciones_max_documentos', presupuesto['max_documentos']))
+        presupuesto['timeout_ms'] = int(config.get('combinaciones_timeout_ms', presupuesto['timeout_ms']))
+        presupuesto['top_k'] = int(config.get('combinaciones_top_k', presupuesto['top_k']))
+    except Exception as e:
+        print(f"Error obteniendo presupuesto de combinaciones: {e}")
+    
+    return presupuesto
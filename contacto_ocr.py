@@ -12,6 +12,7 @@ import numpy as np
 import base64
 import os
 import json
+from cache_extracciones import cachear_extraccion
 from logger_config import get_logger
 
 logger = get_logger(__name__)
@@ -230,6 +231,12 @@ def extraer_texto_imagen(imagen_bytes, debug=False):
         raise
 
 
+# Versión del prompt, modelo y post-proceso de extraer_datos_gpt4_vision:
+# cambiarla al modificarlos para no reutilizar resultados cacheados
+PROMPT_VERSION_CONTACTO = 'gpt-4o/contacto/1'
+
+
+@cachear_extraccion('contacto', PROMPT_VERSION_CONTACTO)
 def extraer_datos_gpt4_vision(imagen_bytes):
     """
     Extrae datos de contacto usando GPT-4 Vision API
@@ -1,6 +1,7 @@
 import sqlite3
 from db_utils import get_db_connection
 from functools import lru_cache
+from contactos_indice import indice_codigos_postales
 
 from constantes import *
 from logger_config import get_logger
@@ -13,7 +14,8 @@ logger = get_logger(__name__)
 def obtener_sugerencias_carrer(query):
     """
     Obtiene sugerencias de dirección (carrer) basadas en una consulta de búsqueda.
-    La caché se aplica a las búsquedas más frecuentes.
+    Se sirven desde el índice en memoria de codipostal (contactos_indice);
+    la consulta SQL queda para cuando no se puede construir.
 
     Args:
         query (str): Texto de búsqueda ingresado por el usuario.
@@ -26,6 +28,9 @@ def obtener_sugerencias_carrer(query):
     
     try:
         conn = get_db_connection()
+        indice = indice_codigos_postales(conn)
+        if indice is not None:
+            return indice.calles(query)
         cursor = conn.cursor()
         
         sql = """
@@ -58,6 +63,9 @@ def buscar_codigos_postales(prefijo):
     """Devuelve lista de CP que empiezan por *prefijo* (máx 20)."""
     try:
         conn = get_db_connection()
+        indice = indice_codigos_postales(conn)
+        if indice is not None:
+            return indice.codigos(prefijo)
         cursor = conn.cursor()
         cursor.execute(
             """
@@ -80,6 +88,10 @@ def buscar_codigos_postales(prefijo):
 def obtener_datos_cp(cp):
     try:
         conn = get_db_connection()
+        indice = indice_codigos_postales(conn)
+        if indice is not None:
+            datos = indice.datos_cp(cp)
+            return [datos] if datos else []
         cursor = conn.cursor()
 
         query = """
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ÍNDICE EN MEMORIA DE CALLES Y CÓDIGOS POSTALES
+==============================================
+Autocompletado de direcciones (searchCarrer) y códigos postales (search_cp,
+get_cp) sin recorrer codipostal con LIKE en cada pulsación.
+
+- Se construye una vez por proceso y por origen de los datos maestros: la BD
+  de maestros compartida (una para todas las empresas) o la copia propia de
+  las empresas antiguas. codipostal no se modifica desde la aplicación; la BD
+  compartida se regenera sustituyendo el fichero y entonces se reconstruye
+- Calles distintas ordenadas como ORDER BY carrer (BINARY); las que empiezan
+  por el texto se buscan con bisect y las que lo contienen a partir de las
+  posiciones de su bigrama/trigrama menos frecuente, comprobadas con NumPy
+- Códigos postales distintos ordenados para la búsqueda por prefijo, con las
+  filas de cada uno en orden de rowid
+- Mismos resultados que las consultas SQL a las que sustituye (LOWER y LIKE
+  de SQLite solo pasan a minúsculas A-Z); '%' y '_' se buscan literalmente
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from logger_config import get_logger
+from multiempresa_config import CONTACTOS_INDICE_CONFIG
+from plantilla_empresa import ESQUEMA_MAESTROS
+
+logger = get_logger(__name__)
+
+# LOWER() de SQLite: solo A-Z (en UTF-8 esos bytes no forman parte de otros caracteres)
+_MINUSCULAS_ASCII = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ', b'abcdefghijklmnopqrstuvwxyz')
+
+# Mayor que cualquier carácter: límite superior de un rango de prefijo
+_FIN_PREFIJO = '\U0010ffff'
+
+# Primer bloque de posiciones que se comprueba de una vez (luego se dobla)
+_BLOQUE = 256
+
+# Búsquedas de 1 carácter memorizadas por índice (no tienen n-gramas)
+_MAX_MEMO_CORTAS = 1024
+
+
+def minusculas_sqlite(texto: str) -> str:
+    """Equivalente a LOWER(texto) de SQLite"""
+    return texto.encode('utf-8', 'surrogatepass').translate(_MINUSCULAS_ASCII).decode('utf-8', 'surrogatepass')
+
+
+def _indexar_ngramas(claves: List[str]):
+    """
+    Texto de todas las claves unidas por 0 y posiciones de cada bigrama y
+    trigrama en él, calculados con NumPy. Cada carácter se numera dentro del
+    alfabeto de las claves (0 = separador) y el n-grama es la concatenación
+    de esos números; un bigrama es un trigrama acabado en 0.
+
+    Returns:
+        tuple: ({carácter: número}, bits por carácter, texto, inicio de cada clave,
+                {n-grama: (inicio, fin)}, posiciones de cada n-grama en orden)
+    """
+    if not claves:
+        vacio = np.zeros(0, dtype=np.uint32)
+        return {}, 1, vacio, np.zeros(0, dtype=np.int64), {}, vacio
+    codigos = np.frombuffer('\x00'.join(claves).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    presentes = np.flatnonzero(np.bincount(codigos))
+    presentes = presentes[presentes != 0]
+    numeros = np.zeros(int(codigos.max()) + 1, dtype=np.uint32)
+    numeros[presentes] = np.arange(1, len(presentes) + 1, dtype=np.uint32)
+    alfabeto = dict(zip(map(chr, presentes.tolist()), range(1, len(presentes) + 1)))
+    bits = len(presentes).bit_length()
+
+    texto = numeros[codigos].astype(np.uint16 if len(presentes) < 2 ** 16 else np.uint32)
+    longitudes = np.fromiter(map(len, claves), dtype=np.int64, count=len(claves))
+    inicios_clave = np.r_[0, np.cumsum(longitudes + 1)[:-1]]
+
+    # n-grama en cada posición; los que incluyen un separador no valen
+    caracteres = texto.astype(np.uint64)
+    validos = caracteres != 0
+    bigramas = validos[:-1] & validos[1:]
+    trigramas = bigramas[:-1] & validos[2:]
+    desplazamiento, doble = np.uint64(bits), np.uint64(2 * bits)
+    ngramas = np.concatenate([
+        ((caracteres[:-1] << doble) | (caracteres[1:] << desplazamiento))[bigramas],
+        ((caracteres[:-2] << doble) | (caracteres[1:-1] << desplazamiento) | caracteres[2:])[trigramas]
+    ])
+    posiciones = np.concatenate([np.flatnonzero(bigramas), np.flatnonzero(trigramas)]).astype(np.uint64)
+    del caracteres, validos, bigramas, trigramas
+
+    # Ordenado por n-grama y, dentro de cada uno, por posición (= por calle)
+    bits_posicion = max(len(texto) - 1, 1).bit_length()
+    if 3 * bits + bits_posicion <= 64:
+        compuesto = np.sort((ngramas << np.uint64(bits_posicion)) | posiciones)
+        ngramas, posiciones = compuesto >> np.uint64(bits_posicion), compuesto & np.uint64((1 << bits_posicion) - 1)
+    else:
+        orden = np.lexsort((posiciones, ngramas))
+        ngramas, posiciones = ngramas[orden], posiciones[orden]
+
+    inicios = np.flatnonzero(np.r_[True, ngramas[1:] != ngramas[:-1]])
+    fines = np.r_[inicios[1:], len(ngramas)]
+    listas = dict(zip(ngramas[inicios].tolist(), zip(inicios.tolist(), fines.tolist())))
+    tipo = np.uint32 if bits_posicion <= 32 else np.uint64
+    return alfabeto, bits, texto, inicios_clave, listas, posiciones.astype(tipo)
+
+
+def _minusculas_lista(textos: List[str]) -> List[str]:
+    """minusculas_sqlite de toda la lista de una vez"""
+    if not textos:
+        return []
+    unidos = '\x00'.join(textos)
+    if unidos.count('\x00') != len(textos) - 1:
+        return [minusculas_sqlite(texto) for texto in textos]
+    return minusculas_sqlite(unidos).split('\x00')
+
+
+class IndiceCodigosPostales:
+    """Calles y códigos postales de una tabla codipostal, listos para autocompletar"""
+
+    def __init__(self, conn):
+        """Lee codipostal de la conexión (la de la empresa o la de maestros adjunta)"""
+        # Valores repetidos (CP, población y provincia) se guardan una sola vez
+        unicos: Dict[Any, Any] = {}
+        unico = unicos.setdefault
+
+        # Códigos postales: filas de cada CP en orden de rowid
+        self._filas_cp: Dict[str, tuple] = {}
+        self.filas = 0
+        for cp, grupo in groupby(conn.execute(
+            'SELECT cp, poblacio, provincia FROM codipostal ORDER BY cp, rowid'
+        ), key=itemgetter(0)):
+            lugares = tuple(unico((poblacio, provincia), (poblacio, provincia)) for _, poblacio, provincia in grupo)
+            self._filas_cp[unico(str(cp), str(cp))] = lugares
+            self.filas += len(lugares)
+        # LIKE no distingue mayúsculas A-Z: se busca sobre la clave en minúsculas
+        self._claves_cp, self._cps = map(list, zip(*sorted(
+            (minusculas_sqlite(cp), cp) for cp in self._filas_cp
+        ))) if self._filas_cp else ([], [])
+
+        # Calles: identificador = posición en ORDER BY carrer
+        self._calles: List[str] = []
+        self._cps_calle: List[tuple] = []
+        for calle, grupo in groupby(conn.execute(
+            'SELECT carrer, cp FROM codipostal WHERE carrer IS NOT NULL ORDER BY carrer, rowid'
+        ), key=itemgetter(0)):
+            self._calles.append(calle)
+            self._cps_calle.append(tuple(unico(str(cp), str(cp)) for _, cp in grupo))
+        (self._alfabeto, self._bits, self._texto, self._inicios_calle,
+         self._ngramas, self._posiciones) = _indexar_ngramas(_minusculas_lista(self._calles))
+        self._memo_cortas: Dict[str, List[int]] = {}
+
+    @property
+    def num_calles(self) -> int:
+        return len(self._calles)
+
+    def _apariciones(self, numeros: List[int]):
+        """
+        Posiciones en el texto donde podría empezar la búsqueda (ya numerada),
+        en orden y por bloques cada vez mayores: con coincidencias frecuentes
+        basta con el principio. Se recorren las posiciones del n-grama menos
+        frecuente de la búsqueda, o todo el texto si tiene 1 carácter.
+        """
+        if len(numeros) == 1:
+            inicio, bloque = 0, _BLOQUE * 64
+            while inicio < len(self._texto):
+                yield inicio + np.flatnonzero(self._texto[inicio:inicio + bloque] == numeros[0])
+                inicio += bloque
+                bloque *= 2
+            return
+
+        mejor = None
+        for desfase in range(max(len(numeros) - 2, 1)):
+            clave = 0
+            for numero in numeros[desfase:desfase + 3]:
+                clave = (clave << self._bits) | numero
+            if len(numeros) == 2:
+                clave <<= self._bits
+            rango = self._ngramas.get(clave)
+            if rango is None:
+                return
+            if mejor is None or rango[1] - rango[0] < mejor[1] - mejor[0]:
+                mejor = (rango[0], rango[1], desfase)
+
+        inicio, fin, desfase = mejor
+        bloque = _BLOQUE
+        while inicio < fin:
+            yield self._posiciones[inicio:min(inicio + bloque, fin)].astype(np.int64) - desfase
+            inicio += bloque
+            bloque *= 2
+
+    def _empiezan_por(self, texto: str, limite: int) -> List[int]:
+        """
+        Primeras calles (en orden) cuya clave empieza por texto. Cada forma de
+        escribir el prefijo con mayúsculas y minúsculas es un rango contiguo
+        de calles; se buscan con bisect carácter a carácter las que existen.
+        """
+        calles = self._calles
+        rangos = [('', 0, len(calles))]
+        for caracter in texto:
+            if 'A' <= caracter <= 'Z':
+                return []  # las claves no tienen mayúsculas A-Z
+            variantes = (caracter, caracter.upper()) if 'a' <= caracter <= 'z' else (caracter,)
+            siguientes = []
+            for prefijo, inicio, fin in rangos:
+                for variante in variantes:
+                    prefijo_variante = prefijo + variante
+                    desde = bisect_left(calles, prefijo_variante, inicio, fin)
+                    hasta = bisect_left(calles, prefijo_variante + _FIN_PREFIJO, desde, fin)
+                    if desde < hasta:
+                        siguientes.append((prefijo_variante, desde, hasta))
+            if not siguientes:
+                return []
+            rangos = siguientes
+        return sorted(i for _, inicio, fin in rangos for i in range(inicio, min(fin, inicio + limite)))[:limite]
+
+    def _contienen(self, texto: str, limite: int) -> List[int]:
+        """Primeras calles (en orden) que contienen texto sin empezar por él"""
+        if len(texto) == 1 and texto in self._memo_cortas:
+            return self._memo_cortas[texto]
+        numeros = [self._alfabeto.get(caracter) for caracter in texto]
+        if not numeros or None in numeros:
+            return []
+
+        buscado = np.array(numeros, dtype=self._texto.dtype)
+        desplazamientos = np.arange(len(buscado))
+        maximo = len(self._texto) - len(buscado)
+        encontradas: List[int] = []
+        for inicios in self._apariciones(numeros):
+            inicios = inicios[(inicios >= 0) & (inicios <= maximo)]
+            # Carácter a carácter desde el final, quedándose solo con las que siguen coincidiendo
+            for desplazamiento in reversed(range(len(numeros))):
+                inicios = inicios[self._texto[inicios + desplazamiento] == numeros[desplazamiento]]
+            calles = np.searchsorted(self._inicios_calle, inicios, side='right') - 1
+            # Fuera las que empiezan por el texto (aunque también lo contengan más adelante)
+            principio = self._inicios_calle[calles]
+            empiezan = principio <= maximo
+            empiezan[empiezan] = (self._texto[principio[empiezan, None] + desplazamientos] == buscado).all(axis=1)
+            for calle in calles[~empiezan].tolist():
+                if not encontradas or encontradas[-1] != calle:
+                    encontradas.append(calle)
+                    if len(encontradas) == limite:
+                        break
+            if len(encontradas) == limite:
+                break
+
+        if len(texto) == 1:
+            if len(self._memo_cortas) >= _MAX_MEMO_CORTAS:
+                self._memo_cortas.clear()
+            self._memo_cortas[texto] = encontradas
+        return encontradas
+
+    def calles(self, texto: str, limite: int = 10) -> List[Dict[str, str]]:
+        """
+        Calles que contienen texto (ya en minúsculas): primero las que empiezan
+        por él, cada grupo en orden de carrer; una entrada por fila de codipostal.
+        """
+        resultado = []
+
+        def anadir(identificadores):
+            for identificador in identificadores:
+                for cp in self._cps_calle[identificador]:
+                    resultado.append({'carrer': self._calles[identificador], 'cp': cp})
+                    if len(resultado) == limite:
+                        return True
+            return False
+
+        # Cada calle aporta al menos una fila: bastan `limite` calles por grupo
+        if anadir(self._empiezan_por(texto, limite)):
+            return resultado
+        anadir(self._contienen(texto, limite))
+        return resultado
+
+    def codigos(self, prefijo: str, limite: int = 20) -> List[Dict[str, Any]]:
+        """Registros cuyo CP empieza por prefijo, ordenados por CP"""
+        prefijo = minusculas_sqlite(prefijo)
+        resultado = []
+        for posicion in range(bisect_left(self._claves_cp, prefijo), len(self._cps)):
+            if not self._claves_cp[posicion].startswith(prefijo):
+                break
+            cp = self._cps[posicion]
+            for poblacio, provincia in self._filas_cp[cp]:
+                resultado.append({'cp': cp, 'poblacio': poblacio, 'provincia': provincia})
+                if len(resultado) == limite:
+                    return resultado
+        return resultado
+
+    def datos_cp(self, cp: str) -> Optional[Dict[str, Any]]:
+        """Primer registro del CP exacto, o None"""
+        filas = self._filas_cp.get(cp)
+        if not filas:
+            return None
+        poblacio, provincia = filas[0]
+        return {'cp': cp, 'poblacio': poblacio, 'provincia': provincia}
+
+
+def _origen(conn):
+    """
+    BD de la que sale codipostal para esta conexión: la propia de la empresa
+    o la de maestros adjunta. La compartida lleva su firma (inode, mtime)
+    para detectar que se ha regenerado.
+    """
+    ficheros = {fila[1]: fila[2] for fila in conn.execute('PRAGMA database_list')}
+    for esquema in ('main', ESQUEMA_MAESTROS):
+        if esquema not in ficheros:
+            continue
+        propia = conn.execute(
+            f"SELECT COUNT(*) FROM {esquema}.sqlite_master WHERE type = 'table' AND name = 'codipostal'"
+        ).fetchone()[0]
+        if propia:
+            ruta = ficheros[esquema]
+            if esquema == 'main':
+                return ruta, None
+            estado = os.stat(ruta)
+            return ruta, (estado.st_ino, estado.st_mtime_ns)
+    return None, None
+
+
+class RegistroIndices:
+    """Índices construidos por origen de datos (LRU)"""
+
+    def __init__(self, max_indices: int = CONTACTOS_INDICE_CONFIG['MAX_INDICES']):
+        self.max_indices = max_indices
+        self._indices: OrderedDict = OrderedDict()  # ruta -> (firma, IndiceCodigosPostales)
+        self._lock = threading.Lock()
+        self.construcciones = 0
+        self.segundos_construccion = 0.0
+        self.consultas = 0
+
+    def obtener(self, conn) -> Optional[IndiceCodigosPostales]:
+        """Índice de la codipostal que ve la conexión (None si no hay tabla)"""
+        ruta, firma = _origen(conn)
+        if not ruta:  # sin codipostal o BD en memoria
+            return None
+        with self._lock:
+            self.consultas += 1
+            entrada = self._indices.get(ruta)
+            if entrada is None or entrada[0] != firma:
+                inicio = time.perf_counter()
+                indice = IndiceCodigosPostales(conn)
+                duracion = time.perf_counter() - inicio
+                self.construcciones += 1
+                self.segundos_construccion += duracion
+                logger.info(f"[CODIPOSTAL] Índice de {ruta}: {indice.filas} filas, "
+                            f"{indice.num_calles} calles en {duracion * 1000:.0f} ms")
+                entrada = (firma, indice)
+                self._indices[ruta] = entrada
+            self._indices.move_to_end(ruta)
+            while len(self._indices) > self.max_indices:
+                self._indices.popitem(last=False)
+            return entrada[1]
+
+    def invalidar(self):
+        """Descarta todos los índices (se reconstruyen en la siguiente consulta)"""
+        with self._lock:
+            self._indices.clear()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'indices': len(self._indices),
+                'max_indices': self.max_indices,
+                'filas': sum(entrada[1].filas for entrada in self._indices.values()),
+                'consultas': self.consultas,
+                'construcciones': self.construcciones,
+                'ms_construccion': round(self.segundos_construccion * 1000, 1)
+            }
+
+
+_registro = RegistroIndices()
+
+
+def indice_codigos_postales(conn) -> Optional[IndiceCodigosPostales]:
+    """Índice compartido del proceso para la codipostal de esta conexión"""
+    return _registro.obtener(conn)
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Métricas para /api/health"""
+    return _registro.get_metrics()
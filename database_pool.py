@@ -4,36 +4,102 @@
 DATABASE CONNECTION POOL PARA SQLITE
 ====================================
 Sistema avanzado de connection pooling con todas las características solicitadas
+
+- Espera justa (FIFO) con variables de condición cuando el pool está agotado:
+  la conexión devuelta se entrega directamente al primero de la cola
+- Validación (SELECT 1) solo de conexiones que llevan tiempo inactivas o que
+  se devolvieron tras un error de SQLite, no en cada préstamo
+- Errores recientes en un buffer circular acotado
+- Histograma de tiempos de espera con percentiles p50/p95/p99
+- Conexiones de solo lectura (mode=ro, query_only) en un pool aparte para
+  que los informes no ocupen las conexiones de escritura
+- Carril de escritura por BD: las transacciones de escritura del proceso
+  pasan en fila (FIFO) y de una en una por la misma conexión, con
+  BEGIN IMMEDIATE, en lugar de competir por el bloqueo con SQLITE_BUSY
+- Perfil de conexión por BD (mmap, temp_store, caché de sentencias,
+  busy_timeout; ver perfiles_conexion.py) y mantenimiento periódico
+  (PRAGMA optimize y wal_checkpoint(PASSIVE)) desde un hilo del registro
 """
 
+import bisect
+import os
 import sqlite3
 import threading
 import time
-import queue
 import logging
+from collections import OrderedDict, deque
 from contextlib import contextmanager
 from datetime import datetime
 from typing import Optional, Dict, Any
 from dataclasses import dataclass
+from urllib.request import pathname2url
+
+from multiempresa_config import DATABASE_POOL_CONFIG
+from perfiles_conexion import aplicar_perfil, opciones_connect, resolver_perfil
+from plantilla_empresa import adjuntar_maestros
 
 logger = logging.getLogger(__name__)
 
+# Límites superiores (ms) de los cubos del histograma de espera; el último cubo es > 5000 ms
+LIMITES_ESPERA_MS = (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class WaitHistogram:
+    """Histograma acumulado de tiempos de espera por cubos fijos"""
+
+    def __init__(self, limites=LIMITES_ESPERA_MS):
+        self.limites = limites
+        self.cubos = [0] * (len(limites) + 1)
+        self.total = 0
+
+    def registrar(self, espera_ms: float):
+        self.cubos[bisect.bisect_left(self.limites, espera_ms)] += 1
+        self.total += 1
+
+    def percentil(self, p: float) -> float:
+        """Límite superior del cubo que contiene el percentil p (0-100)"""
+        if not self.total:
+            return 0.0
+        objetivo = p / 100 * self.total
+        acumulado = 0
+        for i, cantidad in enumerate(self.cubos):
+            acumulado += cantidad
+            if acumulado >= objetivo:
+                return float(self.limites[i]) if i < len(self.limites) else float('inf')
+        return float('inf')
+
+    def as_dict(self) -> Dict[str, Any]:
+        etiquetas = [f'<={limite}ms' for limite in self.limites] + [f'>{self.limites[-1]}ms']
+        return {
+            'p50_ms': self.percentil(50),
+            'p95_ms': self.percentil(95),
+            'p99_ms': self.percentil(99),
+            'buckets': dict(zip(etiquetas, self.cubos))
+        }
+
+
 @dataclass
 class PoolMetrics:
     """Métricas del pool de conexiones"""
     total_connections: int = 0
     active_connections: int = 0
-    connections_in_use: int = 0
     total_requests: int = 0
     failed_requests: int = 0
-    retry_attempts: int = 0
+    waits: int = 0
+    timeouts: int = 0
+    validations: int = 0
+    discarded_connections: int = 0
+    ignored_returns: int = 0  # close() de quien ya no la tenía prestada
     avg_wait_time: float = 0.0
     max_wait_time: float = 0.0
-    errors: list = None
+    errors: deque = None
+    wait_histogram: WaitHistogram = None
     
     def __post_init__(self):
         if self.errors is None:
-            self.errors = []
+            self.errors = deque(maxlen=DATABASE_POOL_CONFIG['MAX_ERRORES_RECIENTES'])
+        if self.wait_histogram is None:
+            self.wait_histogram = WaitHistogram()
 
 class PooledConnection:
     """Wrapper para conexiones con context manager"""
@@ -44,6 +110,14 @@ class PooledConnection:
         self.created_at = datetime.now()
         self.last_used = datetime.now()
         self.in_use = False
+        self.in_pool = False
+        # Momento (monotónico) en que volvió al pool y si hay que validarla antes de reutilizarla
+        self.returned_at = time.monotonic()
+        self.suspect = False
+        # Carril de escritura que la tiene prestada (None = conexión normal del pool)
+        self.lane = None
+        # Hilo que la tiene prestada: solo él puede devolverla
+        self.holder = None
     
     def close(self):
         """Devuelve la conexión al pool en lugar de cerrarla"""
@@ -71,6 +145,8 @@ class PooledConnection:
     
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.in_use = False
+        if exc_type is not None and issubclass(exc_type, sqlite3.Error):
+            self.suspect = True
         self.pool._return_connection(self)
     
     def is_healthy(self) -> bool:
@@ -81,61 +157,254 @@ class PooledConnection:
         except Exception:
             return False
 
+
+class _Waiter:
+    """Hilo en la cola de espera de un pool"""
+    __slots__ = ('condition', 'connection', 'room')
+
+    def __init__(self, lock):
+        self.condition = threading.Condition(lock)
+        self.connection = None  # Conexión entregada directamente al devolverse otra
+        self.room = False  # Se ha cerrado una conexión: hay hueco para abrir otra
+
+
+@dataclass
+class LaneMetrics:
+    """Métricas del carril de escritura"""
+    requests: int = 0
+    waits: int = 0
+    timeouts: int = 0
+    handoffs: int = 0
+    max_wait_time: float = 0.0
+    wait_histogram: WaitHistogram = None
+
+    def __post_init__(self):
+        if self.wait_histogram is None:
+            self.wait_histogram = WaitHistogram()
+
+
+class WriterLane:
+    """
+    Carril de escritura de una BD: un único turno de escritura por proceso.
+
+    Los escritores esperan su turno en orden de llegada y, mientras haya
+    cola, la conexión pasa directamente de uno al siguiente sin volver al
+    pool. El turno es reentrante: quien ya lo tiene recibe la misma conexión.
+    Devolver la conexión (close() o salir del with) cede el turno.
+    """
+
+    def __init__(self, pool: 'DatabasePool'):
+        self.pool = pool
+        self.metrics = LaneMetrics()
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()
+        # Hilo con el turno (o el _Waiter al que se ha cedido y aún no ha despertado)
+        self._holder = None
+        self._depth = 0
+        self._connection: Optional[PooledConnection] = None
+
+    def acquire(self, timeout: float) -> PooledConnection:
+        """Espera el turno y devuelve la conexión del carril"""
+        me = threading.get_ident()
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+
+        with self._lock:
+            if self._holder == me:
+                self._depth += 1
+                return self._connection
+
+            self.metrics.requests += 1
+            waited = self._holder is not None or bool(self._waiters)
+            if waited:
+                waiter = _Waiter(self._lock)
+                self._waiters.append(waiter)
+                while not waiter.room:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    waiter.condition.wait(remaining)
+                if not waiter.room:
+                    self._waiters.remove(waiter)
+                    self.metrics.timeouts += 1
+                    raise RuntimeError(f"No se obtuvo turno de escritura en {timeout:.1f}s ({self.pool.db_path})")
+
+            self._holder = me
+            self._depth = 1
+            wait_time = time.monotonic() - start_time
+            if waited:
+                self.metrics.waits += 1
+            self.metrics.max_wait_time = max(self.metrics.max_wait_time, wait_time)
+            self.metrics.wait_histogram.registrar(wait_time * 1000)
+            pooled_conn = self._connection
+
+        if pooled_conn is None:
+            try:
+                pooled_conn = self.pool.get_connection(max(deadline - time.monotonic(), 0.001))
+            except Exception:
+                with self._lock:
+                    self._pass_turn()
+                raise
+            pooled_conn.lane = self
+            with self._lock:
+                self._connection = pooled_conn
+        # El turno pasa de un escritor a otro sin volver al pool: quien lo tiene es quien la devolverá
+        pooled_conn.holder = me
+        return pooled_conn
+
+    def release(self, pooled_conn: PooledConnection):
+        """Cede el turno: la conexión pasa al siguiente escritor o vuelve al pool"""
+        with self._lock:
+            # Cierre repetido de una conexión que ya tiene otro escritor
+            if self._holder != threading.get_ident() or pooled_conn is not self._connection:
+                return
+            self._depth -= 1
+            if self._depth > 0:
+                return
+
+        # Lo que no se confirmó no pasa al siguiente escritor
+        try:
+            pooled_conn.connection.rollback()
+        except Exception:
+            pooled_conn.suspect = True
+
+        with self._lock:
+            keep = bool(self._waiters) and not pooled_conn.suspect and not (self.pool._shutdown or self.pool._retired)
+            if keep:
+                self.metrics.handoffs += 1
+            else:
+                self._connection = None
+                pooled_conn.lane = None
+            self._pass_turn()
+
+        if not keep:
+            self.pool._return_connection(pooled_conn)
+
+    def _pass_turn(self):
+        """Da el turno al primero de la cola o lo deja libre (con el lock tomado)"""
+        self._depth = 0
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.room = True
+            self._holder = waiter
+            waiter.condition.notify()
+        else:
+            self._holder = None
+
+    def shutdown(self):
+        """Despierta a los que esperan: al pedir conexión verán el pool cerrado"""
+        with self._lock:
+            self._connection = None
+            while self._waiters:
+                self._pass_turn()
+            self._holder = None
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'busy': self._holder is not None,
+                'waiting': len(self._waiters),
+                'requests': self.metrics.requests,
+                'waits': self.metrics.waits,
+                'timeouts': self.metrics.timeouts,
+                'handoffs': self.metrics.handoffs,
+                'max_wait_time': round(self.metrics.max_wait_time, 4),
+                'wait_histogram': self.metrics.wait_histogram.as_dict()
+            }
+
+
 class DatabasePool:
     """
     Pool de conexiones SQLite con todas las funcionalidades requeridas:
     - Máximo 10 conexiones
     - Context managers automáticos  
-    - Retry logic para fallos
-    - Timeout handling
+    - Espera justa con timeout cuando se agotan
+    - Pool de lectura (solo lectura) y carril de escritura asociados
     - Métricas completas
     """
     
-    def __init__(self, db_path: str, max_connections: int = 10):
+    def __init__(self, db_path: str, max_connections: int = 10, min_connections: int = 2,
+                 registry: Optional['PoolRegistry'] = None, read_only: bool = False,
+                 writer_pool: Optional['DatabasePool'] = None, profile: Optional[str] = None):
         self.db_path = db_path
         self.max_connections = max_connections
+        self.min_connections = min_connections
+        self.read_only = read_only
+        self.profile_name, self.profile = resolver_perfil(db_path, profile)
         self.metrics = PoolMetrics()
         
-        # Pool y sincronización
-        self._pool: queue.Queue = queue.Queue(maxsize=max_connections)
+        # Conexiones libres (LIFO: se reutiliza la más reciente) y cola FIFO de espera
+        self._idle: deque = deque()
+        self._waiters: deque = deque()
         self._lock = threading.RLock()
         self._all_connections = []
+        self._creating = 0
         self._shutdown = False
         
-        # Configuración de retry y timeout
-        self.retry_attempts = 5
-        self.retry_delay = 1.0
+        # Registro que reparte el presupuesto global de conexiones (None = sin límite global)
+        self._registry = registry
+        self._retired = False
+        self.last_used = time.monotonic()
+        
+        # Lecturas en un pool propio de solo lectura (se crea al primer uso) y
+        # escrituras en fila por el carril; un pool de lectura delega las
+        # escrituras en el pool de escritura de su BD
+        self._readers: Optional['DatabasePool'] = None
+        self._writer_pool = writer_pool
+        self._lane = None if read_only else WriterLane(self)
+        
+        # Último mantenimiento (PRAGMA optimize + checkpoint) y su resultado
+        self._last_maintenance = time.monotonic()
+        self.maintenance_runs = 0
+        self.last_checkpoint: Optional[Dict[str, int]] = None
+        
+        # Timeout y validación
         self.default_timeout = 60.0
+        self.validate_after_idle = DATABASE_POOL_CONFIG['VALIDAR_TRAS_INACTIVIDAD']
+        # Sin presupuesto global no hay a quién esperar en este pool: se reintenta con esta cadencia
+        self.budget_retry_interval = 0.05
         
-        # Inicializar con 2 conexiones mínimas
+        # Conexiones mínimas (0 = pool perezoso, se abren al primer uso)
         self._initialize_pool()
     
     def _initialize_pool(self):
         """Inicializa el pool con conexiones mínimas"""
         try:
-            for _ in range(2):  # Conexiones mínimas
+            for _ in range(self.min_connections):
                 conn = self._create_connection()
                 if conn:
-                    self._pool.put(conn, block=False)
+                    with self._lock:
+                        conn.in_pool = True
+                        self._idle.append(conn)
             logger.info(f"Pool inicializado para {self.db_path}")
         except Exception as e:
             logger.error(f"Error inicializando pool: {e}")
     
+    def _record_error(self, mensaje: str):
+        with self._lock:
+            self.metrics.errors.append(f"{datetime.now()}: {mensaje}")
+    
     def _create_connection(self) -> Optional[PooledConnection]:
-        """Crea nueva conexión SQLite optimizada"""
+        """
+        Crea nueva conexión SQLite optimizada. Devuelve None si el presupuesto
+        global no lo permite y propaga el error si la BD no se puede abrir.
+        """
+        if self._registry and not self._registry.reserve_connection(self):
+            return None
+        
         try:
-            conn = sqlite3.connect(
-                self.db_path,
-                timeout=self.default_timeout,
-                check_same_thread=False
-            )
+            if self.read_only:
+                uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
+                conn = sqlite3.connect(uri, uri=True, check_same_thread=False, **opciones_connect(self.profile))
+                conn.execute("PRAGMA query_only=1")
+            else:
+                # uri=True para poder adjuntar la BD de maestros en solo lectura
+                conn = sqlite3.connect(self.db_path, uri=True, check_same_thread=False, **opciones_connect(self.profile))
             
-            # Configurar conexión para rendimiento
+            # Configurar conexión según el perfil de la BD
             conn.row_factory = sqlite3.Row
-            conn.execute('PRAGMA encoding="UTF-8"')
-            conn.execute("PRAGMA journal_mode=WAL")
-            conn.execute("PRAGMA synchronous=NORMAL")
-            conn.execute("PRAGMA cache_size=10000")
+            aplicar_perfil(conn, self.profile, solo_lectura=self.read_only)
+            adjuntar_maestros(conn)
             
             pooled_conn = PooledConnection(conn, self)
             
@@ -148,127 +417,234 @@ class DatabasePool:
             
         except Exception as e:
             logger.error(f"Error creando conexión: {e}")
+            if self._registry:
+                self._registry.release_connection()
             with self._lock:
                 self.metrics.failed_requests += 1
-                self.metrics.errors.append(f"{datetime.now()}: {str(e)}")
+            self._record_error(str(e))
+            raise
+    
+    def _take_idle(self) -> Optional[PooledConnection]:
+        """Saca una conexión libre (con el lock tomado)"""
+        if not self._idle:
             return None
+        pooled_conn = self._idle.pop()
+        pooled_conn.in_pool = False
+        return pooled_conn
+    
+    def _usable(self, pooled_conn: PooledConnection) -> bool:
+        """
+        Valida con SELECT 1 solo si lleva más de validate_after_idle segundos
+        sin usarse o se devolvió tras un error; si falla la cierra.
+        """
+        if not pooled_conn.suspect and time.monotonic() - pooled_conn.returned_at < self.validate_after_idle:
+            return True
+        with self._lock:
+            self.metrics.validations += 1
+        if pooled_conn.is_healthy():
+            pooled_conn.suspect = False
+            return True
+        with self._lock:
+            self.metrics.discarded_connections += 1
+        self._close_connection(pooled_conn)
+        return False
     
     def get_connection(self, timeout: Optional[float] = None) -> PooledConnection:
         """
-        Obtiene conexión con retry logic y timeout handling
+        Obtiene conexión: una libre, una nueva si cabe o, si no, espera en
+        cola (por orden de llegada) hasta que otra se devuelva o venza el timeout
         """
         if self._shutdown:
             raise RuntimeError("Pool cerrado")
         
         timeout = timeout or self.default_timeout
-        start_time = time.time()
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        waited = False
         
         with self._lock:
             self.metrics.total_requests += 1
+            self.last_used = start_time
         
-        # Retry logic implementado
-        for attempt in range(self.retry_attempts + 1):
-            try:
-                # Intentar obtener conexión existente
+        # Tras esperar en la cola ya no se cede el turno a los que siguen esperando
+        priority = False
+        while not self._shutdown:
+            with self._lock:
+                queued = bool(self._waiters) and not priority
+                pooled_conn = None if queued else self._take_idle()
+                can_create = pooled_conn is None and not queued and self._has_room()
+                if can_create:
+                    self._creating += 1
+            
+            budget_blocked = False
+            if can_create:
                 try:
-                    pooled_conn = self._pool.get(timeout=min(timeout, 5.0))
-                    
-                    if pooled_conn.is_healthy():
-                        wait_time = time.time() - start_time
-                        self._update_wait_metrics(wait_time)
-                        
-                        with self._lock:
-                            self.metrics.connections_in_use += 1
-                        
-                        return pooled_conn
-                    else:
-                        # Conexión no saludable, cerrar y crear nueva
-                        self._close_connection(pooled_conn)
-                        
-                except queue.Empty:
-                    # Pool vacío, crear nueva conexión si hay espacio
-                    if len(self._all_connections) < self.max_connections:
-                        new_conn = self._create_connection()
-                        if new_conn and new_conn.is_healthy():
-                            wait_time = time.time() - start_time
-                            self._update_wait_metrics(wait_time)
-                            
-                            with self._lock:
-                                self.metrics.connections_in_use += 1
-                            
-                            return new_conn
-                
-                # Si llegamos aquí, hacer retry
-                if attempt < self.retry_attempts:
+                    pooled_conn = self._create_connection()
+                except Exception:
+                    # La BD no se puede abrir: se falla ya en lugar de esperar el timeout
                     with self._lock:
-                        self.metrics.retry_attempts += 1
-                    
-                    logger.warning(f"Retry {attempt + 1}/{self.retry_attempts} en {self.retry_delay}s")
-                    time.sleep(self.retry_delay)
-                    
-                    # Actualizar timeout restante
-                    elapsed = time.time() - start_time
-                    timeout = max(timeout - elapsed, 1.0)
-                
-            except Exception as e:
-                logger.error(f"Error en intento {attempt + 1}: {e}")
+                        self._creating -= 1
+                        self._notify_room()
+                    raise
+                with self._lock:
+                    self._creating -= 1
+                budget_blocked = pooled_conn is None
+            
+            if pooled_conn is None:
+                waited = True
+                pooled_conn, room = self._wait(deadline, budget_blocked, priority)
+                priority = True
+                if pooled_conn is None and not room and time.monotonic() >= deadline:
+                    break
+            
+            if pooled_conn is not None and self._usable(pooled_conn):
+                pooled_conn.holder = threading.get_ident()
+                self._update_wait_metrics(time.monotonic() - start_time, waited)
+                return pooled_conn
         
-        # Todos los intentos fallaron
-        error_msg = f"No se pudo obtener conexión después de {self.retry_attempts + 1} intentos"
-        logger.error(error_msg)
+        if self._shutdown:
+            raise RuntimeError("Pool cerrado")
         
+        error_msg = f"No se pudo obtener conexión en {timeout:.1f}s ({self.db_path})"
+        logger.error(error_msg)
         with self._lock:
             self.metrics.failed_requests += 1
-            self.metrics.errors.append(f"{datetime.now()}: {error_msg}")
-        
+            self.metrics.timeouts += 1
+        self._record_error(error_msg)
         raise RuntimeError(error_msg)
     
+    def _has_room(self) -> bool:
+        """Cabe otra conexión en el pool (con el lock tomado)"""
+        return len(self._all_connections) + self._creating < self.max_connections
+    
+    def _wait(self, deadline: float, budget_blocked: bool, priority: bool):
+        """
+        Espera en la cola FIFO (quien ya esperó vuelve al principio).
+        
+        Returns:
+            tuple: (conexión entregada o None, si hay hueco para abrir una)
+        
+        Sin presupuesto global (budget_blocked) nadie de este pool avisará
+        cuando otro pool libere una conexión, así que la espera se corta cada
+        budget_retry_interval para reintentar.
+        """
+        with self._lock:
+            # Pudo liberarse algo entre el intento y la espera
+            if (priority or not self._waiters) and (self._idle or (not budget_blocked and self._has_room())):
+                return None, True
+            
+            waiter = _Waiter(self._lock)
+            if priority:
+                self._waiters.appendleft(waiter)
+            else:
+                self._waiters.append(waiter)
+            try:
+                while waiter.connection is None and not waiter.room:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    if budget_blocked:
+                        waiter.condition.wait(min(remaining, self.budget_retry_interval))
+                        break
+                    waiter.condition.wait(remaining)
+                return waiter.connection, waiter.room
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                # Si se rinde sin usar lo que ha quedado libre, pasarlo al siguiente
+                if waiter.connection is None and not waiter.room and time.monotonic() >= deadline:
+                    if self._idle and self._waiters:
+                        self._hand_off(self._take_idle())
+                    elif self._has_room():
+                        self._notify_room()
+    
+    def _hand_off(self, pooled_conn: PooledConnection) -> bool:
+        """Entrega la conexión al primero de la cola (con el lock tomado)"""
+        if not self._waiters:
+            return False
+        waiter = self._waiters.popleft()
+        waiter.connection = pooled_conn
+        waiter.condition.notify()
+        return True
+    
+    def _notify_room(self):
+        """Avisa al primero de la cola de que puede abrir una conexión (con el lock tomado)"""
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.room = True
+            waiter.condition.notify()
+    
     def _return_connection(self, pooled_conn: PooledConnection):
         """Devuelve conexión al pool"""
+        # La del carril de escritura cede el turno (y vuelve aquí cuando no hay cola)
+        if pooled_conn.lane is not None:
+            pooled_conn.lane.release(pooled_conn)
+            return
+        
+        # Solo la devuelve el hilo que la tiene prestada. Un close() repetido
+        # (with + close()) la encontraría libre o, peor, ya entregada a otro
+        # hilo: deshacería su transacción y la prestaría dos veces
+        with self._lock:
+            if pooled_conn.in_pool or pooled_conn.holder != threading.get_ident():
+                self.metrics.ignored_returns += 1
+                logger.debug(f"Devolución ignorada de una conexión que este hilo ya no tiene ({self.db_path})")
+                return
+            pooled_conn.holder = None
+        
+        # CRÍTICO: Asegurar que la conexión esté limpia de transacciones
         try:
-            # CRÍTICO: Asegurar que la conexión esté limpia de transacciones
-            try:
-                pooled_conn.connection.rollback()
-            except Exception:
-                pass
-
+            pooled_conn.connection.rollback()
+        except Exception:
+            pooled_conn.suspect = True
+        
+        if pooled_conn.suspect and not pooled_conn.is_healthy():
             with self._lock:
-                self.metrics.connections_in_use = max(0, self.metrics.connections_in_use - 1)
-                
-                if not self._shutdown and pooled_conn.is_healthy():
-                    self._pool.put(pooled_conn, block=False)
-                else:
-                    self._close_connection(pooled_conn)
-                    
-        except queue.Full:
-            # Pool lleno, cerrar conexión
+                self.metrics.discarded_connections += 1
             self._close_connection(pooled_conn)
+            return
+        
+        with self._lock:
+            if self._shutdown or self._retired or pooled_conn not in self._all_connections:
+                self._close_connection(pooled_conn)
+                return
+            
+            pooled_conn.returned_at = time.monotonic()
+            if not self._hand_off(pooled_conn):
+                pooled_conn.in_pool = True
+                self._idle.append(pooled_conn)
     
     def _close_connection(self, pooled_conn: PooledConnection):
         """Cierra conexión específica"""
         try:
             pooled_conn.connection.close()
-            
-            with self._lock:
-                if pooled_conn in self._all_connections:
-                    self._all_connections.remove(pooled_conn)
-                self.metrics.active_connections = max(0, self.metrics.active_connections - 1)
-                
         except Exception as e:
             logger.error(f"Error cerrando conexión: {e}")
+        
+        with self._lock:
+            pooled_conn.in_pool = False
+            if pooled_conn in self._idle:
+                self._idle.remove(pooled_conn)
+            if pooled_conn in self._all_connections:
+                self._all_connections.remove(pooled_conn)
+                if self._registry:
+                    self._registry.release_connection()
+                self.metrics.active_connections = max(0, self.metrics.active_connections - 1)
+                # Queda hueco para abrir otra: que lo aproveche quien espera
+                if not self._shutdown:
+                    self._notify_room()
     
-    def _update_wait_metrics(self, wait_time: float):
+    def _update_wait_metrics(self, wait_time: float, waited: bool):
         """Actualiza métricas de tiempo de espera"""
         with self._lock:
+            if waited:
+                self.metrics.waits += 1
             if wait_time > self.metrics.max_wait_time:
                 self.metrics.max_wait_time = wait_time
+            self.metrics.wait_histogram.registrar(wait_time * 1000)
             
-            # Calcular promedio móvil
-            current_avg = self.metrics.avg_wait_time
-            total_requests = self.metrics.total_requests
-            self.metrics.avg_wait_time = (
-                (current_avg * (total_requests - 1) + wait_time) / total_requests
-            )
+            # Media acumulada sobre los préstamos servidos
+            served = self.metrics.wait_histogram.total
+            self.metrics.avg_wait_time += (wait_time - self.metrics.avg_wait_time) / served
     
     @contextmanager
     def get_db_connection(self):
@@ -284,10 +660,107 @@ class DatabasePool:
         try:
             pooled_conn = self.get_connection()
             yield pooled_conn
+        except sqlite3.Error:
+            if pooled_conn:
+                pooled_conn.suspect = True
+            raise
         finally:
             if pooled_conn:
                 self._return_connection(pooled_conn)
     
+    def get_read_connection(self, timeout: Optional[float] = None) -> PooledConnection:
+        """
+        Conexión de solo lectura (mode=ro, query_only) del pool de lectura de
+        la BD. Si el fichero aún no existe se usa una conexión normal.
+        """
+        if self.read_only:
+            return self.get_connection(timeout)
+        if not os.path.exists(self.db_path):
+            return self.get_connection(timeout)
+        
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Pool cerrado")
+            if self._readers is None:
+                self._readers = DatabasePool(self.db_path, self.max_connections, min_connections=0,
+                                             registry=self._registry, read_only=True, writer_pool=self,
+                                             profile=self.profile_name)
+            readers = self._readers
+        self.last_used = time.monotonic()
+        return readers.get_connection(timeout)
+    
+    def get_writer_connection(self, timeout: Optional[float] = None) -> PooledConnection:
+        """
+        Conexión del carril de escritura: espera turno (FIFO) y la conserva
+        hasta devolverla. No abre transacción; para eso write_transaction().
+        """
+        if self._writer_pool is not None:
+            return self._writer_pool.get_writer_connection(timeout)
+        if self._shutdown:
+            raise RuntimeError("Pool cerrado")
+        self.last_used = time.monotonic()
+        return self._lane.acquire(timeout or self.default_timeout)
+    
+    @contextmanager
+    def write_transaction(self, timeout: Optional[float] = None):
+        """
+        Transacción de escritura por el carril: BEGIN IMMEDIATE al entrar,
+        commit al salir o rollback si hay excepción
+        
+        Usage:
+            with pool.write_transaction() as conn:
+                conn.execute("INSERT INTO ...")
+        """
+        pooled_conn = self.get_writer_connection(timeout)
+        try:
+            if not pooled_conn.in_transaction:
+                pooled_conn.execute('BEGIN IMMEDIATE')
+            yield pooled_conn
+            pooled_conn.commit()
+        except Exception as e:
+            if isinstance(e, sqlite3.Error):
+                pooled_conn.suspect = True
+            try:
+                pooled_conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            pooled_conn.close()
+    
+    def run_maintenance(self, timeout: float = 1.0) -> bool:
+        """
+        PRAGMA optimize y wal_checkpoint(PASSIVE) por el carril de escritura,
+        solo si la BD se ha usado desde el último mantenimiento. Si el carril
+        está ocupado más de `timeout` se deja para la siguiente vuelta. No
+        cuenta como uso del pool (no retrasa su retirada por inactividad).
+        """
+        if self.read_only or self._shutdown or self._retired or self.last_used <= self._last_maintenance:
+            return False
+        
+        last_used = self.last_used
+        try:
+            pooled_conn = self._lane.acquire(timeout)
+        except Exception as e:
+            logger.debug(f"Mantenimiento aplazado para {self.db_path}: {e}")
+            return False
+        try:
+            pooled_conn.execute('PRAGMA main.optimize')
+            busy, wal_frames, checkpointed = pooled_conn.execute('PRAGMA main.wal_checkpoint(PASSIVE)').fetchone()
+        except sqlite3.Error as e:
+            pooled_conn.suspect = True
+            logger.warning(f"Error en mantenimiento de {self.db_path}: {e}")
+            return False
+        finally:
+            pooled_conn.close()
+            self.last_used = last_used
+            self._last_maintenance = time.monotonic()
+        
+        with self._lock:
+            self.maintenance_runs += 1
+            self.last_checkpoint = {'busy': busy, 'wal_frames': wal_frames, 'checkpointed': checkpointed}
+        return True
+    
     def execute_query(self, query: str, params: tuple = None, fetch_one: bool = False):
         """
         Ejecuta query automáticamente usando el pool
@@ -319,91 +792,358 @@ class DatabasePool:
             logger.error(error_msg)
             return {'success': False, 'data': None, 'error': error_msg}
     
+    def _checked_out(self) -> int:
+        """Conexiones propias en uso (con el lock tomado)"""
+        return max(0, len(self._all_connections) - len(self._idle))
+    
+    def connections_checked_out(self) -> int:
+        """Conexiones abiertas que no están libres en el pool (en uso), incluidas las de lectura"""
+        with self._lock:
+            readers = self._readers
+            in_use = self._checked_out()
+        if readers is not None:
+            in_use += readers.connections_checked_out()
+        return in_use
+    
     def get_metrics(self) -> Dict[str, Any]:
         """
         Devuelve métricas detalladas del pool
         """
         with self._lock:
-            return {
+            in_use = self._checked_out()
+            metrics = {
+                'db_path': self.db_path,
+                'profile': self.profile_name,
+                'maintenance_runs': self.maintenance_runs,
+                'last_checkpoint': self.last_checkpoint,
+                'open_connections': len(self._all_connections),
+                'connections_checked_out': in_use,
+                'idle_seconds': round(time.monotonic() - self.last_used, 1),
                 'total_connections': self.metrics.total_connections,
                 'active_connections': self.metrics.active_connections,
-                'connections_in_use': self.metrics.connections_in_use,
-                'connections_available': self._pool.qsize(),
+                'connections_in_use': in_use,
+                'connections_available': len(self._idle),
+                'waiting': len(self._waiters),
                 'total_requests': self.metrics.total_requests,
                 'failed_requests': self.metrics.failed_requests,
-                'retry_attempts': self.metrics.retry_attempts,
+                'waits': self.metrics.waits,
+                'timeouts': self.metrics.timeouts,
+                'validations': self.metrics.validations,
+                'discarded_connections': self.metrics.discarded_connections,
+                'ignored_returns': self.metrics.ignored_returns,
                 'avg_wait_time': round(self.metrics.avg_wait_time, 4),
                 'max_wait_time': round(self.metrics.max_wait_time, 4),
+                'wait_histogram': self.metrics.wait_histogram.as_dict(),
                 'success_rate': round(
                     (1 - self.metrics.failed_requests / max(self.metrics.total_requests, 1)) * 100, 2
                 ),
                 'pool_utilization': round(
-                    (self.metrics.connections_in_use / self.max_connections) * 100, 2
+                    (in_use / self.max_connections) * 100, 2
                 ),
-                'recent_errors': self.metrics.errors[-5:] if self.metrics.errors else []
+                'recent_errors': list(self.metrics.errors)[-5:]
             }
+            readers = self._readers
+        
+        if self._lane is not None:
+            metrics['writer_lane'] = self._lane.get_metrics()
+        if readers is not None:
+            metrics['read_pool'] = readers.get_metrics()
+        return metrics
     
     def reset_metrics(self):
         """Resetea todas las métricas"""
         with self._lock:
-            self.metrics = PoolMetrics()
+            self.metrics = PoolMetrics(
+                total_connections=len(self._all_connections),
+                active_connections=len(self._all_connections)
+            )
             logger.info("Métricas del pool reseteadas")
     
     def health_check(self) -> Dict[str, Any]:
         """
-        Verifica salud del pool y conexiones
+        Verifica salud del pool y conexiones libres
         """
         healthy_connections = 0
         unhealthy_connections = 0
         
         with self._lock:
-            for conn in self._all_connections:
-                if not conn.in_use:
-                    if conn.is_healthy():
-                        healthy_connections += 1
-                    else:
-                        unhealthy_connections += 1
-                        self._close_connection(conn)
+            for conn in list(self._idle):
+                if conn.is_healthy():
+                    healthy_connections += 1
+                else:
+                    unhealthy_connections += 1
+                    self._close_connection(conn)
+            pool_size = len(self._idle)
         
         return {
-            'pool_status': 'healthy' if healthy_connections > 0 else 'degraded',
+            'pool_status': 'healthy' if healthy_connections > 0 or unhealthy_connections == 0 else 'degraded',
             'healthy_connections': healthy_connections,
             'unhealthy_connections': unhealthy_connections,
-            'pool_size': self._pool.qsize(),
+            'pool_size': pool_size,
             'max_connections': self.max_connections
         }
     
+    def close_idle_connection(self) -> bool:
+        """Cierra una conexión libre para ceder su hueco del presupuesto global"""
+        with self._lock:
+            if not self._idle:
+                readers = self._readers
+                return readers.close_idle_connection() if readers is not None else False
+            # La usada hace más tiempo
+            pooled_conn = self._idle.popleft()
+            pooled_conn.in_pool = False
+        self._close_connection(pooled_conn)
+        return True
+    
+    def retire(self):
+        """
+        Saca el pool del registro: cierra las conexiones libres y las que
+        están en uso se cierran al devolverse. Sigue siendo utilizable por
+        quien aún lo tenga, pero ya no guarda conexiones.
+        """
+        with self._lock:
+            self._retired = True
+            readers = self._readers
+        if readers is not None:
+            readers.retire()
+        while self.close_idle_connection():
+            pass
+        logger.info(f"Pool retirado para {self.db_path}")
+    
     def shutdown(self):
         """Cierra el pool y todas las conexiones"""
         self._shutdown = True
         
+        with self._lock:
+            readers = self._readers
+        if readers is not None:
+            readers.shutdown()
+        if self._lane is not None:
+            self._lane.shutdown()
+        
         with self._lock:
             while self._all_connections:
                 conn = self._all_connections[0]
                 self._close_connection(conn)
+            # Despertar a quien espera: verá el plazo o el pool cerrado
+            while self._waiters:
+                self._notify_room()
         
         logger.info(f"Pool cerrado para {self.db_path}")
 
 # =====================================================
-# INSTANCIA GLOBAL DEL POOL
+# REGISTRO GLOBAL DE POOLS (MULTIEMPRESA)
 # =====================================================
 
-# Pool global para la aplicación
-_global_pools = {}
-_pool_lock = threading.Lock()
+@dataclass
+class RegistryMetrics:
+    """Métricas del registro de pools"""
+    pools_created: int = 0
+    lru_evictions: int = 0
+    idle_evictions: int = 0
+    reclaimed_connections: int = 0
+    budget_rejections: int = 0
+    maintenance_cycles: int = 0
+    maintenance_runs: int = 0
+
+
+class PoolRegistry:
+    """
+    Un pool por BD de empresa con un presupuesto común de conexiones:
+    - Los pools se crean sin conexiones y las abren bajo demanda
+    - Nunca hay más de max_total_connections abiertas entre todos los pools;
+      sin hueco, se cierra una conexión libre del pool usado hace más tiempo
+    - Con más de max_pools pools se retiran los menos usados recientemente
+      que no tengan conexiones en uso, igual que los que llevan idle_timeout
+      segundos sin usarse
+    - Cada maintenance_interval segundos un hilo pasa el mantenimiento
+      (PRAGMA optimize + checkpoint) a las BD usadas desde la vez anterior
+    """
+
+    def __init__(self, max_pools: int = 32, max_total_connections: int = 64,
+                 max_connections_per_pool: int = 10, min_connections: int = 0,
+                 idle_timeout: float = 300.0, maintenance_interval: float = 0):
+        self.max_pools = max_pools
+        self.max_total_connections = max_total_connections
+        self.max_connections_per_pool = max_connections_per_pool
+        self.min_connections = min_connections
+        self.idle_timeout = idle_timeout
+        self.maintenance_interval = maintenance_interval
+        self.metrics = RegistryMetrics()
+        
+        # Orden de uso: el último es el más reciente
+        self._pools: 'OrderedDict[str, DatabasePool]' = OrderedDict()
+        self._lock = threading.RLock()
+        # Contador del presupuesto: cerrojo hoja, nunca se llama a un pool con él tomado
+        self._budget_lock = threading.Lock()
+        self._open_connections = 0
+        self._last_idle_check = time.monotonic()
+        
+        # Hilo de mantenimiento (se arranca con el primer pool, también tras un fork)
+        self._maintenance_thread: Optional[threading.Thread] = None
+        self._maintenance_pid: Optional[int] = None
+        self._maintenance_stop = threading.Event()
+
+    def get_pool(self, db_path: str) -> DatabasePool:
+        """Pool de la BD (creándolo vacío si no existe), marcado como recién usado"""
+        with self._lock:
+            pool = self._pools.get(db_path)
+            if pool is None:
+                pool = DatabasePool(db_path, self.max_connections_per_pool,
+                                    min_connections=self.min_connections, registry=self)
+                self._pools[db_path] = pool
+                self.metrics.pools_created += 1
+            else:
+                self._pools.move_to_end(db_path)
+            pool.last_used = time.monotonic()
+            
+            self._evict_idle_pools()
+            self._evict_excess_pools()
+            self._start_maintenance()
+            return pool
+
+    def _start_maintenance(self):
+        """Arranca el hilo de mantenimiento si está activo y no corre en este proceso (con el lock tomado)"""
+        if self.maintenance_interval <= 0 or self._maintenance_stop.is_set():
+            return
+        if self._maintenance_thread is not None and self._maintenance_thread.is_alive() \
+                and self._maintenance_pid == os.getpid():
+            return
+        self._maintenance_pid = os.getpid()
+        self._maintenance_thread = threading.Thread(target=self._maintenance_loop,
+                                                    name='pool-mantenimiento', daemon=True)
+        self._maintenance_thread.start()
+
+    def _maintenance_loop(self):
+        while not self._maintenance_stop.wait(self.maintenance_interval):
+            try:
+                self.run_maintenance()
+            except Exception as e:
+                logger.error(f"Error en el mantenimiento de pools: {e}")
+
+    def run_maintenance(self) -> int:
+        """Mantenimiento de las BD registradas usadas desde la última vez; devuelve cuántas"""
+        with self._lock:
+            pools = list(self._pools.values())
+        runs = sum(1 for pool in pools if pool.run_maintenance())
+        with self._budget_lock:
+            self.metrics.maintenance_cycles += 1
+            self.metrics.maintenance_runs += runs
+        return runs
+
+    def _evict_excess_pools(self):
+        """Retira los pools menos usados hasta volver a max_pools (solo los que no están en uso)"""
+        for db_path in list(self._pools)[:-1]:
+            if len(self._pools) <= self.max_pools:
+                break
+            pool = self._pools[db_path]
+            if pool.connections_checked_out() == 0:
+                del self._pools[db_path]
+                pool.retire()
+                self.metrics.lru_evictions += 1
+
+    def _evict_idle_pools(self):
+        """Retira los pools sin uso desde hace idle_timeout (revisión como mucho cada idle_timeout/4)"""
+        now = time.monotonic()
+        if now - self._last_idle_check < self.idle_timeout / 4:
+            return
+        self._last_idle_check = now
+        
+        for db_path in list(self._pools)[:-1]:
+            pool = self._pools[db_path]
+            if now - pool.last_used > self.idle_timeout and pool.connections_checked_out() == 0:
+                del self._pools[db_path]
+                pool.retire()
+                self.metrics.idle_evictions += 1
+
+    def reserve_connection(self, pool: DatabasePool) -> bool:
+        """
+        Reserva un hueco del presupuesto para abrir una conexión en el pool.
+        Sin hueco, cierra conexiones libres de otros pools (del menos usado
+        recientemente al más) hasta conseguirlo.
+        """
+        with self._budget_lock:
+            if self._open_connections < self.max_total_connections:
+                self._open_connections += 1
+                return True
+        
+        with self._lock:
+            candidates = [p for p in self._pools.values() if p is not pool]
+        
+        for other in candidates:
+            while other.close_idle_connection():
+                with self._budget_lock:
+                    self.metrics.reclaimed_connections += 1
+                    if self._open_connections < self.max_total_connections:
+                        self._open_connections += 1
+                        return True
+        
+        with self._budget_lock:
+            self.metrics.budget_rejections += 1
+        logger.warning(f"Presupuesto de conexiones agotado ({self.max_total_connections}) para {pool.db_path}")
+        return False
+
+    def release_connection(self):
+        """Devuelve al presupuesto el hueco de una conexión cerrada"""
+        with self._budget_lock:
+            self._open_connections = max(0, self._open_connections - 1)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Ocupación global y de cada pool"""
+        with self._lock:
+            pools = list(self._pools.values())
+        por_pool = {pool.db_path: pool.get_metrics() for pool in pools}
+        in_use = sum(m['connections_checked_out'] + m.get('read_pool', {}).get('connections_checked_out', 0)
+                     for m in por_pool.values())
+        
+        with self._budget_lock:
+            return {
+                'pools': len(por_pool),
+                'max_pools': self.max_pools,
+                'open_connections': self._open_connections,
+                'connections_in_use': in_use,
+                'max_total_connections': self.max_total_connections,
+                'budget_utilization': round(self._open_connections / self.max_total_connections * 100, 2),
+                'pools_created': self.metrics.pools_created,
+                'lru_evictions': self.metrics.lru_evictions,
+                'idle_evictions': self.metrics.idle_evictions,
+                'reclaimed_connections': self.metrics.reclaimed_connections,
+                'budget_rejections': self.metrics.budget_rejections,
+                'maintenance_interval': self.maintenance_interval,
+                'maintenance_cycles': self.metrics.maintenance_cycles,
+                'maintenance_runs': self.metrics.maintenance_runs,
+                'per_pool': por_pool
+            }
+
+    def shutdown(self):
+        """Cierra todos los pools registrados y detiene el mantenimiento"""
+        self._maintenance_stop.set()
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.shutdown()
+
+
+_registry = PoolRegistry(
+    max_pools=DATABASE_POOL_CONFIG['MAX_POOLS'],
+    max_total_connections=DATABASE_POOL_CONFIG['MAX_CONEXIONES_TOTALES'],
+    max_connections_per_pool=DATABASE_POOL_CONFIG['MAX_CONEXIONES_POR_BD'],
+    min_connections=DATABASE_POOL_CONFIG['MIN_CONEXIONES'],
+    idle_timeout=DATABASE_POOL_CONFIG['INACTIVIDAD_SEGUNDOS'],
+    maintenance_interval=DATABASE_POOL_CONFIG['MANTENIMIENTO_SEGUNDOS']
+)
 
 def get_database_pool(db_path: str) -> DatabasePool:
     """
     Obtiene o crea pool para una base de datos específica
     """
-    with _pool_lock:
-        if db_path not in _global_pools:
-            _global_pools[db_path] = DatabasePool(db_path)
-        return _global_pools[db_path]
+    return _registry.get_pool(db_path)
+
+def get_metrics() -> Dict[str, Any]:
+    """Métricas del registro global de pools"""
+    return _registry.get_metrics()
 
 def shutdown_all_pools():
     """Cierra todos los pools activos"""
-    with _pool_lock:
-        for pool in _global_pools.values():
-            pool.shutdown()
-        _global_pools.clear()
+    _registry.shutdown()
@@ -10,6 +10,42 @@ from database_pool import get_database_pool
 logger = get_logger(__name__)
 
 
+def _ruta_bd_actual():
+    """
+    Ruta de la BD de la empresa activa: la de la sesión, la de EMPRESA_DB_PATH
+    (procesos en segundo plano) o la BD por defecto.
+    """
+    db_path = None
+    
+    # Obtener BD de sesión (OBLIGATORIO en sistema multiempresa)
+    try:
+        from flask import has_request_context
+        if has_request_context() and 'empresa_db' in session:
+            db_path = session['empresa_db']
+            logger.debug(f"[MULTIEMPRESA] Usando BD de empresa: {db_path}")
+        elif has_request_context():
+            # Contexto de petición pero sin empresa_db en sesión - usar BD por defecto
+            logger.warning("[MULTIEMPRESA] No hay empresa_db en sesión, usando BD por defecto")
+            db_path = DB_NAME
+        else:
+            logger.warning("[MULTIEMPRESA] No hay contexto de petición disponible")
+    except ImportError as e:
+        logger.warning(f"[MULTIEMPRESA] Flask no disponible, usando BD por defecto: {e}")
+    
+    if not db_path:
+        # Fallback para procesos background sin sesión (ej. hilos Veri*Factu)
+        import os
+        env_db = os.getenv('EMPRESA_DB_PATH')
+        if env_db:
+            db_path = env_db
+            logger.debug(f"[MULTIEMPRESA] Usando BD de entorno: {db_path}")
+    
+    if not db_path:
+        db_path = DB_NAME
+        logger.info(f"Usando BD por defecto: {db_path}")
+    return db_path
+
+
 def get_db_connection():
     """
     Crea y retorna una conexión a la base de datos SQLite.
@@ -18,37 +54,8 @@ def get_db_connection():
     La conexión usa Row como row_factory para acceder a las columnas por nombre.
     """
     try:
-        db_path = None
-        
-        # Obtener BD de sesión (OBLIGATORIO en sistema multiempresa)
-        try:
-            from flask import has_request_context
-            if has_request_context() and 'empresa_db' in session:
-                db_path = session['empresa_db']
-                logger.debug(f"[MULTIEMPRESA] Usando BD de empresa: {db_path}")
-            elif has_request_context():
-                # Contexto de petición pero sin empresa_db en sesión - usar BD por defecto
-                logger.warning("[MULTIEMPRESA] No hay empresa_db en sesión, usando BD por defecto")
-                db_path = DB_NAME
-            else:
-                logger.warning("[MULTIEMPRESA] No hay contexto de petición disponible")
-        except ImportError as e:
-            logger.warning(f"[MULTIEMPRESA] Flask no disponible, usando BD por defecto: {e}")
-        
-        if not db_path:
-            # Fallback para procesos background sin sesión (ej. hilos Veri*Factu)
-            import os
-            env_db = os.getenv('EMPRESA_DB_PATH')
-            if env_db:
-                db_path = env_db
-                logger.debug(f"[MULTIEMPRESA] Usando BD de entorno: {db_path}")
-        
-        if not db_path:
-            db_path = DB_NAME
-            logger.info(f"Usando BD por defecto: {db_path}")
-        
         # Pool activado
-        pool = get_database_pool(db_path)
+        pool = get_database_pool(_ruta_bd_actual())
         return pool.get_connection()
         
         # Conexión directa como antes (LEGACY)
@@ -62,6 +69,45 @@ def get_db_connection():
         logger.error(f"Error al conectar a la base de datos: {str(e)}", exc_info=True)
         raise
 
+
+def get_db_read_connection():
+    """
+    Conexión de solo lectura (mode=ro, query_only) a la BD de la empresa activa.
+    Para informes y consultas largas: no ocupa conexiones de escritura ni
+    bloquea a quien escribe. Se devuelve con close() o saliendo del with.
+    """
+    try:
+        return get_database_pool(_ruta_bd_actual()).get_read_connection()
+    except Exception as e:
+        logger.error(f"Error al conectar a la base de datos (lectura): {str(e)}", exc_info=True)
+        raise
+
+
+def get_db_write_connection():
+    """
+    Conexión del carril de escritura de la BD de la empresa activa. Las
+    escrituras del proceso esperan su turno en orden en lugar de competir por
+    el bloqueo (SQLITE_BUSY). El turno se cede con close() o saliendo del with,
+    así que hay que devolverla en cuanto se confirme la transacción.
+    """
+    try:
+        return get_database_pool(_ruta_bd_actual()).get_writer_connection()
+    except Exception as e:
+        logger.error(f"Error al conectar a la base de datos (escritura): {str(e)}", exc_info=True)
+        raise
+
+
+def get_db_write_transaction():
+    """
+    Context manager de transacción de escritura por el carril: BEGIN IMMEDIATE
+    al entrar, commit al salir y rollback si hay excepción.
+
+    Usage:
+        with get_db_write_transaction() as conn:
+            conn.execute("INSERT INTO ...")
+    """
+    return get_database_pool(_ruta_bd_actual()).write_transaction()
+
 def get_db_connection_pooled():
     """
     Context manager que usa el pool de conexiones automáticamente
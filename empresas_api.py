@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from flask import Blueprint, request, jsonify, send_file, session
-from auth_middleware import superadmin_required, require_admin, login_required
+from auth_middleware import superadmin_required, require_admin, login_required, invalidar_cache_permisos
 import sqlite3
 import os
 import json
@@ -9,6 +9,7 @@ import shutil
 from werkzeug.utils import secure_filename
 from logger_config import get_logger
 from email_utils import enviar_email_bienvenida_empresa
+from plantilla_empresa import crear_bd_desde_plantilla
 
 logger = get_logger(__name__)
 
@@ -125,6 +126,22 @@ def generar_codigo_empresa(nombre):
     return codigo[:5]  # Primeros 5 caracteres
 
 def clonar_estructura_bd(bd_origen, bd_destino):
+    """
+    Crea la BD de una empresa con la estructura de bd_origen copiando su
+    plantilla compilada (plantilla_empresa.py). Los datos maestros van en la
+    BD compartida o en la propia copia según PLANTILLA_EMPRESA_CONFIG. Si la
+    plantilla no se puede preparar, se recrea sentencia a sentencia.
+    """
+    try:
+        crear_bd_desde_plantilla(bd_origen, bd_destino)
+        logger.info(f"BD creada desde plantilla compilada: {bd_destino}")
+        return True
+    except Exception as e:
+        logger.error(f"Error creando BD desde plantilla compilada, se clona sentencia a sentencia: {e}", exc_info=True)
+        return _clonar_estructura_sentencias(bd_origen, bd_destino)
+
+
+def _clonar_estructura_sentencias(bd_origen, bd_destino):
     """Clona la estructura de una BD y copia datos maestros (provincia, codipostal)"""
     try:
         # Conectar a BD origen
@@ -796,6 +813,7 @@ def eliminar_empresa(empresa_id):
         
         conn.commit()
         conn.close()
+        invalidar_cache_permisos(empresa_id=empresa_id)
         
         # Eliminar archivos físicos
         archivos_eliminados = []
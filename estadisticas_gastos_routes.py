@@ -2,13 +2,26 @@ from flask import Blueprint, jsonify, request
 from datetime import datetime
 import sqlite3
 from db_utils import get_db_connection
-import re
+from cache_estadisticas import cachear_respuesta
 from logger_config import get_estadisticas_logger
+from normalizador_conceptos import normalizar_concepto, preparar_conceptos_normalizados
+from utils_fechas_optimizadas import (filtro_rango_fecha, generar_where_fecha_optimizada,
+                                      rango_anio, rango_mes, rango_hasta_mes)
 
 logger = get_estadisticas_logger()
 
 estadisticas_gastos_bp = Blueprint('estadisticas_gastos', __name__)
 
+# fecha_valor (DD/MM/YYYY) como ISO: misma expresión que idx_gastos_fecha_valor_optimized
+FILTRO_FECHA_VALOR = filtro_rango_fecha(generar_where_fecha_optimizada('fecha_valor'))
+
+# Nombre con el que se agrupa un gasto: la razón social si está identificada y,
+# si no, el concepto normalizado persistido (razon_social y concepto_normalizado
+# los garantiza _inicializar_campo_puntual; TRIM equivale a str.strip())
+_ESPACIOS_SQL = "' ' || char(9, 10, 11, 12, 13)"
+TIENE_RAZON_SOCIAL = f"TRIM(COALESCE(razon_social, ''), {_ESPACIOS_SQL}) != ''"
+GRUPO_CONCEPTO = f"CASE WHEN {TIENE_RAZON_SOCIAL} THEN TRIM(razon_social, {_ESPACIOS_SQL}) ELSE concepto_normalizado END"
+
 # ===== FUNCIONES AUXILIARES COMPARTIDAS =====
 
 def _inicializar_campo_puntual(conn):
@@ -34,6 +47,9 @@ def _inicializar_campo_puntual(conn):
 
         conn.commit()
         logger.debug("Campos 'puntual' y 'razon_social' verificados/inicializados")
+
+        # Conceptos normalizados de las filas nuevas o modificadas
+        preparar_conceptos_normalizados(conn)
     except Exception as e:
         logger.error(f"Error al inicializar campos gastos: {e}", exc_info=True)
         conn.rollback()
@@ -104,22 +120,24 @@ def _identificar_gastos_puntuales(conn, anio, mes=None):
     """
     cursor = conn.cursor()
 
+    # La agrupación usa gastos.concepto_normalizado: rellenar las filas pendientes
+    preparar_conceptos_normalizados(conn)
+
     # Obtener todos los gastos del año
     if mes:
-        cursor.execute('''
-            SELECT id, concepto, ABS(importe_eur) as importe, fecha_valor
+        cursor.execute(f'''
+            SELECT id, concepto_normalizado, ABS(importe_eur) as importe, fecha_valor
             FROM gastos
-            WHERE substr(fecha_valor, 7, 4) = ?
-            AND CAST(substr(fecha_valor, 4, 2) AS INTEGER) <= ?
+            WHERE {FILTRO_FECHA_VALOR}
             AND importe_eur < 0
-        ''', (str(anio), mes))
+        ''', rango_hasta_mes(anio, mes))
     else:
-        cursor.execute('''
-            SELECT id, concepto, ABS(importe_eur) as importe, fecha_valor
+        cursor.execute(f'''
+            SELECT id, concepto_normalizado, ABS(importe_eur) as importe, fecha_valor
             FROM gastos
-            WHERE substr(fecha_valor, 7, 4) = ?
+            WHERE {FILTRO_FECHA_VALOR}
             AND importe_eur < 0
-        ''', (str(anio),))
+        ''', rango_anio(anio))
 
     gastos = cursor.fetchall()
 
@@ -131,7 +149,7 @@ def _identificar_gastos_puntuales(conn, anio, mes=None):
     # 1. Agrupar todos los gastos por (concepto normalizado + fecha)
     gastos_por_concepto_fecha = {}
     for gasto in gastos:
-        concepto_norm = _normalizar_concepto(gasto['concepto'])
+        concepto_norm = gasto['concepto_normalizado']
         fecha = gasto['fecha_valor']
         clave = (concepto_norm, fecha)
         
@@ -195,26 +213,25 @@ def _calcular_media_mensual_sin_puntuales(conn, anio, mes=None):
     # Calcular gastos excluyendo puntuales marcados
     cursor = conn.cursor()
     if mes:
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT
                 COALESCE(SUM(ABS(importe_eur)), 0) as total_sin_puntuales,
                 COUNT(*) as cantidad_sin_puntuales
             FROM gastos
-            WHERE substr(fecha_valor, 7, 4) = ?
-            AND CAST(substr(fecha_valor, 4, 2) AS INTEGER) <= ?
+            WHERE {FILTRO_FECHA_VALOR}
             AND importe_eur < 0
             AND (puntual IS NULL OR puntual = 0)
-        ''', (str(anio), mes))
+        ''', rango_hasta_mes(anio, mes))
     else:
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT
                 COALESCE(SUM(ABS(importe_eur)), 0) as total_sin_puntuales,
                 COUNT(*) as cantidad_sin_puntuales
             FROM gastos
-            WHERE substr(fecha_valor, 7, 4) = ?
+            WHERE {FILTRO_FECHA_VALOR}
             AND importe_eur < 0
             AND (puntual IS NULL OR puntual = 0)
-        ''', (str(anio),))
+        ''', rango_anio(anio))
 
     resultado = cursor.fetchone()
     total_sin_puntuales = float(resultado['total_sin_puntuales'] or 0)
@@ -261,110 +278,7 @@ def _obtener_filtro_categoria(categoria):
 
 def _normalizar_concepto(concepto_original):
     """Normaliza un concepto de gasto eliminando referencias, números y código redundante"""
-    # Eliminar números de recibo, referencias, códigos
-    concepto = re.sub(r'N[ºo°]\s*Recibo[:\s]+[\d\s]+', '', concepto_original, flags=re.IGNORECASE)
-    concepto = re.sub(r'Nº\s*[\d\s]+', '', concepto)
-    concepto = re.sub(r'Ref[:\.\s]+.*?Mandato[:\s]+[\w\d\-]+', '', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r'Ref[:\.\s]+[\w\d\-]+', '', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r'Mandato[:\s]+[\w\d\-]+', '', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r'Factura[:\s]+[\d\-\/]+', '', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r'Contracte?\s+(Num\.?|N[ºo°])?\s*[\d\s]*', '', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r'Subministrament\s+D\s+Aigua\s+Contracte\s+Num\.?', 'Subministrament D Aigua', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r'\d{2}\/\d{2}\/\d{4}', '', concepto)  # Fechas
-    concepto = re.sub(r'\d{4}-\d{2}-\d{2}', '', concepto)  # Fechas ISO
-    concepto = re.sub(r'\bBb[a-z]{5}\b', '', concepto, flags=re.IGNORECASE)  # Códigos tipo Bbfztpn
-    
-    # === NORMALIZACIÓN ESPECÍFICA POR TIPO ===
-    
-    # TRANSFERENCIAS: Agrupar por destinatario (eliminar variaciones del concepto)
-    if 'Transferencia' in concepto:
-        # Normalizar "Transferencia Inmediata" → "Transferencia"
-        concepto = re.sub(r'Transferencia\s+Inmediata\s+', 'Transferencia ', concepto, flags=re.IGNORECASE)
-        # TRUYOL: Normalizar "Truyol Digital" → "Truyol"
-        if 'truyol' in concepto.lower():
-            concepto = re.sub(r'Truyol\s+Digital', 'Truyol', concepto, flags=re.IGNORECASE)
-        # Si tiene "A Favor De", mantener solo hasta el nombre (eliminar todo después)
-        match = re.search(r'(Transferencia.*?A\s+Favor\s+De\s+[\w\s,]+?)\s+Concepto', concepto, re.IGNORECASE)
-        if match:
-            concepto = match.group(1).strip()
-    
-    # COMPRAS TARJETA: Eliminar info de tarjeta y localización
-    if 'Compra' in concepto or 'Tarjeta' in concepto:
-        # Normalizar "Compra Internet En" → "Compra En"
-        concepto = re.sub(r'Compra\s+Internet\s+En\s+', 'Compra En ', concepto, flags=re.IGNORECASE)
-        
-        # AMAZON: Normalizar todas las compras de Amazon
-        if 'amazon' in concepto.lower() or 'amzn' in concepto.lower():
-            concepto = 'Compra Amazon Business'
-        
-        # UBER EATS: Normalizar variaciones
-        if 'uber' in concepto.lower() and 'eats' in concepto.lower():
-            concepto = 'Compra Uber Eats'
-        
-        # TAXI: Normalizar taxis (Llic, Lic., etc.)
-        if 'taxi' in concepto.lower() or 'autotaxi' in concepto.lower():
-            concepto = 'Compra Taxi'
-        
-        # Eliminar información de tarjeta y comisión (con números)
-        # Formato: ", Tarjeta 4176570108340631 , Comision 0" o "Comision 0,00"
-        concepto = re.sub(r',\s*Tarjeta\s+[\d\s]+,\s*Comision\s+[\d,\.]+', '', concepto, flags=re.IGNORECASE)
-        # Formato más simple: ", Tarjeta , Comision"
-        concepto = re.sub(r',?\s*Tarjeta\s*,?\s*Comision\s*', '', concepto, flags=re.IGNORECASE)
-        # Eliminar solo ", Tarjeta" al final
-        concepto = re.sub(r',?\s*Tarjeta\s*$', '', concepto, flags=re.IGNORECASE)
-        concepto = re.sub(r',?\s*Tarj\.\s*:?\*?\d*\s*$', '', concepto, flags=re.IGNORECASE)
-        
-        # Eliminar todo después de la segunda coma (ciudad)
-        partes = concepto.split(',')
-        if len(partes) > 2:
-            concepto = ','.join(partes[:2])
-        # Eliminar ", [Ciudad]" al final
-        concepto = re.sub(r',\s*[A-Z][\w\s]+$', '', concepto)
-    
-    # Eliminar ", De" al final y variaciones
-    concepto = re.sub(r',\s*De\s*$', '', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r',\s*D\s*$', '', concepto)  # Solo ", D" al final
-    
-    # REPSOL: Eliminar texto duplicado y redundante
-    if 'repsol' in concepto.lower():
-        # Eliminar "repsol Comercializadora D"
-        concepto = re.sub(r'repsol\s+Comercializadora\s+D?', 'Repsol', concepto, flags=re.IGNORECASE)
-        # Eliminar "Repsol XXXX" donde XXXX son números (códigos de contrato)
-        concepto = re.sub(r'(Repsol)\s+\d+', r'\1', concepto, flags=re.IGNORECASE)
-        # Si aparece "Repsol" duplicado, dejarlo una vez
-        concepto = re.sub(r'(Repsol)[,\s]+(Repsol)', r'\1', concepto, flags=re.IGNORECASE)
-    
-    # ORANGE: Normalizar todas las variaciones
-    if 'orange' in concepto.lower():
-        # Normalizar TODO a "Recibo Orange"
-        if 'Recibo' in concepto:
-            concepto = 'Recibo Orange Espagne'
-    
-    # Eliminar TODOS los números que quedan (muy agresivo)
-    concepto = re.sub(r'\b\d+\b', '', concepto)  # Números aislados
-    concepto = re.sub(r'\s+[A-Z]?\d+[A-Z]?\s*$', '', concepto)  # Códigos alfanuméricos al final
-    
-    # Eliminar texto redundante común
-    concepto = re.sub(r'Periodo\s+Liquidacion[:\s]*[\/\-]*\s*,?\s*', '', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r',?\s*De\s+(No|Not\s+Provided)\s*$', '', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r'\s*[\/\-]+\s*', ' ', concepto)  # Barras y guiones sueltos
-    concepto = re.sub(r'\s*R\.e\.\s*', ' ', concepto, flags=re.IGNORECASE)  # R.e. (régimen especial)
-    concepto = re.sub(r'\bautonomos\b', 'Autónomos', concepto, flags=re.IGNORECASE)
-    
-    # Normalizar puntuación: S.l.u. → Slu, S.a.u → Sau, etc.
-    concepto = re.sub(r'S\.[lL]\.[uU]\.', 'Slu', concepto)
-    concepto = re.sub(r'S\.[aA]\.[uU]\.', 'Sau', concepto)
-    concepto = re.sub(r'S\.[lL]\.', 'Sl', concepto)
-    concepto = re.sub(r'S\.c\.c\.l\.', 'Sccl', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r'S\.a\.', 'Sa', concepto, flags=re.IGNORECASE)
-    concepto = re.sub(r'C\s+B\b', 'CB', concepto)
-    
-    # Eliminar múltiples espacios y puntuación redundante
-    concepto = re.sub(r'\s+', ' ', concepto).strip()
-    concepto = re.sub(r'[,.\s]+$', '', concepto)
-    concepto = re.sub(r'\s*,\s*,\s*', ', ', concepto)  # Comas duplicadas
-    
-    return concepto
+    return normalizar_concepto(concepto_original)
 
 @estadisticas_gastos_bp.route('/api/gastos/estadisticas', methods=['GET'])
 def obtener_estadisticas_gastos():
@@ -387,31 +301,28 @@ def obtener_estadisticas_gastos():
             _marcar_gastos_puntuales(conn, gastos_puntuales_ids)
     
             # Gastos totales del año actual HASTA el mes seleccionado (inclusive) - TOTAL REAL (INCLUYE PUNTUALES)
-            mes_str = str(mes).zfill(2)
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT
                     COALESCE(SUM(ABS(importe_eur)), 0) as total_gastos_anio,
                     COUNT(*) as cantidad_gastos_anio
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
-                AND CAST(substr(fecha_valor, 4, 2) AS INTEGER) <= ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
-            ''', (str(anio), mes))
+            ''', rango_hasta_mes(anio, mes))
     
             datos_anio = cursor.fetchone()
             total_gastos_anio = float(datos_anio['total_gastos_anio'] or 0)
             cantidad_gastos_anio = int(datos_anio['cantidad_gastos_anio'] or 0)
     
             # Gastos del mes actual - TOTAL REAL (INCLUYE PUNTUALES)
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT
                     COALESCE(SUM(ABS(importe_eur)), 0) as total_gastos_mes,
                     COUNT(*) as cantidad_gastos_mes
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
-                AND substr(fecha_valor, 4, 2) = ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
-            ''', (str(anio), mes_str))
+            ''', rango_mes(anio, mes))
     
             datos_mes = cursor.fetchone()
             total_gastos_mes = float(datos_mes['total_gastos_mes'] or 0)
@@ -419,24 +330,22 @@ def obtener_estadisticas_gastos():
     
             # Gastos del año anterior HASTA el mismo mes (para comparación justa) - TOTAL REAL
             anio_anterior = anio - 1
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT COALESCE(SUM(ABS(importe_eur)), 0) as total_gastos_anio_anterior
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
-                AND CAST(substr(fecha_valor, 4, 2) AS INTEGER) <= ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
-            ''', (str(anio_anterior), mes))
+            ''', rango_hasta_mes(anio_anterior, mes))
     
             total_gastos_anio_anterior = float(cursor.fetchone()['total_gastos_anio_anterior'] or 0)
     
             # Gastos del mismo mes del año anterior - TOTAL REAL
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT COALESCE(SUM(ABS(importe_eur)), 0) as total_gastos_mes_anterior
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
-                AND substr(fecha_valor, 4, 2) = ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
-            ''', (str(anio_anterior), mes_str))
+            ''', rango_mes(anio_anterior, mes))
     
             total_gastos_mes_anterior = float(cursor.fetchone()['total_gastos_mes_anterior'] or 0)
             
@@ -473,10 +382,11 @@ def obtener_estadisticas_gastos():
 
 
 @estadisticas_gastos_bp.route('/api/gastos/top10', methods=['GET'])
+@cachear_respuesta('top10_gastos')
 def obtener_top10_gastos():
     """
     Devuelve el top 10 de conceptos de gastos del año actual
-    Agrupados por CONCEPTO NORMALIZADO (usando _normalizar_concepto en Python)
+    Agrupados por CONCEPTO NORMALIZADO (columna concepto_normalizado, agrupada en SQL)
     """
     try:
         anio = request.args.get('anio', datetime.now().year, type=int)
@@ -490,98 +400,54 @@ def obtener_top10_gastos():
             gastos_puntuales_ids = _identificar_gastos_puntuales(conn, anio)
             _marcar_gastos_puntuales(conn, gastos_puntuales_ids)
             
-            # 1. Obtener TODOS los gastos del año actual
-            # Incluir columna razon_social en la consulta (si existe en la tabla, SQLite no da error si seleccionamos NULL as razon_social si no existiera, 
-            # pero ya hemos garantizado que existe con _inicializar_campo_puntual)
-            
-            # Verificar si razon_social existe antes de hacer la query (por seguridad)
-            cursor.execute("PRAGMA table_info(gastos)")
-            cols = [c['name'] for c in cursor.fetchall()]
-            
-            col_razon = "razon_social" if "razon_social" in cols else "NULL as razon_social"
-
+            # 1. Agrupar los gastos del año por razón social o concepto normalizado
             cursor.execute(f'''
-                SELECT concepto, ABS(importe_eur) as importe, puntual, {col_razon}
+                SELECT
+                    {GRUPO_CONCEPTO} as concepto,
+                    SUM(ABS(importe_eur)) as total,
+                    COUNT(*) as cantidad,
+                    SUM(CASE WHEN puntual = 1 THEN 1 ELSE 0 END) as cantidad_puntuales,
+                    TOTAL(CASE WHEN puntual = 1 THEN ABS(importe_eur) END) as total_puntuales
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
-            ''', (str(anio),))
-            
-            gastos_anio = cursor.fetchall()
-            
-            # 2. Agrupar por concepto normalizado en Python
-            agrupados = {}
-            
-            for gasto in gastos_anio:
-                concepto_raw = gasto['concepto']
-                importe = float(gasto['importe'] or 0)
-                es_puntual = int(gasto['puntual'] or 0) == 1
-                razon_social = gasto['razon_social']
-                
-                # Si tenemos razon_social (proveedor identificado), la usamos.
-                # Si no, normalizamos el concepto del banco.
-                if razon_social and razon_social.strip():
-                    concepto_norm = razon_social.strip()
-                else:
-                    concepto_norm = _normalizar_concepto(concepto_raw)
-                
-                if concepto_norm not in agrupados:
-                    agrupados[concepto_norm] = {
-                        'total': 0.0,
-                        'cantidad': 0,
-                        'cantidad_puntuales': 0,
-                        'total_puntuales': 0.0
-                    }
-                
-                agrupados[concepto_norm]['total'] += importe
-                agrupados[concepto_norm]['cantidad'] += 1
-                if es_puntual:
-                    agrupados[concepto_norm]['cantidad_puntuales'] += 1
-                    agrupados[concepto_norm]['total_puntuales'] += importe
-            
-            # 3. Convertir a lista y ordenar
-            lista_gastos = []
-            for concepto, datos in agrupados.items():
-                total_gasto = datos['total']
-                total_puntuales = datos['total_puntuales']
+                GROUP BY 1
+                ORDER BY total DESC
+                LIMIT 10
+            ''', rango_anio(anio))
+            
+            # 2. Top 10 ya ordenado descendentemente por total
+            top_gastos = []
+            for fila in cursor.fetchall():
+                total_gasto = float(fila['total'] or 0)
+                total_puntuales = float(fila['total_puntuales'] or 0)
                 
                 # Determinar si es mayormente puntual
                 es_mayormente_puntual = (total_puntuales / total_gasto > 0.5) if total_gasto > 0 else False
                 
-                lista_gastos.append({
-                    'concepto': concepto,
+                top_gastos.append({
+                    'concepto': fila['concepto'],
                     'total': round(total_gasto, 2),
-                    'cantidad': datos['cantidad'],
+                    'cantidad': fila['cantidad'],
                     'es_puntual': es_mayormente_puntual,
                     'total_puntuales': round(total_puntuales, 2),
-                    'cantidad_puntuales': datos['cantidad_puntuales']
+                    'cantidad_puntuales': fila['cantidad_puntuales']
                 })
             
-            # Ordenar descendentemente por total
-            lista_gastos.sort(key=lambda x: x['total'], reverse=True)
-            
-            # Quedarse con el Top 10
-            top_gastos = lista_gastos[:10]
-            
-            # 4. Obtener datos del año anterior para comparación
+            # 3. Datos del año anterior para comparación (por concepto normalizado)
             anio_anterior = anio - 1
-            cursor.execute('''
-                SELECT concepto, ABS(importe_eur) as importe
+            cursor.execute(f'''
+                SELECT concepto_normalizado, SUM(ABS(importe_eur)) as importe
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
-            ''', (str(anio_anterior),))
+                GROUP BY concepto_normalizado
+            ''', rango_anio(anio_anterior))
             
-            gastos_anterior = cursor.fetchall()
-            
-            # Agrupar año anterior
-            agrupados_anterior = {}
-            for gasto in gastos_anterior:
-                concepto_norm = _normalizar_concepto(gasto['concepto'])
-                importe = float(gasto['importe'] or 0)
-                agrupados_anterior[concepto_norm] = agrupados_anterior.get(concepto_norm, 0.0) + importe
+            agrupados_anterior = {fila['concepto_normalizado']: float(fila['importe'] or 0)
+                                  for fila in cursor.fetchall()}
                 
-            # 5. Calcular diferencias
+            # 4. Calcular diferencias
             for gasto in top_gastos:
                 concepto = gasto['concepto']
                 total_anterior = agrupados_anterior.get(concepto, 0.0)
@@ -618,49 +484,36 @@ def obtener_detalles_gasto():
             cursor = conn.cursor()
             conn.row_factory = sqlite3.Row
             
-            # Verificar si razon_social existe
-            cursor.execute("PRAGMA table_info(gastos)")
-            cols = [c['name'] for c in cursor.fetchall()]
-            col_razon = "razon_social" if "razon_social" in cols else "NULL as razon_social"
+            # Asegurar columnas y conceptos normalizados al día
+            _inicializar_campo_puntual(conn)
             
-            # Obtener TODOS los gastos del año para filtrar en memoria (igual que en top10)
+            # Gastos del año cuyo concepto agrupado coincide (misma agrupación que top10)
             cursor.execute(f'''
                 SELECT 
                     concepto as concepto_original,
                     ABS(importe_eur) as importe,
                     fecha_valor,
-                    {col_razon}
+                    {TIENE_RAZON_SOCIAL} as es_razon_social
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
+                AND {GRUPO_CONCEPTO} = ?
                 ORDER BY fecha_valor DESC
-            ''', (str(anio),))
+            ''', (*rango_anio(anio), concepto_buscado))
             
             gastos_filtrados = []
             importes = []
             
             for row in cursor.fetchall():
-                concepto_raw = row['concepto_original']
                 importe = float(row['importe'] or 0)
-                fecha = row['fecha_valor']
-                razon_social = row['razon_social']
-                
-                # Lógica de normalización idéntica a top10
-                if razon_social and razon_social.strip():
-                    concepto_norm = razon_social.strip()
-                else:
-                    concepto_norm = _normalizar_concepto(concepto_raw)
-                
-                # Si coincide con el concepto buscado
-                if concepto_norm == concepto_buscado:
-                    gastos_filtrados.append({
-                        'concepto': concepto_norm, # Concepto agrupado
-                        'concepto_real': concepto_raw, # Concepto original del banco
-                        'fecha': fecha,
-                        'importe': round(importe, 2),
-                        'es_razon_social': bool(razon_social and razon_social.strip())
-                    })
-                    importes.append(importe)
+                gastos_filtrados.append({
+                    'concepto': concepto_buscado, # Concepto agrupado
+                    'concepto_real': row['concepto_original'], # Concepto original del banco
+                    'fecha': row['fecha_valor'],
+                    'importe': round(importe, 2),
+                    'es_razon_social': bool(row['es_razon_social'])
+                })
+                importes.append(importe)
             
             if not gastos_filtrados:
                  return jsonify({
@@ -736,45 +589,16 @@ def obtener_gastos_por_categoria_mes():
             gastos_puntuales_ids = _identificar_gastos_puntuales(conn, anio, mes)
             _marcar_gastos_puntuales(conn, gastos_puntuales_ids)
             
-            # Verificar columna razon_social
-            cursor.execute("PRAGMA table_info(gastos)")
-            cols = [c['name'] for c in cursor.fetchall()]
-            col_razon = "razon_social" if "razon_social" in cols else "NULL as razon_social"
-
-            # Obtener TODOS los gastos del mes
+            # Gastos del mes agrupados por razón social o concepto normalizado
             cursor.execute(f'''
-                SELECT 
-                    concepto, ABS(importe_eur) as importe, puntual, {col_razon}
+                SELECT {GRUPO_CONCEPTO} as concepto, SUM(ABS(importe_eur)) as total
                 FROM gastos
-                WHERE substr(fecha_valor, 4, 2) = ?
-                AND substr(fecha_valor, 7, 4) = ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
-            ''', (str(mes).zfill(2), str(anio)))
+                GROUP BY 1
+            ''', rango_mes(anio, mes))
             
-            agrupados = {}
-            total_general = 0.0
-            
-            for row in cursor.fetchall():
-                importe = float(row['importe'] or 0)
-                es_puntual = int(row['puntual'] or 0) == 1
-                
-                # Excluir puntuales automáticos del gráfico mensual (según lógica anterior)
-                # if es_puntual:
-                #    continue
-
-                razon_social = row['razon_social']
-                concepto_raw = row['concepto']
-
-                if razon_social and razon_social.strip():
-                    concepto_norm = razon_social.strip()
-                else:
-                    concepto_norm = _normalizar_concepto(concepto_raw)
-                
-                if concepto_norm not in agrupados:
-                    agrupados[concepto_norm] = 0.0
-                
-                agrupados[concepto_norm] += importe
-                total_general += importe
+            agrupados = {row['concepto']: float(row['total'] or 0) for row in cursor.fetchall()}
             
             # Convertir a lista
             lista_categorias = [{'categoria': k, 'total': v} for k, v in agrupados.items()]
@@ -815,6 +639,7 @@ def obtener_gastos_por_categoria_mes():
         return jsonify({'error': str(e)}), 500
 
 @estadisticas_gastos_bp.route('/api/gastos/por-categoria-anio', methods=['GET'])
+@cachear_respuesta('gastos_por_categoria_anio')
 def obtener_gastos_por_categoria_anio():
     """
     Devuelve gastos del año completo agrupados por CONCEPTO NORMALIZADO para gráfico de pastel
@@ -825,39 +650,19 @@ def obtener_gastos_por_categoria_anio():
         with get_db_connection() as conn:
             cursor = conn.cursor()
             conn.row_factory = sqlite3.Row
-            
-            # Verificar columna razon_social
+
             _inicializar_campo_puntual(conn) # Asegurar columnas
-            
-            cursor.execute("PRAGMA table_info(gastos)")
-            cols = [c['name'] for c in cursor.fetchall()]
-            col_razon = "razon_social" if "razon_social" in cols else "NULL as razon_social"
 
-            # Obtener gastos del año completo
+            # Gastos del año completo agrupados por razón social o concepto normalizado
             cursor.execute(f'''
-                SELECT 
-                    concepto, ABS(importe_eur) as importe, {col_razon}
+                SELECT {GRUPO_CONCEPTO} as concepto, SUM(ABS(importe_eur)) as total
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
-            ''', (str(anio),))
+                GROUP BY 1
+            ''', rango_anio(anio))
             
-            agrupados = {}
-            
-            for row in cursor.fetchall():
-                importe = float(row['importe'] or 0)
-                razon_social = row['razon_social']
-                concepto_raw = row['concepto']
-
-                if razon_social and razon_social.strip():
-                    concepto_norm = razon_social.strip()
-                else:
-                    concepto_norm = _normalizar_concepto(concepto_raw)
-                
-                if concepto_norm not in agrupados:
-                    agrupados[concepto_norm] = 0.0
-                
-                agrupados[concepto_norm] += importe
+            agrupados = {row['concepto']: float(row['total'] or 0) for row in cursor.fetchall()}
             
             # Convertir a lista
             lista_categorias = [{'categoria': k, 'total': v} for k, v in agrupados.items()]
@@ -917,24 +722,16 @@ def obtener_detalles_categoria():
             gastos_puntuales_ids = _identificar_gastos_puntuales(conn, anio, mes)
             _marcar_gastos_puntuales(conn, gastos_puntuales_ids)
             
-            # Verificar columna razon_social
-            cursor.execute("PRAGMA table_info(gastos)")
-            cols = [c['name'] for c in cursor.fetchall()]
-            col_razon = "razon_social" if "razon_social" in cols else "NULL as razon_social"
-            
-            # 1. Obtener TODOS los gastos (del año o del mes según corresponda)
+            # 1. Obtener TODOS los gastos (del año o del mes según corresponda) con su concepto agrupado
             query = f'''
                 SELECT 
-                    id, fecha_valor, concepto, ABS(importe_eur) as importe, puntual, {col_razon}
+                    id, fecha_valor, concepto, ABS(importe_eur) as importe, puntual,
+                    {GRUPO_CONCEPTO} as concepto_norm
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
             '''
-            params = [str(anio)]
-            
-            if mes:
-                query += ' AND substr(fecha_valor, 4, 2) = ?'
-                params.append(str(mes).zfill(2))
+            params = list(rango_mes(anio, mes) if mes else rango_anio(anio))
                 
             query += ' ORDER BY fecha_valor DESC'
             
@@ -949,14 +746,9 @@ def obtener_detalles_categoria():
             
             for row in todos_los_gastos:
                 importe = float(row['importe'] or 0)
-                razon_social = row['razon_social']
                 concepto_raw = row['concepto']
                 fecha = row['fecha_valor']
-                
-                if razon_social and razon_social.strip():
-                    concepto_norm = razon_social.strip()
-                else:
-                    concepto_norm = _normalizar_concepto(concepto_raw)
+                concepto_norm = row['concepto_norm']
                 
                 if concepto_norm not in agrupados_totales:
                     agrupados_totales[concepto_norm] = 0.0
@@ -1044,6 +836,7 @@ def obtener_detalles_categoria():
         return jsonify({'error': str(e)}), 500
 
 @estadisticas_gastos_bp.route('/api/gastos/evolucion-mensual', methods=['GET'])
+@cachear_respuesta('evolucion_mensual')
 def obtener_evolucion_mensual():
     """
     Devuelve la evolución mensual de gastos para una categoría específica
@@ -1074,7 +867,7 @@ def obtener_evolucion_mensual():
                         COALESCE(SUM(CASE WHEN puntual = 1 THEN ABS(importe_eur) ELSE 0 END), 0) as total_puntuales,
                         COALESCE(SUM(CASE WHEN puntual = 1 THEN 1 ELSE 0 END), 0) as cantidad_puntuales
                     FROM gastos
-                    WHERE substr(fecha_valor, 7, 4) = ?
+                    WHERE {FILTRO_FECHA_VALOR}
                     AND importe_eur < 0
                     GROUP BY mes
                     ORDER BY mes
@@ -1090,14 +883,14 @@ def obtener_evolucion_mensual():
                         COALESCE(SUM(CASE WHEN puntual = 1 THEN ABS(importe_eur) ELSE 0 END), 0) as total_puntuales,
                         COALESCE(SUM(CASE WHEN puntual = 1 THEN 1 ELSE 0 END), 0) as cantidad_puntuales
                     FROM gastos
-                    WHERE substr(fecha_valor, 7, 4) = ?
+                    WHERE {FILTRO_FECHA_VALOR}
                     AND importe_eur < 0
                     AND {filtro_categoria}
                     GROUP BY mes
                     ORDER BY mes
                 '''
             
-            cursor.execute(query, (str(anio),))
+            cursor.execute(query, rango_anio(anio))
             
             # Crear array con todos los meses (0 si no hay datos)
             meses_data = {i: {'total': 0.0, 'cantidad': 0, 'total_puntuales': 0.0, 'cantidad_puntuales': 0, 'total_bruto': 0.0} for i in range(1, 13)}
@@ -1143,6 +936,7 @@ def obtener_evolucion_mensual():
         return jsonify({'error': str(e)}), 500
 
 @estadisticas_gastos_bp.route('/api/informe-situacion', methods=['GET'])
+@cachear_respuesta('informe_situacion')
 def generar_informe_situacion():
     """
     Genera un informe completo de situación financiera analizando ventas y gastos
@@ -1156,7 +950,6 @@ def generar_informe_situacion():
             
             # ===== DATOS DE VENTAS =====
             # Total ventas del año hasta el mes actual (FACTURAS + TICKETS)
-            mes_str = str(mes).zfill(2)
             
             # Facturas del año (solo cobradas)
             cursor.execute('''
@@ -1164,10 +957,9 @@ def generar_informe_situacion():
                     COALESCE(SUM(importe_cobrado), 0) as total_ventas,
                     COUNT(*) as num_facturas
                 FROM factura
-                WHERE CAST(substr(fecha, 1, 4) AS INTEGER) = ?
-                AND CAST(substr(fecha, 6, 2) AS INTEGER) <= ?
+                WHERE fecha >= ? AND fecha < ?
                 AND estado = 'C'
-            ''', (anio, mes))
+            ''', rango_hasta_mes(anio, mes))
             facturas_anio = cursor.fetchone()
             total_facturas = float(facturas_anio['total_ventas'] or 0)
             num_facturas = int(facturas_anio['num_facturas'] or 0)
@@ -1178,10 +970,9 @@ def generar_informe_situacion():
                     COALESCE(SUM(importe_cobrado), 0) as total_ventas,
                     COUNT(*) as num_tickets
                 FROM tickets
-                WHERE CAST(substr(fecha, 1, 4) AS INTEGER) = ?
-                AND CAST(substr(fecha, 6, 2) AS INTEGER) <= ?
+                WHERE fecha >= ? AND fecha < ?
                 AND estado = 'C'
-            ''', (anio, mes))
+            ''', rango_hasta_mes(anio, mes))
             tickets_anio = cursor.fetchone()
             total_tickets = float(tickets_anio['total_ventas'] or 0)
             num_tickets = int(tickets_anio['num_tickets'] or 0)
@@ -1193,8 +984,8 @@ def generar_informe_situacion():
                     COUNT(*) as num_pendientes
                 FROM factura
                 WHERE estado = 'P'
-                AND CAST(substr(fecha, 1, 4) AS INTEGER) = ?
-            ''', (anio,))
+                AND fecha >= ? AND fecha < ?
+            ''', rango_anio(anio))
             facturas_pend = cursor.fetchone()
             total_fact_pendientes = float(facturas_pend['total_pendientes'] or 0)
             num_fact_pendientes = int(facturas_pend['num_pendientes'] or 0)
@@ -1206,8 +997,8 @@ def generar_informe_situacion():
                     COUNT(*) as num_vencidas
                 FROM factura
                 WHERE estado = 'V'
-                AND CAST(substr(fecha, 1, 4) AS INTEGER) = ?
-            ''', (anio,))
+                AND fecha >= ? AND fecha < ?
+            ''', rango_anio(anio))
             facturas_venc = cursor.fetchone()
             total_fact_vencidas = float(facturas_venc['total_vencidas'] or 0)
             num_fact_vencidas = int(facturas_venc['num_vencidas'] or 0)
@@ -1220,20 +1011,18 @@ def generar_informe_situacion():
             cursor.execute('''
                 SELECT COALESCE(SUM(importe_cobrado), 0) as total_mes
                 FROM factura
-                WHERE substr(fecha, 1, 4) = ?
-                AND substr(fecha, 6, 2) = ?
+                WHERE fecha >= ? AND fecha < ?
                 AND estado = 'C'
-            ''', (str(anio), mes_str))
+            ''', rango_mes(anio, mes))
             facturas_mes = float(cursor.fetchone()['total_mes'] or 0)
             
             # Ventas del mes actual (tickets cobrados)
             cursor.execute('''
                 SELECT COALESCE(SUM(importe_cobrado), 0) as total_mes
                 FROM tickets
-                WHERE substr(fecha, 1, 4) = ?
-                AND substr(fecha, 6, 2) = ?
+                WHERE fecha >= ? AND fecha < ?
                 AND estado = 'C'
-            ''', (str(anio), mes_str))
+            ''', rango_mes(anio, mes))
             tickets_mes = float(cursor.fetchone()['total_mes'] or 0)
             
             # Total mes (facturas + tickets)
@@ -1248,29 +1037,27 @@ def generar_informe_situacion():
     
             # ===== DATOS DE GASTOS =====
             # Total gastos del año hasta el mes actual - EXCLUYENDO PUNTUALES
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT
                     COALESCE(SUM(ABS(importe_eur)), 0) as total_gastos,
                     COUNT(*) as num_gastos
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
-                AND CAST(substr(fecha_valor, 4, 2) AS INTEGER) <= ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
                 AND (puntual IS NULL OR puntual = 0)
-            ''', (str(anio), mes))
+            ''', rango_hasta_mes(anio, mes))
             gastos_anio = cursor.fetchone()
             total_gastos = float(gastos_anio['total_gastos'] or 0)
             num_gastos = int(gastos_anio['num_gastos'] or 0)
     
             # Gastos del mes actual - EXCLUYENDO PUNTUALES
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT COALESCE(SUM(ABS(importe_eur)), 0) as total_mes
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
-                AND substr(fecha_valor, 4, 2) = ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
                 AND (puntual IS NULL OR puntual = 0)
-            ''', (str(anio), mes_str))
+            ''', rango_mes(anio, mes))
             gastos_mes = float(cursor.fetchone()['total_mes'] or 0)
             
             # ===== ANÁLISIS Y MÉTRICAS =====
@@ -1301,13 +1088,12 @@ def generar_informe_situacion():
                     COALESCE(SUM(ABS(importe_eur)), 0) as total,
                     COUNT(*) as cantidad
                 FROM gastos
-                WHERE substr(fecha_valor, 7, 4) = ?
-                AND CAST(substr(fecha_valor, 4, 2) AS INTEGER) <= ?
+                WHERE {FILTRO_FECHA_VALOR}
                 AND importe_eur < 0
                 GROUP BY categoria
                 ORDER BY total DESC
                 LIMIT 5
-            ''', (str(anio), mes))
+            ''', rango_hasta_mes(anio, mes))
             
             top_categorias_gastos = []
             for row in cursor.fetchall():
@@ -1419,31 +1205,28 @@ def simular_escenarios():
         cursor.execute('''
             SELECT COALESCE(SUM(importe_cobrado), 0) as total
             FROM factura
-            WHERE CAST(substr(fecha, 1, 4) AS INTEGER) = ?
-            AND CAST(substr(fecha, 6, 2) AS INTEGER) <= ?
+            WHERE fecha >= ? AND fecha < ?
             AND estado = 'C'
-        ''', (anio, mes))
+        ''', rango_hasta_mes(anio, mes))
         ventas_facturas = float(cursor.fetchone()['total'] or 0)
 
         # Tickets cobrados
         cursor.execute('''
             SELECT COALESCE(SUM(importe_cobrado), 0) as total
             FROM tickets
-            WHERE CAST(substr(fecha, 1, 4) AS INTEGER) = ?
-            AND CAST(substr(fecha, 6, 2) AS INTEGER) <= ?
+            WHERE fecha >= ? AND fecha < ?
             AND estado = 'C'
-        ''', (anio, mes))
+        ''', rango_hasta_mes(anio, mes))
         ventas_tickets = float(cursor.fetchone()['total'] or 0)
 
         # Gastos - EXCLUYENDO PUNTUALES
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT COALESCE(SUM(ABS(importe_eur)), 0) as total
             FROM gastos
-            WHERE substr(fecha_valor, 7, 4) = ?
-            AND CAST(substr(fecha_valor, 4, 2) AS INTEGER) <= ?
+            WHERE {FILTRO_FECHA_VALOR}
             AND importe_eur < 0
             AND (puntual IS NULL OR puntual = 0)
-        ''', (str(anio), mes))
+        ''', rango_hasta_mes(anio, mes))
         gastos_totales = float(cursor.fetchone()['total'] or 0)
         
         # Datos reales
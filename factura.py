@@ -1,6 +1,7 @@
 import base64
 import json
 import os
+import re
 # --- Utilidades y acceso a base de datos ---
 import sqlite3
 import tempfile
@@ -13,26 +14,16 @@ from logger_config import get_factura_logger
 
 logger = get_factura_logger()
 
-try:
-    from weasyprint import CSS, HTML
-except ImportError:
-    logger.warning("WeasyPrint no está instalado. La generación de PDF no estará disponible.")
-    # Mock classes to prevent import errors
-    class CSS:
-        def __init__(self, *args, **kwargs):
-            pass
-    class HTML:
-        def __init__(self, *args, **kwargs):
-            pass
-        def write_pdf(self, *args, **kwargs):
-            raise ImportError("WeasyPrint no está disponible")
 from decimal import Decimal, ROUND_HALF_UP
 
 from db_utils import (actualizar_numerador, get_db_connection,
-                      verificar_numero_factura)
+                      get_db_write_connection, verificar_numero_factura)
 from email_utils import enviar_factura_por_email
 # --- Integración Facturae ---
 from utils_emisor import cargar_datos_emisor
+from motor_plantillas import contexto_emisor, get_motor_plantillas
+from multiempresa_config import VERIFACTU_OUTBOX_CONFIG
+from verifactu_outbox import encolar_factura
 
 # --- Integración VERI*FACTU ---
 import logging
@@ -89,6 +80,276 @@ app = Flask(__name__)
 
 factura_bp = Blueprint('facturas', __name__)
 
+def generar_facturae_factura(factura_id, data, presentar_face_flag, push_notif, emisor=None):
+    """
+    Genera y firma el XML Facturae de una factura ya guardada.
+    Devuelve la ruta del XML o None si no se ha podido generar; los errores
+    se registran y se notifican, nunca se propagan.
+
+    emisor: datos del emisor ya cargados. cargar_datos_emisor() depende de la
+    sesión, así que fuera de una petición (worker de la outbox) hay que pasarlos.
+    """
+    try:
+        logger.info("[FACTURAE] Iniciando integración Facturae para factura_id:", factura_id)
+        if emisor is None:
+            emisor = cargar_datos_emisor()
+        push_notif("Generando XML Facturae ...")
+
+        # Para Facturae necesitamos datos de contacto. Usamos nueva conexión si es necesaria
+        # O mejor, extraemos datos ANTES de cerrar la conexión.
+        # Como ya cerré, debo abrir nueva conexión SOLO para leer contacto si Facturae lo hace internamente o aquí.
+        # El código original hacía query aquí.
+
+        # RE-OPEN conexión temporal solo lectura
+        with get_db_connection() as temp_conn:
+            temp_cursor = temp_conn.cursor()
+            temp_cursor.execute('''
+                SELECT razonsocial, identificador, direccion, cp, localidad, provincia,
+                       dir3_oficina, dir3_organo, dir3_unidad, face_presentacion, tipo
+                FROM contactos WHERE idContacto = ?
+            ''', (data['idContacto'],))
+            contacto = temp_cursor.fetchone()
+
+        if contacto:
+            logger.info(f"[FACTURAE]Datos de contacto encontrados: {contacto}")
+            # Convierte contacto (sqlite3.Row o tuple) a dict para acceso seguro
+            datos_contacto = {
+                'razonsocial': contacto[0],
+                'nif': contacto[1],
+                'direccion': contacto[2],
+                'cp': contacto[3],
+                'localidad': contacto[4],
+                'provincia': contacto[5],
+                'dir3_oficina': contacto[6],
+                'dir3_organo': contacto[7],
+                'dir3_unidad': contacto[8],
+                'face_presentacion': contacto[9],
+                'tipo': contacto[10]
+            }
+            requiere_face = presentar_face_flag or (datos_contacto.get('face_presentacion') == 1)
+            if requiere_face:
+                faltantes = []
+                if not (datos_contacto.get('dir3_oficina') or '').strip():
+                    faltantes.append('DIR3 Oficina contable')
+                if not (datos_contacto.get('dir3_organo') or '').strip():
+                    faltantes.append('DIR3 Órgano gestor')
+                if not (datos_contacto.get('dir3_unidad') or '').strip():
+                    faltantes.append('DIR3 Unidad tramitadora')
+                if faltantes:
+                    mensaje_error = f"El contacto requiere FACe pero faltan códigos DIR3: {', '.join(faltantes)}"
+                    logger.info(f"[FACTURAE][ERROR] {mensaje_error}")
+                    push_notif(mensaje_error, tipo='error')
+                    return None
+
+            direccion_completa = f"{datos_contacto['direccion']}, {datos_contacto['cp']} {datos_contacto['localidad']} ({datos_contacto['provincia']})"
+            datos_facturae = {
+                'emisor': emisor,
+                'receptor': {
+                    'nif': datos_contacto['nif'] if datos_contacto['nif'] else 'B00000000',
+                    'nombre': datos_contacto['razonsocial'],
+                    'direccion': direccion_completa,
+                    'direccion_calle': datos_contacto['direccion'],
+                    'cp': datos_contacto['cp'],
+                    'ciudad': datos_contacto['localidad'],
+                    'provincia': datos_contacto['provincia'],
+                    'pais': 'ESP',
+                    'tipo': datos_contacto.get('tipo')
+                },
+                # Campos obligatorios para formato Facturae
+                'invoice_number': data['numero'],
+                'issue_date': data['fecha'],
+                'numero': data['numero'],
+                'fecha': data['fecha'],
+                'concepto': data['detalles'][0]['concepto'] if data['detalles'] else 'Concepto',
+                'cantidad': data['detalles'][0]['cantidad'] if data['detalles'] else 1,
+                'precio_unitario': data['detalles'][0]['precio'] if data['detalles'] else data['total'],
+                'total': data['total'],
+                'iva': data['detalles'][0]['impuestos'] if data['detalles'] else 21.0,
+                'detalles': data['detalles'],
+                'customer_info': {
+                    'nif': datos_contacto['nif'] if datos_contacto['nif'] else 'B00000000',
+                    'nombre': datos_contacto['razonsocial'],
+                    'direccion': direccion_completa,
+                    'cp': datos_contacto['cp'],
+                    'localidad': datos_contacto['localidad'],
+                    'provincia': datos_contacto['provincia'],
+                    'pais': 'ESP'
+                },
+                'base_amount': float(data['importe_bruto']),
+                'taxes': float(data['importe_impuestos']),
+                'total_amount': float(data['total']),
+                # Añadimos campo 'items' con el formato correcto para generar_facturae
+                'items': data['detalles'],
+                # Nos aseguramos de que el campo 'detalles' esté presente con el formato esperado por generar_facturae
+                'detalles': data['detalles'],
+                'presentar_face': 1 if requiere_face else 0,
+                'dir3_oficina': datos_contacto.get('dir3_oficina'),
+                'dir3_organo': datos_contacto.get('dir3_organo'),
+                'dir3_unidad': datos_contacto.get('dir3_unidad')
+            }
+        else:
+            logger.info("[FACTURAE] No se encontraron datos del contacto, usando valores por defecto para receptor.")
+            datos_facturae = {
+                'emisor': emisor,
+                'receptor': {
+                    'nif': 'B00000000',
+                    'nombre': 'CONTACTO_DESCONOCIDO',
+                    'direccion': '-',
+                    'direccion_calle': '-',
+                    'cp': '-',
+                    'ciudad': '-',
+                    'provincia': '-',
+                    'pais': 'ESP',
+                    'tipo': None
+                },
+                'invoice_number': data['numero'],
+                'issue_date': data['fecha'],
+                'numero': data['numero'],
+                'fecha': data['fecha'],
+                'total': data['total'],
+                'iva': data['detalles'][0]['impuestos'] if data['detalles'] else 21.0,
+                'detalles': data['detalles'],
+                'customer_info': {
+                    'nif': 'B00000000',
+                    'nombre': 'CONTACTO_DESCONOCIDO',
+                    'direccion': '-',
+                    'cp': '-',
+                    'localidad': '-',
+                    'provincia': '-',
+                    'pais': 'ESP'
+                },
+                'base_amount': float(data['importe_bruto']),
+                'taxes': float(data['importe_impuestos']),
+                'total_amount': float(data['total']),
+                # Añadimos campo 'items' con el formato correcto para generar_facturae
+                'items': data['detalles'],
+                # Nos aseguramos de que el campo 'detalles' esté presente con el formato esperado
+                'detalles': data['detalles']
+            }
+        # Validar campos críticos antes de generar Facturae
+        campos_obligatorios = ['invoice_number', 'issue_date', 'customer_info', 'items', 'base_amount', 'taxes', 'total_amount']
+        missing_fields = [campo for campo in campos_obligatorios if campo not in datos_facturae or datos_facturae[campo] is None]
+        if missing_fields:
+            with safe_append_debug('facturae_debug.txt') as log_file:
+                log_file.write(f"[VALIDACIÓN] Campos faltantes: {missing_fields}\n")
+                log_file.write(f"[VALIDACIÓN] Claves disponibles: {list(datos_facturae.keys())}\n")
+            raise ValueError(f"Campos obligatorios faltantes: {', '.join(missing_fields)}")
+
+        datos_facturae['total_amount'] = data['total']  # Añadimos el campo requerido
+
+        # Añadimos campos para VERI*FACTU
+        datos_facturae['verifactu'] = VERIFACTU_DISPONIBLE  # Se genera formato VERI*FACTU sólo si está habilitado
+        datos_facturae['factura_id'] = factura_id  # ID de factura para registro en VERI*FACTU
+
+        logger.info("[FACTURAE] Llamando a generar_facturae con configuración VERI*FACTU")
+        # Log detallado antes de llamar a generar_facturae
+        with safe_append_debug('facturae_env_debug.txt') as f:
+            f.write(f'[DEBUG][factura.py] datos_facturae={datos_facturae}\n')
+            f.write('[DEBUG][factura.py] Integración VERI*FACTU activada\n')
+        try:
+            # Explicitamente importamos la función desde facturae.generador para evitar confusión
+            from facturae.generador import \
+                generar_facturae as generar_facturae_modular
+
+            push_notif("Firmando XML Facturae ...")  # noqa: E501
+            # Usar la versión modular que genera el XML en formato Facturae 3.2.2 compatible con VERI*FACTU
+            ruta_xml_final = generar_facturae_modular(datos_facturae)
+            logger.info(f"[FACTURAE]Facturae 3.2.2 generada y firmada en {ruta_xml_final}")
+            if ruta_xml_final and ruta_xml_final.lower().endswith('.xsig'):
+                push_notif("XML Facturae generado")
+            logger.info(f"[FACTURAE]Factura electrónica generada correctamente para factura ID: {factura_id}")
+            return ruta_xml_final
+        except Exception as e:
+            logger.info(f"[FACTURAE][ERROR] Error generando Facturae: {e}")
+            push_notif("Error al generar XML Facturae", tipo='error')
+            # Registrar traza completa del error
+            import traceback
+            logger.error("Traceback:", exc_info=True)
+    except Exception as e:
+        logger.info(f"[FACTURAE][ERROR] Error en integración Facturae: {e}")
+    return None
+
+
+def empresa_codigo_de_ruta(db_path):
+    """Código de empresa a partir de la ruta de su BD (/db/CODIGO/CODIGO.db)"""
+    # Si db_path es None (ej: error extrayéndolo) no se puede saber la empresa
+    if not db_path:
+        return 'unknown'
+    match = re.search(r'/db/([^/]+)/\1\.db', db_path)
+    if match:
+        return match.group(1)
+    return os.path.basename(db_path).replace('.db', '')
+
+
+def enviar_verifactu_factura(factura_id, db_path_val, push_notif):
+    """
+    Encadena el hash VERI*FACTU de la factura, genera el QR y envía el
+    registro a la AEAT. Devuelve el dict 'datos_adicionales' de la respuesta.
+    """
+    try:
+        logger.info("[VERIFACTU] Iniciando integración VERI*FACTU para factura_id:", factura_id)
+        push_notif("Enviando registro AEAT ...")
+        # Generar datos VERI*FACTU para la factura (solo si está disponible)
+        if VERIFACTU_DISPONIBLE:
+            try:
+                empresa_codigo = empresa_codigo_de_ruta(db_path_val)
+                logger.info(f"[VERIFACTU] Usando empresa_codigo={empresa_codigo} (extraído de BD: {db_path_val})")
+                datos_verifactu = verifactu.generar_datos_verifactu_para_factura(factura_id, empresa_codigo=empresa_codigo)
+                if datos_verifactu and 'datos' in datos_verifactu and 'hash' in datos_verifactu['datos']:
+                    logger.info(f"[VERIFACTU]Datos generados correctamente: hash={datos_verifactu['datos']['hash'][:10]}...")
+                    push_notif("QR generado")
+                    # Enviamos como parte del retorno
+                    datos_adicionales = {
+                        'hash': datos_verifactu['datos']['hash'],
+                        'verifactu': True
+                    }
+                else:
+                    logger.info("[VERIFACTU] No se pudieron generar los datos VERI*FACTU")
+                    # Intentar extraer código/descripcion de error devuelto por AEAT
+                    codigo_err = None
+                    descripcion_err = None
+                    if datos_verifactu and isinstance(datos_verifactu, dict):
+                        errores_list = datos_verifactu.get('errores')
+                        if errores_list and isinstance(errores_list, list):
+                            codigo_err = errores_list[0].get('codigo')
+                            descripcion_err = errores_list[0].get('descripcion_error') or errores_list[0].get('descripcion')
+                    if codigo_err:
+                        push_notif(f"Error AEAT {codigo_err}", tipo='error')
+                    else:
+                        push_notif("Error en generación de datos VERI*FACTU", tipo='error')
+
+                    # Preparar mensaje claro para frontend
+                    mensaje_front = f"Error AEAT {codigo_err}: {descripcion_err}" if codigo_err else "Fallo al generar datos VERI*FACTU"
+                    datos_adicionales = {
+                        'verifactu': False,
+                        'error': mensaje_front,
+                        'codigo_error_aeat': codigo_err
+                    }
+            except Exception as e:
+                logger.warning(f"[!] Error al generar datos VERI*FACTU: {str(e)}")
+                push_notif("Error al enviar registro AEAT", tipo='error')
+                # Continuamos sin VERI*FACTU
+                datos_adicionales = {
+                    'verifactu': False,
+                    'error': f"Error VERI*FACTU: {str(e)}"
+                }
+        else:
+            logger.warning("[!] Módulo VERI*FACTU no disponible - Omitiendo generación de datos")
+            datos_adicionales = {
+                'verifactu': False,
+                'error': "Módulo VERI*FACTU no disponible"
+            }
+    except Exception as e:
+        logger.info(f"[VERIFACTU][ERROR] Error en integración VERI*FACTU: {e}")
+        import traceback
+        logger.error("Traceback:", exc_info=True)
+        datos_adicionales = {
+            'verifactu': False,
+            'error': f"Error en integración VERI*FACTU: {str(e)}"
+        }
+    return datos_adicionales
+
+
 def crear_factura(data=None):
     conn = None
     try:
@@ -121,7 +382,8 @@ def crear_factura(data=None):
         if verificacion.json['existe']:
             return jsonify({'error': 'Ya existe una factura con este número'}), 400
 
-        conn = get_db_connection()
+        # Carril de escritura: espera su turno en lugar de chocar con otras escrituras
+        conn = get_db_write_connection()
         cursor = conn.cursor()
         
         # Iniciar transacción
@@ -186,6 +448,21 @@ def crear_factura(data=None):
                 if numerador_actual is None:
                     raise Exception("Error al actualizar el numerador")
    
+            # Si la factura todavía no está lista para envío (pendiente de cobro) y NO es rectificativa,
+            # omitimos la generación de XML Facturae y el envío a AEAT. Las facturas rectificativas (estado 'RE',
+            # tipo 'R' o cuyo número termina en '-R') deben enviarse aunque no estén cobradas.
+            estado_doc = data.get('estado', 'P')
+            tipo_doc = data.get('tipo', 'N')
+            num_doc = str(data.get('numero', ''))
+            es_rectificativa = (estado_doc == 'RE') or (tipo_doc.upper() == 'R') or num_doc.upper().endswith('-R')
+            requiere_envio = estado_doc == 'C' or es_rectificativa
+
+            # Con la outbox activa, Facturae y VERI*FACTU los hace el worker: el aviso
+            # se guarda en la misma transacción que la factura, o se guardan los dos o ninguno
+            encolada = requiere_envio and VERIFACTU_OUTBOX_CONFIG['ACTIVA']
+            if encolada:
+                encolar_factura(conn, factura_id, {'data': data, 'presentar_face': presentar_face_flag})
+
             # Commit al final de todas las operaciones
             conn.commit()
 
@@ -200,17 +477,19 @@ def crear_factura(data=None):
             conn.close()
             conn = None
 
-            # Si la factura todavía no está lista para envío (pendiente de cobro) y NO es rectificativa,
-            # omitimos la generación de XML Facturae y el envío a AEAT. Las facturas rectificativas (estado 'RE',
-            # tipo 'R' o cuyo número termina en '-R') deben enviarse aunque no estén cobradas.
-            estado_doc = data.get('estado', 'P')
-            tipo_doc = data.get('tipo', 'N')
-            num_doc = str(data.get('numero', ''))
-            es_rectificativa = (estado_doc == 'RE') or (tipo_doc.upper() == 'R') or num_doc.upper().endswith('-R')
-            
             logger.debug(f"[DEBUG crear_factura] estado={estado_doc}, presentar_face_flag={presentar_face_flag}, es_rectificativa={es_rectificativa}")
             
-            if estado_doc != 'C' and not es_rectificativa:
+            if encolada:
+                push_notif("Factura creada; XML Facturae y registro AEAT en cola", tipo='success')
+                logger.info(f"[FACTURA] Factura {factura_id} encolada para Facturae y VERI*FACTU")
+                return jsonify({
+                    'mensaje': 'Factura creada exitosamente',
+                    'id': factura_id,
+                    'notificaciones': notificaciones,
+                    'datos_adicionales': {'verifactu': 'pendiente'}
+                })
+
+            if not requiere_envio:
                 push_notif("Factura guardada", tipo='success')
                 logger.info("[FACTURA] Guardada como pendiente: se omite generación de XML y envío AEAT")
                 return jsonify({
@@ -221,266 +500,15 @@ def crear_factura(data=None):
 
             # --- Generación de Facturae ---
             logger.info(f"[FACTURA] Generando XML Facturae (presentar_face={presentar_face_flag}, VERIFACTU_HABILITADO={VERIFACTU_HABILITADO})")
-
-            try:
-                logger.info("[FACTURAE] Iniciando integración Facturae para factura_id:", factura_id)
-                push_notif("Generando XML Facturae ...")
-                
-                # Para Facturae necesitamos datos de contacto. Usamos nueva conexión si es necesaria
-                # O mejor, extraemos datos ANTES de cerrar la conexión.
-                # Como ya cerré, debo abrir nueva conexión SOLO para leer contacto si Facturae lo hace internamente o aquí.
-                # El código original hacía query aquí.
-                
-                # RE-OPEN conexión temporal solo lectura
-                with get_db_connection() as temp_conn:
-                    temp_cursor = temp_conn.cursor()
-                    temp_cursor.execute('''
-                        SELECT razonsocial, identificador, direccion, cp, localidad, provincia,
-                               dir3_oficina, dir3_organo, dir3_unidad, face_presentacion, tipo
-                        FROM contactos WHERE idContacto = ?
-                    ''', (data['idContacto'],))
-                    contacto = temp_cursor.fetchone()
-                
-                if contacto:
-                    logger.info(f"[FACTURAE]Datos de contacto encontrados: {contacto}")
-                    # Convierte contacto (sqlite3.Row o tuple) a dict para acceso seguro
-                    datos_contacto = {
-                        'razonsocial': contacto[0],
-                        'nif': contacto[1],
-                        'direccion': contacto[2],
-                        'cp': contacto[3],
-                        'localidad': contacto[4],
-                        'provincia': contacto[5],
-                        'dir3_oficina': contacto[6],
-                        'dir3_organo': contacto[7],
-                        'dir3_unidad': contacto[8],
-                        'face_presentacion': contacto[9],
-                        'tipo': contacto[10]
-                    }
-                    requiere_face = presentar_face_flag or (datos_contacto.get('face_presentacion') == 1)
-                    if requiere_face:
-                        faltantes = []
-                        if not (datos_contacto.get('dir3_oficina') or '').strip():
-                            faltantes.append('DIR3 Oficina contable')
-                        if not (datos_contacto.get('dir3_organo') or '').strip():
-                            faltantes.append('DIR3 Órgano gestor')
-                        if not (datos_contacto.get('dir3_unidad') or '').strip():
-                            faltantes.append('DIR3 Unidad tramitadora')
-                        if faltantes:
-                            mensaje_error = f"El contacto requiere FACe pero faltan códigos DIR3: {', '.join(faltantes)}"
-                            logger.info(f"[FACTURAE][ERROR] {mensaje_error}")
-                            conn.rollback()
-                            return jsonify({'error': mensaje_error, 'codigo': 'DIR3_INCOMPLETO'}), 400
-
-                    direccion_completa = f"{datos_contacto['direccion']}, {datos_contacto['cp']} {datos_contacto['localidad']} ({datos_contacto['provincia']})"
-                    datos_facturae = {
-                        'emisor': cargar_datos_emisor(),
-                        'receptor': {
-                            'nif': datos_contacto['nif'] if datos_contacto['nif'] else 'B00000000',
-                            'nombre': datos_contacto['razonsocial'],
-                            'direccion': direccion_completa,
-                            'direccion_calle': datos_contacto['direccion'],
-                            'cp': datos_contacto['cp'],
-                            'ciudad': datos_contacto['localidad'],
-                            'provincia': datos_contacto['provincia'],
-                            'pais': 'ESP',
-                            'tipo': datos_contacto.get('tipo')
-                        },
-                        # Campos obligatorios para formato Facturae
-                        'invoice_number': data['numero'],
-                        'issue_date': data['fecha'],
-                        'numero': data['numero'],
-                        'fecha': data['fecha'],
-                        'concepto': data['detalles'][0]['concepto'] if data['detalles'] else 'Concepto',
-                        'cantidad': data['detalles'][0]['cantidad'] if data['detalles'] else 1,
-                        'precio_unitario': data['detalles'][0]['precio'] if data['detalles'] else data['total'],
-                        'total': data['total'],
-                        'iva': data['detalles'][0]['impuestos'] if data['detalles'] else 21.0,
-                        'detalles': data['detalles'],
-                        'customer_info': {
-                            'nif': datos_contacto['nif'] if datos_contacto['nif'] else 'B00000000',
-                            'nombre': datos_contacto['razonsocial'],
-                            'direccion': direccion_completa,
-                            'cp': datos_contacto['cp'],
-                            'localidad': datos_contacto['localidad'],
-                            'provincia': datos_contacto['provincia'],
-                            'pais': 'ESP'
-                        },
-                        'base_amount': float(data['importe_bruto']),
-                        'taxes': float(data['importe_impuestos']),
-                        'total_amount': float(data['total']),
-                        # Añadimos campo 'items' con el formato correcto para generar_facturae
-                        'items': data['detalles'],
-                        # Nos aseguramos de que el campo 'detalles' esté presente con el formato esperado por generar_facturae
-                        'detalles': data['detalles'],
-                        'presentar_face': 1 if requiere_face else 0,
-                        'dir3_oficina': datos_contacto.get('dir3_oficina'),
-                        'dir3_organo': datos_contacto.get('dir3_organo'),
-                        'dir3_unidad': datos_contacto.get('dir3_unidad')
-                    }
-                else:
-                    logger.info("[FACTURAE] No se encontraron datos del contacto, usando valores por defecto para receptor.")
-                    datos_facturae = {
-                        'emisor': cargar_datos_emisor(),
-                        'receptor': {
-                            'nif': 'B00000000',
-                            'nombre': 'CONTACTO_DESCONOCIDO',
-                            'direccion': '-',
-                            'direccion_calle': '-',
-                            'cp': '-',
-                            'ciudad': '-',
-                            'provincia': '-',
-                            'pais': 'ESP',
-                            'tipo': None
-                        },
-                        'invoice_number': data['numero'],
-                        'issue_date': data['fecha'],
-                        'numero': data['numero'],
-                        'fecha': data['fecha'],
-                        'total': data['total'],
-                        'iva': data['detalles'][0]['impuestos'] if data['detalles'] else 21.0,
-                        'detalles': data['detalles'],
-                        'customer_info': {
-                            'nif': 'B00000000',
-                            'nombre': 'CONTACTO_DESCONOCIDO',
-                            'direccion': '-',
-                            'cp': '-',
-                            'localidad': '-',
-                            'provincia': '-',
-                            'pais': 'ESP'
-                        },
-                        'base_amount': float(data['importe_bruto']),
-                        'taxes': float(data['importe_impuestos']),
-                        'total_amount': float(data['total']),
-                        # Añadimos campo 'items' con el formato correcto para generar_facturae
-                        'items': data['detalles'],
-                        # Nos aseguramos de que el campo 'detalles' esté presente con el formato esperado
-                        'detalles': data['detalles']
-                    }
-                # Validar campos críticos antes de generar Facturae
-                campos_obligatorios = ['invoice_number', 'issue_date', 'customer_info', 'items', 'base_amount', 'taxes', 'total_amount']
-                missing_fields = [campo for campo in campos_obligatorios if campo not in datos_facturae or datos_facturae[campo] is None]
-                if missing_fields:
-                    with safe_append_debug('facturae_debug.txt') as log_file:
-                        log_file.write(f"[VALIDACIÓN] Campos faltantes: {missing_fields}\n")
-                        log_file.write(f"[VALIDACIÓN] Claves disponibles: {list(datos_facturae.keys())}\n")
-                    raise ValueError(f"Campos obligatorios faltantes: {', '.join(missing_fields)}")
-                
-                datos_facturae['total_amount'] = data['total']  # Añadimos el campo requerido
-                
-                # Añadimos campos para VERI*FACTU
-                datos_facturae['verifactu'] = VERIFACTU_DISPONIBLE  # Se genera formato VERI*FACTU sólo si está habilitado
-                datos_facturae['factura_id'] = factura_id  # ID de factura para registro en VERI*FACTU
-                
-                logger.info("[FACTURAE] Llamando a generar_facturae con configuración VERI*FACTU")
-                # Log detallado antes de llamar a generar_facturae
-                with safe_append_debug('facturae_env_debug.txt') as f:
-                    f.write(f'[DEBUG][factura.py] datos_facturae={datos_facturae}\n')
-                    f.write('[DEBUG][factura.py] Integración VERI*FACTU activada\n')
-                try:
-                    # Explicitamente importamos la función desde facturae.generador para evitar confusión
-                    from facturae.generador import \
-                        generar_facturae as generar_facturae_modular
-                    
-                    push_notif("Firmando XML Facturae ...")  # noqa: E501
-                    # Usar la versión modular que genera el XML en formato Facturae 3.2.2 compatible con VERI*FACTU
-                    ruta_xml_final = generar_facturae_modular(datos_facturae)
-                    logger.info(f"[FACTURAE]Facturae 3.2.2 generada y firmada en {ruta_xml_final}")
-                    if ruta_xml_final and ruta_xml_final.lower().endswith('.xsig'):
-                        push_notif("XML Facturae generado")
-                    logger.info(f"[FACTURAE]Factura electrónica generada correctamente para factura ID: {factura_id}")
-                    conn.commit()
-                except Exception as e:
-                    logger.info(f"[FACTURAE][ERROR] Error generando Facturae: {e}")
-                    push_notif("Error al generar XML Facturae", tipo='error')
-                    # Registrar traza completa del error
-                    import traceback
-                    logger.error("Traceback:", exc_info=True)
-            except Exception as e:
-                logger.info(f"[FACTURAE][ERROR] Error en integración Facturae: {e}")
+            generar_facturae_factura(factura_id, data, presentar_face_flag, push_notif)
 
             # --- Integración VERI*FACTU ---
             respuesta = {
                 'mensaje': 'Factura creada exitosamente',
                 'id': factura_id,
-                'notificaciones': notificaciones  # lista de pasos realizados
+                'notificaciones': notificaciones,  # lista de pasos realizados
+                'datos_adicionales': enviar_verifactu_factura(factura_id, db_path_val, push_notif)
             }
-            try:
-                logger.info("[VERIFACTU] Iniciando integración VERI*FACTU para factura_id:", factura_id)
-                push_notif("Enviando registro AEAT ...")
-                # Generar datos VERI*FACTU para la factura (solo si está disponible)
-                if VERIFACTU_DISPONIBLE:
-                    try:
-                        # Obtener código de empresa de la ruta de la BD
-                        import re
-                        db_path = db_path_val
-                        # Si db_path_val es None (ej: error extrayéndolo), intentar fallback o no usar empresa_codigo
-                        empresa_codigo = 'unknown'
-                        
-                        if db_path:
-                            match = re.search(r'/db/([^/]+)/\1\.db', db_path)
-                            if match:
-                                empresa_codigo = match.group(1)
-                            else:
-                                import os
-                                db_name = os.path.basename(db_path)
-                                empresa_codigo = db_name.replace('.db', '')
-                        
-                        logger.info(f"[VERIFACTU] Usando empresa_codigo={empresa_codigo} (extraído de BD: {db_path})")
-                        datos_verifactu = verifactu.generar_datos_verifactu_para_factura(factura_id, empresa_codigo=empresa_codigo)
-                        if datos_verifactu and 'datos' in datos_verifactu and 'hash' in datos_verifactu['datos']:
-                            logger.info(f"[VERIFACTU]Datos generados correctamente: hash={datos_verifactu['datos']['hash'][:10]}...")
-                            push_notif("QR generado")
-                            # Enviamos como parte del retorno
-                            respuesta['datos_adicionales'] = {
-                                'hash': datos_verifactu['datos']['hash'],
-                                'verifactu': True
-                            }
-                        else:
-                            logger.info("[VERIFACTU] No se pudieron generar los datos VERI*FACTU")
-                            # Intentar extraer código/descripcion de error devuelto por AEAT
-                            codigo_err = None
-                            descripcion_err = None
-                            if datos_verifactu and isinstance(datos_verifactu, dict):
-                                errores_list = datos_verifactu.get('errores')
-                                if errores_list and isinstance(errores_list, list):
-                                    codigo_err = errores_list[0].get('codigo')
-                                    descripcion_err = errores_list[0].get('descripcion_error') or errores_list[0].get('descripcion')
-                            if codigo_err:
-                                push_notif(f"Error AEAT {codigo_err}", tipo='error')
-                            else:
-                                push_notif("Error en generación de datos VERI*FACTU", tipo='error')
-
-                            # Preparar mensaje claro para frontend
-                            mensaje_front = f"Error AEAT {codigo_err}: {descripcion_err}" if codigo_err else "Fallo al generar datos VERI*FACTU"
-                            respuesta['datos_adicionales'] = {
-                                'verifactu': False,
-                                'error': mensaje_front,
-                                'codigo_error_aeat': codigo_err
-                            }
-                    except Exception as e:
-                        logger.warning(f"[!] Error al generar datos VERI*FACTU: {str(e)}")
-                        push_notif("Error al enviar registro AEAT", tipo='error')
-                        # Continuamos sin VERI*FACTU
-                        respuesta['datos_adicionales'] = {
-                            'verifactu': False,
-                            'error': f"Error VERI*FACTU: {str(e)}"
-                        }
-                else:
-                    logger.warning("[!] Módulo VERI*FACTU no disponible - Omitiendo generación de datos")
-                    respuesta['datos_adicionales'] = {
-                        'verifactu': False,
-                        'error': "Módulo VERI*FACTU no disponible"
-                    }
-            except Exception as e:
-                logger.info(f"[VERIFACTU][ERROR] Error en integración VERI*FACTU: {e}")
-                import traceback
-                logger.error("Traceback:", exc_info=True)
-                respuesta['datos_adicionales'] = {
-                    'verifactu': False,
-                    'error': f"Error en integración VERI*FACTU: {str(e)}"
-                }
-            
             push_notif("Factura creada", tipo='success')
             logger.debug("[DEBUG] Respuesta enviada a frontend:", respuesta)
             return jsonify(respuesta)
@@ -1444,6 +1472,7 @@ def obtener_factura_para_imprimir(factura_id):
 def enviar_factura_email(id_factura, email_destino_override=None, return_dict=False, adjunto_adicional=None):
     try:
         logger.debug(f"Iniciando envío de factura {id_factura}")
+        inicio_consulta = time.perf_counter()
         conn = get_db_connection()
         cursor = conn.cursor()
 
@@ -1619,15 +1648,9 @@ def enviar_factura_email(id_factura, email_destino_override=None, return_dict=Fa
             else:
                 logger.info("No se encontró código QR en la base de datos")
                 
-            # Leer el HTML base con la codificación correcta
-            with open('/var/www/html/frontend/IMPRIMIR_FACTURA.html', 'r', encoding='utf-8') as f:
-                html_base = f.read()
-
-            # Modificar la ruta del logo para usar ruta absoluta del sistema de archivos
-            html_base = html_base.replace('src="/static/img/logo.png"', 'src="file:///var/www/html/static/img/logo.png"')
+            motor = get_motor_plantillas()
+            motor.registrar_etapa('consulta', time.perf_counter() - inicio_consulta)
 
-            # Generar el HTML con los datos ya insertados
-            detalles_html = ""
             # Helper de formateo europeo con separador de miles (totales: 2 decimales fijos)
             def _fmt_euro(n, dec=2):
                 try:
@@ -1666,141 +1689,28 @@ def enviar_factura_email(id_factura, email_destino_override=None, return_dict=Fa
                     s = f"{entero},{decs_trim}"
                 return s
 
+            lineas = []
             for detalle in detalles_list:
-                descripcion_html = f"<span class='detalle-descripcion'>{detalle.get('descripcion', '')}</span>" if detalle.get('descripcion') else ''
                 _precio_raw = detalle.get('precio', 0)
                 _cantidad = detalle.get('cantidad', 0)
                 # Calcular subtotal SIN IVA (cantidad × precio)
                 _subtotal_sin_iva = round(_cantidad * _precio_raw, 2)
-                # Precio unitario: mismo comportamiento que impresión (2-5 decimales)
-                _precio_str = _fmt_euro_var(_precio_raw, min_dec=2, max_dec=5)
-                _subtotal_str = _fmt_euro(_subtotal_sin_iva)
-                detalles_html += f"""
-                    <tr>
-                        <td>
-                            <div class=\"detalle-concepto\">
-                                <span>{detalle.get('concepto', '')}</span>
-                                {descripcion_html}
-                            </div>
-                        </td>
-                        <td class=\"cantidad\">{_cantidad}</td>
-                        <td class=\"precio\">{_precio_str}€</td>
-                        <td class=\"total\">{_subtotal_str}€</td>
-                    </tr>
-                """
-
-            # Reemplazar los elementos con los datos reales
-            html_modificado = html_base.replace(
-                '<script type="module" src="/static/imprimir-factura.js"></script>',
-                ''
-            ).replace(
-                'id="numero" style="font-weight:700;"></span>',
-                f'id="numero" style="font-weight:700;">{factura_dict["numero"]}</span>'
-            ).replace(
-                'id="fecha" style="font-weight:700;color:#000;"></span>',
-                f'id="fecha" style="font-weight:700;color:#000;">{datetime.strptime(factura_dict["fecha"], "%Y-%m-%d").strftime("%d/%m/%Y")}</span>'
-            ).replace(
-                'id="fecha-vencimiento" style="font-weight:700;color:#000;"></span>',
-                f'id="fecha-vencimiento" style="font-weight:700;color:#000;">{datetime.strptime(factura_dict["fvencimiento"], "%Y-%m-%d").strftime("%d/%m/%Y") if factura_dict.get("fvencimiento") else ""}</span>'
-            )
-            
-            # Obtener datos del emisor desde JSON de la empresa
-            from utils_emisor import cargar_datos_emisor
-            emisor = cargar_datos_emisor()
-            logger.info(f"[FACTURA.PY] Datos del emisor cargados: {emisor.get('nombre')} - {emisor.get('nif')}")
-            
-            # Reemplazar datos del emisor con los valores del JSON
-            html_modificado = html_modificado.replace(
-                '<p id="emisor-nombre"></p>',
-                f'<p>{emisor.get("nombre", "")}</p>'
-            ).replace(
-                '<p id="emisor-direccion"></p>',
-                f'<p>{emisor.get("direccion", "")}</p>'
-            ).replace(
-                '<p id="emisor-cp-ciudad"></p>',
-                f'<p>{emisor.get("ciudad", "")} ({emisor.get("cp", "")}), {emisor.get("provincia", "")}, {emisor.get("pais", "España")}</p>'
-            ).replace(
-                '<p id="emisor-nif"></p>',
-                f'<p>{emisor.get("nif", "")}</p>'
-            ).replace(
-                '<p id="emisor-email"></p>',
-                f'<p>{emisor.get("email", "")}</p>'
-            ).replace(
-                '<p id="razonsocial"></p>',
-                f'<p>{factura_dict["razonsocial"]}</p>'
-            ).replace(
-                '<p id="direccion"></p>',
-                f'<p>{factura_dict["direccion"] or ""}</p>'
-            ).replace(
-                '<p id="cp-localidad"></p>',
-                f'<p>{", ".join(filter(None, [factura_dict["cp"], factura_dict["localidad"], factura_dict["provincia"]]))}</p>'
-            ).replace(
-                '<p id="nif"></p>',
-                f'<p>{factura_dict["identificador"] or ""}</p>'
-            ).replace(
-                '<!-- Los detalles se insertarán aquí dinámicamente -->',
-                detalles_html
-            ).replace(
-                'id="base"></span>',
-                f'id="base">{_fmt_euro(importe_bruto)}€</span>'
-            ).replace(
-                'id="iva"></span>',
-                f'id="iva">{_fmt_euro(importe_impuestos)}€</span>'
-            ).replace(
-                'id="total"></strong>',
-                f'id="total">{_fmt_euro(total)}€</strong>'
-            ).replace(
-                '<p id="forma-pago">Tarjeta</p>',
-                f'<p>{decodificar_forma_pago(factura_dict.get("formaPago", "T"))}</p>'
-            )
+                lineas.append({
+                    'concepto': detalle.get('concepto', ''),
+                    'descripcion': detalle.get('descripcion'),
+                    'cantidad': _cantidad,
+                    # Precio unitario: mismo comportamiento que impresión (2-5 decimales)
+                    'precio': _fmt_euro_var(_precio_raw, min_dec=2, max_dec=5),
+                    'subtotal': _fmt_euro(_subtotal_sin_iva)
+                })
 
-            # Reemplazos adicionales robustos usando regex por si la plantilla difiere en espacios/atributos
-            import re
-            def _safe(s):
-                return '' if s is None else str(s)
-            def set_p(html, elem_id, value):
-                pattern = rf'<p\s+id="{re.escape(elem_id)}"[^>]*>.*?</p>'
-                replacement = f'<p id="{elem_id}">{_safe(value)}</p>'
-                return re.sub(pattern, replacement, html, flags=re.DOTALL|re.IGNORECASE)
-            def set_span(html, elem_id, value):
-                # Preservar atributos existentes y reemplazar solo el contenido usando función para evitar backrefs
-                pattern = rf'(<span\s+id="{re.escape(elem_id)}"[^>]*>)(.*?)(</span>)'
-                return re.sub(pattern, lambda m: m.group(1) + _safe(value) + m.group(3), html, flags=re.DOTALL|re.IGNORECASE)
-
-            # Cliente
-            html_modificado = set_p(html_modificado, 'razonsocial', factura_dict.get('razonsocial', ''))
-            html_modificado = set_p(html_modificado, 'direccion', factura_dict.get('direccion', ''))
-            html_modificado = set_p(html_modificado, 'cp-localidad', ", ".join(filter(None, [
-                _safe(factura_dict.get('cp')), _safe(factura_dict.get('localidad')), _safe(factura_dict.get('provincia'))
-            ])))
-            html_modificado = set_p(html_modificado, 'nif', factura_dict.get('identificador', ''))
-
-            # Emisor (por si cambian atributos en plantilla) - obtener datos del JSON
-            from utils_emisor import cargar_datos_emisor
-            emisor = cargar_datos_emisor()
-            html_modificado = set_p(html_modificado, 'emisor-nombre', emisor.get('nombre', ''))
-            html_modificado = set_p(html_modificado, 'emisor-direccion', emisor.get('direccion', ''))
-            cp_ciudad = f"{emisor.get('ciudad', '')} ({emisor.get('cp', '')}), {emisor.get('provincia', '')}, {emisor.get('pais', 'España')}"
-            html_modificado = set_p(html_modificado, 'emisor-cp-ciudad', cp_ciudad)
-            html_modificado = set_p(html_modificado, 'emisor-nif', emisor.get('nif', ''))
-            html_modificado = set_p(html_modificado, 'emisor-email', emisor.get('email', ''))
-
-            # Totales y fechas (span)
-            html_modificado = set_span(html_modificado, 'numero', factura_dict["numero"])
-            html_modificado = set_span(html_modificado, 'fecha', datetime.strptime(factura_dict["fecha"], "%Y-%m-%d").strftime("%d/%m/%Y"))
-            html_modificado = set_span(html_modificado, 'fecha-vencimiento', datetime.strptime(factura_dict["fvencimiento"], "%Y-%m-%d").strftime("%d/%m/%Y") if factura_dict.get("fvencimiento") else '')
-            html_modificado = set_span(html_modificado, 'base', f"{_fmt_euro(importe_bruto)}€")
-            html_modificado = set_span(html_modificado, 'iva', f"{_fmt_euro(importe_impuestos)}€")
-            html_modificado = re.sub(r'<strong\s+id="total"[^>]*>.*?</strong>', f'<strong id="total">{_fmt_euro(total)}€</strong>', html_modificado, flags=re.DOTALL)
-            
             # --- Leyenda para facturas rectificativas ---
             es_rectificativa = (
                 (factura_dict.get("tipo") == "R") or
                 (factura_dict.get("estado") == "RE") or
                 (str(factura_dict.get("numero", "")).endswith("-R"))
             )
-            import re
-            pattern_rect = r'<div\s+id="rectificativa-info"[^>]*></div>'
+            rectificativa = None
             if es_rectificativa:
                 num_orig = ""
                 fecha_orig = ""
@@ -1815,85 +1725,41 @@ def enviar_factura_email(id_factura, email_destino_override=None, return_dict=Fa
                             fecha_orig = row_orig["fecha"] if isinstance(row_orig, dict) else row_orig[1]
                     except Exception as e:
                         logger.error(f"Error obteniendo factura original para leyenda rectificativa: {e}")
-                rect_html = f'<div style="border:2px solid #c00; padding:10px; margin:10px 0;"><h2 style="color:#c00; text-align:center;">FACTURA RECTIFICATIVA</h2><p><strong>Factura rectificada:</strong> Nº {num_orig} de fecha {fecha_orig}</p><p><strong>Motivo:</strong> {motivo}</p></div>'
-                html_modificado = re.sub(pattern_rect, rect_html, html_modificado, flags=re.IGNORECASE)
-            else:
-                html_modificado = re.sub(pattern_rect, '', html_modificado, flags=re.IGNORECASE)
-            
-            logger.info("Modificando el HTML para insertar hash y QR VERI*FACTU...")
-            
-            # Enfoque directo para insertar el hash y el QR
-            # 1. (Deshabilitado) No escribir HTML temporal en disco
-            # logger.info("HTML temporal omitido (/tmp/html_antes.html)")
-            # Si la configuración deshabilita VERI*FACTU, omitimos leyenda y QR
-            import re
+                rectificativa = {'numero': num_orig, 'fecha': fecha_orig, 'motivo': motivo}
+
+            # Si la factura no tiene CSV o la configuración deshabilita VERI*FACTU, omitimos leyenda y QR
             csv_value = registro['csv'] if registro else None
-            has_csv = bool(csv_value and str(csv_value).strip())
-            if not has_csv or not VERIFACTU_HABILITADO:
-                qr_code = None
+            mostrar_verifactu = bool(csv_value and str(csv_value).strip()) and VERIFACTU_HABILITADO
+            if not mostrar_verifactu:
                 logger.info("Factura sin CSV VERI*FACTU o VERIFACTU deshabilitado - se omite leyenda y QR.")
-                # Eliminar leyenda y QR relativos a VERI*FACTU
-                html_modificado = html_modificado.replace('<p id="hash-factura">Hash: </p>', '')
-                # Eliminar también cualquier div del QR VERI*FACTU completo
-                html_modificado = re.sub(r'<div id="qr-verifactu"[\s\S]*?</div>', '', html_modificado)
-                # Eliminar cualquier bloque que contenga la leyenda o texto VERI*FACTU
-                # Eliminamos contenedor principal y subcontenedores secundarios
-                html_modificado = re.sub(r'<div[^>]*border-top[^>]*>[\s\S]*?</div>', '', html_modificado, flags=re.IGNORECASE)
-                html_modificado = re.sub(r'<p[^>]*>[^<]*VERI\*FACTU[^<]*</p>', '', html_modificado, flags=re.IGNORECASE)
-                # Eliminar solo la badget de la cabecera (span VERI*FACTU) sin borrar el bloque de cabecera
-                html_modificado = re.sub(r'<span[^>]*?>\s*VERI\*FACTU\s*</span>', '', html_modificado, flags=re.IGNORECASE)
-            
-            # 2. Buscar de forma exacta dónde insertar el hash y el QR
-            hash_placeholder = '<p id="hash-factura">Hash: </p>'
-            qr_placeholder = '<div id="qr-verifactu" style="width: 150px; height: 150px; margin-left: auto;">\n                <!-- Aquí se insertará el código QR -->\n            </div>'
-            
-            # 3. Crear los contenidos de reemplazo
-            hash_replacement = f'<p id="hash-factura">Hash: {hash_value}</p>'
-            
-            # 4. Realizar reemplazos
-            if hash_placeholder in html_modificado:
-                html_modificado = html_modificado.replace(hash_placeholder, hash_replacement)
-                logger.info("Hash reemplazado con éxito")
-            else:
-                logger.error(f"ERROR: No se encontró el marcador del hash: {hash_placeholder}")
-            
-            # 5. Insertar el QR si existe
-            if qr_code:
-                qr_replacement = f'<div id="qr-verifactu" style="width: 150px; height: 150px; margin-left: auto;">\n                <img src="data:image/png;base64,{qr_code}" alt="Código QR VERI*FACTU" style="width: 150px; height: 150px;">\n            </div>'
-                
-                # Asegurarse de que el div del QR exista en el HTML y reemplazarlo
-                if qr_placeholder in html_modificado:
-                    html_modificado = html_modificado.replace(qr_placeholder, qr_replacement)
-                    logger.info("QR insertado con éxito")
-                else:
-                    # Si no encuentra el placeholder exacto, intentar con búsqueda más general
-                    logger.info("No se encontró el marcador exacto del QR, intentando con búsqueda alternativa")
-                    if '<div id="qr-verifactu"' in html_modificado:
-                        # Usar expresiones regulares para encontrar y reemplazar el div del QR
-                        import re
-                        pattern = r'<div id="qr-verifactu"[^>]*>.*?</div>'
-                        html_modificado = re.sub(pattern, qr_replacement, html_modificado, flags=re.DOTALL)
-                        logger.info("QR insertado con método alternativo")
-                    else:
-                        # Si aún no lo encuentra, añadirlo al final del documento antes del cierre del body
-                        logger.info("Insertando QR antes del cierre del body")
-                        html_modificado = html_modificado.replace('</body>', f'{qr_replacement}\n</body>')
-            else:
-                logger.info("No hay código QR para insertar")
-                
-            # 6. (Deshabilitado) No escribir HTML final en disco
-            # logger.info("HTML final omitido (/tmp/html_despues.html)")
 
+            # Obtener datos del emisor desde JSON de la empresa
+            emisor = cargar_datos_emisor()
+            logger.info(f"[FACTURA.PY] Datos del emisor cargados: {emisor.get('nombre')} - {emisor.get('nif')}")
+
+            html_modificado = motor.renderizar_factura(dict(
+                contexto_emisor(emisor),
+                logo_src='file:///var/www/html/static/img/logo.png',
+                numero=factura_dict['numero'],
+                fecha=datetime.strptime(factura_dict["fecha"], "%Y-%m-%d").strftime("%d/%m/%Y"),
+                fecha_vencimiento=datetime.strptime(factura_dict["fvencimiento"], "%Y-%m-%d").strftime("%d/%m/%Y") if factura_dict.get("fvencimiento") else '',
+                razonsocial=factura_dict.get('razonsocial'),
+                direccion=factura_dict.get('direccion'),
+                cp_localidad=", ".join(str(v) for v in (factura_dict.get('cp'), factura_dict.get('localidad'), factura_dict.get('provincia')) if v),
+                nif=factura_dict.get('identificador'),
+                rectificativa=rectificativa,
+                lineas=lineas,
+                base=f"{_fmt_euro(importe_bruto)}€",
+                iva=f"{_fmt_euro(importe_impuestos)}€",
+                total=f"{_fmt_euro(total)}€",
+                forma_pago=decodificar_forma_pago(factura_dict.get("formaPago", "T")),
+                mostrar_verifactu=mostrar_verifactu,
+                hash=hash_value,
+                qr_code=qr_code if mostrar_verifactu else None
+            ))
 
             logger.info("Convirtiendo HTML a PDF")
-            # Convertir HTML a PDF usando WeasyPrint con ruta base para recursos estáticos
-            HTML(
-                string=html_modificado,
-                base_url='/var/www/html'  # Ruta base para recursos estáticos
-            ).write_pdf(
-                tmp.name,
-                stylesheets=[CSS(string='@page { size: A4; margin: 1cm }')]
-            )
+            motor.html_a_pdf(html_modificado, tmp.name)
             
             logger.info("Preparando correo")
             # Preparar el correo (incluir fecha y vencimiento)
@@ -9,6 +9,7 @@ import json
 import io
 import re
 from PIL import Image, ImageEnhance
+from cache_extracciones import cachear_extraccion
 from logger_config import get_logger
 
 logger = get_logger(__name__)
@@ -37,6 +38,12 @@ except ImportError:
     logger.warning("pdf2image no disponible - No se podrán procesar archivos PDF")
 
 
+# Versión del prompt, modelo y post-proceso de extraer_datos_factura_gpt4:
+# cambiarla al modificarlos para no reutilizar resultados cacheados
+PROMPT_VERSION_FACTURA = 'gpt-4o/factura/1'
+
+
+@cachear_extraccion('factura', PROMPT_VERSION_FACTURA)
 def extraer_datos_factura_gpt4(imagen_bytes, nif_cliente=None):
     """
     Extrae datos de factura usando GPT-4 Vision API
@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+"""
+Pipeline por etapas para la recepción de facturas de proveedores por email
+
+procesar_emails_facturas.py descargaba cada mensaje completo (RFC822), lo
+asignaba siempre a la primera empresa activa y esperaba la extracción remota
+de cada PDF antes de pasar al siguiente. El pipeline separa el trabajo en
+etapas con contadores propios:
+
+1. Descarga: una sola conexión IMAP pide los mensajes por lotes de UIDs
+   (BODYSTRUCTURE + cabeceras) y después solo la parte PDF de cada uno.
+2. Enrutado: la empresa se deduce de la dirección de destino (email de la
+   empresa o subdirección buzon+CODIGO@dominio).
+3. Deduplicación: hash del PDF contra lo ya procesado, antes de extraer.
+4. Extracción: pool acotado de hilos; solo esta etapa espera a la API remota.
+5. Guardado: en el hilo principal, con la BD de cada empresa.
+
+Las etapas que tocan la BD (deduplicación y guardado) se ejecutan en el hilo
+principal: get_db_connection() resuelve la empresa con EMPRESA_DB_PATH, que
+es global al proceso.
+"""
+
+import base64
+import itertools
+import os
+import quopri
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import date
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from email.utils import decode_rfc2231, getaddresses
+from hashlib import sha256
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import unquote
+
+from logger_config import get_logger
+from multiempresa_config import FACTURAS_EMAIL_CONFIG
+
+logger = get_logger(__name__)
+
+CABECERAS = ('FROM', 'SUBJECT', 'DELIVERED-TO', 'X-ORIGINAL-TO', 'TO', 'CC')
+ETAPAS = ('descarga', 'deduplicacion', 'extraccion', 'guardado')
+
+# Elementos de una respuesta FETCH: paréntesis, cadena entre comillas,
+# referencia a literal {n} y átomo (con sección BODY[...]<n> opcional)
+_TOKEN = re.compile(
+    r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\x00(\d+)\x00|([^\s()"\[\x00]+(?:\[[^\]]*\](?:<\d+>)?)?))'
+)
+_LITERAL = re.compile(rb'\{(\d+)\}$')
+
+
+# ============================================================================
+# RESPUESTAS IMAP
+# ============================================================================
+
+def parsear_fetch(datos) -> List[Dict[str, Any]]:
+    """
+    Convierte la respuesta de imaplib a FETCH en un dict por mensaje con sus
+    elementos ('UID', 'BODYSTRUCTURE', 'BODY[2]', ...). Las listas IMAP quedan
+    como listas, NIL como None y los literales como bytes.
+    """
+    textos, literales = [], []
+    for elemento in datos or []:
+        if isinstance(elemento, tuple):
+            prefijo, literal = elemento[0], elemento[1]
+            textos.append(_LITERAL.sub(b'', prefijo.rstrip()).decode('utf-8', 'replace'))
+            textos.append(f'\x00{len(literales)}\x00')
+            literales.append(literal)
+        elif isinstance(elemento, bytes):
+            textos.append(elemento.decode('utf-8', 'replace'))
+    texto = ' '.join(textos)
+
+    pila = [[]]
+    pos = 0
+    while texto[pos:].strip():
+        encontrado = _TOKEN.match(texto, pos)
+        if not encontrado:
+            raise ValueError(f'Respuesta FETCH no válida cerca de: {texto[pos:pos + 40]!r}')
+        pos = encontrado.end()
+        abre, cierra, cadena, literal, atomo = encontrado.groups()
+        if abre:
+            pila.append([])
+        elif cierra:
+            if len(pila) == 1:
+                raise ValueError('Respuesta FETCH con paréntesis desequilibrados')
+            lista = pila.pop()
+            pila[-1].append(lista)
+        elif cadena is not None:
+            pila[-1].append(re.sub(r'\\(.)', r'\1', cadena))
+        elif literal is not None:
+            pila[-1].append(literales[int(literal)])
+        else:
+            pila[-1].append(None if atomo.upper() == 'NIL' else atomo)
+    if len(pila) != 1:
+        raise ValueError('Respuesta FETCH con paréntesis desequilibrados')
+
+    mensajes = []
+    for elemento in pila[0]:
+        if isinstance(elemento, list):
+            mensajes.append({str(clave).upper(): valor for clave, valor in zip(elemento[::2], elemento[1::2])})
+    return mensajes
+
+
+def conjunto_uids(uids) -> str:
+    """'1,2,3,7,9,10' -> '1:3,7,9:10' para FETCH"""
+    numeros = sorted({int(uid) for uid in uids})
+    rangos = []
+    for _, grupo in itertools.groupby(enumerate(numeros), lambda par: par[1] - par[0]):
+        grupo = [numero for _, numero in grupo]
+        rangos.append(str(grupo[0]) if len(grupo) == 1 else f'{grupo[0]}:{grupo[-1]}')
+    return ','.join(rangos)
+
+
+def _texto(valor) -> str:
+    if valor is None:
+        return ''
+    if isinstance(valor, bytes):
+        return valor.decode('utf-8', 'replace')
+    return str(valor)
+
+
+def _parametros(lista) -> Dict[str, str]:
+    """("name" "a.pdf" "charset" "x") -> {'name': 'a.pdf', 'charset': 'x'}"""
+    if not isinstance(lista, list):
+        return {}
+    return {_texto(clave).lower(): _texto(valor) for clave, valor in zip(lista[::2], lista[1::2])}
+
+
+def _nombre_adjunto(parametros: Dict[str, str]) -> Optional[str]:
+    """Nombre del adjunto, decodificando RFC 2231 (filename*) y RFC 2047 (=?utf-8?...)"""
+    for clave in ('filename*', 'name*'):
+        if parametros.get(clave):
+            partes = decode_rfc2231(parametros[clave])
+            juego = partes[0] if len(partes) == 3 else None
+            try:
+                return unquote(partes[-1], encoding=juego or 'utf-8', errors='replace')
+            except LookupError:
+                return unquote(partes[-1])
+    for clave in ('filename', 'name'):
+        nombre = parametros.get(clave)
+        if nombre:
+            if '=?' in nombre:
+                try:
+                    nombre = str(make_header(decode_header(nombre)))
+                except Exception:
+                    pass
+            return nombre
+    return None
+
+
+def partes_pdf(estructura, numero: str = '') -> List[Dict[str, Any]]:
+    """
+    Partes PDF de un BODYSTRUCTURE, en orden, con su número de sección IMAP,
+    codificación, nombre y tamaño codificado. Entra en los mensajes reenviados
+    como adjunto (message/rfc822).
+    """
+    if not isinstance(estructura, list) or not estructura:
+        return []
+
+    if isinstance(estructura[0], list):
+        partes = []
+        hijas = itertools.takewhile(lambda parte: isinstance(parte, list), estructura)
+        for indice, hija in enumerate(hijas, 1):
+            partes.extend(partes_pdf(hija, f'{numero}.{indice}' if numero else str(indice)))
+        return partes
+
+    numero = numero or '1'
+    tipo, subtipo = _texto(estructura[0]).lower(), _texto(estructura[1]).lower()
+    if tipo == 'message' and subtipo == 'rfc822' and len(estructura) > 8:
+        interno = estructura[8]
+        if isinstance(interno, list) and interno and isinstance(interno[0], list):
+            return partes_pdf(interno, numero)
+        return partes_pdf(interno, f'{numero}.1')
+
+    # Disposición: tras las líneas en text/*, tras el MD5 en el resto
+    posicion_disposicion = 9 if tipo == 'text' else 8
+    disposicion = estructura[posicion_disposicion] if len(estructura) > posicion_disposicion else None
+    parametros = _parametros(estructura[2])
+    if isinstance(disposicion, list) and len(disposicion) > 1:
+        parametros = {**parametros, **_parametros(disposicion[1])}
+    nombre = _nombre_adjunto(parametros)
+
+    if (tipo, subtipo) != ('application', 'pdf') and not (nombre and nombre.lower().endswith('.pdf')):
+        return []
+    try:
+        tamaño = int(estructura[6])
+    except (IndexError, TypeError, ValueError):
+        tamaño = 0
+    return [{'parte': numero, 'codificacion': _texto(estructura[5]).lower(), 'nombre': nombre, 'tamaño': tamaño}]
+
+
+def decodificar_parte(contenido: bytes, codificacion: str) -> bytes:
+    """Contenido de la parte según su Content-Transfer-Encoding"""
+    if codificacion == 'base64':
+        return base64.b64decode(contenido)  # descarta los saltos de línea
+    if codificacion == 'quoted-printable':
+        return quopri.decodestring(contenido)
+    return contenido
+
+
+# ============================================================================
+# MÉTRICAS
+# ============================================================================
+
+@dataclass
+class EtapaMetrics:
+    """Contadores de una etapa del pipeline"""
+    entradas: int = 0
+    salidas: int = 0
+    descartes: int = 0
+    errores: int = 0
+    segundos: float = 0.0  # en extracción, suma del tiempo de todos los hilos
+
+    def como_dict(self) -> Dict[str, Any]:
+        datos = asdict(self)
+        datos['segundos'] = round(self.segundos, 3)
+        datos['por_segundo'] = round(self.salidas / self.segundos, 2) if self.segundos else None
+        return datos
+
+
+@dataclass
+class PipelineMetrics:
+    """Métricas de una ejecución: contadores por etapa y totales de descarga"""
+    etapas: Dict[str, EtapaMetrics] = field(default_factory=lambda: {etapa: EtapaMetrics() for etapa in ETAPAS})
+    mensajes: int = 0
+    sin_pdf: int = 0
+    sin_empresa: int = 0
+    bytes_descargados: int = 0
+    bytes_omitidos: int = 0  # tamaño de los mensajes menos la parte PDF descargada
+    por_empresa: Dict[str, int] = field(default_factory=dict)
+    segundos: float = 0.0
+
+    def como_dict(self) -> Dict[str, Any]:
+        return {
+            'etapas': {nombre: etapa.como_dict() for nombre, etapa in self.etapas.items()},
+            'mensajes': self.mensajes,
+            'sin_pdf': self.sin_pdf,
+            'sin_empresa': self.sin_empresa,
+            'bytes_descargados': self.bytes_descargados,
+            'bytes_omitidos': self.bytes_omitidos,
+            'por_empresa': dict(self.por_empresa),
+            'segundos': round(self.segundos, 3),
+        }
+
+
+# ============================================================================
+# ETAPAS
+# ============================================================================
+
+@dataclass
+class MensajeFactura:
+    """PDF descargado de un email, con los datos del mensaje que se guardan"""
+    uid: str
+    remitente: str
+    asunto: str
+    destinatarios: List[str]
+    pdf_bytes: bytes
+    pdf_nombre: Optional[str]
+
+
+class DescargadorIMAP:
+    """
+    Etapa de descarga. Por cada lote de UIDs hace un FETCH de BODYSTRUCTURE y
+    cabeceras y, agrupando los mensajes por número de parte, un FETCH de
+    BODY.PEEK[parte] solo con el PDF. PEEK no marca los mensajes como leídos.
+    """
+
+    def __init__(self, mail, metricas: PipelineMetrics, lote: int = None):
+        self.mail = mail
+        self.metricas = metricas
+        self.lote = lote or FACTURAS_EMAIL_CONFIG['LOTE_FETCH']
+
+    def buscar(self, criterio: str) -> List[str]:
+        status, datos = self.mail.uid('SEARCH', None, criterio)
+        if status != 'OK':
+            logger.warning(f"No se pudo buscar emails: {status}")
+            return []
+        return datos[0].decode().split() if datos and datos[0] else []
+
+    def _fetch(self, uids, elementos):
+        status, datos = self.mail.uid('FETCH', conjunto_uids(uids), elementos)
+        if status != 'OK':
+            raise RuntimeError(f'FETCH {elementos} devolvió {status}')
+        return parsear_fetch(datos)
+
+    def lotes(self, uids):
+        """Mensajes con PDF de cada lote de UIDs, lote a lote"""
+        for inicio in range(0, len(uids), self.lote):
+            etapa = self.metricas.etapas['descarga']
+            t0 = time.perf_counter()
+            try:
+                mensajes = self._descargar_lote(uids[inicio:inicio + self.lote])
+            except Exception as e:
+                etapa.errores += len(uids[inicio:inicio + self.lote])
+                logger.error(f"❌ Error descargando lote de {len(uids[inicio:inicio + self.lote])} emails: {e}")
+                mensajes = []
+            etapa.segundos += time.perf_counter() - t0
+            yield mensajes
+
+    def _descargar_lote(self, uids) -> List[MensajeFactura]:
+        etapa = self.metricas.etapas['descarga']
+        cabeceras = f"(UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({' '.join(CABECERAS)})])"
+        pendientes = {}
+        for datos in self._fetch(uids, cabeceras):
+            etapa.entradas += 1
+            self.metricas.mensajes += 1
+            try:
+                pdfs = partes_pdf(datos.get('BODYSTRUCTURE'))
+            except Exception as e:
+                etapa.errores += 1
+                logger.error(f"Error leyendo BODYSTRUCTURE del email {datos.get('UID')}: {e}")
+                continue
+            if not pdfs:
+                etapa.descartes += 1
+                self.metricas.sin_pdf += 1
+                continue
+            cabecera = next((valor for clave, valor in datos.items() if clave.startswith('BODY[HEADER')), b'')
+            pendientes[str(datos.get('UID'))] = (datos, pdfs[0], message_from_bytes(cabecera or b''))
+
+        # Un FETCH por número de parte ("2", "1.2"...), normalmente uno o dos por lote
+        por_parte = {}
+        for uid, (_, pdf, _) in pendientes.items():
+            por_parte.setdefault(pdf['parte'], []).append(uid)
+
+        mensajes = []
+        for parte, uids_parte in por_parte.items():
+            contenidos = {str(datos.get('UID')): datos.get(f'BODY[{parte}]')
+                          for datos in self._fetch(uids_parte, f'(UID BODY.PEEK[{parte}])')}
+            for uid in uids_parte:
+                datos, pdf, cabecera = pendientes[uid]
+                contenido = contenidos.get(uid)
+                try:
+                    if not contenido:
+                        raise ValueError(f'parte {parte} vacía')
+                    if isinstance(contenido, str):
+                        contenido = contenido.encode('latin-1')
+                    pdf_bytes = decodificar_parte(contenido, pdf['codificacion'])
+                except Exception as e:
+                    etapa.errores += 1
+                    logger.error(f"Error descargando el PDF del email {uid}: {e}")
+                    continue
+                self.metricas.bytes_descargados += len(contenido)
+                try:
+                    self.metricas.bytes_omitidos += max(int(datos.get('RFC822.SIZE') or 0) - len(contenido), 0)
+                except ValueError:
+                    pass
+
+                direcciones = getaddresses([str(valor) for nombre in CABECERAS[2:]
+                                            for valor in cabecera.get_all(nombre, [])])
+                mensajes.append(MensajeFactura(
+                    uid=uid,
+                    remitente=str(cabecera.get('From', '')),
+                    asunto=str(cabecera.get('Subject', '')),
+                    destinatarios=[direccion for _, direccion in direcciones if direccion],
+                    pdf_bytes=pdf_bytes,
+                    pdf_nombre=pdf['nombre'],
+                ))
+                etapa.salidas += 1
+        return mensajes
+
+
+class EnrutadorEmpresas:
+    """
+    Empresa destinataria de cada email: la del email de la empresa o la del
+    código en la subdirección (facturas+CODIGO@dominio). Si ninguna encaja se
+    usa la empresa por defecto: la configurada o, si solo hay una activa, esa.
+    """
+
+    def __init__(self, empresas: List[Dict[str, Any]], por_defecto: Optional[str] = None):
+        self.por_direccion = {str(e['email']).strip().lower(): e for e in empresas if e.get('email')}
+        self.por_codigo = {str(e['codigo']).lower(): e for e in empresas if e.get('codigo')}
+        if por_defecto:
+            self.por_defecto = self.por_codigo.get(str(por_defecto).lower())
+            if self.por_defecto is None:
+                logger.warning(f"Empresa por defecto {por_defecto} no está activa")
+        else:
+            self.por_defecto = empresas[0] if len(empresas) == 1 else None
+
+    def empresa_para(self, destinatarios: List[str]) -> Optional[Dict[str, Any]]:
+        for direccion in destinatarios:
+            direccion = direccion.strip().lower()
+            if direccion in self.por_direccion:
+                return self.por_direccion[direccion]
+            usuario, _, _ = direccion.partition('@')
+            if '+' in usuario:
+                empresa = self.por_codigo.get(usuario.split('+', 1)[1])
+                if empresa:
+                    return empresa
+        return self.por_defecto
+
+
+@contextmanager
+def bd_empresa(db_path: Optional[str]):
+    """get_db_connection() de facturas_proveedores contra la BD de la empresa"""
+    anterior = os.environ.get('EMPRESA_DB_PATH')
+    if db_path:
+        os.environ['EMPRESA_DB_PATH'] = db_path
+    try:
+        yield
+    finally:
+        if anterior is None:
+            os.environ.pop('EMPRESA_DB_PATH', None)
+        else:
+            os.environ['EMPRESA_DB_PATH'] = anterior
+
+
+def extraer_datos_factura_local(pdf_bytes: bytes) -> Dict[str, Any]:
+    """
+    Extractor local para pruebas y medidas de carga: devuelve datos fijos sin
+    llamar a la API remota. El número de factura sale del hash del PDF, así que
+    el mismo PDF da siempre la misma factura. LATENCIA_LOCAL simula la espera
+    de la API.
+    """
+    if FACTURAS_EMAIL_CONFIG['LATENCIA_LOCAL']:
+        time.sleep(FACTURAS_EMAIL_CONFIG['LATENCIA_LOCAL'])
+    return {
+        'numero_factura': f'LOCAL-{sha256(pdf_bytes).hexdigest()[:10].upper()}',
+        'fecha_emision': date.today().isoformat(),
+        'fecha_vencimiento': None,
+        'proveedor_nombre': 'PROVEEDOR PRUEBAS',
+        'proveedor_nif': 'B00000000',
+        'proveedor_direccion': None,
+        'base_imponible': 100.0,
+        'iva_porcentaje': 21.0,
+        'iva_importe': 21.0,
+        'total': 121.0,
+        'concepto': 'Factura de pruebas (extractor local)',
+        'metodo_extraccion': 'local',
+        'confianza_extraccion': 0.0,
+    }
+
+
+class PipelineFacturasEmail:
+    """
+    Orquesta las etapas. Las funciones de cada etapa se inyectan para que el
+    script use las de facturas_proveedores y las pruebas las suyas:
+
+        extraer(pdf_bytes) -> dict | None
+        ya_procesada(empresa, pdf_hash) -> bool
+        guardar(empresa, mensaje, pdf_hash, datos) -> id de factura | None
+        calcular_hash(pdf_bytes) -> str
+    """
+
+    def __init__(self, mail, enrutador: EnrutadorEmpresas, extraer: Callable, ya_procesada: Callable,
+                 guardar: Callable, calcular_hash: Callable, trabajadores: int = None,
+                 max_pendientes: int = None, lote: int = None):
+        self.enrutador = enrutador
+        self.extraer = extraer
+        self.ya_procesada = ya_procesada
+        self.guardar = guardar
+        self.calcular_hash = calcular_hash
+        self.trabajadores = trabajadores or FACTURAS_EMAIL_CONFIG['TRABAJADORES']
+        self.max_pendientes = max(max_pendientes or FACTURAS_EMAIL_CONFIG['MAX_PENDIENTES'], self.trabajadores)
+        self.metricas = PipelineMetrics()
+        self.descargador = DescargadorIMAP(mail, self.metricas, lote)
+        self._vistos = set()
+        self._lock = threading.Lock()
+
+    def ejecutar(self, criterio: str) -> Dict[str, Any]:
+        """Procesa los emails que cumplen el criterio IMAP y devuelve las métricas"""
+        inicio = time.perf_counter()
+        uids = self.descargador.buscar(criterio)
+        logger.info(f"✓ Encontrados {len(uids)} email(s) con facturas")
+
+        pendientes = {}
+        with ThreadPoolExecutor(max_workers=self.trabajadores, thread_name_prefix='extraccion-factura') as pool:
+            for mensajes in self.descargador.lotes(uids):
+                for mensaje in mensajes:
+                    trabajo = self._deduplicar(mensaje)
+                    if trabajo is None:
+                        continue
+                    pendientes[pool.submit(self._extraer, mensaje.pdf_bytes)] = trabajo
+                    # Contrapresión: no acumular más PDFs en memoria de los que se extraen
+                    while len(pendientes) >= self.max_pendientes:
+                        self._guardar_terminadas(pendientes, bloquear=True)
+                self._guardar_terminadas(pendientes, bloquear=False)
+            while pendientes:
+                self._guardar_terminadas(pendientes, bloquear=True)
+
+        self.metricas.segundos = time.perf_counter() - inicio
+        return self.metricas.como_dict()
+
+    def _deduplicar(self, mensaje: MensajeFactura):
+        etapa = self.metricas.etapas['deduplicacion']
+        etapa.entradas += 1
+        t0 = time.perf_counter()
+        try:
+            empresa = self.enrutador.empresa_para(mensaje.destinatarios)
+            if empresa is None:
+                etapa.descartes += 1
+                self.metricas.sin_empresa += 1
+                logger.warning(f"⚠️ Email {mensaje.uid} sin empresa destinataria: {', '.join(mensaje.destinatarios)}")
+                return None
+            pdf_hash = self.calcular_hash(mensaje.pdf_bytes)
+            clave = (empresa['id'], pdf_hash)
+            if clave in self._vistos or self.ya_procesada(empresa, pdf_hash):
+                etapa.descartes += 1
+                logger.info(f"⏭️ Email {mensaje.uid}: factura ya procesada (hash duplicado)")
+                return None
+            self._vistos.add(clave)
+            etapa.salidas += 1
+            return mensaje, empresa, pdf_hash
+        except Exception as e:
+            etapa.errores += 1
+            logger.error(f"Error comprobando duplicado del email {mensaje.uid}: {e}")
+            return None
+        finally:
+            etapa.segundos += time.perf_counter() - t0
+
+    def _extraer(self, pdf_bytes: bytes):
+        """Se ejecuta en el pool: solo extracción, sin BD"""
+        t0 = time.perf_counter()
+        try:
+            return self.extraer(pdf_bytes)
+        finally:
+            with self._lock:
+                self.metricas.etapas['extraccion'].segundos += time.perf_counter() - t0
+
+    def _guardar_terminadas(self, pendientes: Dict, bloquear: bool):
+        if not pendientes:
+            return
+        terminadas, _ = wait(list(pendientes), timeout=None if bloquear else 0, return_when=FIRST_COMPLETED)
+        for futuro in terminadas:
+            mensaje, empresa, pdf_hash = pendientes.pop(futuro)
+            extraccion = self.metricas.etapas['extraccion']
+            extraccion.entradas += 1
+            try:
+                datos = futuro.result()
+            except Exception as e:
+                datos = None
+                logger.error(f"❌ Error extrayendo datos del email {mensaje.uid}: {e}")
+            if not datos:
+                extraccion.errores += 1
+                continue
+            extraccion.salidas += 1
+            self._guardar(mensaje, empresa, pdf_hash, datos)
+
+    def _guardar(self, mensaje: MensajeFactura, empresa: Dict[str, Any], pdf_hash: str, datos: Dict[str, Any]):
+        etapa = self.metricas.etapas['guardado']
+        etapa.entradas += 1
+        t0 = time.perf_counter()
+        try:
+            if not datos.get('proveedor_nif') or not datos.get('numero_factura'):
+                etapa.descartes += 1
+                logger.error(f"❌ Email {mensaje.uid}: faltan datos obligatorios (NIF o número de factura)")
+                return
+            factura_id = self.guardar(empresa, mensaje, pdf_hash, datos)
+            if factura_id is None:
+                etapa.errores += 1
+                return
+            etapa.salidas += 1
+            codigo = str(empresa.get('codigo'))
+            self.metricas.por_empresa[codigo] = self.metricas.por_empresa.get(codigo, 0) + 1
+        except Exception as e:
+            etapa.errores += 1
+            logger.error(f"❌ Error guardando la factura del email {mensaje.uid}: {e}", exc_info=True)
+        finally:
+            etapa.segundos += time.perf_counter() - t0
@@ -1394,10 +1394,29 @@ def factura_ya_procesada(pdf_hash, empresa_id):
     
     existe = cursor.fetchone() is not None
     conn.close()
-    
+
     return existe
 
 
+def registrar_historial(factura_id, accion, usuario, datos_anteriores=None, datos_nuevos=None):
+    """Registra una acción sobre la factura en historial_facturas_proveedores"""
+    conn = get_db_connection()
+    try:
+        conn.execute("""
+            INSERT INTO historial_facturas_proveedores (factura_id, usuario, accion, datos_anteriores, datos_nuevos)
+            VALUES (?, ?, ?, ?, ?)
+        """, (
+            factura_id,
+            usuario,
+            accion,
+            json.dumps(datos_anteriores, ensure_ascii=False, default=str) if datos_anteriores is not None else None,
+            json.dumps(datos_nuevos, ensure_ascii=False, default=str) if datos_nuevos is not None else None
+        ))
+        conn.commit()
+    finally:
+        conn.close()
+
+
 
 def obtener_factura_por_id(factura_id, empresa_id):
     """Obtiene una factura por su ID"""
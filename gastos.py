@@ -5,12 +5,17 @@ from flask import Blueprint, jsonify, request
 
 from db_utils import get_db_connection
 from logger_config import get_logger
+from utils_fechas_optimizadas import filtro_rango_fecha, generar_where_fecha_optimizada, rango_anio
 
 # Inicializar logger
 logger = get_logger(__name__)
 
 gastos_bp = Blueprint('gastos', __name__)
 
+# Fecha de operación en ISO (misma expresión que el índice idx_gastos_fecha_operacion_expr)
+FECHA_OPERACION = generar_where_fecha_optimizada('fecha_operacion', 'fecha_operacion_iso')
+FILTRO_FECHA_OPERACION = filtro_rango_fecha(FECHA_OPERACION)
+
 
 @gastos_bp.route('/ingresos_gastos_mes', methods=['GET'])
 @gastos_bp.route('/api/ingresos_gastos_mes', methods=['GET'])
@@ -31,19 +36,17 @@ def ingresos_gastos_mes():
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute(
-            """
+            f"""
             SELECT substr(COALESCE(fecha_operacion_iso, 
                           substr(fecha_operacion, 7, 4) || '-' || substr(fecha_operacion, 4, 2) || '-' || substr(fecha_operacion, 1, 2)
                          ), 6, 2) as mes,
                    SUM(CASE WHEN importe_eur > 0 THEN importe_eur ELSE 0 END) as ingresos,
                    SUM(CASE WHEN importe_eur < 0 THEN importe_eur ELSE 0 END) as gastos
             FROM gastos
-            WHERE substr(COALESCE(fecha_operacion_iso, 
-                          substr(fecha_operacion, 7, 4) || '-' || substr(fecha_operacion, 4, 2) || '-' || substr(fecha_operacion, 1, 2)
-                         ), 1, 4) = ?
+            WHERE {FILTRO_FECHA_OPERACION}
             GROUP BY mes
             """,
-            (str(anio),)
+            rango_anio(anio)
         )
         rows = cur.fetchall()
         conn.close()
@@ -139,118 +142,111 @@ def consulta_gastos():
 # -------------------------------------------------------------------------
 #  NUEVO ENDPOINT: INGRESOS Y GASTOS TOTALES POR AÑO
 # -------------------------------------------------------------------------
+def calcular_ingresos_gastos_totales(conn, anio_actual):
+    """
+    Totales anuales de ingresos y gastos del año y del anterior sobre una conexión abierta.
+
+    Ambos años se suman en una sola pasada por el rango [1/1 año anterior, 1/1 año siguiente).
+    """
+    anio_anterior = anio_actual - 1
+    inicio_actual, hasta = rango_anio(anio_actual)
+    desde, _ = rango_anio(anio_anterior)
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT
+            SUM(CASE WHEN {FECHA_OPERACION} >= ? AND importe_eur > 0 THEN importe_eur ELSE 0 END) AS ingresos_act,
+            SUM(CASE WHEN {FECHA_OPERACION} >= ? AND importe_eur < 0 THEN importe_eur ELSE 0 END) AS gastos_act,
+            SUM(CASE WHEN {FECHA_OPERACION} < ? AND importe_eur > 0 THEN importe_eur ELSE 0 END) AS ingresos_prev,
+            SUM(CASE WHEN {FECHA_OPERACION} < ? AND importe_eur < 0 THEN importe_eur ELSE 0 END) AS gastos_prev,
+            MAX(CASE WHEN {FECHA_OPERACION} >= ? THEN fecha_operacion END) AS ultima_actualizacion
+        FROM gastos
+        WHERE {FILTRO_FECHA_OPERACION}
+        """,
+        (inicio_actual, inicio_actual, inicio_actual, inicio_actual, inicio_actual, desde, hasta)
+    )
+    row = cur.fetchone()
+    ingresos_act = float(row['ingresos_act'] or 0)
+    gastos_act = float(row['gastos_act'] or 0)
+    ingresos_prev = float(row['ingresos_prev'] or 0)
+    gastos_prev = float(row['gastos_prev'] or 0)
+    ultima_actualizacion = row['ultima_actualizacion']
+
+    # Obtener directamente el valor máximo de ts y formatearlo
+    try:
+        cur.execute(
+            """
+            SELECT MAX(ts) AS ultima_fecha
+            FROM gastos
+            """
+        )
+        row = cur.fetchone()
+        ultima_fecha = row['ultima_fecha'] if row and row['ultima_fecha'] else None
+    except Exception as e:
+        logger.error(f"Error al consultar la base de datos: {e}", exc_info=True)
+        ultima_fecha = None
+
+    # Crear versión con fecha y hora completa en formato dd/mm/aaaa hh:mm:ss
+    ultima_actualizacion_completa = None
+    if ultima_fecha:
+        fecha_dt = None
+        # Intentar ISO primero (incluyendo fracciones y 'T')
+        try:
+            s = str(ultima_fecha).replace('Z', '')
+            fecha_dt = datetime.fromisoformat(s)
+        except Exception:
+            # Intentar con 'T' reemplazada por espacio
+            try:
+                s2 = str(ultima_fecha).replace('T', ' ')
+                fecha_dt = datetime.fromisoformat(s2)
+            except Exception:
+                # Intentar formato clásico sin fracciones
+                try:
+                    fecha_dt = datetime.strptime(str(ultima_fecha), '%Y-%m-%d %H:%M:%S')
+                except Exception:
+                    fecha_dt = None
+        if fecha_dt:
+            ultima_actualizacion_completa = fecha_dt.strftime('%d/%m/%Y %H:%M:%S')
+        else:
+            # Fallback: usar fecha_operacion si está disponible
+            ultima_actualizacion_completa = ultima_actualizacion
+    elif ultima_actualizacion:
+        # Fallback: Si no hay ts pero sí fecha_operacion
+        ultima_actualizacion_completa = ultima_actualizacion
+
+    def pct(actual:float, prev:float):
+        if prev == 0:
+            return 100.0 if actual != 0 else 0.0
+        return ((actual - prev) / prev) * 100
+
+    return {
+        'año_actual': anio_actual,
+        'año_anterior': anio_anterior,
+        'ultima_actualizacion': ultima_actualizacion,
+        'ultima_actualizacion_completa': ultima_actualizacion_completa,
+        'ingresos': {
+            'total_actual': ingresos_act,
+            'total_anterior': ingresos_prev,
+            'porcentaje_diferencia': pct(ingresos_act, ingresos_prev)
+        },
+        'gastos': {
+            'total_actual': gastos_act,
+            'total_anterior': gastos_prev,
+            'porcentaje_diferencia': pct(abs(gastos_act), abs(gastos_prev))
+        }
+    }
+
+
 @gastos_bp.route('/ingresos_gastos_totales', methods=['GET'])
 @gastos_bp.route('/api/ingresos_gastos_totales', methods=['GET'])
 def ingresos_gastos_totales():
     """Totales anuales de ingresos y gastos y variación vs. año anterior."""
     try:
-        from datetime import datetime
         anio_actual = int(request.args.get('anio', datetime.now().year))
-        # Si se especifica un mes, filtramos por mes. Si no, devolvemos el año completo.
-        mes = request.args.get('mes', None)
-        anio_anterior = anio_actual - 1
 
         conn = get_db_connection()
         try:
-            cur = conn.cursor()
-
-            def totales(anio:int):
-                cur.execute(
-                    """
-                    SELECT 
-                        SUM(CASE WHEN importe_eur > 0 THEN importe_eur ELSE 0 END) AS ingresos,
-                        SUM(CASE WHEN importe_eur < 0 THEN importe_eur ELSE 0 END) AS gastos
-                    FROM gastos
-                    WHERE substr(fecha_operacion, 7, 4) = ?
-                    """,
-                    (str(anio),)
-                )
-                row = cur.fetchone() or {'ingresos':0,'gastos':0}
-                return float(row['ingresos'] or 0), float(row['gastos'] or 0)
-
-            ingresos_act, gastos_act = totales(anio_actual)
-            ingresos_prev, gastos_prev = totales(anio_anterior)
-            
-            # Obtener directamente el valor máximo de ts y formatearlo
-            try:
-                # Consulta para obtener el ts máximo directamente
-                cur.execute(
-                    """
-                    SELECT MAX(ts) AS ultima_fecha
-                    FROM gastos
-                    """
-                )
-                row = cur.fetchone()
-                ultima_fecha = row['ultima_fecha'] if row and row['ultima_fecha'] else None
-                
-                # Como fallback, también obtenemos la fecha_operacion
-                cur.execute(
-                    """
-                    SELECT MAX(fecha_operacion) as ultima_actualizacion
-                    FROM gastos
-                    WHERE substr(fecha_operacion, 7, 4) = ?
-                    """,
-                    (str(anio_actual),)
-                )
-                row_fecha = cur.fetchone()
-                ultima_actualizacion = row_fecha['ultima_actualizacion'] if row_fecha and row_fecha['ultima_actualizacion'] else None
-            except Exception as e:
-                logger.error(f"Error al consultar la base de datos: {e}", exc_info=True)
-                ultima_fecha = None
-                ultima_actualizacion = None
-            
-            # Crear versión con fecha y hora completa en formato dd/mm/aaaa hh:mm:ss
-            ultima_actualizacion_completa = None
-            if ultima_fecha:
-                fecha_dt = None
-                # Intentar ISO primero (incluyendo fracciones y 'T')
-                try:
-                    s = str(ultima_fecha).replace('Z', '')
-                    fecha_dt = datetime.fromisoformat(s)
-                except Exception:
-                    # Intentar con 'T' reemplazada por espacio
-                    try:
-                        s2 = str(ultima_fecha).replace('T', ' ')
-                        fecha_dt = datetime.fromisoformat(s2)
-                    except Exception:
-                        # Intentar formato clásico sin fracciones
-                        try:
-                            fecha_dt = datetime.strptime(str(ultima_fecha), '%Y-%m-%d %H:%M:%S')
-                        except Exception:
-                            fecha_dt = None
-                if fecha_dt:
-                    ultima_actualizacion_completa = fecha_dt.strftime('%d/%m/%Y %H:%M:%S')
-                else:
-                    # Fallback: usar fecha_operacion si está disponible
-                    ultima_actualizacion_completa = ultima_actualizacion
-            elif ultima_actualizacion:
-                # Fallback: Si no hay ts pero sí fecha_operacion
-                ultima_actualizacion_completa = ultima_actualizacion
-
-            def pct(actual:float, prev:float):
-                if prev == 0:
-                    return 100.0 if actual != 0 else 0.0
-                return ((actual - prev) / prev) * 100
-
-            pct_ingresos = pct(ingresos_act, ingresos_prev)
-            pct_gastos   = pct(abs(gastos_act), abs(gastos_prev))
-
-            return jsonify({
-                'año_actual': anio_actual,
-                'año_anterior': anio_anterior,
-                'ultima_actualizacion': ultima_actualizacion,
-                'ultima_actualizacion_completa': ultima_actualizacion_completa,
-                'ingresos': {
-                    'total_actual': ingresos_act,
-                    'total_anterior': ingresos_prev,
-                    'porcentaje_diferencia': pct_ingresos
-                },
-                'gastos': {
-                    'total_actual': gastos_act,
-                    'total_anterior': gastos_prev,
-                    'porcentaje_diferencia': pct_gastos
-                }
-            })
+            return jsonify(calcular_ingresos_gastos_totales(conn, anio_actual))
         finally:
             if conn:
                 conn.close()
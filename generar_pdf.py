@@ -1,16 +1,17 @@
 
 import base64
 import tempfile
+import time
 import traceback
 import xml.etree.ElementTree as ET
 from datetime import datetime
-from weasyprint import CSS, HTML
-from flask import session
 from db_utils import get_db_connection
 from verifactu_logger import logger  # Ajusta según tu sistema
 from verifactu.config import VERIFACTU_CONSTANTS  # Ruta corregida al módulo
 from format_utils import format_currency_es_two, format_total_es_two, format_number_es_max5, format_percentage
 from logger_config import get_logger
+from motor_plantillas import contexto_emisor, get_motor_plantillas, logo_empresa_sesion
+from utils_emisor import cargar_datos_emisor
 
 # Inicializar logger
 logger = get_logger(__name__)
@@ -158,6 +159,7 @@ def generar_factura_pdf(id_factura):
     """
     try:
         logger.info(f"Iniciando generación del PDF para factura {id_factura}")
+        inicio_consulta = time.perf_counter()
         conn = get_db_connection()
         cursor = conn.cursor()
 
@@ -289,17 +291,8 @@ def generar_factura_pdf(id_factura):
             else:
                 logger.info("No se encontró registro VERI*FACTU para esta factura")
                 
-            # Leer el HTML base con la codificación correcta
-            with open('/var/www/html/frontend/IMPRIMIR_FACTURA.html', 'r', encoding='utf-8') as f:
-                html_base = f.read()
-
-            # Modificar la ruta del logo para usar ruta absoluta del sistema de archivos
-            # Obtener logo de la empresa desde la sesión
-            empresa_logo = session.get('empresa_logo', 'default_header.png')
-            logo_factura = f'/static/logos/{empresa_logo}'
-            # Convertir ruta web a ruta absoluta del sistema de archivos
-            logo_path = logo_factura.replace('/static/logos/', '/var/www/html/static/logos/')
-            html_base = html_base.replace('src="/static/img/logo.png"', f'src="file://{logo_path}"')
+            motor = get_motor_plantillas()
+            motor.registrar_etapa('consulta', time.perf_counter() - inicio_consulta)
 
             # Generar el HTML con los datos ya insertados (igual que factura.py)
             def _fmt_euro(val):
@@ -324,30 +317,20 @@ def generar_factura_pdf(id_factura):
                     s = f"{entero},{decs_trim}"
                 return s
             
-            detalles_html = ""
+            lineas = []
             for detalle in detalles_list:
-                descripcion_html = f"<span class='detalle-descripcion'>{detalle.get('descripcion', '')}</span>" if detalle.get('descripcion') else ''
                 _precio_raw = detalle.get('precio', 0)
                 _cantidad = detalle.get('cantidad', 0)
                 # Calcular subtotal SIN IVA (cantidad × precio)
                 _subtotal_sin_iva = round(_cantidad * _precio_raw, 2)
-                # Precio unitario: mismo comportamiento que impresión (2-5 decimales)
-                _precio_str = _fmt_euro_var(_precio_raw, min_dec=2, max_dec=5)
-                _subtotal_str = _fmt_euro(_subtotal_sin_iva)
-                
-                detalles_html += f"""
-                    <tr>
-                        <td>
-                            <div class="detalle-concepto">
-                                <span>{detalle.get('concepto', '')}</span>
-                                {descripcion_html}
-                            </div>
-                        </td>
-                        <td class="cantidad">{_cantidad}</td>
-                        <td class="precio">{_precio_str}€</td>
-                        <td class="total">{_subtotal_str}€</td>
-                    </tr>
-                """
+                lineas.append({
+                    'concepto': detalle.get('concepto', ''),
+                    'descripcion': detalle.get('descripcion'),
+                    'cantidad': _cantidad,
+                    # Precio unitario: mismo comportamiento que impresión (2-5 decimales)
+                    'precio': _fmt_euro_var(_precio_raw, min_dec=2, max_dec=5),
+                    'subtotal': _fmt_euro(_subtotal_sin_iva)
+                })
 
             # Detectar si es factura rectificativa
             es_rectificativa = (
@@ -355,7 +338,7 @@ def generar_factura_pdf(id_factura):
                 factura_dict.get('estado') == 'RE' or
                 str(factura_dict.get('numero', '')).endswith('-R')
             )
-            rectificativa_html = ''
+            rectificativa = None
             if es_rectificativa:
                 num_orig = ''
                 fecha_orig = ''
@@ -369,120 +352,36 @@ def generar_factura_pdf(id_factura):
                             num_orig, fecha_orig = orig[0], datetime.strptime(orig[1], '%Y-%m-%d').strftime('%d/%m/%Y')
                 except Exception:
                     pass
-                rectificativa_html = f"""
-                <div style='border:2px solid #c00; padding:10px; margin:10px 0;'>
-                    <h2 style='color:#c00; text-align:center;'>FACTURA RECTIFICATIVA</h2>
-                    <p><strong>Factura rectificada:</strong> Nº {num_orig} de fecha {fecha_orig}</p>
-                    <p><strong>Motivo rectificación:</strong> {motivo}</p>
-                    <p><strong>Importe rectificado:</strong> {'{:.2f}'.format(total).replace('.', ',')}€</p>
-                </div>
-                """
-            # Reemplazar los elementos con los datos reales
-            html_modificado = html_base.replace(
-                '<script type="module" src="/static/imprimir-factura.js"></script>',
-                ''
-            ).replace(
-                'id="numero" style="font-weight:700;"></span>',
-                f'id="numero" style="font-weight:700;">{factura_dict["numero"]}</span>'
-            ).replace(
-                'id="fecha" style="font-weight:700;color:#000;"></span>',
-                f'id="fecha" style="font-weight:700;color:#000;">{datetime.strptime(factura_dict["fecha"], "%Y-%m-%d").strftime("%d/%m/%Y")}</span>'
-            ).replace(
-                'id="fecha-vencimiento" style="font-weight:700;color:#000;"></span>',
-                f'id="fecha-vencimiento" style="font-weight:700;color:#000;">{datetime.strptime(factura_dict["fvencimiento"], "%Y-%m-%d").strftime("%d/%m/%Y") if factura_dict.get("fvencimiento") else ""}</span>'
-            )
-            
+                rectificativa = {'numero': num_orig, 'fecha': fecha_orig, 'motivo': motivo}
+
             # Obtener datos del emisor desde JSON de la empresa
-            from utils_emisor import cargar_datos_emisor
             emisor = cargar_datos_emisor()
             logger.info(f"Datos del emisor cargados: {emisor.get('nombre')} - {emisor.get('nif')}")
-            
-            # Reemplazar datos del emisor con los valores del JSON
-            html_modificado = html_modificado.replace(
-                '<p id="emisor-nombre"></p>',
-                f'<p>{emisor.get("nombre", "")}</p>'
-            ).replace(
-                '<p id="emisor-direccion"></p>',
-                f'<p>{emisor.get("direccion", "")}</p>'
-            ).replace(
-                '<p id="emisor-cp-ciudad"></p>',
-                f'<p>{emisor.get("ciudad", "")} ({emisor.get("cp", "")}), {emisor.get("provincia", "")}, {emisor.get("pais", "España")}</p>'
-            ).replace(
-                '<p id="emisor-nif"></p>',
-                f'<p>{emisor.get("nif", "")}</p>'
-            ).replace(
-                '<p id="emisor-email"></p>',
-                f'<p>{emisor.get("email", "")}</p>'
-            ).replace(
-                '<p id="razonsocial"></p>',
-                f'<p>{factura_dict.get("razonsocial") or ""}</p>'
-            ).replace(
-                '<p id="direccion"></p>',
-                f'<p>{factura_dict.get("direccion") or ""}</p>'
-            ).replace(
-                '<p id="cp-localidad"></p>',
-                f'<p>{", ".join(filter(None, [factura_dict.get("cp"), factura_dict.get("localidad"), factura_dict.get("provincia")]))}</p>'
-            ).replace(
-                '<p id="nif"></p>',
-                f'<p>{factura_dict.get("identificador") or ""}</p>'
-            ).replace(
-                '<div id="rectificativa-info"></div>',
-                rectificativa_html if rectificativa_html else ''
-            ).replace(
-                '<!-- Los detalles se insertarán aquí dinámicamente -->',
-                detalles_html
-            ).replace(
-                'id="base"></span>',
-                f'id="base">{base_imponible_raw}</span>'
-            ).replace(
-                'id="iva"></span>',
-                f'id="iva">{iva_raw}</span>'
-            ).replace(
-                'id="total"></strong>',
-                f'id="total">{total_raw}</strong>'
-            ).replace(
-                '<p id="forma-pago">Tarjeta</p>',
-                f'<p>{decodificar_forma_pago(factura_dict.get("formaPago", "T"))}</p>'
-            )
-            
-            # Enfoque directo para insertar el hash y el QR
-            hash_placeholder = '<p id="hash-factura">Hash: </p>'
-            qr_placeholder = '<div id="qr-verifactu" style="width: 150px; height: 150px; margin-left: auto;">\n                <!-- Aquí se insertará el código QR -->\n                <img src="/static/tmp_qr/qr_temp.png" alt="Código QR VERI*FACTU" style="width: 150px; height: 150px;" onerror="this.onerror=null; this.src=\'/static/tmp_qr/qr_temp.png?\'+new Date().getTime();">\n            </div>'
-            
-            # Crear los contenidos de reemplazo
-            hash_replacement = f'<p id="hash-factura">Hash: {hash_value}</p>'
-            
-            # Realizar reemplazos
-            if not VERIFACTU_HABILITADO:
-                # Ocultar con CSS en lugar de eliminar del HTML
-                # Añadir CSS para ocultar elementos VERIFACTU
-                verifactu_hide_css = """
-                <style>
-                    #qr-verifactu { display: none !important; }
-                    #hash-factura { display: none !important; }
-                    .header h1 span[style*="VERI*FACTU"] { display: none !important; }
-                    div[style*="Información VERI*FACTU"] { display: none !important; }
-                </style>
-                """
-                html_modificado = html_modificado.replace('</head>', verifactu_hide_css + '</head>')
-                html_modificado = html_modificado.replace(hash_placeholder, '<p id="hash-factura" style="display:none;">Hash: </p>')
-                html_modificado = html_modificado.replace(qr_placeholder, '<div id="qr-verifactu" style="display:none;"></div>')
-            else:
-                if hash_placeholder in html_modificado:
-                    html_modificado = html_modificado.replace(hash_placeholder, hash_replacement)
-                    if qr_code:
-                        qr_replacement = f'<div id="qr-verifactu" style="width: 150px; height: 150px; margin-left: auto;"><img src="data:image/png;base64,{qr_code}" alt="Código QR VERI*FACTU" style="width: 150px; height: 150px;"></div>'
-                        html_modificado = html_modificado.replace(qr_placeholder, qr_replacement)
-            
-    
+
+            # Con VERI*FACTU deshabilitado no se muestran distintivo, hash ni QR
+            html_modificado = motor.renderizar_factura(dict(
+                contexto_emisor(emisor),
+                logo_src=logo_empresa_sesion(),
+                numero=factura_dict['numero'],
+                fecha=datetime.strptime(factura_dict["fecha"], "%Y-%m-%d").strftime("%d/%m/%Y"),
+                fecha_vencimiento=datetime.strptime(factura_dict["fvencimiento"], "%Y-%m-%d").strftime("%d/%m/%Y") if factura_dict.get("fvencimiento") else '',
+                razonsocial=factura_dict.get('razonsocial'),
+                direccion=factura_dict.get('direccion'),
+                cp_localidad=", ".join(str(v) for v in (factura_dict.get('cp'), factura_dict.get('localidad'), factura_dict.get('provincia')) if v),
+                nif=factura_dict.get('identificador'),
+                rectificativa=rectificativa,
+                lineas=lineas,
+                base=base_imponible_raw,
+                iva=iva_raw,
+                total=total_raw,
+                forma_pago=decodificar_forma_pago(factura_dict.get("formaPago", "T")),
+                mostrar_verifactu=VERIFACTU_HABILITADO,
+                hash=hash_value,
+                qr_code=qr_code
+            ))
+
             # Convertir HTML a PDF usando WeasyPrint con ruta base para recursos estáticos
-            HTML(
-                string=html_modificado,
-                base_url='/var/www/html'  # Ruta base para recursos estáticos
-            ).write_pdf(
-                tmp.name,
-                stylesheets=[CSS(string='@page { size: A4; margin: 1cm }')]
-            )
+            motor.html_a_pdf(html_modificado, tmp.name)
             
             pdf_path = tmp.name
     
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MOTOR DE PLANTILLAS DE FACTURAS Y PRESUPUESTOS
+==============================================
+Cada PDF de factura (envío por email, descarga, batch) o de presupuesto leía
+la plantilla HTML del disco y la rellenaba con decenas de str.replace y
+re.sub sobre el documento completo, volviendo a cargar los datos del emisor
+en cada paso.
+
+Aquí cada plantilla se prepara una sola vez: los marcadores de la plantilla
+(elementos vacíos con id, comentarios, {{VARIABLE}}) se convierten en
+expresiones Jinja, se compila y se guarda en memoria hasta que cambie el
+archivo (fecha de modificación y tamaño). Cada documento solo renderiza la
+plantilla compilada con su contexto.
+
+- Plantillas por empresa: MOTOR_PLANTILLAS_CONFIG['DIRECTORIO_EMPRESAS']/
+  <CODIGO>/<plantilla> sustituye a la común si existe
+- Los datos del emisor se leen con utils_emisor, que reutiliza el JSON
+  mientras no cambie
+- Tiempos por etapa (consulta de datos, HTML y PDF) en get_metrics()
+- El PDF lo genera servicio_pdf (trabajadores WeasyPrint y cache por contenido)
+"""
+
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from jinja2 import Environment, Template
+
+from logger_config import get_logger
+from multiempresa_config import MOTOR_PLANTILLAS_CONFIG
+from servicio_pdf import get_servicio_pdf
+
+logger = get_logger(__name__)
+
+PLANTILLA_FACTURA = 'IMPRIMIR_FACTURA.html'
+PLANTILLA_PRESUPUESTO = 'IMPRIMIR_PRESUPUESTO.html'
+
+ETAPAS = ('consulta', 'html', 'pdf')
+
+# Página de las facturas en WeasyPrint
+ESTILO_PAGINA_A4 = '@page { size: A4; margin: 1cm }'
+
+_FLAGS = re.DOTALL | re.IGNORECASE
+
+
+# ============================================================================
+# PREPARACIÓN DE PLANTILLAS
+# ============================================================================
+
+def _escapar_jinja(fuente: str) -> str:
+    """Protege los delimitadores Jinja que ya tenga una plantilla HTML plana"""
+    return re.sub(r'\{[{%#]', lambda m: "{{ '%s' }}" % m.group(0), fuente)
+
+
+def _sustituir(fuente: str, patron: str, reemplazo, nombre: str, plantilla: str) -> str:
+    nueva, n = re.subn(patron, reemplazo, fuente, count=1, flags=_FLAGS)
+    if not n:
+        logger.warning(f"Plantilla {plantilla}: no se encontró el marcador '{nombre}'")
+    return nueva
+
+
+def _envolver_div(fuente: str, patron_apertura: str, condicion: str) -> Tuple[str, bool]:
+    """Envuelve en {% if condicion %} el primer <div> que case con el patrón, con sus div anidados"""
+    inicio = re.search(patron_apertura, fuente, _FLAGS)
+    if not inicio:
+        return fuente, False
+    nivel = 0
+    for etiqueta in re.compile(r'<(/?)div\b[^>]*>', _FLAGS).finditer(fuente, inicio.start()):
+        nivel += -1 if etiqueta.group(1) else 1
+        if nivel == 0:
+            fin = etiqueta.end()
+            return (fuente[:inicio.start()] + '{% if ' + condicion + ' %}' + fuente[inicio.start():fin]
+                    + '{% endif %}' + fuente[fin:]), True
+    return fuente, False
+
+
+_LINEAS_FACTURA = '''{% for linea in lineas %}
+                    <tr>
+                        <td>
+                            <div class="detalle-concepto">
+                                <span>{{ linea.concepto }}</span>
+                                {% if linea.descripcion %}<span class='detalle-descripcion'>{{ linea.descripcion }}</span>{% endif %}
+                            </div>
+                        </td>
+                        <td class="cantidad">{{ linea.cantidad }}</td>
+                        <td class="precio">{{ linea.precio }}€</td>{% if linea.impuestos is defined and linea.impuestos is not none %}
+                        <td class="precio">{{ linea.impuestos }}%</td>{% endif %}
+                        <td class="total">{{ linea.subtotal }}€</td>
+                    </tr>
+{% endfor %}'''
+
+_RECTIFICATIVA = (
+    '{% if rectificativa %}<div style="border:2px solid #c00; padding:10px; margin:10px 0;">'
+    '<h2 style="color:#c00; text-align:center;">FACTURA RECTIFICATIVA</h2>'
+    '<p><strong>Factura rectificada:</strong> Nº {{ rectificativa.numero }} de fecha {{ rectificativa.fecha }}</p>'
+    '<p><strong>Motivo:</strong> {{ rectificativa.motivo }}</p></div>{% endif %}'
+)
+
+_QR_FACTURA = ('<img src="data:image/png;base64,{{ qr_code }}" alt="Código QR VERI*FACTU" '
+               'style="width: 150px; height: 150px;">')
+
+# Elementos de IMPRIMIR_FACTURA.html que se rellenan: id -> variable del contexto
+_SPANS_FACTURA = (('numero', 'numero'), ('fecha', 'fecha'), ('fecha-vencimiento', 'fecha_vencimiento'),
+                  ('base', 'base'), ('iva', 'iva'), ('total', 'total'))
+_PARRAFOS_FACTURA = (('emisor-nombre', 'emisor_nombre'), ('emisor-direccion', 'emisor_direccion'),
+                     ('emisor-cp-ciudad', 'emisor_cp_ciudad'), ('emisor-nif', 'emisor_nif'),
+                     ('emisor-email', 'emisor_email'), ('razonsocial', 'razonsocial'),
+                     ('direccion', 'direccion'), ('cp-localidad', 'cp_localidad'), ('nif', 'nif'),
+                     ('forma-pago', 'forma_pago'))
+
+
+def preparar_factura(fuente: str) -> str:
+    """
+    Convierte IMPRIMIR_FACTURA.html (la plantilla que rellena
+    imprimir-factura.js en el navegador) en plantilla Jinja.
+
+    Variables: logo_src (o logo_alternativo si es vacío), estilos_extra,
+    numero, fecha, fecha_vencimiento, emisor_* (ver contexto_emisor),
+    razonsocial, direccion, cp_localidad, nif, rectificativa ({numero,
+    fecha, motivo} o None), lineas ([{concepto, descripcion, cantidad,
+    precio, subtotal, impuestos opcional}]), base, iva, total, forma_pago,
+    mostrar_verifactu, hash y qr_code (PNG en base64).
+    """
+    nombre = PLANTILLA_FACTURA
+    html = _escapar_jinja(fuente)
+    html = _sustituir(html, r'<script\b[^>]*imprimir-factura\.js[^>]*>\s*</script>', '', 'script', nombre)
+    html = _sustituir(html, r'</head>', '{{ estilos_extra }}</head>', '</head>', nombre)
+    html = _sustituir(html, r'<img\s+id="logo"([^>]*?)\ssrc="[^"]*"([^>]*)>',
+                      r'{% if logo_src %}<img id="logo"\g<1> src="{{ logo_src }}"\g<2>>'
+                      r'{% else %}{{ logo_alternativo }}{% endif %}', 'logo', nombre)
+    for elemento_id, variable in _SPANS_FACTURA:
+        html = _sustituir(html, rf'(<(span|strong)\s+id="{re.escape(elemento_id)}"[^>]*>).*?(</\2>)',
+                          rf'\g<1>{{{{ {variable} }}}}\g<3>', elemento_id, nombre)
+    for elemento_id, variable in _PARRAFOS_FACTURA:
+        html = _sustituir(html, rf'<p\s+id="{re.escape(elemento_id)}"[^>]*>.*?</p>',
+                          f'<p id="{elemento_id}">{{{{ {variable} }}}}</p>', elemento_id, nombre)
+    html = _sustituir(html, r'<div\s+id="rectificativa-info"[^>]*>\s*</div>',
+                      lambda m: _RECTIFICATIVA, 'rectificativa-info', nombre)
+    html = _sustituir(html, r'<!--\s*Los detalles se insertarán aquí dinámicamente\s*-->',
+                      lambda m: _LINEAS_FACTURA, 'detalles', nombre)
+    html = _sustituir(html, r'(<p\s+id="hash-factura"[^>]*>).*?(</p>)', r'\g<1>Hash: {{ hash }}\g<2>',
+                      'hash-factura', nombre)
+    html = _sustituir(html, r'(<div\s+id="qr-verifactu"[^>]*>)(.*?)(</div>)',
+                      lambda m: m.group(1) + '{% if qr_code %}' + _QR_FACTURA + '{% else %}'
+                      + m.group(2) + '{% endif %}' + m.group(3), 'qr-verifactu', nombre)
+    # Distintivo de la cabecera y bloque de información VERI*FACTU
+    html = _sustituir(html, r'<span[^>]*>\s*VERI\*FACTU\s*</span>',
+                      r'{% if mostrar_verifactu %}\g<0>{% endif %}', 'distintivo VERI*FACTU', nombre)
+    html, encontrado = _envolver_div(html, r'<div[^>]*border-top[^>]*>', 'mostrar_verifactu')
+    if not encontrado:
+        logger.warning(f"Plantilla {nombre}: no se encontró el bloque de información VERI*FACTU")
+    return html
+
+
+def preparar_presupuesto(fuente: str) -> str:
+    """
+    IMPRIMIR_PRESUPUESTO.html ya usa marcadores {{VARIABLE}}; solo se añade
+    el logo de la empresa (logo_src).
+    """
+    return _sustituir(fuente, r'src="/static/img/logo\.png"', 'src="{{ logo_src }}"', 'logo', PLANTILLA_PRESUPUESTO)
+
+
+# ============================================================================
+# CONTEXTO COMÚN
+# ============================================================================
+
+def contexto_emisor(emisor: Dict[str, Any]) -> Dict[str, Any]:
+    """Variables emisor_* de la factura a partir de los datos de cargar_datos_emisor()"""
+    return {
+        'emisor_nombre': emisor.get('nombre', ''),
+        'emisor_direccion': emisor.get('direccion', ''),
+        'emisor_cp_ciudad': (f"{emisor.get('ciudad', '')} ({emisor.get('cp', '')}), "
+                             f"{emisor.get('provincia', '')}, {emisor.get('pais', 'España')}"),
+        'emisor_nif': emisor.get('nif', ''),
+        'emisor_email': emisor.get('email', '')
+    }
+
+
+def logo_empresa_sesion() -> str:
+    """Ruta file:// del logo de la empresa de la sesión (static/logos)"""
+    from flask import session
+    empresa_logo = session.get('empresa_logo', 'default_header.png')
+    return f"file://{os.path.join(MOTOR_PLANTILLAS_CONFIG['BASE_URL'], 'static', 'logos', empresa_logo)}"
+
+
+def _codigo_empresa_actual() -> Optional[str]:
+    try:
+        from flask import has_request_context, session
+        if has_request_context() and session.get('codigo_empresa'):
+            return session['codigo_empresa']
+    except Exception:
+        pass
+    return os.environ.get('EMPRESA_CODIGO')
+
+
+# ============================================================================
+# MÉTRICAS
+# ============================================================================
+
+@dataclass
+class EtapaRenderMetrics:
+    """Tiempos de una etapa de generación de documentos"""
+    documentos: int = 0
+    errores: int = 0
+    segundos: float = 0.0
+    max_segundos: float = 0.0
+
+    def como_dict(self) -> Dict[str, Any]:
+        datos = asdict(self)
+        datos['segundos'] = round(self.segundos, 3)
+        datos['max_segundos'] = round(self.max_segundos, 3)
+        datos['ms_medio'] = round(self.segundos * 1000 / self.documentos, 1) if self.documentos else None
+        return datos
+
+
+@dataclass
+class MotorPlantillasMetrics:
+    """Métricas del motor de plantillas"""
+    etapas: Dict[str, EtapaRenderMetrics] = field(
+        default_factory=lambda: {etapa: EtapaRenderMetrics() for etapa in ETAPAS})
+    compilaciones: int = 0
+    aciertos: int = 0  # plantilla servida ya compilada
+
+
+# ============================================================================
+# MOTOR
+# ============================================================================
+
+class MotorPlantillas:
+    """Plantillas compiladas por ruta y preparación, con invalidación por fecha de modificación"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = dict(MOTOR_PLANTILLAS_CONFIG, **(config or {}))
+        self.metrics = MotorPlantillasMetrics()
+        self._lock = threading.Lock()
+        self._plantillas: Dict[Tuple[str, str], Tuple[Tuple[int, int], Template]] = {}
+        # Sin autoescape: los datos se insertaban tal cual; None se muestra vacío
+        self._entorno = Environment(autoescape=False, finalize=lambda valor: '' if valor is None else valor)
+
+    def ruta_plantilla(self, nombre: str, codigo_empresa: str = None) -> str:
+        """Plantilla propia de la empresa si existe; si no, la común"""
+        codigo = codigo_empresa or _codigo_empresa_actual()
+        if codigo:
+            propia = os.path.join(self.config['DIRECTORIO_EMPRESAS'], codigo, nombre)
+            if os.path.exists(propia):
+                return propia
+        return os.path.join(self.config['DIRECTORIO'], nombre)
+
+    def plantilla(self, ruta: str, preparar: Callable[[str], str] = None) -> Template:
+        """
+        Plantilla compilada de `ruta`. `preparar` convierte el HTML del
+        archivo en fuente Jinja antes de compilar; solo se llama al compilar.
+
+        Raises:
+            OSError: Si la plantilla no existe
+        """
+        estado = os.stat(ruta)
+        firma = (estado.st_mtime_ns, estado.st_size)
+        clave = (ruta, getattr(preparar, '__qualname__', '') if preparar else '')
+        with self._lock:
+            guardada = self._plantillas.get(clave)
+            if guardada is not None and guardada[0] == firma:
+                self.metrics.aciertos += 1
+                return guardada[1]
+
+        with open(ruta, 'r', encoding='utf-8') as f:
+            fuente = f.read()
+        compilada = self._entorno.from_string(preparar(fuente) if preparar else fuente)
+        with self._lock:
+            self._plantillas[clave] = (firma, compilada)
+            self.metrics.compilaciones += 1
+        logger.info(f"Plantilla compilada: {ruta}")
+        return compilada
+
+    def renderizar(self, nombre: str, contexto: Dict[str, Any], preparar: Callable[[str], str] = None,
+                   codigo_empresa: str = None) -> str:
+        """HTML de la plantilla `nombre` (de la empresa o común) con `contexto`"""
+        with self.etapa('html'):
+            return self.plantilla(self.ruta_plantilla(nombre, codigo_empresa), preparar).render(contexto)
+
+    def renderizar_factura(self, contexto: Dict[str, Any], codigo_empresa: str = None) -> str:
+        """HTML de la factura; las variables que falten quedan vacías (ver preparar_factura)"""
+        return self.renderizar(PLANTILLA_FACTURA, contexto, preparar_factura, codigo_empresa)
+
+    def html_a_pdf(self, html: str, destino: str, estilos: Optional[str] = ESTILO_PAGINA_A4,
+                   base_url: str = None):
+        """Escribe en `destino` el PDF de `html` (servicio_pdf: trabajadores WeasyPrint y cache por contenido)"""
+        with self.etapa('pdf'):
+            get_servicio_pdf().generar(html, destino, estilos=estilos, base_url=base_url or self.config['BASE_URL'])
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        """Mide el bloque como una ejecución de la etapa `nombre` ('consulta', 'html' o 'pdf')"""
+        inicio = time.perf_counter()
+        correcto = False
+        try:
+            yield
+            correcto = True
+        finally:
+            self.registrar_etapa(nombre, time.perf_counter() - inicio, correcto)
+
+    def registrar_etapa(self, nombre: str, segundos: float, correcto: bool = True):
+        """Suma una ejecución de la etapa medida por quien llama (p. ej. consultas repartidas)"""
+        with self._lock:
+            etapa = self.metrics.etapas[nombre]
+            if correcto:
+                etapa.documentos += 1
+                etapa.segundos += segundos
+                etapa.max_segundos = max(etapa.max_segundos, segundos)
+            else:
+                etapa.errores += 1
+
+    def invalidar(self):
+        """Descarta las plantillas compiladas"""
+        with self._lock:
+            self._plantillas.clear()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'plantillas': len(self._plantillas),
+                'compilaciones': self.metrics.compilaciones,
+                'aciertos': self.metrics.aciertos,
+                'etapas': {nombre: etapa.como_dict() for nombre, etapa in self.metrics.etapas.items()}
+            }
+
+
+_motor = None
+_motor_lock = threading.Lock()
+
+
+def get_motor_plantillas() -> MotorPlantillas:
+    """Motor único por proceso"""
+    global _motor
+    if _motor is None:
+        with _motor_lock:
+            if _motor is None:
+                _motor = MotorPlantillas()
+    return _motor
@@ -37,7 +37,147 @@ SECURITY_CONFIG = {
     'LOCKOUT_DURATION': 900,  # 15 minutos en segundos
     'PASSWORD_MIN_LENGTH': 8,
     'REQUIRE_PASSWORD_CHANGE_DAYS': 90,
-    'SESSION_TIMEOUT_WARNING': 300  # 5 minutos antes de expirar
+    'SESSION_TIMEOUT_WARNING': 300,  # 5 minutos antes de expirar
+    'PERMISOS_CACHE_TTL': 60  # Segundos que se reutiliza la matriz de permisos por proceso
+}
+
+# Escritura asíncrona del log de auditoría
+AUDITORIA_CONFIG = {
+    'MAX_COLA': 10000,  # Registros pendientes antes de empezar a descartar
+    'TAMANO_LOTE': 200,  # Registros por transacción
+    'INTERVALO_FLUSH_MS': 250  # Espera máxima antes de escribir un lote incompleto
+}
+
+# Cache de respuestas de estadísticas (invalidada por la versión de datos de cada empresa)
+CACHE_ESTADISTICAS_CONFIG = {
+    'ACTIVA': True,
+    'MAX_ENTRADAS': 256  # Respuestas por proceso (LRU entre todas las empresas)
+}
+
+# Pools de conexiones SQLite (database_pool.py), compartidos por todas las empresas
+DATABASE_POOL_CONFIG = {
+    'MAX_POOLS': 32,  # BD con pool abierto a la vez; se retiran las menos usadas
+    'MAX_CONEXIONES_TOTALES': 64,  # Presupuesto de conexiones abiertas entre todos los pools
+    'MAX_CONEXIONES_POR_BD': 10,
+    'MIN_CONEXIONES': 0,  # Conexiones abiertas al crear un pool (0 = bajo demanda)
+    'INACTIVIDAD_SEGUNDOS': 300,  # Pools sin uso este tiempo se retiran
+    'VALIDAR_TRAS_INACTIVIDAD': 30,  # Segundos libre tras los que una conexión se valida (SELECT 1) al prestarla
+    'MAX_ERRORES_RECIENTES': 50,  # Errores guardados por pool (buffer circular)
+    'PERFIL_CONEXION': 'estandar',  # Perfil de PERFILES_CONEXION por defecto
+    'PERFIL_BD_GRANDE': 'grande',  # Perfil de las BD que superan UMBRAL_BD_GRANDE_MB
+    'UMBRAL_BD_GRANDE_MB': 256,
+    'PERFILES_EMPRESA': {},  # Perfil fijo por código de empresa, p. ej. {'CHAPA': 'grande'}
+    'MANTENIMIENTO_SEGUNDOS': 900,  # PRAGMA optimize + wal_checkpoint(PASSIVE) de las BD usadas (0 = desactivado)
+    'BENCHMARK_PERFILES_AL_ARRANCAR': False  # Medir lectura/escritura de cada perfil al arrancar (en segundo plano)
+}
+
+# Perfiles de conexión SQLite (perfiles_conexion.py)
+PERFILES_CONEXION = {
+    # Conexión mínima: solo WAL y caché de páginas (como se abría antes)
+    'basico': {
+        'synchronous': 'NORMAL',
+        'cache_size': 10000,  # Páginas (positivo) o KiB (negativo)
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'cached_statements': 128,
+        'busy_timeout_ms': 60000
+    },
+    'estandar': {
+        'synchronous': 'NORMAL',
+        'cache_size': 10000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'cached_statements': 256,
+        'busy_timeout_ms': 30000
+    },
+    # BD de empresa con muchos años de facturas y movimientos
+    'grande': {
+        'synchronous': 'NORMAL',
+        'cache_size': -64 * 1024,
+        'mmap_size': 512 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'cached_statements': 512,
+        'busy_timeout_ms': 30000
+    }
+}
+
+# Normalización de conceptos de gastos (normalizador_conceptos.py)
+NORMALIZADOR_CONCEPTOS_CONFIG = {
+    'MAX_MEMO': 4096  # Conceptos originales memorizados por normalizador (LRU)
+}
+
+# Índice de precios por cantidad (productos_precios.py)
+PRECIOS_PRODUCTOS_CONFIG = {
+    'MAX_EMPRESAS': 32,  # Empresas con índice en memoria por proceso (LRU)
+    'MAX_LINEAS_CESTA': 500  # Líneas por petición a /api/productos/precios
+}
+
+# Alta de empresas desde plantilla compilada (plantilla_empresa.py)
+PLANTILLA_EMPRESA_CONFIG = {
+    'MAESTROS_COMPARTIDOS': True,  # provincia/codipostal en una BD común adjunta en solo lectura
+    'TABLAS_MAESTRAS': ('provincia', 'codipostal'),
+    'BD_MAESTROS': os.path.join(BASE_DIR, 'db', 'maestros.db')
+}
+
+# Índice en memoria de calles y códigos postales (contactos_indice.py)
+CONTACTOS_INDICE_CONFIG = {
+    'MAX_INDICES': 8  # Orígenes de codipostal indexados por proceso (LRU)
+}
+
+# Cache de extracciones GPT-4 Vision por contenido (cache_extracciones.py)
+CACHE_EXTRACCIONES_CONFIG = {
+    'ACTIVA': True,
+    'RUTA': os.path.join(BASE_DIR, 'db', 'cache_extracciones.db'),  # Compartida por todas las empresas
+    'MAX_ENTRADAS': 20000,  # Documentos cacheados (LRU)
+    'MAX_BYTES': 64 * 1024 * 1024  # Tamaño máximo de los resultados guardados (LRU)
+}
+
+# Recepción de facturas de proveedores por email (facturas_email_pipeline.py)
+FACTURAS_EMAIL_CONFIG = {
+    'TRABAJADORES': 4,  # Extracciones de datos simultáneas
+    'MAX_PENDIENTES': 16,  # PDFs descargados a la espera de extracción o guardado
+    'LOTE_FETCH': 50,  # Emails por FETCH IMAP
+    'EXTRACTOR': os.getenv('FACTURAS_EMAIL_EXTRACTOR', 'gpt4'),  # 'gpt4' o 'local' (pruebas, sin API)
+    'LATENCIA_LOCAL': 0.0,  # Segundos de espera simulada del extractor local
+    'EMPRESA_POR_DEFECTO': os.getenv('FACTURAS_EMAIL_EMPRESA')  # Código; None: la única empresa activa
+}
+
+# Outbox de Facturae y VERI*FACTU de facturas (verifactu_outbox.py)
+VERIFACTU_OUTBOX_CONFIG = {
+    # Activar solo con scripts/verifactu_worker.py en marcha: sin worker las facturas quedan en cola sin enviar.
+    # False: crear_factura envía dentro de la petición
+    'ACTIVA': os.getenv('VERIFACTU_OUTBOX', '0') == '1',
+    'MAX_INTENTOS': 10,  # Después la fila queda en 'error' y la cola de la empresa sigue
+    'ESPERA_BASE': 30,  # Segundos antes del primer reintento; se dobla en cada fallo
+    'ESPERA_MAX': 3600,  # Espera máxima entre reintentos
+    'BLOQUEO': 300,  # Segundos que una fila queda reservada por el worker que la procesa
+    'LOTE': 20,  # Filas por empresa y vuelta, para no acaparar el worker
+    'INTERVALO': 2.0,  # Segundos de espera del worker cuando no hay nada que enviar
+    'ENVIO': os.getenv('VERIFACTU_ENVIO', 'aeat'),  # 'aeat' o 'local' (stub SOAP, pruebas sin red)
+    'LATENCIA_LOCAL': 0.0  # Segundos de espera simulada del stub local
+}
+
+# Plantillas HTML de facturas y presupuestos (motor_plantillas.py)
+MOTOR_PLANTILLAS_CONFIG = {
+    'DIRECTORIO': os.path.join(BASE_DIR, 'frontend'),  # IMPRIMIR_FACTURA.html, IMPRIMIR_PRESUPUESTO.html
+    'DIRECTORIO_EMPRESAS': os.path.join(BASE_DIR, 'frontend', 'plantillas'),  # <CODIGO>/<plantilla> sustituye a la común
+    'BASE_URL': BASE_DIR  # Raíz de las rutas relativas (imágenes, CSS) al generar el PDF
+}
+
+# Generación de PDF en procesos dedicados con cache por contenido (servicio_pdf.py)
+SERVICIO_PDF_CONFIG = {
+    'PROCESOS': int(os.getenv('PDF_PROCESOS', '2')),  # Trabajadores WeasyPrint por proceso web; 0: en el hilo que pide
+    'TIMEOUT': 60,  # Segundos por documento; después se mata el trabajador y se arranca otro
+    'ARRANQUE': 60,  # Segundos para arrancar un trabajador (importar WeasyPrint y cargar fuentes)
+    'ESPERA_MAX': 30,  # Segundos esperando un trabajador libre
+    'MAX_TRABAJOS': 500,  # Documentos por trabajador antes de reciclarlo
+    'ESTILOS_PRECARGADOS': ('@page { size: A4; margin: 1cm }', '@page { size: A4; margin: 10mm }'),  # Hojas compiladas al arrancar
+    'CACHE_ACTIVA': True,
+    'CACHE_RUTA': os.path.join(BASE_DIR, 'db', 'cache_pdf.db'),  # Compartida por todas las empresas
+    'CACHE_MAX_ENTRADAS': 5000,  # PDFs cacheados (LRU)
+    'CACHE_MAX_BYTES': 256 * 1024 * 1024,  # Tamaño máximo de los PDF guardados (LRU)
+    'RENDERIZADOR': os.getenv('PDF_RENDERIZADOR', 'weasyprint'),  # 'weasyprint' o 'local' (pruebas, sin WeasyPrint)
+    'LATENCIA_LOCAL': 0.0  # Segundos de espera simulada del renderizador local
 }
 
 # Rutas públicas (no requieren autenticación)
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NORMALIZADOR DE CONCEPTOS DE GASTOS
+===================================
+Agrupa los conceptos bancarios de gastos ("Recibo Orange Nº 123...",
+"Compra Internet En Amazon..., Tarjeta 4176...") bajo un mismo nombre.
+
+- Las reglas base se compilan una sola vez al importar el módulo
+- Cada empresa puede añadir reglas propias en la tabla
+  reglas_normalizacion_concepto (se aplican antes que las base)
+- Los resultados se memorizan por concepto original en una LRU acotada
+- El concepto normalizado se guarda en gastos.concepto_normalizado al
+  importar movimientos, de modo que las estadísticas agrupan con un
+  GROUP BY sobre la columna en lugar de normalizar fila a fila
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict
+
+from cache_estadisticas import incrementar_version_datos
+from logger_config import get_logger
+from multiempresa_config import NORMALIZADOR_CONCEPTOS_CONFIG
+
+logger = get_logger(__name__)
+
+# Incrementar al cambiar REGLAS_BASE: fuerza a recalcular la columna persistida
+VERSION_REGLAS_BASE = 1
+
+TIPOS_REGLA_EMPRESA = ('sustituir', 'fijar')
+
+ESQUEMA_REGLAS = '''
+    CREATE TABLE IF NOT EXISTS reglas_normalizacion_concepto (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        orden INTEGER NOT NULL DEFAULT 0,
+        tipo TEXT NOT NULL DEFAULT 'sustituir' CHECK (tipo IN ('sustituir', 'fijar')),
+        patron TEXT NOT NULL,
+        reemplazo TEXT NOT NULL DEFAULT '',
+        ignorar_mayusculas INTEGER NOT NULL DEFAULT 1,
+        activa INTEGER NOT NULL DEFAULT 1,
+        descripcion TEXT
+    )
+'''
+
+ESQUEMA_ESTADO = '''
+    CREATE TABLE IF NOT EXISTS normalizacion_concepto_estado (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        firma TEXT NOT NULL
+    )
+'''
+
+# Un cambio de concepto invalida el normalizado; se recalcula en el siguiente relleno
+TRIGGER_CONCEPTO = '''
+    CREATE TRIGGER IF NOT EXISTS trg_gastos_concepto_normalizado
+    AFTER UPDATE OF concepto ON gastos
+    WHEN OLD.concepto IS NOT NEW.concepto
+    BEGIN
+        UPDATE gastos SET concepto_normalizado = NULL WHERE id = NEW.id;
+    END
+'''
+
+
+# ===== TIPOS DE REGLA =====
+
+class Sustituir:
+    """re.sub con un patrón precompilado"""
+    __slots__ = ('patron', 'reemplazo')
+
+    def __init__(self, patron, reemplazo, flags=0):
+        self.patron = re.compile(patron, flags)
+        self.reemplazo = reemplazo
+
+    def aplicar(self, concepto):
+        return self.patron.sub(self.reemplazo, concepto)
+
+
+class Fijar:
+    """Sustituye el concepto completo por un nombre fijo"""
+    __slots__ = ('valor',)
+
+    def __init__(self, valor):
+        self.valor = valor
+
+    def aplicar(self, concepto):
+        return self.valor
+
+
+class Extraer:
+    """Se queda con el primer grupo del patrón si aparece"""
+    __slots__ = ('patron',)
+
+    def __init__(self, patron, flags=0):
+        self.patron = re.compile(patron, flags)
+
+    def aplicar(self, concepto):
+        coincidencia = self.patron.search(concepto)
+        return coincidencia.group(1).strip() if coincidencia else concepto
+
+
+class RecortarComas:
+    """Conserva solo los primeros trozos separados por comas"""
+    __slots__ = ('maximo',)
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+
+    def aplicar(self, concepto):
+        partes = concepto.split(',')
+        return ','.join(partes[:self.maximo]) if len(partes) > self.maximo else concepto
+
+
+class Recortar:
+    """Elimina espacios al principio y al final"""
+    __slots__ = ()
+
+    def aplicar(self, concepto):
+        return concepto.strip()
+
+
+class Bloque:
+    """
+    Reglas que solo se aplican si el concepto cumple la condición. La
+    condición se evalúa una vez, al entrar en el bloque.
+    """
+    __slots__ = ('condicion', 'reglas')
+
+    def __init__(self, condicion, *reglas):
+        self.condicion = condicion
+        self.reglas = reglas
+
+    def aplicar(self, concepto):
+        if self.condicion(concepto):
+            for regla in self.reglas:
+                concepto = regla.aplicar(concepto)
+        return concepto
+
+
+def contiene(*terminos):
+    """Condición: aparece alguno de los términos (distingue mayúsculas)"""
+    return lambda concepto: any(t in concepto for t in terminos)
+
+
+def contiene_sin_mayusculas(*terminos, todos=False):
+    """Condición: aparece alguno (o todos) de los términos en minúsculas"""
+    agregado = all if todos else any
+    return lambda concepto: agregado(t in concepto.lower() for t in terminos)
+
+
+I = re.IGNORECASE
+
+REGLAS_BASE = (
+    # Números de recibo, referencias, mandatos, facturas, contratos y fechas
+    Sustituir(r'N[ºo°]\s*Recibo[:\s]+[\d\s]+', '', I),
+    Sustituir(r'Nº\s*[\d\s]+', ''),
+    Sustituir(r'Ref[:\.\s]+.*?Mandato[:\s]+[\w\d\-]+', '', I),
+    Sustituir(r'Ref[:\.\s]+[\w\d\-]+', '', I),
+    Sustituir(r'Mandato[:\s]+[\w\d\-]+', '', I),
+    Sustituir(r'Factura[:\s]+[\d\-\/]+', '', I),
+    Sustituir(r'Contracte?\s+(Num\.?|N[ºo°])?\s*[\d\s]*', '', I),
+    Sustituir(r'Subministrament\s+D\s+Aigua\s+Contracte\s+Num\.?', 'Subministrament D Aigua', I),
+    Sustituir(r'\d{2}\/\d{2}\/\d{4}', ''),
+    Sustituir(r'\d{4}-\d{2}-\d{2}', ''),
+    Sustituir(r'\bBb[a-z]{5}\b', '', I),  # Códigos tipo Bbfztpn
+
+    # TRANSFERENCIAS: agrupar por destinatario
+    Bloque(
+        contiene('Transferencia'),
+        Sustituir(r'Transferencia\s+Inmediata\s+', 'Transferencia ', I),
+        Bloque(contiene_sin_mayusculas('truyol'), Sustituir(r'Truyol\s+Digital', 'Truyol', I)),
+        Extraer(r'(Transferencia.*?A\s+Favor\s+De\s+[\w\s,]+?)\s+Concepto', I),
+    ),
+
+    # COMPRAS TARJETA: comercios conocidos, datos de tarjeta y localización
+    Bloque(
+        contiene('Compra', 'Tarjeta'),
+        Sustituir(r'Compra\s+Internet\s+En\s+', 'Compra En ', I),
+        Bloque(contiene_sin_mayusculas('amazon', 'amzn'), Fijar('Compra Amazon Business')),
+        Bloque(contiene_sin_mayusculas('uber', 'eats', todos=True), Fijar('Compra Uber Eats')),
+        Bloque(contiene_sin_mayusculas('taxi', 'autotaxi'), Fijar('Compra Taxi')),
+        Sustituir(r',\s*Tarjeta\s+[\d\s]+,\s*Comision\s+[\d,\.]+', '', I),
+        Sustituir(r',?\s*Tarjeta\s*,?\s*Comision\s*', '', I),
+        Sustituir(r',?\s*Tarjeta\s*$', '', I),
+        Sustituir(r',?\s*Tarj\.\s*:?\*?\d*\s*$', '', I),
+        RecortarComas(2),
+        Sustituir(r',\s*[A-Z][\w\s]+$', ''),  # ", Ciudad" al final
+    ),
+
+    Sustituir(r',\s*De\s*$', '', I),
+    Sustituir(r',\s*D\s*$', ''),
+
+    # REPSOL: texto duplicado y códigos de contrato
+    Bloque(
+        contiene_sin_mayusculas('repsol'),
+        Sustituir(r'repsol\s+Comercializadora\s+D?', 'Repsol', I),
+        Sustituir(r'(Repsol)\s+\d+', r'\1', I),
+        Sustituir(r'(Repsol)[,\s]+(Repsol)', r'\1', I),
+    ),
+
+    # ORANGE: todos los recibos bajo el mismo nombre
+    Bloque(contiene_sin_mayusculas('orange'), Bloque(contiene('Recibo'), Fijar('Recibo Orange Espagne'))),
+
+    # Números sueltos y códigos alfanuméricos al final
+    Sustituir(r'\b\d+\b', ''),
+    Sustituir(r'\s+[A-Z]?\d+[A-Z]?\s*$', ''),
+
+    # Texto redundante común
+    Sustituir(r'Periodo\s+Liquidacion[:\s]*[\/\-]*\s*,?\s*', '', I),
+    Sustituir(r',?\s*De\s+(No|Not\s+Provided)\s*$', '', I),
+    Sustituir(r'\s*[\/\-]+\s*', ' '),
+    Sustituir(r'\s*R\.e\.\s*', ' ', I),  # R.e. (régimen especial)
+    Sustituir(r'\bautonomos\b', 'Autónomos', I),
+
+    # Formas societarias: S.l.u. → Slu, S.a.u → Sau...
+    Sustituir(r'S\.[lL]\.[uU]\.', 'Slu'),
+    Sustituir(r'S\.[aA]\.[uU]\.', 'Sau'),
+    Sustituir(r'S\.[lL]\.', 'Sl'),
+    Sustituir(r'S\.c\.c\.l\.', 'Sccl', I),
+    Sustituir(r'S\.a\.', 'Sa', I),
+    Sustituir(r'C\s+B\b', 'CB'),
+
+    # Espacios y puntuación redundante
+    Sustituir(r'\s+', ' '),
+    Recortar(),
+    Sustituir(r'[,.\s]+$', ''),
+    Sustituir(r'\s*,\s*,\s*', ', '),  # Comas duplicadas
+)
+
+
+# ===== MOTOR =====
+
+@dataclass
+class NormalizadorMetrics:
+    """Métricas de la memoria de conceptos normalizados"""
+    aciertos: int = 0
+    fallos: int = 0
+    expulsiones: int = 0
+
+
+class Normalizador:
+    """
+    Reglas de una empresa (propias + base) con memoria LRU por concepto
+    original. Las reglas propias de tipo 'fijar' terminan la normalización
+    con su reemplazo en cuanto el patrón aparece en el concepto original.
+    """
+
+    def __init__(self, reglas_empresa=(), max_memo: int = NORMALIZADOR_CONCEPTOS_CONFIG['MAX_MEMO']):
+        self.reglas_empresa = tuple(reglas_empresa)
+        self.firma = hashlib.sha1(repr((VERSION_REGLAS_BASE, self.reglas_empresa)).encode('utf-8')).hexdigest()
+        self.max_memo = max_memo
+        self.metrics = NormalizadorMetrics()
+        self._fijas = []
+        self._reglas = []
+        for tipo, patron, reemplazo, ignorar_mayusculas in self.reglas_empresa:
+            flags = re.IGNORECASE if ignorar_mayusculas else 0
+            if tipo == 'fijar':
+                self._fijas.append((re.compile(patron, flags), reemplazo))
+            else:
+                self._reglas.append(Sustituir(patron, reemplazo, flags))
+        self._reglas.extend(REGLAS_BASE)
+        self._memo: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _calcular(self, concepto):
+        for patron, reemplazo in self._fijas:
+            if patron.search(concepto):
+                return reemplazo
+        for regla in self._reglas:
+            concepto = regla.aplicar(concepto)
+        return concepto
+
+    def normalizar(self, concepto_original):
+        """Concepto normalizado (los conceptos vacíos o NULL quedan como '')"""
+        if not concepto_original:
+            return ''
+        with self._lock:
+            normalizado = self._memo.get(concepto_original)
+            if normalizado is not None:
+                self._memo.move_to_end(concepto_original)
+                self.metrics.aciertos += 1
+                return normalizado
+            self.metrics.fallos += 1
+
+        normalizado = self._calcular(concepto_original)
+
+        with self._lock:
+            self._memo[concepto_original] = normalizado
+            while len(self._memo) > self.max_memo:
+                self._memo.popitem(last=False)
+                self.metrics.expulsiones += 1
+        return normalizado
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'reglas_empresa': len(self.reglas_empresa),
+                'memo': len(self._memo),
+                'max_memo': self.max_memo,
+                'aciertos': self.metrics.aciertos,
+                'fallos': self.metrics.fallos,
+                'expulsiones': self.metrics.expulsiones
+            }
+
+
+NORMALIZADOR_BASE = Normalizador()
+
+
+def normalizar_concepto(concepto_original):
+    """Normaliza un concepto solo con las reglas base"""
+    return NORMALIZADOR_BASE.normalizar(concepto_original)
+
+
+def cargar_reglas_empresa(conn):
+    """
+    Reglas activas de reglas_normalizacion_concepto como tuplas
+    (tipo, patron, reemplazo, ignorar_mayusculas). Las que no compilan o
+    tienen un tipo desconocido se descartan con un aviso.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'reglas_normalizacion_concepto'")
+    if not cursor.fetchone():
+        return ()
+
+    cursor.execute('''
+        SELECT id, tipo, patron, reemplazo, ignorar_mayusculas
+        FROM reglas_normalizacion_concepto
+        WHERE activa = 1
+        ORDER BY orden, id
+    ''')
+    reglas = []
+    for id_regla, tipo, patron, reemplazo, ignorar_mayusculas in cursor.fetchall():
+        if tipo not in TIPOS_REGLA_EMPRESA:
+            logger.warning(f"Regla de normalización {id_regla} ignorada: tipo desconocido '{tipo}'")
+            continue
+        try:
+            re.compile(patron)
+        except re.error as e:
+            logger.warning(f"Regla de normalización {id_regla} ignorada: patrón inválido ({e})")
+            continue
+        reglas.append((tipo, patron, reemplazo or '', bool(ignorar_mayusculas)))
+    return tuple(reglas)
+
+
+_normalizadores: Dict[str, Normalizador] = {}
+_normalizadores_lock = threading.Lock()
+
+
+def _ruta_bd(conn):
+    return conn.execute('PRAGMA database_list').fetchone()[2]
+
+
+def obtener_normalizador(conn):
+    """
+    Normalizador de la empresa de la conexión. Las reglas se leen y compilan
+    la primera vez que el proceso usa esa BD; invalidar_normalizador() fuerza
+    a releerlas (preparar_conceptos_normalizados lo hace al ver que la firma
+    guardada en la BD ya no es la de sus reglas).
+    """
+    db_path = _ruta_bd(conn)
+    normalizador = _normalizadores.get(db_path)
+    if normalizador is not None:
+        return normalizador
+
+    reglas = cargar_reglas_empresa(conn)
+    normalizador = Normalizador(reglas) if reglas else NORMALIZADOR_BASE
+    if db_path:  # las BD en memoria no tienen ruta y no se recuerdan
+        with _normalizadores_lock:
+            normalizador = _normalizadores.setdefault(db_path, normalizador)
+    return normalizador
+
+
+def invalidar_normalizador(db_path=None):
+    """Olvida las reglas compiladas de una BD (o de todas)"""
+    with _normalizadores_lock:
+        if db_path is None:
+            _normalizadores.clear()
+        else:
+            _normalizadores.pop(db_path, None)
+    with _preparar_lock:
+        if db_path is None:
+            _bases_preparadas.clear()
+        else:
+            _bases_preparadas.discard(db_path)
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Métricas del normalizador base y de los de cada empresa con reglas propias"""
+    with _normalizadores_lock:
+        propios = {db_path: n.get_metrics() for db_path, n in _normalizadores.items() if n is not NORMALIZADOR_BASE}
+    return {'base': NORMALIZADOR_BASE.get_metrics(), 'empresas': propios}
+
+
+# ===== COLUMNA PERSISTIDA =====
+
+def instalar_concepto_normalizado(conn, normalizador):
+    """
+    Crea (si faltan) la columna gastos.concepto_normalizado, su índice, el
+    trigger que la invalida al cambiar el concepto y la tabla de reglas. Si
+    las reglas han cambiado desde el último relleno, vacía la columna para
+    recalcularla e invalida la cache de estadísticas de gastos. Hace commit.
+    Devuelve False si la BD no tiene gastos.
+    """
+    cursor = conn.cursor()
+    if conn.in_transaction:
+        conn.commit()
+
+    cursor.execute('PRAGMA table_info(gastos)')
+    columnas = [fila[1] for fila in cursor.fetchall()]
+    if not columnas:
+        return False
+
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        if 'concepto_normalizado' not in columnas:
+            logger.info("Agregando campo 'concepto_normalizado' a tabla gastos")
+            cursor.execute('ALTER TABLE gastos ADD COLUMN concepto_normalizado TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_gastos_concepto_normalizado ON gastos(concepto_normalizado)')
+        cursor.execute(TRIGGER_CONCEPTO)
+        cursor.execute(ESQUEMA_REGLAS)
+        cursor.execute(ESQUEMA_ESTADO)
+
+        cursor.execute('SELECT firma FROM normalizacion_concepto_estado WHERE id = 1')
+        fila = cursor.fetchone()
+        if fila is None or fila[0] != normalizador.firma:
+            if fila is not None:
+                logger.info("Reglas de normalización cambiadas: se recalculan los conceptos normalizados")
+            cursor.execute('UPDATE gastos SET concepto_normalizado = NULL WHERE concepto_normalizado IS NOT NULL')
+            # Los triggers de data_version ignoran esta columna: invalidar aquí
+            # las estadísticas agrupadas por concepto (top 10, por categoría)
+            incrementar_version_datos(conn, 'gastos')
+            cursor.execute('INSERT OR REPLACE INTO normalizacion_concepto_estado (id, firma) VALUES (1, ?)',
+                           (normalizador.firma,))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def rellenar_conceptos_normalizados(conn, normalizador=None):
+    """
+    Calcula concepto_normalizado para las filas que no lo tienen (altas
+    por rutas que no lo rellenan o conceptos modificados). Hace commit y
+    devuelve el número de filas actualizadas.
+    """
+    normalizador = normalizador or obtener_normalizador(conn)
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, concepto FROM gastos WHERE concepto_normalizado IS NULL')
+    pendientes = [(normalizador.normalizar(concepto), id_gasto) for id_gasto, concepto in cursor.fetchall()]
+    if pendientes:
+        cursor.executemany('UPDATE gastos SET concepto_normalizado = ? WHERE id = ?', pendientes)
+        logger.debug(f"Conceptos normalizados rellenados: {len(pendientes)}")
+    conn.commit()
+    return len(pendientes)
+
+
+_bases_preparadas = set()
+_preparar_lock = threading.Lock()
+
+
+def _firma_guardada(conn):
+    """Firma de las reglas con que se rellenó la columna (None si aún no hay estado)"""
+    try:
+        fila = conn.execute('SELECT firma FROM normalizacion_concepto_estado WHERE id = 1').fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return fila[0] if fila else None
+
+
+def preparar_conceptos_normalizados(conn):
+    """
+    Deja gastos.concepto_normalizado al día: instala la columna la primera
+    vez que el proceso usa la BD y rellena las filas pendientes.
+
+    Si otro proceso ha cambiado la firma guardada (otro worker arrancado con
+    reglas nuevas o scripts/renormalizar_conceptos.py), se releen las reglas
+    antes de rellenar, para no normalizar filas nuevas con las antiguas.
+    """
+    normalizador = obtener_normalizador(conn)
+    db_path = _ruta_bd(conn)
+    if db_path in _bases_preparadas and _firma_guardada(conn) != normalizador.firma:
+        logger.info("Reglas de normalización cambiadas en la BD: se vuelven a cargar")
+        invalidar_normalizador(db_path)
+        normalizador = obtener_normalizador(conn)
+    if db_path not in _bases_preparadas:
+        with _preparar_lock:
+            if db_path not in _bases_preparadas:
+                if not instalar_concepto_normalizado(conn, normalizador):
+                    return 0
+                if db_path:
+                    _bases_preparadas.add(db_path)
+    return rellenar_conceptos_normalizados(conn, normalizador)
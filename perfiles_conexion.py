@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PERFILES DE CONEXIÓN SQLITE
+===========================
+Con qué PRAGMAs y caché de sentencias abre el pool las conexiones de cada BD.
+
+- Los perfiles están en PERFILES_CONEXION (multiempresa_config.py):
+  mmap_size, temp_store, cache_size, synchronous, cached_statements y
+  busy_timeout
+- Cada empresa usa el perfil fijado en PERFILES_EMPRESA o, si no tiene,
+  el de BD grande cuando su fichero supera UMBRAL_BD_GRANDE_MB
+- benchmark_perfiles() mide lecturas y escrituras por segundo de cada
+  perfil sobre una copia de una BD, para elegir ajustes con datos
+"""
+
+import glob
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.request import pathname2url
+
+from logger_config import get_logger
+from multiempresa_config import BASE_DIR, DATABASE_POOL_CONFIG, PERFILES_CONEXION
+
+logger = get_logger(__name__)
+
+TEMP_STORE_VALIDOS = ('DEFAULT', 'FILE', 'MEMORY')
+SYNCHRONOUS_VALIDOS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def codigo_empresa(db_path: str) -> str:
+    """Código de empresa a partir de la ruta (db/CODIGO/CODIGO.db)"""
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+
+def resolver_perfil(db_path: str, nombre: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Perfil con el que abrir la BD: el indicado, el fijado para la empresa,
+    el de BD grande si el fichero supera el umbral o el perfil por defecto.
+
+    Returns:
+        tuple: (nombre del perfil, ajustes)
+    """
+    if nombre is None:
+        nombre = DATABASE_POOL_CONFIG['PERFILES_EMPRESA'].get(codigo_empresa(db_path))
+    if nombre is None:
+        nombre = DATABASE_POOL_CONFIG['PERFIL_CONEXION']
+        try:
+            if os.path.getsize(db_path) >= DATABASE_POOL_CONFIG['UMBRAL_BD_GRANDE_MB'] * 1024 * 1024:
+                nombre = DATABASE_POOL_CONFIG['PERFIL_BD_GRANDE']
+        except OSError:
+            pass  # BD en memoria o aún sin crear
+
+    if nombre not in PERFILES_CONEXION:
+        logger.warning(f"Perfil de conexión desconocido '{nombre}' para {db_path}, se usa el por defecto")
+        nombre = DATABASE_POOL_CONFIG['PERFIL_CONEXION']
+    return nombre, PERFILES_CONEXION[nombre]
+
+
+def opciones_connect(perfil: Dict[str, Any]) -> Dict[str, Any]:
+    """Argumentos de sqlite3.connect que dependen del perfil"""
+    return {
+        'timeout': perfil['busy_timeout_ms'] / 1000,
+        'cached_statements': int(perfil['cached_statements'])
+    }
+
+
+def aplicar_perfil(conn: sqlite3.Connection, perfil: Dict[str, Any], solo_lectura: bool = False):
+    """
+    Aplica los PRAGMAs del perfil a una conexión recién abierta. Las de solo
+    lectura no tocan journal_mode ni synchronous (no pueden cambiarlos).
+    """
+    temp_store = str(perfil['temp_store']).upper()
+    synchronous = str(perfil['synchronous']).upper()
+    if temp_store not in TEMP_STORE_VALIDOS or synchronous not in SYNCHRONOUS_VALIDOS:
+        raise ValueError(f"Perfil de conexión no válido: {perfil}")
+
+    if not solo_lectura:
+        conn.execute('PRAGMA encoding="UTF-8"')
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+    conn.execute(f"PRAGMA busy_timeout={int(perfil['busy_timeout_ms'])}")
+    conn.execute(f"PRAGMA cache_size={int(perfil['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size={int(perfil['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store={temp_store}")
+
+
+# ===== BENCHMARK =====
+
+TABLA_BENCHMARK = '_benchmark_perfil'
+
+_ultimo_benchmark: Optional[Dict[str, Any]] = None
+_benchmark_lock = threading.Lock()
+
+
+def _preparar_copia(origen: Optional[str], destino: str, filas: int):
+    """Copia la BD de origen (o crea una vacía) y añade la tabla sintética del benchmark"""
+    conn = sqlite3.connect(destino)
+    try:
+        if origen:
+            fuente = sqlite3.connect(f"file:{pathname2url(os.path.abspath(origen))}?mode=ro", uri=True)
+            try:
+                fuente.backup(conn)
+            finally:
+                fuente.close()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f'''
+            CREATE TABLE {TABLA_BENCHMARK} (
+                id INTEGER PRIMARY KEY, grupo INTEGER, importe REAL, concepto TEXT
+            )
+        ''')
+        aleatorio = random.Random(0)
+        conn.executemany(
+            f'INSERT INTO {TABLA_BENCHMARK} (grupo, importe, concepto) VALUES (?, ?, ?)',
+            [(aleatorio.randrange(1000), aleatorio.uniform(-500, 500), f'Concepto {i % 997}') for i in range(filas)]
+        )
+        conn.execute(f'CREATE INDEX idx{TABLA_BENCHMARK}_grupo ON {TABLA_BENCHMARK} (grupo)')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def medir_perfil(db_path: str, nombre: str, segundos: float = 1.0, hilos: int = 4) -> Dict[str, Any]:
+    """
+    Lecturas (consultas agregadas por grupo, desde `hilos` hilos) y escrituras
+    (transacciones de una fila por el carril de escritura) por segundo con
+    el perfil indicado, sobre una BD preparada con _preparar_copia.
+    """
+    from database_pool import DatabasePool
+
+    pool = DatabasePool(db_path, max_connections=hilos + 1, min_connections=0, profile=nombre)
+    lecturas = [0] * hilos
+    escrituras = [0]
+    fin = threading.Event()
+
+    def leer(indice):
+        aleatorio = random.Random(indice)
+        while not fin.is_set():
+            with pool.get_read_connection() as conn:
+                conn.execute(f'SELECT COUNT(*), SUM(importe), MAX(concepto) FROM {TABLA_BENCHMARK} WHERE grupo = ?',
+                             (aleatorio.randrange(1000),)).fetchone()
+            lecturas[indice] += 1
+
+    def escribir():
+        while not fin.is_set():
+            with pool.write_transaction() as conn:
+                conn.execute(f'INSERT INTO {TABLA_BENCHMARK} (grupo, importe, concepto) VALUES (?, ?, ?)',
+                             (escrituras[0] % 1000, 1.0, 'Escritura'))
+            escrituras[0] += 1
+
+    trabajadores = [threading.Thread(target=leer, args=(i,)) for i in range(hilos)]
+    trabajadores.append(threading.Thread(target=escribir))
+    inicio = time.perf_counter()
+    for t in trabajadores:
+        t.start()
+    fin.wait(segundos)
+    fin.set()
+    for t in trabajadores:
+        t.join()
+    duracion = time.perf_counter() - inicio
+    pool.shutdown()
+
+    return {
+        'lecturas_s': round(sum(lecturas) / duracion, 1),
+        'escrituras_s': round(escrituras[0] / duracion, 1)
+    }
+
+
+def benchmark_perfiles(origen: Optional[str] = None, perfiles=None, segundos: float = 1.0,
+                       filas: int = 50000, hilos: int = 4) -> Dict[str, Any]:
+    """
+    Mide cada perfil sobre su propia copia de `origen` (o sobre una BD
+    sintética si no se indica) para no tocar la BD real.
+
+    Returns:
+        dict: {'origen', 'tamano_mb', 'segundos', 'perfiles': {nombre: {'lecturas_s', 'escrituras_s'}}}
+    """
+    global _ultimo_benchmark
+    perfiles = list(perfiles or PERFILES_CONEXION)
+    resultados = {}
+    with tempfile.TemporaryDirectory(prefix='benchmark_perfiles_') as directorio:
+        for nombre in perfiles:
+            copia = os.path.join(directorio, f'{nombre}.db')
+            _preparar_copia(origen, copia, filas)
+            resultados[nombre] = medir_perfil(copia, nombre, segundos, hilos)
+            logger.info(f"[PERFILES] {nombre}: {resultados[nombre]['lecturas_s']} lecturas/s, "
+                        f"{resultados[nombre]['escrituras_s']} escrituras/s")
+
+    informe = {
+        'origen': origen,
+        'tamano_mb': round(os.path.getsize(origen) / 1024 / 1024, 1) if origen else 0,
+        'segundos': segundos,
+        'perfiles': resultados,
+        'fecha': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    with _benchmark_lock:
+        _ultimo_benchmark = informe
+    return informe
+
+
+def bd_empresa_mas_grande() -> Optional[str]:
+    """Ruta de la BD de empresa más grande (db/CODIGO/CODIGO.db)"""
+    rutas = [r for r in glob.glob(os.path.join(BASE_DIR, 'db', '*', '*.db'))
+             if codigo_empresa(r) == os.path.basename(os.path.dirname(r))]
+    return max(rutas, key=os.path.getsize) if rutas else None
+
+
+def iniciar_benchmark_al_arrancar() -> Optional[threading.Thread]:
+    """
+    Lanza en segundo plano el benchmark de perfiles sobre una copia de la
+    BD de empresa más grande, si BENCHMARK_PERFILES_AL_ARRANCAR está activo.
+    """
+    if not DATABASE_POOL_CONFIG['BENCHMARK_PERFILES_AL_ARRANCAR']:
+        return None
+
+    def ejecutar():
+        try:
+            benchmark_perfiles(bd_empresa_mas_grande())
+        except Exception as e:
+            logger.error(f"[PERFILES] Error en el benchmark de perfiles: {e}", exc_info=True)
+
+    hilo = threading.Thread(target=ejecutar, name='benchmark-perfiles', daemon=True)
+    hilo.start()
+    return hilo
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Perfiles configurados y resultado del último benchmark"""
+    with _benchmark_lock:
+        benchmark = _ultimo_benchmark
+    return {
+        'por_defecto': DATABASE_POOL_CONFIG['PERFIL_CONEXION'],
+        'bd_grande': DATABASE_POOL_CONFIG['PERFIL_BD_GRANDE'],
+        'perfiles': sorted(PERFILES_CONEXION),
+        'ultimo_benchmark': benchmark
+    }
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PLANTILLA DE BD DE EMPRESA Y DATOS MAESTROS COMPARTIDOS
+=======================================================
+Alta rápida de la BD de una empresa nueva:
+
+- La primera vez (o cuando cambia el esquema de plantilla.db) se compila una
+  plantilla: esquema de tablas e índices, sin datos, compactada con VACUUM.
+  Dar de alta una empresa es copiar ese fichero
+- Los datos maestros (provincia, codipostal) viven en una única BD compartida
+  (PLANTILLA_EMPRESA_CONFIG['BD_MAESTROS']) que el pool adjunta en solo
+  lectura a cada conexión de las empresas que no tienen su propia copia.
+  Las consultas no cambian: SQLite resuelve `FROM codipostal` en la BD
+  adjunta cuando la principal no tiene la tabla
+- Con MAESTROS_COMPARTIDOS desactivado la plantilla lleva los datos maestros,
+  como antes
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Optional
+from urllib.request import pathname2url
+
+from logger_config import get_logger
+from multiempresa_config import PLANTILLA_EMPRESA_CONFIG
+
+logger = get_logger(__name__)
+
+ESQUEMA_MAESTROS = 'maestros'
+
+_compilar_lock = threading.Lock()
+
+
+def ruta_plantilla_compilada(bd_origen: str) -> str:
+    """Plantilla compilada junto a la de origen (plantilla.db -> plantilla_compilada.db)"""
+    base, extension = os.path.splitext(bd_origen)
+    return f'{base}_compilada{extension}'
+
+
+def _tablas_maestras():
+    return tuple(PLANTILLA_EMPRESA_CONFIG['TABLAS_MAESTRAS'])
+
+
+def huella_plantilla(bd_origen: str) -> str:
+    """
+    Huella del esquema de la plantilla de origen, de sus datos maestros
+    (número de filas) y de si los maestros van compartidos. Si cambia, la
+    plantilla compilada está obsoleta.
+    """
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(bd_origen))}?mode=ro", uri=True)
+    try:
+        huella = hashlib.sha256()
+        for tipo, nombre, sql in conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY type, name"
+        ):
+            huella.update(f'{tipo}|{nombre}|{sql}\n'.encode('utf-8'))
+        for tabla in _tablas_maestras():
+            try:
+                filas = conn.execute(f'SELECT COUNT(*) FROM "{tabla}"').fetchone()[0]
+            except sqlite3.OperationalError:
+                filas = None
+            huella.update(f'{tabla}={filas}\n'.encode('utf-8'))
+        huella.update(f"compartidos={PLANTILLA_EMPRESA_CONFIG['MAESTROS_COMPARTIDOS']}".encode('utf-8'))
+        return huella.hexdigest()
+    finally:
+        conn.close()
+
+
+def _leer_huella(ruta: str) -> Optional[str]:
+    try:
+        with open(f'{ruta}.huella', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _reemplazar(temporal: str, destino: str, huella: Optional[str] = None):
+    """Mueve el fichero generado a su sitio (atómico) y guarda su huella"""
+    os.replace(temporal, destino)
+    if huella is not None:
+        with open(f'{destino}.huella', 'w', encoding='utf-8') as f:
+            f.write(huella)
+
+
+def _copiar_esquema(conn_origen, conn_destino, incluir_tabla):
+    """CREATE TABLE/INDEX de la plantilla para las tablas que cumplen incluir_tabla(nombre)"""
+    for tipo in ('table', 'index'):
+        for nombre, tabla, sql in conn_origen.execute(
+            "SELECT name, tbl_name, sql FROM sqlite_master WHERE type = ? AND sql IS NOT NULL", (tipo,)
+        ):
+            if nombre == 'sqlite_sequence' or not incluir_tabla(tabla.lower()):
+                continue
+            try:
+                conn_destino.execute(sql)
+            except Exception as e:
+                logger.warning(f"Error creando {tipo} {nombre}: {e}")
+
+
+def _copiar_maestros(conn_origen, conn_destino):
+    """Datos de las tablas maestras"""
+    for tabla in _tablas_maestras():
+        try:
+            datos = conn_origen.execute(f'SELECT * FROM "{tabla}"').fetchall()
+            if datos:
+                marcas = ','.join('?' * len(datos[0]))
+                conn_destino.executemany(f'INSERT INTO "{tabla}" VALUES ({marcas})', datos)
+                logger.info(f"Copiados {len(datos)} registros de tabla {tabla}")
+        except Exception as e:
+            logger.warning(f"Error copiando datos de tabla {tabla}: {e}")
+
+
+def _generar(bd_origen: str, destino: str, incluir_tabla, con_maestros: bool) -> str:
+    """
+    Genera, en un temporal del mismo directorio que destino, una BD con el
+    esquema de las tablas elegidas (y los datos maestros si se piden)
+    compactada con VACUUM. Devuelve la ruta del temporal.
+    """
+    descriptor, temporal = tempfile.mkstemp(prefix='.plantilla_', suffix='.db', dir=os.path.dirname(destino) or '.')
+    os.close(descriptor)
+    os.remove(temporal)
+
+    conn_origen = sqlite3.connect(f"file:{pathname2url(os.path.abspath(bd_origen))}?mode=ro", uri=True)
+    conn_destino = sqlite3.connect(temporal)
+    try:
+        _copiar_esquema(conn_origen, conn_destino, incluir_tabla)
+        if con_maestros:
+            _copiar_maestros(conn_origen, conn_destino)
+        conn_destino.commit()
+        conn_destino.execute('VACUUM')
+        conn_destino.close()
+    except Exception:
+        conn_destino.close()
+        os.remove(temporal)
+        raise
+    finally:
+        conn_origen.close()
+    return temporal
+
+
+def preparar_plantilla(bd_origen: str) -> str:
+    """
+    Devuelve la ruta de la plantilla compilada, generándola (y la BD de
+    maestros compartida) si no existe o si la de origen ha cambiado.
+    """
+    compilada = ruta_plantilla_compilada(bd_origen)
+    huella = huella_plantilla(bd_origen)
+    if os.path.exists(compilada) and _leer_huella(compilada) == huella:
+        return compilada
+
+    with _compilar_lock:
+        if os.path.exists(compilada) and _leer_huella(compilada) == huella:
+            return compilada
+
+        maestras = {tabla.lower() for tabla in _tablas_maestras()}
+        compartidos = PLANTILLA_EMPRESA_CONFIG['MAESTROS_COMPARTIDOS']
+        if compartidos:
+            maestros = PLANTILLA_EMPRESA_CONFIG['BD_MAESTROS']
+            if _leer_huella(maestros) != huella:
+                temporal = _generar(bd_origen, maestros, lambda tabla: tabla in maestras, con_maestros=True)
+                _reemplazar(temporal, maestros, huella)
+                logger.info(f"[PLANTILLA] BD de maestros compartida generada: {maestros}")
+
+        temporal = _generar(bd_origen, compilada, lambda tabla: not (compartidos and tabla in maestras),
+                            con_maestros=not compartidos)
+        _reemplazar(temporal, compilada, huella)
+        logger.info(f"[PLANTILLA] Plantilla compilada ({os.path.getsize(compilada) // 1024} KB): {compilada}")
+        return compilada
+
+
+def crear_bd_desde_plantilla(bd_origen: str, bd_destino: str):
+    """Crea la BD de una empresa copiando la plantilla compilada con la API de backup"""
+    compilada = preparar_plantilla(bd_origen)
+    if os.path.exists(bd_destino):
+        os.remove(bd_destino)
+
+    fuente = sqlite3.connect(f"file:{pathname2url(os.path.abspath(compilada))}?mode=ro", uri=True)
+    destino = sqlite3.connect(bd_destino)
+    try:
+        fuente.backup(destino)
+    finally:
+        destino.close()
+        fuente.close()
+
+
+def adjuntar_maestros(conn: sqlite3.Connection) -> bool:
+    """
+    Adjunta en solo lectura la BD de maestros compartida a una conexión de
+    empresa que no tiene su propia copia de las tablas maestras.
+
+    Returns:
+        bool: True si se ha adjuntado
+    """
+    if not PLANTILLA_EMPRESA_CONFIG['MAESTROS_COMPARTIDOS']:
+        return False
+    maestros = PLANTILLA_EMPRESA_CONFIG['BD_MAESTROS']
+    if not os.path.exists(maestros):
+        return False
+
+    marcas = ','.join('?' * len(_tablas_maestras()))
+    propias = conn.execute(
+        f"SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ({marcas})", _tablas_maestras()
+    ).fetchone()[0]
+    if propias:
+        return False
+
+    # immutable: nadie escribe en ella; al regenerarla se sustituye el fichero
+    conn.execute(
+        f"ATTACH DATABASE ? AS {ESQUEMA_MAESTROS}",
+        (f"file:{pathname2url(os.path.abspath(maestros))}?mode=ro&immutable=1",)
+    )
+    return True
@@ -746,14 +746,115 @@ def convertir_presupuesto_a_ticket(id_presupuesto):
             conn.close()
 
 
+# Emisor por defecto si no se puede leer emisor_config.json
+EMISOR_PRESUPUESTO_DEFECTO = {
+    'nombre': 'ALEPH 70',
+    'direccion': 'C/ Ejemplo, 123',
+    'cp': '28001',
+    'ciudad': 'Madrid',
+    'provincia': 'Madrid',
+    'email': 'info@aleph70.com',
+    'nif': 'B12345678'
+}
+
+
+def _renderizar_presupuesto(motor, presupuesto_dict, detalles_html, subtotal, total_iva, total_final):
+    """HTML de IMPRIMIR_PRESUPUESTO.html con los datos del presupuesto y sus filas de detalle ya generadas"""
+    from motor_plantillas import PLANTILLA_PRESUPUESTO, logo_empresa_sesion, preparar_presupuesto
+    from utils_emisor import cargar_json_emisor
+
+    # Formatear fecha
+    try:
+        fecha_obj = datetime.strptime(presupuesto_dict['fecha'], '%Y-%m-%d')
+        fecha_formateada = fecha_obj.strftime('%d/%m/%Y')
+        fecha_validez = (fecha_obj + timedelta(days=30)).strftime('%d/%m/%Y')
+    except Exception as e:
+        logger.error(f"Error: {e}", exc_info=True)
+        fecha_formateada = presupuesto_dict['fecha']
+        fecha_validez = 'N/A'
+    
+    # Estados formateados
+    estados = {
+        'B': 'Borrador',
+        'EN': 'Enviado', 
+        'AP': 'Aceptado',
+        'RJ': 'Rechazado',
+        'CD': 'Caducado',
+        'F': 'Facturada',
+        'T': 'Ticket'
+    }
+    estado_texto = estados.get(presupuesto_dict.get('estado', 'B'), 'Borrador')
+
+    # Cargar datos del emisor (se reutilizan mientras el archivo no cambie)
+    try:
+        emisor_config = cargar_json_emisor('/var/www/html/emisor_config.json')
+    except Exception as e:
+        logger.error(f"Error cargando emisor_config.json: {e}", exc_info=True)
+        emisor_config = dict(EMISOR_PRESUPUESTO_DEFECTO)
+
+    # Construir bloque de cliente dinámicamente (solo si hay datos)
+    razon = str(presupuesto_dict.get('razonsocial', '') or '')
+    direccion = str(presupuesto_dict.get('direccion', '') or '')
+    poblacion = str(presupuesto_dict.get('poblacion', '') or '')
+    cp = str(presupuesto_dict.get('codigopostal', '') or '')
+    provincia = str(presupuesto_dict.get('provincia', '') or '')
+    telefono = str(presupuesto_dict.get('telf1', '') or '')
+    email = str(presupuesto_dict.get('mail', '') or '')
+    # Obtener identificador (NIF/CIF)
+    identificador = str(presupuesto_dict.get('identificador', '') or presupuesto_dict.get('nif', '') or '')
+    
+    hay_cliente = any([razon, direccion, poblacion, cp, provincia, telefono, email, identificador])
+    if hay_cliente:
+        cliente_html = f"""
+        <div class=\"client-info\">
+            <div class=\"info-box\">
+                <div class=\"info-title\">RAZÓN SOCIAL</div>
+                <div style=\"font-weight: bold; font-size: 16px; margin-bottom: 10px;\">{razon}</div>
+                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">IDENTIFICADOR</div>
+                <div style=\"margin-bottom: 8px;\">{identificador}</div>
+                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">DIRECCIÓN</div>
+                <div style=\"margin-bottom: 8px;\">{direccion}</div>
+                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">CP Y LOCALIDAD</div>
+                <div style=\"margin-bottom: 8px;\">{cp} {poblacion}</div>
+                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">PROVINCIA</div>
+                <div style=\"margin-bottom: 8px;\">{provincia}</div>
+            </div>
+        </div>
+        """
+    else:
+        cliente_html = ''
+
+    # Placeholders del emisor: asegurar que no sean None
+    return motor.renderizar(PLANTILLA_PRESUPUESTO, {
+        'EMISOR_NOMBRE': str(emisor_config.get('nombre', 'ALEPH 70') or 'ALEPH 70'),
+        'EMISOR_DIRECCION': str(emisor_config.get('direccion', '') or ''),
+        'EMISOR_CP': str(emisor_config.get('cp', '') or ''),
+        'EMISOR_CIUDAD': str(emisor_config.get('ciudad', '') or ''),
+        'EMISOR_PROVINCIA': str(emisor_config.get('provincia', '') or ''),
+        'EMISOR_EMAIL': str(emisor_config.get('email', '') or ''),
+        'EMISOR_NIF': str(emisor_config.get('nif', '') or ''),
+        'CLIENTE_HTML': cliente_html,
+        'NUMERO_PRESUPUESTO': presupuesto_dict['numero'],
+        'FECHA_PRESUPUESTO': fecha_formateada,
+        'ESTADO_TEXTO': estado_texto,
+        'FECHA_VALIDEZ': fecha_validez,
+        'DETALLES_HTML': detalles_html,
+        'SUBTOTAL': format_currency_es_two(subtotal),
+        'TOTAL_IVA': format_currency_es_two(total_iva),
+        'TOTAL_FINAL': format_currency_es_two(total_final),
+        # Logo de la empresa desde la sesión, con ruta absoluta del sistema de archivos
+        'logo_src': logo_empresa_sesion()
+    }, preparar_presupuesto)
+
+
 def generar_pdf_presupuesto(id):
     """Genera un PDF profesional del presupuesto"""
     try:
-        from weasyprint import HTML
-        import tempfile
-        import os
-        from datetime import datetime, timedelta
+        import time
+        from motor_plantillas import get_motor_plantillas
         
+        motor = get_motor_plantillas()
+        inicio_consulta = time.perf_counter()
         conn = get_db_connection()
         cursor = conn.cursor()
         
@@ -777,32 +878,7 @@ def generar_pdf_presupuesto(id):
         ''', (id,))
         
         detalles = [dict(row) for row in cursor.fetchall()]
-        
-        # Leer plantilla HTML
-        with open('/var/www/html/frontend/IMPRIMIR_PRESUPUESTO.html', 'r', encoding='utf-8') as f:
-            html_template = f.read()
-        
-        # Formatear fecha
-        try:
-            fecha_obj = datetime.strptime(presupuesto_dict['fecha'], '%Y-%m-%d')
-            fecha_formateada = fecha_obj.strftime('%d/%m/%Y')
-            fecha_validez = (fecha_obj + timedelta(days=30)).strftime('%d/%m/%Y')
-        except Exception as e:
-            logger.error(f"Error: {e}", exc_info=True)
-            fecha_formateada = presupuesto_dict['fecha']
-            fecha_validez = 'N/A'
-        
-        # Estados formateados
-        estados = {
-            'B': 'Borrador',
-            'EN': 'Enviado', 
-            'AP': 'Aceptado',
-            'RJ': 'Rechazado',
-            'CD': 'Caducado',
-            'F': 'Facturada',
-            'T': 'Ticket'
-        }
-        estado_texto = estados.get(presupuesto_dict.get('estado', 'B'), 'Borrador')
+        motor.registrar_etapa('consulta', time.perf_counter() - inicio_consulta)
         
         # Calcular totales
         subtotal = sum(float(d['precio']) * int(d['cantidad']) for d in detalles)
@@ -828,92 +904,12 @@ def generar_pdf_presupuesto(id):
             </tr>
             """
         
-        # Cargar datos del emisor
-        try:
-            import json
-            with open('/var/www/html/emisor_config.json', 'r', encoding='utf-8') as f:
-                emisor_config = json.load(f)
-        except Exception as e:
-            logger.error(f"Error cargando emisor_config.json: {e}", exc_info=True)
-            emisor_config = {
-                'nombre': 'ALEPH 70',
-                'direccion': 'C/ Ejemplo, 123',
-                'cp': '28001',
-                'ciudad': 'Madrid',
-                'provincia': 'Madrid',
-                'email': 'info@aleph70.com',
-                'nif': 'B12345678'
-            }
-        
-        # Reemplazar placeholders del emisor (asegurar que no sean None)
-        html_content = html_template.replace('{{EMISOR_NOMBRE}}', str(emisor_config.get('nombre', 'ALEPH 70') or 'ALEPH 70'))
-        html_content = html_content.replace('{{EMISOR_DIRECCION}}', str(emisor_config.get('direccion', '') or ''))
-        html_content = html_content.replace('{{EMISOR_CP}}', str(emisor_config.get('cp', '') or ''))
-        html_content = html_content.replace('{{EMISOR_CIUDAD}}', str(emisor_config.get('ciudad', '') or ''))
-        html_content = html_content.replace('{{EMISOR_PROVINCIA}}', str(emisor_config.get('provincia', '') or ''))
-        html_content = html_content.replace('{{EMISOR_EMAIL}}', str(emisor_config.get('email', '') or ''))
-        html_content = html_content.replace('{{EMISOR_NIF}}', str(emisor_config.get('nif', '') or ''))
-
-        # Construir bloque de cliente dinámicamente (solo si hay datos)
-        razon = str(presupuesto_dict.get('razonsocial', '') or '')
-        direccion = str(presupuesto_dict.get('direccion', '') or '')
-        poblacion = str(presupuesto_dict.get('poblacion', '') or '')
-        cp = str(presupuesto_dict.get('codigopostal', '') or '')
-        provincia = str(presupuesto_dict.get('provincia', '') or '')
-        telefono = str(presupuesto_dict.get('telf1', '') or '')
-        email = str(presupuesto_dict.get('mail', '') or '')
-        # Obtener identificador (NIF/CIF)
-        identificador = str(presupuesto_dict.get('identificador', '') or presupuesto_dict.get('nif', '') or '')
+        html_content = _renderizar_presupuesto(motor, presupuesto_dict, detalles_html, subtotal, total_iva, total_final)
         
-        hay_cliente = any([razon, direccion, poblacion, cp, provincia, telefono, email, identificador])
-        if hay_cliente:
-            cliente_html = f"""
-        <div class=\"client-info\">
-            <div class=\"info-box\">
-                <div class=\"info-title\">RAZÓN SOCIAL</div>
-                <div style=\"font-weight: bold; font-size: 16px; margin-bottom: 10px;\">{razon}</div>
-                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">IDENTIFICADOR</div>
-                <div style=\"margin-bottom: 8px;\">{identificador}</div>
-                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">DIRECCIÓN</div>
-                <div style=\"margin-bottom: 8px;\">{direccion}</div>
-                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">CP Y LOCALIDAD</div>
-                <div style=\"margin-bottom: 8px;\">{cp} {poblacion}</div>
-                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">PROVINCIA</div>
-                <div style=\"margin-bottom: 8px;\">{provincia}</div>
-            </div>
-        </div>
-        """
-        else:
-            cliente_html = ''
-        html_content = html_content.replace('{{CLIENTE_HTML}}', cliente_html)
-        html_content = html_content.replace('{{NUMERO_PRESUPUESTO}}', presupuesto_dict['numero'])
-        html_content = html_content.replace('{{FECHA_PRESUPUESTO}}', fecha_formateada)
-        html_content = html_content.replace('{{ESTADO_TEXTO}}', estado_texto)
-        html_content = html_content.replace('{{FECHA_VALIDEZ}}', fecha_validez)
-        html_content = html_content.replace('{{DETALLES_HTML}}', detalles_html)
-        html_content = html_content.replace('{{SUBTOTAL}}', format_currency_es_two(subtotal))
-        html_content = html_content.replace('{{TOTAL_IVA}}', format_currency_es_two(total_iva))
-        html_content = html_content.replace('{{TOTAL_FINAL}}', format_currency_es_two(total_final))
-        
-        # Modificar ruta del logo para usar ruta absoluta
-        # Obtener logo de la empresa desde la sesión
-        empresa_logo = session.get('empresa_logo', 'default_header.png')
-        logo_factura = f'/static/logos/{empresa_logo}'
-        # Convertir ruta web a ruta absoluta del sistema de archivos
-        logo_path = logo_factura.replace('/static/logos/', '/var/www/html/static/logos/')
-        html_content = html_content.replace('src="/static/img/logo.png"', f'src="file://{logo_path}"')
-        
-        # Asegurar ruta absoluta del logo y generar PDF
+        # Generar PDF
         pdf_filename = f"presupuesto_{presupuesto_dict['numero']}.pdf"
         temp_pdf_path = f"/tmp/{pdf_filename}"
-        
-        # Obtener logo de la empresa desde la sesión
-        empresa_logo = session.get('empresa_logo', 'default_header.png')
-        logo_factura = f'/static/logos/{empresa_logo}'
-        # Convertir ruta web a ruta absoluta del sistema de archivos
-        logo_path = logo_factura.replace('/static/logos/', '/var/www/html/static/logos/')
-        html_content = html_content.replace('src="/static/img/logo.png"', f'src="file://{logo_path}"')
-        HTML(string=html_content, base_url='/var/www/html').write_pdf(temp_pdf_path)
+        motor.html_a_pdf(html_content, temp_pdf_path, estilos=None)
         
         # Enviar PDF como respuesta
         from flask import send_file
@@ -930,12 +926,13 @@ def generar_pdf_presupuesto(id):
 def enviar_email_presupuesto(id):
     """Envía el presupuesto por correo electrónico"""
     try:
-        from weasyprint import HTML
-        import tempfile
         import os
-        from datetime import datetime, timedelta
+        import time
         from email_utils import enviar_presupuesto_por_email
+        from motor_plantillas import get_motor_plantillas
         
+        motor = get_motor_plantillas()
+        inicio_consulta = time.perf_counter()
         conn = get_db_connection()
         cursor = conn.cursor()
         
@@ -963,32 +960,7 @@ def enviar_email_presupuesto(id):
         ''', (id,))
         
         detalles = [dict(row) for row in cursor.fetchall()]
-        
-        # Generar PDF del presupuesto usando la misma lógica que generar_pdf_presupuesto
-        with open('/var/www/html/frontend/IMPRIMIR_PRESUPUESTO.html', 'r', encoding='utf-8') as f:
-            html_template = f.read()
-        
-        # Formatear fecha
-        try:
-            fecha_obj = datetime.strptime(presupuesto_dict['fecha'], '%Y-%m-%d')
-            fecha_formateada = fecha_obj.strftime('%d/%m/%Y')
-            fecha_validez = (fecha_obj + timedelta(days=30)).strftime('%d/%m/%Y')
-        except Exception as e:
-            logger.error(f"Error: {e}", exc_info=True)
-            fecha_formateada = presupuesto_dict['fecha']
-            fecha_validez = 'N/A'
-        
-        # Estados formateados
-        estados = {
-            'B': 'Borrador',
-            'EN': 'Enviado',
-            'AP': 'Aceptado', 
-            'RJ': 'Rechazado',
-            'CD': 'Caducado',
-            'F': 'Facturada',
-            'T': 'Ticket'
-        }
-        estado_texto = estados.get(presupuesto_dict.get('estado', 'B'), 'Borrador')
+        motor.registrar_etapa('consulta', time.perf_counter() - inicio_consulta)
         
         # Calcular totales
         subtotal = sum(float(d['precio']) * int(d['cantidad']) for d in detalles)
@@ -1017,88 +989,13 @@ def enviar_email_presupuesto(id):
             </tr>
             """
         
-        # Cargar datos del emisor
-        try:
-            import json
-            with open('/var/www/html/emisor_config.json', 'r', encoding='utf-8') as f:
-                emisor_config = json.load(f)
-        except Exception as e:
-            logger.error(f"Error cargando emisor_config.json: {e}", exc_info=True)
-            emisor_config = {
-                'nombre': 'ALEPH 70',
-                'direccion': 'C/ Ejemplo, 123',
-                'cp': '28001',
-                'ciudad': 'Madrid',
-                'provincia': 'Madrid',
-                'email': 'info@aleph70.com',
-                'nif': 'B12345678'
-            }
-
-        # Reemplazar placeholders del emisor (asegurar que no sean None)
-        html_content = html_template.replace('{{EMISOR_NOMBRE}}', str(emisor_config.get('nombre', 'ALEPH 70') or 'ALEPH 70'))
-        html_content = html_content.replace('{{EMISOR_DIRECCION}}', str(emisor_config.get('direccion', '') or ''))
-        html_content = html_content.replace('{{EMISOR_CP}}', str(emisor_config.get('cp', '') or ''))
-        html_content = html_content.replace('{{EMISOR_CIUDAD}}', str(emisor_config.get('ciudad', '') or ''))
-        html_content = html_content.replace('{{EMISOR_PROVINCIA}}', str(emisor_config.get('provincia', '') or ''))
-        html_content = html_content.replace('{{EMISOR_EMAIL}}', str(emisor_config.get('email', '') or ''))
-        html_content = html_content.replace('{{EMISOR_NIF}}', str(emisor_config.get('nif', '') or ''))
-
-        # Construir bloque de cliente dinámicamente (solo si hay datos)
-        razon = str(presupuesto_dict.get('razonsocial', '') or '')
-        direccion = str(presupuesto_dict.get('direccion', '') or '')
-        poblacion = str(presupuesto_dict.get('poblacion', '') or '')
-        cp = str(presupuesto_dict.get('codigopostal', '') or '')
-        provincia = str(presupuesto_dict.get('provincia', '') or '')
-        telefono = str(presupuesto_dict.get('telf1', '') or '')
-        email = str(presupuesto_dict.get('mail', '') or '')
-        # Obtener identificador (NIF/CIF)
-        identificador = str(presupuesto_dict.get('identificador', '') or presupuesto_dict.get('nif', '') or '')
-        
-        hay_cliente = any([razon, direccion, poblacion, cp, provincia, telefono, email, identificador])
-        if hay_cliente:
-            cliente_html = f"""
-        <div class=\"client-info\"> 
-            <div class=\"info-box\">
-                <div class=\"info-title\">RAZÓN SOCIAL</div>
-                <div style=\"font-weight: bold; font-size: 16px; margin-bottom: 10px;\">{razon}</div>
-                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">IDENTIFICADOR</div>
-                <div style=\"margin-bottom: 8px;\">{identificador}</div>
-                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">DIRECCIÓN</div>
-                <div style=\"margin-bottom: 8px;\">{direccion}</div>
-                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">CP Y LOCALIDAD</div>
-                <div style=\"margin-bottom: 8px;\">{cp} {poblacion}</div>
-                <div style=\"color: #666; font-size: 11px; margin-bottom: 3px;\">PROVINCIA</div>
-                <div style=\"margin-bottom: 8px;\">{provincia}</div>
-            </div>
-        </div>
-        """
-        else:
-            cliente_html = ''
-        html_content = html_content.replace('{{CLIENTE_HTML}}', cliente_html)
-
-        # Rellenar datos del documento
-        html_content = html_content.replace('{{NUMERO_PRESUPUESTO}}', presupuesto_dict['numero'])
-        html_content = html_content.replace('{{FECHA_PRESUPUESTO}}', fecha_formateada)
-        html_content = html_content.replace('{{ESTADO_TEXTO}}', estado_texto)
-        html_content = html_content.replace('{{FECHA_VALIDEZ}}', fecha_validez)
-        html_content = html_content.replace('{{DETALLES_HTML}}', detalles_html)
-        html_content = html_content.replace('{{SUBTOTAL}}', format_currency_es_two(subtotal))
-        html_content = html_content.replace('{{TOTAL_IVA}}', format_currency_es_two(total_iva))
-        html_content = html_content.replace('{{TOTAL_FINAL}}', format_currency_es_two(total_final))
-
-        # Asegurar ruta absoluta del logo
-        # Obtener logo de la empresa desde la sesión
-        empresa_logo = session.get('empresa_logo', 'default_header.png')
-        logo_factura = f'/static/logos/{empresa_logo}'
-        # Convertir ruta web a ruta absoluta del sistema de archivos
-        logo_path = logo_factura.replace('/static/logos/', '/var/www/html/static/logos/')
-        html_content = html_content.replace('src="/static/img/logo.png"', f'src="file://{logo_path}"')
+        html_content = _renderizar_presupuesto(motor, presupuesto_dict, detalles_html, subtotal, total_iva, total_final)
 
         # Generar PDF temporal
         pdf_filename = f"presupuesto_{presupuesto_dict['numero']}.pdf"
         temp_pdf_path = f"/tmp/{pdf_filename}"
+        motor.html_a_pdf(html_content, temp_pdf_path, estilos=None)
         
-        HTML(string=html_content, base_url='/var/www/html').write_pdf(temp_pdf_path)
         
         # Preparar email
         asunto = f"Presupuesto {presupuesto_dict['numero']} - {presupuesto_dict['razonsocial']}"
@@ -3,34 +3,34 @@
 Sistema automático de procesamiento de facturas de proveedores por email
 Monitorea un buzón de correo y procesa PDFs de facturas automáticamente
 
-Flujo:
+Flujo (pipeline por etapas de facturas_email_pipeline):
 1. Conecta al buzón IMAP
 2. Busca emails del trimestre actual con asunto "FACTURA" o "F"
-3. Extrae PDFs adjuntos
-4. Procesa con GPT-4 Vision (extracción de datos)
-5. Busca o crea proveedor automáticamente
-6. Guarda factura en base de datos
-7. Guarda PDF en directorio de empresa
-8. Registra en historial
-9. Marca email como procesado (opcional)
+3. Descarga por lotes solo la parte PDF de cada email
+4. Asigna la empresa por la dirección de destino
+5. Descarta los PDFs ya procesados (hash) antes de extraer
+6. Extrae los datos con GPT-4 Vision en un pool de hilos acotado
+7. Busca o crea proveedor, guarda PDF y factura y registra en historial
 """
 
 import imaplib
-import email
-from email.header import decode_header
 import os
 import sys
 import sqlite3
 from datetime import datetime
-from pathlib import Path
 import base64
 import io
 
 # Agregar directorio al path
 sys.path.insert(0, '/var/www/html')
 
+from cache_extracciones import cachear_extraccion
 from logger_config import get_logger
 import facturas_proveedores
+from facturas_email_pipeline import (
+    EnrutadorEmpresas, PipelineFacturasEmail, bd_empresa, extraer_datos_factura_local
+)
+from multiempresa_config import DB_USUARIOS_PATH, FACTURAS_EMAIL_CONFIG, obtener_db_empresa
 
 logger = get_logger(__name__)
 
@@ -40,8 +40,9 @@ EMAIL_PORT = int(os.getenv('EMAIL_IMAP_PORT', '993'))
 EMAIL_USER = os.getenv('SMTP_USERNAME')
 EMAIL_PASSWORD = os.getenv('SMTP_PASSWORD')
 
-# Base de datos
-DB_PATH = '/var/www/html/copisteria.db'
+# Versión del prompt, modelo y post-proceso de extraer_datos_factura_gpt4:
+# cambiarla al modificarlos para no reutilizar resultados cacheados
+PROMPT_VERSION = 'gpt-4-vision-preview/factura_email/1'
 
 
 def conectar_email():
@@ -58,21 +59,24 @@ def conectar_email():
 
 
 def obtener_empresas_activas():
-    """Obtiene lista de empresas activas"""
+    """Empresas activas con su email y la ruta de su BD"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(DB_USUARIOS_PATH)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
         cursor.execute("""
-            SELECT id, codigo, nombre
+            SELECT id, codigo, nombre, email, db_path
             FROM empresas
-            WHERE activo = 1
+            WHERE activa = 1
         """)
         
         empresas = [dict(row) for row in cursor.fetchall()]
         conn.close()
         
+        for empresa in empresas:
+            empresa['db_path'] = obtener_db_empresa(empresa['id']) or empresa['db_path']
+        
         return empresas
         
     except Exception as e:
@@ -80,63 +84,24 @@ def obtener_empresas_activas():
         return []
 
 
-def buscar_emails_facturas(mail):
+def criterio_busqueda():
     """
-    Busca emails del trimestre actual con asunto FACTURA o F
+    Criterio IMAP: emails del trimestre actual con asunto FACTURA o F
     Busca tanto leídos como no leídos
     """
-    try:
-        mail.select('INBOX')
-        
-        # Obtener fechas del trimestre actual
-        trimestre, año, fecha_inicio, fecha_fin = facturas_proveedores.obtener_trimestre_actual()
-        
-        # Formato de fecha para IMAP: DD-MMM-YYYY
-        fecha_desde = fecha_inicio.strftime('%d-%b-%Y')
-        
-        logger.info(f"🔍 Buscando emails del trimestre {trimestre} {año} (desde {fecha_desde})...")
-        
-        # Buscar emails con asunto FACTURA o F desde inicio de trimestre
-        # No filtrar por UNSEEN para procesar todos los del trimestre
-        criterio = f'(SINCE {fecha_desde}) (OR SUBJECT "FACTURA" SUBJECT "F")'
-        
-        status, messages = mail.search(None, criterio)
-        
-        if status != 'OK':
-            logger.warning("No se pudo buscar emails")
-            return []
-        
-        email_ids = messages[0].split() if messages[0] else []
-        logger.info(f"✓ Encontrados {len(email_ids)} email(s) con facturas")
-        
-        return email_ids
-        
-    except Exception as e:
-        logger.error(f"Error buscando emails: {e}")
-        return []
-
-
-def extraer_pdf_email(msg):
-    """Extrae el PDF adjunto de un email"""
-    try:
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            filename = part.get_filename()
-            
-            if content_type == 'application/pdf' or (filename and filename.lower().endswith('.pdf')):
-                pdf_bytes = part.get_payload(decode=True)
-                
-                if pdf_bytes:
-                    logger.info(f"✓ PDF encontrado: {filename} ({len(pdf_bytes)/1024:.1f} KB)")
-                    return pdf_bytes, filename
-        
-        return None, None
-        
-    except Exception as e:
-        logger.error(f"Error extrayendo PDF: {e}")
-        return None, None
+    # Obtener fechas del trimestre actual
+    trimestre, año, fecha_inicio, fecha_fin = facturas_proveedores.obtener_trimestre_actual()
+    
+    # Formato de fecha para IMAP: DD-MMM-YYYY
+    fecha_desde = fecha_inicio.strftime('%d-%b-%Y')
+    
+    logger.info(f"🔍 Buscando emails del trimestre {trimestre} {año} (desde {fecha_desde})...")
+    
+    # No filtrar por UNSEEN para procesar todos los del trimestre
+    return f'(SINCE {fecha_desde}) (OR SUBJECT "FACTURA" SUBJECT "F")'
 
 
+@cachear_extraccion('factura_email', PROMPT_VERSION)
 def extraer_datos_factura_gpt4(pdf_bytes):
     """
     Extrae datos de la factura usando GPT-4 Vision
@@ -240,80 +205,83 @@ IMPORTANTE:
         return None
 
 
-def procesar_email_factura(mail, email_id, empresa_id, empresa_codigo):
-    """Procesa un email individual con factura"""
+def guardar_pdf_factura(pdf_bytes, empresa_codigo, proveedor_nombre, numero_factura):
+    """Guarda el PDF en el directorio correspondiente"""
     try:
-        # Obtener email
-        status, msg_data = mail.fetch(email_id, '(RFC822)')
-        
-        if status != 'OK':
-            logger.error(f"No se pudo obtener email {email_id}")
-            return False
-        
-        raw_email = msg_data[0][1]
-        msg = email.message_from_bytes(raw_email)
-        
-        # Obtener remitente
-        remitente = msg.get('From', '')
-        asunto = msg.get('Subject', '')
+        # Obtener trimestre actual
+        hoy = datetime.now()
+        año = hoy.year
+        trimestre = f"Q{(hoy.month - 1) // 3 + 1}"
         
-        logger.info(f"\n📧 Procesando email de: {remitente}")
-        logger.info(f"   Asunto: {asunto}")
+        # Obtener directorio
+        directorio = facturas_proveedores.obtener_directorio_facturas(empresa_codigo, año, trimestre)
         
-        # Extraer PDF
-        pdf_bytes, pdf_nombre = extraer_pdf_email(msg)
+        # Sanitizar nombre de archivo
+        proveedor_safe = proveedor_nombre.replace(' ', '_').replace('/', '_')[:30]
+        factura_safe = numero_factura.replace('/', '_').replace(' ', '_')[:20]
         
-        if not pdf_bytes:
-            logger.warning("⚠️ No se encontró PDF en el email")
-            return False
+        # Nombre del archivo: PROVEEDOR_FACTURA_TIMESTAMP.pdf
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        nombre_archivo = f"{proveedor_safe}_{factura_safe}_{timestamp}.pdf"
         
-        # Verificar si ya fue procesado (por hash)
-        pdf_hash = facturas_proveedores.calcular_hash_pdf(pdf_bytes)
+        # Ruta completa
+        ruta_completa = directorio / nombre_archivo
         
-        if facturas_proveedores.factura_ya_procesada(pdf_hash, empresa_id):
-            logger.info("⏭️ Factura ya procesada anteriormente (hash duplicado)")
-            return False
+        # Guardar archivo
+        with open(ruta_completa, 'wb') as f:
+            f.write(pdf_bytes)
         
-        # Extraer datos con GPT-4
-        datos_factura = extraer_datos_factura_gpt4(pdf_bytes)
+        # Retornar ruta relativa (para BD)
+        ruta_relativa = str(ruta_completa).replace('/var/www/html/', '')
         
-        if not datos_factura:
-            logger.error("❌ No se pudieron extraer datos de la factura")
-            return False
+        logger.info(f"✓ PDF guardado: {ruta_relativa}")
         
-        # Validar datos mínimos
-        if not datos_factura.get('proveedor_nif') or not datos_factura.get('numero_factura'):
-            logger.error("❌ Faltan datos obligatorios (NIF o número de factura)")
-            return False
+        return ruta_relativa
         
+    except Exception as e:
+        logger.error(f"Error guardando PDF: {e}")
+        raise
+
+
+def factura_ya_procesada(empresa, pdf_hash):
+    """Etapa de deduplicación: hash contra la BD de la empresa"""
+    with bd_empresa(empresa.get('db_path')):
+        return facturas_proveedores.factura_ya_procesada(pdf_hash, empresa['id'])
+
+
+def guardar_factura(empresa, mensaje, pdf_hash, datos_factura):
+    """Etapa de guardado: proveedor, PDF, factura e historial en la BD de la empresa"""
+    empresa_id = empresa['id']
+    
+    logger.info(f"\n📧 Guardando factura del email de: {mensaje.remitente} ({empresa['codigo']})")
+    logger.info(f"   Asunto: {mensaje.asunto}")
+    
+    with bd_empresa(empresa.get('db_path')):
         # Buscar o crear proveedor
-        logger.info("🔍 Buscando proveedor...")
         proveedor_id = facturas_proveedores.obtener_o_crear_proveedor(
             nif=datos_factura.get('proveedor_nif'),
             nombre=datos_factura.get('proveedor_nombre', 'PROVEEDOR DESCONOCIDO'),
             empresa_id=empresa_id,
             datos_adicionales=datos_factura,
-            email_origen=remitente
+            email_origen=mensaje.remitente
         )
         
         # Guardar PDF en directorio
-        logger.info("💾 Guardando PDF...")
         ruta_pdf = guardar_pdf_factura(
-            pdf_bytes,
-            empresa_codigo,
-            datos_factura.get('proveedor_nombre', 'DESCONOCIDO'),
-            datos_factura.get('numero_factura', 'SN')
+            mensaje.pdf_bytes,
+            empresa['codigo'],
+            datos_factura.get('proveedor_nombre') or 'DESCONOCIDO',
+            datos_factura.get('numero_factura') or 'SN'
         )
         
         # Guardar factura en BD
-        logger.info("💾 Guardando factura en base de datos...")
         factura_id = facturas_proveedores.guardar_factura_bd(
             empresa_id=empresa_id,
             proveedor_id=proveedor_id,
             datos_factura=datos_factura,
             ruta_pdf=ruta_pdf,
             pdf_hash=pdf_hash,
-            email_origen=remitente,
+            email_origen=mensaje.remitente,
             usuario='sistema_email'
         )
         
@@ -324,56 +292,39 @@ def procesar_email_factura(mail, email_id, empresa_id, empresa_codigo):
             'sistema_email',
             datos_nuevos=datos_factura
         )
-        
-        logger.info(f"🎉 Factura procesada exitosamente (ID: {factura_id})")
-        
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Error procesando email: {e}", exc_info=True)
-        return False
+    
+    logger.info(f"🎉 Factura procesada exitosamente (ID: {factura_id})")
+    return factura_id
 
 
-def guardar_pdf_factura(pdf_bytes, empresa_codigo, proveedor_nombre, numero_factura):
-    """Guarda el PDF en el directorio correspondiente"""
-    try:
-        # Obtener trimestre actual
-        hoy = datetime.now()
-        año = hoy.year
-        trimestre = f"Q{(hoy.month - 1) // 3 + 1}"
-        
-        # Obtener directorio
-        directorio = facturas_proveedores.obtener_directorio_facturas(empresa_codigo, año, trimestre)
-        
-        # Sanitizar nombre de archivo
-        proveedor_safe = proveedor_nombre.replace(' ', '_').replace('/', '_')[:30]
-        factura_safe = numero_factura.replace('/', '_').replace(' ', '_')[:20]
-        
-        # Nombre del archivo: PROVEEDOR_FACTURA_TIMESTAMP.pdf
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        nombre_archivo = f"{proveedor_safe}_{factura_safe}_{timestamp}.pdf"
-        
-        # Ruta completa
-        ruta_completa = directorio / nombre_archivo
-        
-        # Guardar archivo
-        with open(ruta_completa, 'wb') as f:
-            f.write(pdf_bytes)
-        
-        # Retornar ruta relativa (para BD)
-        ruta_relativa = str(ruta_completa).replace('/var/www/html/', '')
-        
-        logger.info(f"✓ PDF guardado: {ruta_relativa}")
-        
-        return ruta_relativa
-        
-    except Exception as e:
-        logger.error(f"Error guardando PDF: {e}")
-        raise
+def obtener_extractor():
+    """Extractor configurado: GPT-4 Vision o el local de pruebas"""
+    if FACTURAS_EMAIL_CONFIG['EXTRACTOR'] == 'local':
+        logger.warning("⚠️ Usando el extractor local de pruebas (sin GPT-4)")
+        return extraer_datos_factura_local
+    return extraer_datos_factura_gpt4
+
+
+def mostrar_resumen(resumen):
+    """Resumen del procesamiento con el rendimiento de cada etapa"""
+    logger.info("\n" + "=" * 70)
+    logger.info("📊 RESUMEN DEL PROCESAMIENTO")
+    logger.info("=" * 70)
+    for nombre, etapa in resumen['etapas'].items():
+        ritmo = f"{etapa['por_segundo']}/s" if etapa['por_segundo'] is not None else '-'
+        logger.info(f"   {nombre:<14} entradas {etapa['entradas']:>5}  salidas {etapa['salidas']:>5}  "
+                    f"descartes {etapa['descartes']:>5}  errores {etapa['errores']:>5}  "
+                    f"{etapa['segundos']:>8.2f} s  {ritmo}")
+    logger.info(f"✅ Facturas procesadas: {resumen['etapas']['guardado']['salidas']} {resumen['por_empresa']}")
+    logger.info(f"📧 Total emails revisados: {resumen['mensajes']} "
+                f"(sin PDF: {resumen['sin_pdf']}, sin empresa: {resumen['sin_empresa']})")
+    logger.info(f"📦 Descargado {resumen['bytes_descargados'] / 1024:.1f} KB, "
+                f"omitido {resumen['bytes_omitidos'] / 1024:.1f} KB; total {resumen['segundos']:.2f} s")
+    logger.info("=" * 70)
 
 
 def procesar_facturas_email():
-    """Proceso principal"""
+    """Proceso principal; devuelve el resumen del pipeline o None si no se ejecuta"""
     logger.info("=" * 70)
     logger.info("🚀 INICIANDO PROCESAMIENTO DE FACTURAS POR EMAIL")
     logger.info("=" * 70)
@@ -383,13 +334,13 @@ def procesar_facturas_email():
     if not EMAIL_USER or not EMAIL_PASSWORD:
         logger.error("❌ Faltan credenciales de email en variables de entorno")
         logger.error("   Configurar: SMTP_USERNAME y SMTP_PASSWORD")
-        return
+        return None
     
     # Conectar al email
     mail = conectar_email()
     if not mail:
         logger.error("❌ No se pudo conectar al buzón")
-        return
+        return None
     
     try:
         # Obtener empresas activas
@@ -398,47 +349,24 @@ def procesar_facturas_email():
         
         if not empresas:
             logger.warning("⚠️ No hay empresas activas para procesar")
-            return
-        
-        # Buscar emails con facturas
-        email_ids = buscar_emails_facturas(mail)
-        
-        if not email_ids:
-            logger.info("📭 No hay emails con facturas para procesar")
-            return
-        
-        # Procesar cada email para cada empresa
-        # (En un sistema real, deberías identificar a qué empresa pertenece cada email)
-        # Por ahora, procesamos para la primera empresa activa
-        empresa = empresas[0]
-        empresa_id = empresa['id']
-        empresa_codigo = empresa['codigo']
-        
-        logger.info(f"\n🏢 Procesando para empresa: {empresa['nombre']} ({empresa_codigo})")
-        
-        procesados = 0
-        errores = 0
-        
-        for email_id in email_ids:
-            try:
-                if procesar_email_factura(mail, email_id, empresa_id, empresa_codigo):
-                    procesados += 1
-                else:
-                    errores += 1
-            except Exception as e:
-                logger.error(f"Error procesando email {email_id}: {e}")
-                errores += 1
-        
-        logger.info("\n" + "=" * 70)
-        logger.info("📊 RESUMEN DEL PROCESAMIENTO")
-        logger.info("=" * 70)
-        logger.info(f"✅ Facturas procesadas: {procesados}")
-        logger.info(f"❌ Errores: {errores}")
-        logger.info(f"📧 Total emails revisados: {len(email_ids)}")
-        logger.info("=" * 70)
+            return None
+        
+        mail.select('INBOX')
+        pipeline = PipelineFacturasEmail(
+            mail,
+            EnrutadorEmpresas(empresas, FACTURAS_EMAIL_CONFIG['EMPRESA_POR_DEFECTO']),
+            extraer=obtener_extractor(),
+            ya_procesada=factura_ya_procesada,
+            guardar=guardar_factura,
+            calcular_hash=facturas_proveedores.calcular_hash_pdf
+        )
+        resumen = pipeline.ejecutar(criterio_busqueda())
+        mostrar_resumen(resumen)
+        return resumen
         
     except Exception as e:
         logger.error(f"❌ Error en el proceso: {e}", exc_info=True)
+        return None
         
     finally:
         # Cerrar conexión
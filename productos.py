@@ -2,7 +2,7 @@ import sqlite3
 from functools import lru_cache
 
 from constantes import *
-from db_utils import get_db_connection, redondear_importe
+from db_utils import get_db_connection, get_db_write_transaction, redondear_importe
 from flask import jsonify, request
 from logger_config import get_productos_logger
 
@@ -47,8 +47,13 @@ def aplicar_franjas_a_todos(ancho: int = 10, max_unidades: int = 500, descuento_
     - Descuento máximo `descuento_max` (por defecto 60%).
     - Garantiza que el precio total (con IVA) sea estrictamente decreciente entre franjas.
 
+    Las franjas se generan en lote y se guardan en una sola transacción,
+    reescribiendo solo los productos cuyas franjas cambian.
+
     Retorna dict con resumen.
     """
+    from productos_franjas_lote import escribir_franjas_lote, generar_franjas_lote
+
     if ancho < 1:
         ancho = 10
     if max_unidades < ancho:
@@ -65,8 +70,6 @@ def aplicar_franjas_a_todos(ancho: int = 10, max_unidades: int = 500, descuento_
         cur.execute('SELECT id, subtotal, impuestos FROM productos ORDER BY id ASC')
         productos_rows = cur.fetchall()
 
-        total = 0
-        afectados = 0
         errores = []
 
         # Calcular número de bandas necesarias
@@ -78,33 +81,40 @@ def aplicar_franjas_a_todos(ancho: int = 10, max_unidades: int = 500, descuento_
         # Plan de descuentos lineal desde 0 hasta descuento_max en num_bandas-1 pasos
         descuento_inicial = 0.0
         incremento = (float(descuento_max) - descuento_inicial) / max(1, (num_bandas - 1))
+        franjas_cfg = {
+            'bandas': num_bandas,
+            'ancho': ancho,
+            'descuento_inicial': descuento_inicial,
+            'incremento': incremento
+        }
 
         ensure_tabla_descuentos_bandas()
 
+        ids, subtotales, ivas = [], [], []
         for row in productos_rows:
             try:
                 producto_id = int(row['id'] if isinstance(row, sqlite3.Row) else row[0])
                 base_subtotal = float(row['subtotal'] if isinstance(row, sqlite3.Row) else row[1])
                 iva_pct = float(row['impuestos'] if isinstance(row, sqlite3.Row) else row[2])
-
-                franjas_cfg = {
-                    'bandas': num_bandas,
-                    'ancho': ancho,
-                    'descuento_inicial': descuento_inicial,
-                    'incremento': incremento
-                }
-                franjas = _generar_franjas_automaticas(base_subtotal, iva_pct, franjas_cfg)
-                reemplazar_franjas_descuento_producto(producto_id, franjas)
-                afectados += 1
             except Exception as e_prod:
                 errores.append({'producto_id': row['id'] if isinstance(row, sqlite3.Row) else row[0], 'error': str(e_prod)})
-            finally:
-                total += 1
+                continue
+            ids.append(producto_id)
+            subtotales.append(base_subtotal)
+            ivas.append(iva_pct)
+
+        franjas = generar_franjas_lote(subtotales, ivas, franjas_cfg)
+        with get_db_write_transaction() as conn_escritura:
+            diff = escribir_franjas_lote(conn_escritura, dict(zip(ids, franjas)))
 
         return {
             'success': True,
-            'procesados': total,
-            'actualizados': afectados,
+            'procesados': len(productos_rows),
+            'actualizados': len(diff['actualizados']),
+            'sin_cambios': diff['sin_cambios'],
+            'productos_actualizados': diff['actualizados'],
+            'franjas_eliminadas': diff['franjas_eliminadas'],
+            'franjas_insertadas': diff['franjas_insertadas'],
             'errores': errores
         }
     except Exception as e:
@@ -113,13 +123,14 @@ def aplicar_franjas_a_todos(ancho: int = 10, max_unidades: int = 500, descuento_
         if 'conn' in locals():
             conn.close()
 
-def _generar_franjas_automaticas(base_subtotal: float, iva_pct: float, franjas_cfg: dict):
+def _normalizar_cfg_franjas(franjas_cfg: dict):
     """
-    Genera las franjas automáticas respetando parámetros enviados por el frontend.
-    franjas_cfg keys esperadas: bandas, ancho, descuento_inicial, incremento
-    Devuelve lista de dicts [{min, max, descuento}]
+    Normaliza la configuración de franjas (bandas, ancho, descuento_inicial,
+    incremento) a los límites admitidos. Valores en (0, 1] se interpretan como
+    fracción y se pasan a porcentaje.
+
+    Retorna tupla (num_bandas, ancho, desc_inicial, incremento)
     """
-    # Normalización de parámetros
     bandas_val = franjas_cfg.get('bandas')
     num_bandas = int(bandas_val) if bandas_val is not None else 3
     ancho_val = franjas_cfg.get('ancho')
@@ -128,7 +139,7 @@ def _generar_franjas_automaticas(base_subtotal: float, iva_pct: float, franjas_c
     inc_val = franjas_cfg.get('incremento')
     desc_inicial = float(desc_ini_val) if desc_ini_val is not None else 5.0
     incremento = float(inc_val) if inc_val is not None else 5.0
-    
+
     logger.debug(f"Parámetros recibidos: bandas={bandas_val}, ancho={ancho_val}, desc_inicial={desc_ini_val}, incremento={inc_val}")
     logger.debug(f"Valores normalizados: num_bandas={num_bandas}, ancho={ancho}, desc_inicial={desc_inicial}, incremento={incremento}")
     if 0.0 < desc_inicial <= 1.0:
@@ -142,6 +153,16 @@ def _generar_franjas_automaticas(base_subtotal: float, iva_pct: float, franjas_c
     if num_bandas < 1: num_bandas = 1
     if num_bandas > 60: num_bandas = 60
     if ancho < 1: ancho = 1
+    return num_bandas, ancho, desc_inicial, incremento
+
+
+def _generar_franjas_automaticas(base_subtotal: float, iva_pct: float, franjas_cfg: dict):
+    """
+    Genera las franjas automáticas respetando parámetros enviados por el frontend.
+    franjas_cfg keys esperadas: bandas, ancho, descuento_inicial, incremento
+    Devuelve lista de dicts [{min, max, descuento}]
+    """
+    num_bandas, ancho, desc_inicial, incremento = _normalizar_cfg_franjas(franjas_cfg)
 
     def precio_con_iva_por_descuento(pct_desc: float) -> float:
         aplicado = max(0.0, base_subtotal * (1.0 - max(0.0, min(60.0, pct_desc)) / 100.0))
@@ -496,6 +517,34 @@ def obtener_franjas_descuento_por_producto(producto_id):
             conn.close()
 
 
+def _fila_franja(producto_id, fr):
+    """
+    Valida una franja {min, max, descuento} y la convierte en la fila que se
+    guarda: (min_cantidad, max_cantidad, porcentaje_descuento) con el
+    descuento limitado a [0, 60] y redondeado a 6 decimales.
+    """
+    min_c = int(fr.get('min', 0))
+    max_c = int(fr.get('max', 0))
+    try:
+        desc = float(fr.get('descuento', 0))
+    except Exception as _e:
+        logger.warning(f"Valor de descuento no numérico para producto {producto_id}, franja {fr}: {_e}. Se usará 0.0")
+        desc = 0.0
+    if min_c <= 0 or max_c <= 0 or max_c < min_c:
+        raise ValueError(f"Franja inválida: {fr}")
+    # Limitar rango de porcentaje a [0, 60]
+    clamped_desc = desc
+    if clamped_desc < 0:
+        clamped_desc = 0.0
+    if clamped_desc > 60.0:
+        clamped_desc = 60.0
+    # Redondeo a 6 decimales para consistencia de almacenamiento
+    clamped_desc = round(float(clamped_desc), 6)
+    if clamped_desc != desc:
+        logger.debug(f"Clamp aplicado producto {producto_id}: desc_original={desc} -> desc_clamp={clamped_desc}")
+    return min_c, max_c, clamped_desc
+
+
 def reemplazar_franjas_descuento_producto(producto_id, franjas):
     """
     Reemplaza atómicamente todas las franjas del producto por las recibidas.
@@ -507,30 +556,7 @@ def reemplazar_franjas_descuento_producto(producto_id, franjas):
         conn.execute('BEGIN IMMEDIATE')
         cur.execute('DELETE FROM descuento_producto_franja WHERE producto_id = ?', (producto_id,))
         for fr in franjas:
-            min_c = int(fr.get('min', 0))
-            max_c = int(fr.get('max', 0))
-            # Registrar valores originales recibidos
-            try:
-                original_desc = fr.get('descuento', 0)
-                desc = float(original_desc)
-            except Exception as _e:
-                logger.warning(f"Valor de descuento no numérico para producto {producto_id}, franja {fr}: {_e}. Se usará 0.0")
-                desc = 0.0
-                original_desc = original_desc if 'original_desc' in locals() else None
-            if min_c <= 0 or max_c <= 0 or max_c < min_c:
-                raise ValueError(f"Franja inválida: {fr}")
-            # Limitar rango de porcentaje a [0, 60]
-            clamped_desc = desc
-            if clamped_desc < 0:
-                clamped_desc = 0.0
-            if clamped_desc > 60.0:
-                clamped_desc = 60.0
-            # Redondeo a 6 decimales para consistencia de almacenamiento
-            clamped_desc = round(float(clamped_desc), 6)
-            if clamped_desc != desc:
-                logger.debug(f"Clamp aplicado producto {producto_id}: desc_original={desc} -> desc_clamp={clamped_desc}")
-            else:
-                logger.debug(f"Descuento dentro de rango producto {producto_id}: desc={desc}")
+            min_c, max_c, clamped_desc = _fila_franja(producto_id, fr)
             cur.execute(
                 'INSERT INTO descuento_producto_franja (producto_id, min_cantidad, max_cantidad, porcentaje_descuento) VALUES (?,?,?,?)',
                 (producto_id, min_c, max_c, clamped_desc)
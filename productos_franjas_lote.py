@@ -0,0 +1,174 @@
+"""
+Generación y escritura en lote de franjas de descuento por cantidad.
+
+generar_franjas_lote reproduce exactamente productos._generar_franjas_automaticas
+para muchos productos a la vez: recorre las bandas una sola vez y calcula los
+precios de todos los productos con arrays de NumPy. escribir_franjas_lote
+compara con las franjas guardadas y solo reescribe los productos que cambian,
+en una única transacción.
+"""
+import numpy as np
+
+from logger_config import get_productos_logger
+from productos import _fila_franja, _generar_franjas_automaticas, _normalizar_cfg_franjas
+
+logger = get_productos_logger()
+
+# A partir de estas filas insertadas compensa quitar el índice secundario y
+# recrearlo al final (el índice UNIQUE sigue sirviendo los DELETE por producto)
+UMBRAL_RECREAR_INDICE = 5000
+
+# Paso del microajuste de descuento, como en el generador por producto
+PASO_MICROAJUSTE = 0.0001
+
+
+def _precios(subtotales, factores_iva, pct):
+    """Precio con IVA de cada producto con el descuento pct (mismo orden de operaciones que el generador)"""
+    aplicado = np.maximum(0.0, subtotales * (1.0 - np.maximum(0.0, np.minimum(60.0, pct)) / 100.0))
+    return aplicado * factores_iva
+
+
+def generar_franjas_lote(subtotales, ivas, franjas_cfg: dict):
+    """
+    Genera las franjas automáticas de muchos productos a la vez.
+
+    Args:
+        subtotales: Secuencia de subtotales (sin IVA) de los productos
+        ivas: Secuencia de porcentajes de IVA, en el mismo orden
+        franjas_cfg: Configuración común (bandas, ancho, descuento_inicial, incremento)
+
+    Returns:
+        list: Por producto, lista de dicts [{min, max, descuento}] idéntica a la de
+        _generar_franjas_automaticas(subtotal, iva, franjas_cfg)
+    """
+    subtotales = np.asarray(subtotales, dtype=np.float64)
+    ivas = np.asarray(ivas, dtype=np.float64)
+    total = len(subtotales)
+    if total == 0:
+        return []
+
+    num_bandas, ancho, desc_inicial, incremento = _normalizar_cfg_franjas(franjas_cfg)
+    factores_iva = 1.0 + np.maximum(0.0, ivas) / 100.0
+    ultimo_max = 1 + ancho * num_bandas - 1
+
+    # El generador por producto fusiona en cuanto el precio anterior es 0; eso solo
+    # puede pasar con precios no positivos, que se calculan con él fila a fila
+    regulares = (np.isfinite(subtotales) & np.isfinite(ivas)
+                 & (_precios(subtotales, factores_iva, np.full(total, 60.0)) > 0))
+
+    descuentos = np.zeros((total, num_bandas), dtype=np.float64)
+    num_franjas = np.zeros(total, dtype=np.int64)
+    activos = regulares.copy()
+    precio_anterior = np.zeros(total, dtype=np.float64)
+    pct_anterior = np.zeros(total, dtype=np.float64)
+
+    for i in range(num_bandas):
+        if not activos.any():
+            break
+        pct_banda = 0.0 if i == 0 else round(float(min(60.0, max(0.0, desc_inicial + (i - 1) * incremento))), 5)
+
+        # Alcanzar el 60% antes de la última banda fusiona el resto
+        if pct_banda >= 60.0 and i < num_bandas - 1:
+            break
+
+        pct = np.full(total, pct_banda)
+        precio = _precios(subtotales, factores_iva, pct)
+        descuentos[activos, i] = pct_banda
+        ajustar = np.flatnonzero(activos & (precio >= precio_anterior)) if i > 0 else np.array([], dtype=np.int64)
+        if len(ajustar):
+            # Microajuste dentro del tope del plan para bajar al menos 0,001 €
+            tope = min(60.0, max(0.0, desc_inicial + i * incremento))
+            objetivo = np.array([max(0.0, round(p - 0.001, 3)) for p in precio_anterior[ajustar].tolist()])
+            base_con_iva = subtotales[ajustar] * factores_iva[ajustar]
+            pct_necesario = (1.0 - (objetivo / base_con_iva)) * 100.0
+            pct_objetivo = np.minimum(tope, np.maximum(pct_anterior[ajustar], pct_necesario))
+            pct_aj = pct[ajustar]
+            precio_aj = precio[ajustar]
+            pendientes = (precio_aj >= precio_anterior[ajustar]) & (pct_aj < pct_objetivo)
+            guard = 0
+            while pendientes.any() and guard < 100000:
+                pct_aj = np.where(pendientes, np.minimum(pct_objetivo, pct_aj + PASO_MICROAJUSTE), pct_aj)
+                precio_aj = np.where(pendientes, _precios(subtotales[ajustar], factores_iva[ajustar], pct_aj), precio_aj)
+                pendientes = (precio_aj >= precio_anterior[ajustar]) & (pct_aj < pct_objetivo)
+                guard += 1
+            pct[ajustar] = pct_aj
+            precio[ajustar] = precio_aj
+
+            # Sin margen para bajar sin superar el tope: se fusiona el resto de bandas
+            sin_margen = ajustar[precio_aj >= precio_anterior[ajustar]]
+            activos[sin_margen] = False
+            ajustados = ajustar[precio_aj < precio_anterior[ajustar]]
+            descuentos[ajustados, i] = [round(p, 5) for p in pct[ajustados].tolist()]
+
+        num_franjas[activos] = i + 1
+        precio_anterior = np.where(activos, precio, precio_anterior)
+        pct_anterior = np.where(activos, np.maximum(pct_anterior, pct), pct_anterior)
+
+    resultado = []
+    for fila in range(total):
+        if not regulares[fila]:
+            resultado.append(_generar_franjas_automaticas(float(subtotales[fila]), float(ivas[fila]), franjas_cfg))
+            continue
+        franjas = [
+            {'min': 1 + k * ancho, 'max': k * ancho + ancho, 'descuento': valor}
+            for k, valor in enumerate(descuentos[fila, :num_franjas[fila]].tolist())
+        ]
+        # La última franja (tras fusionar o no) siempre llega hasta el máximo
+        franjas[-1]['max'] = ultimo_max
+        resultado.append(franjas)
+    return resultado
+
+
+def escribir_franjas_lote(conn, franjas_por_producto: dict):
+    """
+    Guarda las franjas de muchos productos dentro de la transacción abierta en conn,
+    reescribiendo solo los productos cuyas franjas cambian.
+
+    Args:
+        conn: Conexión con la transacción de escritura ya iniciada
+        franjas_por_producto: {producto_id: [{min, max, descuento}]}
+
+    Returns:
+        dict: {'actualizados': [producto_id], 'sin_cambios', 'franjas_eliminadas', 'franjas_insertadas'}
+    """
+    nuevas = {
+        producto_id: [_fila_franja(producto_id, fr) for fr in franjas]
+        for producto_id, franjas in franjas_por_producto.items()
+    }
+
+    actuales = {}
+    for producto_id, min_c, max_c, desc in conn.execute(
+        'SELECT producto_id, min_cantidad, max_cantidad, porcentaje_descuento '
+        'FROM descuento_producto_franja ORDER BY producto_id, min_cantidad, max_cantidad'
+    ):
+        actuales.setdefault(producto_id, []).append((min_c, max_c, desc))
+
+    actualizados = sorted(pid for pid, filas in nuevas.items() if actuales.get(pid, []) != sorted(filas))
+    eliminadas = sum(len(actuales.get(pid, [])) for pid in actualizados)
+    insertar = [(pid, min_c, max_c, desc) for pid in actualizados for min_c, max_c, desc in nuevas[pid]]
+
+    if actualizados:
+        recrear_indice = len(insertar) >= UMBRAL_RECREAR_INDICE
+        if recrear_indice:
+            conn.execute('DROP INDEX IF EXISTS idx_desc_franja_producto')
+        conn.executemany('DELETE FROM descuento_producto_franja WHERE producto_id = ?',
+                         [(pid,) for pid in actualizados])
+        conn.executemany(
+            'INSERT INTO descuento_producto_franja (producto_id, min_cantidad, max_cantidad, porcentaje_descuento) '
+            'VALUES (?,?,?,?)',
+            insertar
+        )
+        if recrear_indice:
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_desc_franja_producto '
+                'ON descuento_producto_franja (producto_id, min_cantidad, max_cantidad)'
+            )
+
+    logger.info(f"[FRANJAS] Lote: {len(actualizados)} productos reescritos, "
+                f"{len(nuevas) - len(actualizados)} sin cambios, {len(insertar)} franjas insertadas")
+    return {
+        'actualizados': actualizados,
+        'sin_cambios': len(nuevas) - len(actualizados),
+        'franjas_eliminadas': eliminadas,
+        'franjas_insertadas': len(insertar)
+    }
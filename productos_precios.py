@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ÍNDICE DE PRECIOS POR CANTIDAD
+==============================
+Precio de una línea de ticket o factura según las franjas de descuento del
+producto (descuento_producto_franja), sin consultar la BD en cada línea.
+
+- Por proceso y por empresa se guarda, para cada producto ya consultado,
+  su subtotal, su IVA y los límites de sus franjas ordenados; la franja de
+  una cantidad se busca con bisect
+- Los productos que faltan se cargan de una vez para toda la cesta
+- Altas, cambios y bajas de productos o franjas (crear_producto,
+  actualizar_producto, regenerar_franjas_producto, scripts u otros procesos)
+  incrementan su versión en data_version con triggers, igual que en la cache
+  de estadísticas; al cambiar la versión se descarta el índice de esa empresa
+- Misma regla que el TPV: la franja que contiene la cantidad, la última si
+  la cantidad la supera y sin descuento si no cae en ninguna
+- Lo usan el precio de línea del TPV y de facturas (/api/productos/precios)
+  y la consulta de franjas de un producto (franjas_descuento)
+"""
+
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache_estadisticas import instalar_version_datos, obtener_version_datos
+from db_utils import get_db_connection
+from logger_config import get_logger
+from multiempresa_config import PRECIOS_PRODUCTOS_CONFIG
+
+logger = get_logger(__name__)
+
+# Tablas cuyas escrituras invalidan el índice
+TABLAS_PRECIOS = ('descuento_producto_franja', 'productos')
+
+
+@dataclass(frozen=True)
+class PrecioProducto:
+    """Subtotal, IVA y franjas (ordenadas por mínimo) de un producto"""
+    subtotal: float
+    impuestos: float
+    minimos: Tuple[int, ...]
+    maximos: Tuple[int, ...]
+    descuentos: Tuple[float, ...]
+
+    def franja(self, cantidad: float) -> Optional[int]:
+        """Índice de la franja que aplica a la cantidad, o None"""
+        if not self.minimos:
+            return None
+        indice = bisect_right(self.minimos, cantidad) - 1
+        if indice >= 0 and cantidad <= self.maximos[indice]:
+            return indice
+        if cantidad > self.maximos[-1]:
+            return len(self.maximos) - 1
+        return None
+
+
+def calcular_linea(producto_id: int, precio: PrecioProducto, cantidad: float) -> Dict[str, Any]:
+    """Precio unitario con descuento e importes de una línea (redondeo como el TPV)"""
+    indice = precio.franja(cantidad)
+    descuento = precio.descuentos[indice] if indice is not None else 0.0
+    precio_unitario = precio.subtotal * (100 - descuento) / 100
+    subtotal = precio_unitario * cantidad
+    iva = round(subtotal * (precio.impuestos / 100), 2)
+    return {
+        'producto_id': producto_id,
+        'cantidad': cantidad,
+        'precio_base': precio.subtotal,
+        'descuento': descuento,
+        'franja': {'min': precio.minimos[indice], 'max': precio.maximos[indice]} if indice is not None else None,
+        'precio_unitario': round(precio_unitario, 5),
+        'impuestos': precio.impuestos,
+        'subtotal': round(subtotal, 2),
+        'iva': iva,
+        'total': round(subtotal + iva, 2)
+    }
+
+
+def _cargar_productos(conn, producto_ids) -> Dict[int, PrecioProducto]:
+    """Subtotal, IVA y franjas de los productos indicados en dos consultas"""
+    marcas = ','.join('?' * len(producto_ids))
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT id, subtotal, impuestos FROM productos WHERE id IN ({marcas})', producto_ids)
+    productos = {fila[0]: (float(fila[1] or 0), float(fila[2] or 0)) for fila in cursor.fetchall()}
+
+    franjas = {producto_id: ([], [], []) for producto_id in productos}
+    cursor.execute(f'''
+        SELECT producto_id, min_cantidad, max_cantidad, porcentaje_descuento
+        FROM descuento_producto_franja
+        WHERE producto_id IN ({marcas})
+        ORDER BY producto_id, min_cantidad, max_cantidad
+    ''', producto_ids)
+    for producto_id, minimo, maximo, descuento in cursor.fetchall():
+        if producto_id in franjas:
+            minimos, maximos, descuentos = franjas[producto_id]
+            minimos.append(int(minimo))
+            maximos.append(int(maximo))
+            descuentos.append(round(float(descuento), 6))
+
+    return {
+        producto_id: PrecioProducto(subtotal, impuestos, *(tuple(valores) for valores in franjas[producto_id]))
+        for producto_id, (subtotal, impuestos) in productos.items()
+    }
+
+
+@dataclass
+class IndicePreciosMetrics:
+    """Métricas del índice de precios"""
+    lineas: int = 0
+    aciertos: int = 0
+    cargados: int = 0
+    invalidaciones: int = 0
+    expulsiones: int = 0
+
+
+class IndicePrecios:
+    """
+    Productos ya consultados de cada empresa, con la versión de datos con la
+    que se cargaron. LRU de empresas: al superar max_empresas se descarta la
+    menos usada.
+    """
+
+    def __init__(self, max_empresas: int = PRECIOS_PRODUCTOS_CONFIG['MAX_EMPRESAS']):
+        self.max_empresas = max_empresas
+        self.metrics = IndicePreciosMetrics()
+        self._empresas: OrderedDict = OrderedDict()  # db_path -> (versión, {producto_id: PrecioProducto})
+        self._lock = threading.Lock()
+
+    def _productos_empresa(self, db_path, version) -> Dict[int, PrecioProducto]:
+        """Productos indexados de la empresa para esta versión (vacío si cambió)"""
+        entrada = self._empresas.get(db_path)
+        if entrada is None or entrada[0] != version:
+            if entrada is not None:
+                self.metrics.invalidaciones += 1
+            entrada = (version, {})
+            self._empresas[db_path] = entrada
+        self._empresas.move_to_end(db_path)
+        while len(self._empresas) > self.max_empresas:
+            self._empresas.popitem(last=False)
+            self.metrics.expulsiones += 1
+        return entrada[1]
+
+    def precios(self, conn, producto_ids) -> Dict[int, PrecioProducto]:
+        """Precio indexado de cada producto (los inexistentes no aparecen)"""
+        db_path, version = obtener_version_datos(conn, TABLAS_PRECIOS)
+        if len(version) < len(TABLAS_PRECIOS):
+            # Empresa sin tabla de franjas todavía: se crea y se vigila desde ya
+            from productos import ensure_tabla_descuentos_bandas
+            ensure_tabla_descuentos_bandas()
+            instalar_version_datos(conn, TABLAS_PRECIOS)
+            db_path, version = obtener_version_datos(conn, TABLAS_PRECIOS)
+        producto_ids = list(dict.fromkeys(producto_ids))
+        with self._lock:
+            productos = self._productos_empresa(db_path, version)
+            faltan = [producto_id for producto_id in producto_ids if producto_id not in productos]
+            self.metrics.aciertos += len(producto_ids) - len(faltan)
+
+        if faltan:
+            # Se carga fuera del lock; si entretanto cambia la versión, lo cargado
+            # queda en el diccionario de la versión anterior y no se sirve más
+            cargados = _cargar_productos(conn, faltan)
+            with self._lock:
+                productos.update(cargados)
+                self.metrics.cargados += len(cargados)
+
+        with self._lock:
+            return {producto_id: productos[producto_id] for producto_id in producto_ids if producto_id in productos}
+
+    def precios_cesta(self, conn, lineas: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+        """
+        Precio de cada línea (producto_id, cantidad) de una cesta.
+
+        Returns:
+            list: Una entrada por línea, en el mismo orden (con 'error' si el producto no existe)
+        """
+        precios = self.precios(conn, [producto_id for producto_id, _ in lineas])
+        with self._lock:
+            self.metrics.lineas += len(lineas)
+        resultado = []
+        for producto_id, cantidad in lineas:
+            precio = precios.get(producto_id)
+            if precio is None:
+                resultado.append({'producto_id': producto_id, 'cantidad': cantidad, 'error': 'Producto no encontrado'})
+            else:
+                resultado.append(calcular_linea(producto_id, precio, cantidad))
+        return resultado
+
+    def invalidar(self, db_path=None):
+        """Descarta el índice completo o solo el de una BD"""
+        with self._lock:
+            if db_path is None:
+                self._empresas.clear()
+            else:
+                self._empresas.pop(db_path, None)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Tamaño y contadores del índice"""
+        with self._lock:
+            return {
+                'empresas': len(self._empresas),
+                'max_empresas': self.max_empresas,
+                'productos': sum(len(entrada[1]) for entrada in self._empresas.values()),
+                'lineas': self.metrics.lineas,
+                'aciertos': self.metrics.aciertos,
+                'cargados': self.metrics.cargados,
+                'invalidaciones': self.metrics.invalidaciones,
+                'expulsiones': self.metrics.expulsiones
+            }
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def get_indice_precios() -> IndicePrecios:
+    """Índice único por proceso"""
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                _indice = IndicePrecios()
+    return _indice
+
+
+def precios_cesta(lineas: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+    """Precio de cada línea (producto_id, cantidad) en la BD de la empresa activa"""
+    with get_db_connection() as conn:
+        return get_indice_precios().precios_cesta(conn, lineas)
+
+
+def franjas_producto(producto_id: int) -> List[Dict[str, Any]]:
+    """
+    Franjas de un producto servidas desde el índice, con el mismo formato que
+    productos.obtener_franjas_descuento_por_producto (vacía si no existe).
+    """
+    with get_db_connection() as conn:
+        precio = get_indice_precios().precios(conn, [producto_id]).get(producto_id)
+    if precio is None:
+        return []
+    return [
+        {'min_cantidad': minimo, 'max_cantidad': maximo, 'porcentaje_descuento': descuento}
+        for minimo, maximo, descuento in zip(precio.minimos, precio.maximos, precio.descuentos)
+    ]
@@ -6,8 +6,10 @@ from flask import Blueprint, jsonify, request
 from auth_middleware import login_required
 import productos
 import productos_franjas_utils
+import productos_precios
 from logger_config import get_logger
 from db_utils import get_db_connection
+from multiempresa_config import PRECIOS_PRODUCTOS_CONFIG
 
 logger = get_logger('aleph70.productos_routes')
 
@@ -172,11 +174,47 @@ def crear_producto_rest():
         return jsonify({'error': str(e)}), 500
 
 
+@productos_bp.route('/api/productos/precios', methods=['POST'])
+@login_required
+def api_precios_cesta():
+    """
+    Precio de una cesta completa según las franjas de cada producto.
+    Body: {"lineas": [{"producto_id": 1, "cantidad": 25}, ...]}
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        lineas_data = body.get('lineas')
+        if not isinstance(lineas_data, list) or not lineas_data:
+            return jsonify({'error': 'Las líneas deben ser una lista no vacía'}), 400
+        if len(lineas_data) > PRECIOS_PRODUCTOS_CONFIG['MAX_LINEAS_CESTA']:
+            return jsonify({'error': f"Máximo {PRECIOS_PRODUCTOS_CONFIG['MAX_LINEAS_CESTA']} líneas por petición"}), 400
+
+        try:
+            lineas = [(int(linea['producto_id']), float(linea['cantidad'])) for linea in lineas_data]
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'error': f'Línea inválida: {e}'}), 400
+        if any(cantidad <= 0 for _, cantidad in lineas):
+            return jsonify({'error': 'La cantidad debe ser mayor que 0'}), 400
+
+        resultado = productos_precios.precios_cesta(lineas)
+        validas = [linea for linea in resultado if 'error' not in linea]
+        return jsonify({
+            'success': True,
+            'lineas': resultado,
+            'subtotal': round(sum(linea['subtotal'] for linea in validas), 2),
+            'iva': round(sum(linea['iva'] for linea in validas), 2),
+            'total': round(sum(linea['total'] for linea in validas), 2)
+        })
+    except Exception as e:
+        logger.error(f"Error calculando precios de la cesta: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 @productos_bp.route('/api/productos/<int:producto_id>/franjas_descuento', methods=['GET'])
 @productos_bp.route('/productos/<int:producto_id>/franjas_descuento', methods=['GET'])
 def api_get_franjas_descuento_producto(producto_id):
     try:
-        franjas = productos.obtener_franjas_descuento_por_producto(producto_id)
+        franjas = productos_precios.franjas_producto(producto_id)
         try:
             return jsonify({'success': True, 'franjas': franjas})
         except Exception as json_e:
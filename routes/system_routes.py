@@ -5,6 +5,16 @@ Rutas de sistema (configuración, versión, debug, utilidades)
 import os
 from flask import Blueprint, jsonify, request, Response, send_file
 from auth_middleware import login_required
+from auditoria_writer import get_auditoria_writer
+from cache_estadisticas import get_cache_estadisticas
+from cache_extracciones import get_cache_extracciones
+from motor_plantillas import get_motor_plantillas
+from servicio_pdf import get_servicio_pdf
+from database_pool import get_metrics as get_pool_metrics
+from normalizador_conceptos import get_metrics as get_normalizador_metrics
+from perfiles_conexion import get_metrics as get_perfiles_metrics
+from productos_precios import get_indice_precios
+from contactos_indice import get_metrics as get_codigos_postales_metrics
 from logger_config import get_logger
 from db_utils import get_db_connection
 from services.common_services import format_date
@@ -308,6 +318,16 @@ def health_check():
             'version': APP_VERSION,
             'timestamp': datetime.now().isoformat(),
             'database': db_status,
+            'auditoria': get_auditoria_writer().get_metrics(),
+            'cache_estadisticas': get_cache_estadisticas().get_metrics(),
+            'normalizador_conceptos': get_normalizador_metrics(),
+            'database_pools': get_pool_metrics(),
+            'perfiles_conexion': get_perfiles_metrics(),
+            'indice_precios': get_indice_precios().get_metrics(),
+            'indice_codigos_postales': get_codigos_postales_metrics(),
+            'cache_extracciones': get_cache_extracciones().get_metrics(),
+            'motor_plantillas': get_motor_plantillas().get_metrics(),
+            'servicio_pdf': get_servicio_pdf().get_metrics(),
             'uptime': 'running'
         })
         
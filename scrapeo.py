@@ -9,7 +9,8 @@ from pathlib import Path
 
 import pandas as pd
 
-from db_utils import get_db_connection
+from db_utils import get_db_write_connection
+from normalizador_conceptos import preparar_conceptos_normalizados
 from notificaciones_utils import guardar_notificacion
 from constantes import DB_NAME
 from logger_config import get_logger
@@ -27,8 +28,8 @@ def importar_desde_excel(ruta_excel: str):
     Solo inserta los registros que aún no existen (por fecha_operacion, concepto, importe_eur)."""
 
 
-    # Conexión a la base de datos
-    conn = get_db_connection()
+    # Conexión del carril de escritura de la BD (la importación escribe en gastos)
+    conn = get_db_write_connection()
     cursor = conn.cursor()
 
     # Obtener registros existentes para evitar duplicados. Se usa la combinación
@@ -223,6 +224,12 @@ def importar_desde_excel(ruta_excel: str):
         inserted = max(despues - antes, 0)
         logging.info("%d registros nuevos insertados en 'gastos'", inserted)
         logger.info(f"Registros insertados: {inserted}")
+
+        # Concepto normalizado de los movimientos nuevos (agrupación en estadísticas)
+        try:
+            preparar_conceptos_normalizados(conn)
+        except Exception as e:
+            logger.error(f"Error normalizando conceptos importados: {e}", exc_info=True)
         
         # === VALIDACIÓN Y ELIMINACIÓN DE DUPLICADOS POST-INSERCIÓN ===
         logger.info("🔍 Verificando duplicados después de la inserción...")
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BENCHMARK DE LA CADENA DE HUELLAS VERI*FACTU
+============================================
+Sobre una cadena sintética de registro_facturacion (facturas y tickets):
+
+- Verificación completa: verificar_cadena (un recorrido por bloques) frente
+  a comprobar cada registro consultando el anterior
+- Anexos: obtener_ultimo_hash + INSERT en conexiones separadas (flujo
+  antiguo) frente a ServicioCadena.anexar, en serie y con dos hilos a la vez
+  (dos procesos con su propia cabeza en memoria); después se cuenta cuántos
+  eslabones han quedado rotos
+
+Uso:
+    python scripts/benchmark_cadena_verifactu.py [--registros 100000] [--anexos 1000]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_utils import get_db_connection
+from verifactu.hash.cadena import ServicioCadena, verificar_cadena
+from verifactu.hash.sha256 import (calcular_hash_encadenado, contenido_hash_factura,
+                                   contenido_hash_ticket, obtener_ultimo_hash)
+
+ESQUEMA = '''
+    CREATE TABLE registro_facturacion (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, factura_id INTEGER, ticket_id INTEGER, nif_emisor TEXT,
+        nif_receptor TEXT, fecha_emision TEXT, total REAL, hash TEXT, numero_factura TEXT,
+        estado_envio TEXT, huella_aeat TEXT);
+'''
+
+NIF_EMISOR = 'B12345678'
+
+INSERTAR = ('INSERT INTO registro_facturacion (factura_id, ticket_id, nif_emisor, nif_receptor, fecha_emision, '
+            'total, hash, numero_factura) VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+
+def generar_cadena(conn, registros):
+    """Cadena válida con un ticket de cada tres registros"""
+    aleatorio = random.Random(42)
+    filas = []
+    anterior = None
+    for i in range(1, registros + 1):
+        fecha = f"2025-{(i * 12 // (registros + 1)) + 1:02d}-{aleatorio.randint(1, 28):02d}"
+        total = round(aleatorio.uniform(1, 3000), 2)
+        if i % 3 == 0:
+            numero = f'T{i:07d}'
+            anterior = calcular_hash_encadenado(contenido_hash_ticket(NIF_EMISOR, fecha, numero, total), anterior)
+            filas.append((i, i, NIF_EMISOR, None, fecha, total, anterior, numero))
+        else:
+            numero = f'F{i:07d}'
+            receptor = f'A{aleatorio.randint(1, 5000):08d}'
+            anterior = calcular_hash_encadenado(
+                contenido_hash_factura(NIF_EMISOR, receptor, fecha, numero, total), anterior)
+            filas.append((i, None, NIF_EMISOR, receptor, fecha, total, anterior, numero))
+    conn.executemany(INSERTAR, filas)
+    conn.commit()
+
+
+def verificar_registro_a_registro(conn):
+    """Comprobación ingenua: una consulta del registro anterior por cada registro"""
+    roturas = 0
+    for registro_id, ticket_id, nif_emisor, nif_receptor, fecha, numero, total, huella in conn.execute(
+            'SELECT id, ticket_id, nif_emisor, nif_receptor, fecha_emision, numero_factura, total, hash '
+            'FROM registro_facturacion ORDER BY id').fetchall():
+        previo = conn.execute('SELECT hash FROM registro_facturacion WHERE id < ? ORDER BY id DESC LIMIT 1',
+                              (registro_id,)).fetchone()
+        if ticket_id:
+            contenido = contenido_hash_ticket(nif_emisor, fecha, numero, total)
+        else:
+            contenido = contenido_hash_factura(nif_emisor, nif_receptor, fecha, numero, total)
+        if calcular_hash_encadenado(contenido, previo[0] if previo else None) != huella:
+            roturas += 1
+    return roturas
+
+
+def _fila_nueva(numero):
+    return contenido_hash_factura(NIF_EMISOR, 'A00000001', '2026-01-15', numero, 121.0), \
+        (None, None, NIF_EMISOR, 'A00000001', '2026-01-15', 121.0)
+
+
+def anexar_antiguo(numero):
+    """Flujo antiguo: leer el último hash y después insertar con otra conexión"""
+    contenido, datos = _fila_nueva(numero)
+    huella = calcular_hash_encadenado(contenido, obtener_ultimo_hash())
+    conn = get_db_connection()
+    try:
+        conn.execute(INSERTAR, (*datos, huella, numero))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def anexador_servicio():
+    servicio = ServicioCadena()
+
+    def anexar(numero):
+        contenido, datos = _fila_nueva(numero)
+        servicio.anexar(contenido, lambda conn, huella: conn.execute(INSERTAR, (*datos, huella, numero)), numero)
+    return anexar
+
+
+def medir_anexos(anexar, anexos, hilos=1):
+    """Segundos totales para `anexos` anexos repartidos entre `hilos` hilos"""
+    def serie(prefijo, cantidad):
+        for i in range(cantidad):
+            anexar(f'{prefijo}{i:06d}')
+
+    trabajadores = [threading.Thread(target=serie, args=(f'N{h}', anexos // hilos)) for h in range(hilos)]
+    inicio = time.perf_counter()
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+    return time.perf_counter() - inicio
+
+
+def ejecutar(registros, anexos):
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, 'benchmark.db')
+        conn = sqlite3.connect(ruta)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(ESQUEMA)
+        generar_cadena(conn, registros)
+        os.environ['EMPRESA_DB_PATH'] = ruta
+
+        print(f"📊 Cadena de {registros} registros")
+        inicio = time.perf_counter()
+        resultado = verificar_cadena(conn)
+        t_recorrido = time.perf_counter() - inicio
+        assert resultado['roturas'] == 0, resultado['detalle'][:3]
+        inicio = time.perf_counter()
+        assert verificar_registro_a_registro(conn) == 0
+        t_ingenuo = time.perf_counter() - inicio
+        print(f"{'Verificación':<40}{'registro a registro':>22}{'un recorrido':>16}")
+        print(f"{'':<40}{t_ingenuo:>21.2f}s{t_recorrido:>15.2f}s"
+              f"   ({registros / t_recorrido:,.0f} registros/s)")
+
+        print(f"\n{'Anexos (' + str(anexos) + ')':<40}{'ms/anexo':>12}{'roturas':>10}")
+        for nombre, crear, hilos in (('antiguo, 1 hilo', lambda: anexar_antiguo, 1),
+                                     ('servicio de cadena, 1 hilo', anexador_servicio, 1),
+                                     ('antiguo, 2 hilos', lambda: anexar_antiguo, 2),
+                                     ('servicio de cadena, 2 hilos', None, 2)):
+            conn.execute('DELETE FROM registro_facturacion WHERE id > ?', (registros,))
+            conn.commit()
+            if crear is None:
+                # Un servicio por hilo: como dos procesos, cada uno con su cabeza en memoria
+                servicios = {}
+
+                def anexar(numero):
+                    hilo = threading.get_ident()
+                    if hilo not in servicios:
+                        servicios[hilo] = anexador_servicio()
+                    servicios[hilo](numero)
+            else:
+                anexar = crear()
+            segundos = medir_anexos(anexar, anexos, hilos)
+            roturas = verificar_cadena(conn)['roturas']
+            print(f"{nombre:<40}{segundos * 1000 / anexos:>12.3f}{roturas:>10}")
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de la cadena de huellas VERI*FACTU')
+    parser.add_argument('--registros', type=int, default=100000)
+    parser.add_argument('--anexos', type=int, default=1000)
+    args = parser.parse_args()
+    ejecutar(args.registros, args.anexos)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BENCHMARK DEL ÍNDICE DE CALLES Y CÓDIGOS POSTALES
+=================================================
+Compara el índice en memoria de contactos_indice con las consultas SQL de
+searchCarrer y search_cp sobre una codipostal: la de maestros compartida
+(por defecto), la de la BD indicada o una sintética del tamaño del callejero
+postal español completo (--sintetica). Comprueba además que los resultados
+coinciden. La BD de origen no se modifica.
+
+Uso:
+    python scripts/benchmark_indice_codipostal.py [ruta.db] [--sintetica] [--filas 1000000] [--consultas 300]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contactos_indice import IndiceCodigosPostales
+from multiempresa_config import PLANTILLA_EMPRESA_CONFIG
+
+SQL_CALLES = """
+    SELECT carrer, cp FROM codipostal
+    WHERE LOWER(carrer) LIKE ?
+    ORDER BY CASE WHEN LOWER(carrer) LIKE ? THEN 1 ELSE 3 END, carrer
+    LIMIT 10
+"""
+SQL_CP = "SELECT cp, poblacio, provincia FROM codipostal WHERE cp LIKE ? || '%' ORDER BY cp LIMIT 20"
+
+TIPOS_VIA = ('Calle', 'Carrer de', 'Avenida', 'Avinguda de', 'Plaza', 'Plaça de', 'Paseo', 'Passeig de',
+             'Camino', 'Ronda de', 'Travesía', 'Rúa', 'Kalea', 'Glorieta', 'Urbanización')
+NOMBRES = ('Mayor', 'Real', 'Sant Joan', 'San José', 'Santa María', 'Iglesia', 'Mar', 'Sol', 'Luna', 'Río',
+           'Constitución', 'España', 'Cervantes', 'Goya', 'Velázquez', 'Antonio Machado', 'Rosalía de Castro',
+           'Jaume I', 'Pau Casals', 'Escultor Llimona', 'Doctor Fleming', 'Pintor Sorolla', 'Olivos', 'Pinos',
+           'Castillo', 'Molino', 'Estación', 'Huerta', 'Fuente', 'Libertad', 'Ramón y Cajal', 'Isabel II')
+PROVINCIAS = ('ARABA', 'ALBACETE', 'ALICANTE', 'ALMERIA', 'AVILA', 'BADAJOZ', 'ILLES BALEARS', 'BARCELONA',
+              'BURGOS', 'CACERES', 'CADIZ', 'CASTELLON', 'CIUDAD REAL', 'CORDOBA', 'A CORUÑA', 'CUENCA',
+              'GIRONA', 'GRANADA', 'GUADALAJARA', 'GIPUZKOA', 'HUELVA', 'HUESCA', 'JAEN', 'LEON', 'LLEIDA',
+              'LA RIOJA', 'LUGO', 'MADRID', 'MALAGA', 'MURCIA', 'NAVARRA', 'OURENSE', 'ASTURIAS', 'PALENCIA',
+              'LAS PALMAS', 'PONTEVEDRA', 'SALAMANCA', 'SANTA CRUZ DE TENERIFE', 'CANTABRIA', 'SEGOVIA',
+              'SEVILLA', 'SORIA', 'TARRAGONA', 'TERUEL', 'TOLEDO', 'VALENCIA', 'VALLADOLID', 'BIZKAIA',
+              'ZAMORA', 'ZARAGOZA', 'CEUTA', 'MELILLA')
+
+
+def crear_sintetica(ruta, filas):
+    """codipostal con filas vías repartidas por los CP de las 52 provincias"""
+    aleatorio = random.Random(42)
+    conn = sqlite3.connect(ruta)
+    conn.executescript('''
+        CREATE TABLE codipostal (idCp INTEGER PRIMARY KEY, cp TEXT NOT NULL, carrer TEXT DEFAULT NULL,
+                                 poblacio NOT NULL, provincia TEXT DEFAULT NULL);
+        CREATE INDEX cp ON codipostal (cp);
+        CREATE INDEX calle ON codipostal (carrer);
+    ''')
+
+    def fila():
+        provincia = aleatorio.randrange(1, 53)
+        cp = f'{provincia:02d}{aleatorio.randrange(1000):03d}'
+        via = aleatorio.random()
+        if via < 0.05:
+            carrer = None
+        else:
+            carrer = f'{aleatorio.choice(TIPOS_VIA)} {aleatorio.choice(NOMBRES)}'
+            if via < 0.8:
+                carrer += f' {aleatorio.choice(NOMBRES)} {aleatorio.randrange(1, 400)}'
+        return cp, carrer, f'POBLACION {cp[2:]}', PROVINCIAS[provincia - 1]
+
+    conn.executemany('INSERT INTO codipostal (cp, carrer, poblacio, provincia) VALUES (?, ?, ?, ?)',
+                     (fila() for _ in range(filas)))
+    conn.commit()
+    conn.close()
+
+
+def textos_de_busqueda(conn, consultas):
+    """Fragmentos de calles reales de 1 a 12 caracteres, como los teclea el usuario"""
+    aleatorio = random.Random(7)
+    calles = [fila[0] for fila in conn.execute(
+        'SELECT carrer FROM codipostal WHERE carrer IS NOT NULL ORDER BY RANDOM() LIMIT ?', (consultas,)
+    )]
+    textos = []
+    for calle in calles:
+        calle = calle.lower()
+        inicio = 0 if aleatorio.random() < 0.5 else aleatorio.randrange(len(calle) or 1)
+        texto = calle[inicio:inicio + aleatorio.randint(1, 12)].strip()
+        if texto and '%' not in texto and '_' not in texto:
+            textos.append(texto)
+    return textos
+
+
+def medir(funcion, argumentos):
+    """Tiempos en ms de cada llamada y resultados"""
+    tiempos, resultados = [], []
+    for argumento in argumentos:
+        inicio = time.perf_counter()
+        resultados.append(funcion(argumento))
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos, resultados
+
+
+def resumen(nombre, tiempos):
+    tiempos = sorted(tiempos)
+    p99 = tiempos[int(len(tiempos) * 0.99) - 1] if len(tiempos) >= 100 else tiempos[-1]
+    print(f"   {nombre:<22} media {statistics.mean(tiempos):>9.3f} ms   p50 {tiempos[len(tiempos) // 2]:>9.3f} ms"
+          f"   p99 {p99:>9.3f} ms   máx {tiempos[-1]:>9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del índice de calles y códigos postales')
+    parser.add_argument('bd', nargs='?', help='BD con codipostal (por defecto la de maestros compartida)')
+    parser.add_argument('--sintetica', action='store_true', help='Generar una codipostal sintética')
+    parser.add_argument('--filas', type=int, default=1000000, help='Filas de la codipostal sintética')
+    parser.add_argument('--consultas', type=int, default=300, help='Búsquedas de calles a medir')
+    args = parser.parse_args()
+
+    temporal = None
+    if args.sintetica:
+        descriptor, temporal = tempfile.mkstemp(suffix='.db')
+        os.close(descriptor)
+        os.remove(temporal)
+        inicio = time.perf_counter()
+        crear_sintetica(temporal, args.filas)
+        print(f"🔧 codipostal sintética de {args.filas:,} filas en {time.perf_counter() - inicio:.1f} s")
+        ruta = temporal
+    else:
+        ruta = args.bd or PLANTILLA_EMPRESA_CONFIG['BD_MAESTROS']
+        if not os.path.exists(ruta):
+            print(f"❌ {ruta} no existe")
+            return 1
+
+    conn = sqlite3.connect(f'file:{ruta}?mode=ro', uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        inicio = time.perf_counter()
+        indice = IndiceCodigosPostales(conn)
+        construccion = time.perf_counter() - inicio
+        print(f"📊 {ruta}: {indice.filas:,} filas, {indice.num_calles:,} calles distintas; "
+              f"índice construido en {construccion:.2f} s")
+
+        textos = textos_de_busqueda(conn, args.consultas)
+        prefijos = [f'{random.Random(i).randrange(1, 53):02d}{str(i % 1000)[:i % 4]}' for i in range(len(textos))]
+
+        t_indice, r_indice = medir(indice.calles, textos)
+        t_sql, r_sql = medir(lambda q: [{'carrer': f[0], 'cp': f[1]} for f in
+                                        conn.execute(SQL_CALLES, (f'%{q}%', f'{q}%'))], textos)
+        print(f"   Calles ({len(textos)} búsquedas):")
+        resumen('índice', t_indice)
+        resumen('SQL LIKE', t_sql)
+
+        c_indice, rc_indice = medir(indice.codigos, prefijos)
+        c_sql, rc_sql = medir(lambda p: [dict(f) for f in conn.execute(SQL_CP, (p,))], prefijos)
+        print(f"   Códigos postales ({len(prefijos)} prefijos):")
+        resumen('índice', c_indice)
+        resumen('SQL LIKE', c_sql)
+
+        distintos = sum(a != b for a, b in zip(r_indice, r_sql)) + sum(a != b for a, b in zip(rc_indice, rc_sql))
+    finally:
+        conn.close()
+        if temporal:
+            os.remove(temporal)
+
+    if distintos:
+        print(f"❌ {distintos} búsquedas con resultados distintos del SQL")
+        return 1
+    print("✅ Mismos resultados que las consultas SQL")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BENCHMARK DE PERFILES DE CONEXIÓN SQLITE
+========================================
+Mide lecturas y escrituras por segundo de cada perfil de PERFILES_CONEXION
+sobre una copia de la BD indicada (por defecto la BD de empresa más grande),
+con una tabla sintética añadida a la copia. La BD original no se modifica.
+
+Uso:
+    python scripts/benchmark_perfiles_conexion.py [ruta.db] [--perfiles basico,grande]
+                                                  [--segundos 2] [--filas 50000] [--hilos 4]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perfiles_conexion import bd_empresa_mas_grande, benchmark_perfiles, resolver_perfil
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de perfiles de conexión SQLite')
+    parser.add_argument('bd', nargs='?', help='BD a copiar (por defecto la de empresa más grande)')
+    parser.add_argument('--perfiles', help='Perfiles separados por comas (por defecto todos)')
+    parser.add_argument('--segundos', type=float, default=2.0, help='Duración de la medición por perfil')
+    parser.add_argument('--filas', type=int, default=50000, help='Filas de la tabla sintética')
+    parser.add_argument('--hilos', type=int, default=4, help='Hilos lectores')
+    parser.add_argument('--sintetica', action='store_true', help='Sin copiar ninguna BD, solo la tabla sintética')
+    args = parser.parse_args()
+
+    origen = None if args.sintetica else (args.bd or bd_empresa_mas_grande())
+    if origen and not os.path.exists(origen):
+        print(f"❌ {origen} no existe")
+        return 1
+    perfiles = args.perfiles.split(',') if args.perfiles else None
+
+    informe = benchmark_perfiles(origen, perfiles, args.segundos, args.filas, args.hilos)
+
+    if origen:
+        print(f"📊 {origen} ({informe['tamano_mb']} MB), perfil actual: {resolver_perfil(origen)[0]}")
+    else:
+        print("📊 BD sintética")
+    print(f"   {'Perfil':<12} {'Lecturas/s':>12} {'Escrituras/s':>14}")
+    for nombre, resultado in informe['perfiles'].items():
+        print(f"   {nombre:<12} {resultado['lecturas_s']:>12,.0f} {resultado['escrituras_s']:>14,.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
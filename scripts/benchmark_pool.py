@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BENCHMARK DE PRÉSTAMO CONCURRENTE DEL POOL
+==========================================
+Lanza más hilos que conexiones tiene el pool; cada hilo pide una conexión,
+ejecuta una consulta corta, la retiene un instante y la devuelve. Mide el
+rendimiento y los percentiles de espera del histograma del pool, con la
+validación por inactividad (por defecto) y validando en cada préstamo
+(--validar-siempre, el comportamiento anterior).
+
+Uso:
+    python scripts/benchmark_pool.py [--hilos 32] [--conexiones 10] [--prestamos 500]
+                                     [--retencion-ms 1] [--validar-siempre]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_pool import DatabasePool
+
+
+def preparar_bd(db_path):
+    """BD con una tabla pequeña para la consulta de cada préstamo"""
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE tickets (id INTEGER PRIMARY KEY, total REAL)')
+    conn.executemany('INSERT INTO tickets (total) VALUES (?)', [(i * 1.5,) for i in range(1000)])
+    conn.commit()
+    conn.close()
+
+
+def ejecutar(hilos, conexiones, prestamos, retencion_ms, validar_siempre):
+    """Ejecuta el benchmark y devuelve (segundos, métricas del pool, errores)"""
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = os.path.join(directorio, 'benchmark.db')
+        preparar_bd(db_path)
+
+        pool = DatabasePool(db_path, max_connections=conexiones, min_connections=0)
+        if validar_siempre:
+            pool.validate_after_idle = 0
+        errores = []
+        barrera = threading.Barrier(hilos)
+
+        def trabajador():
+            barrera.wait()
+            for _ in range(prestamos):
+                try:
+                    with pool.get_db_connection() as conn:
+                        conn.execute('SELECT SUM(total) FROM tickets WHERE id < 100').fetchone()
+                        if retencion_ms:
+                            time.sleep(retencion_ms / 1000)
+                except Exception as e:
+                    errores.append(str(e))
+
+        trabajadores = [threading.Thread(target=trabajador) for _ in range(hilos)]
+        inicio = time.perf_counter()
+        for t in trabajadores:
+            t.start()
+        for t in trabajadores:
+            t.join()
+        segundos = time.perf_counter() - inicio
+
+        metricas = pool.get_metrics()
+        pool.shutdown()
+        return segundos, metricas, errores
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de préstamo concurrente del pool SQLite')
+    parser.add_argument('--hilos', type=int, default=32)
+    parser.add_argument('--conexiones', type=int, default=10)
+    parser.add_argument('--prestamos', type=int, default=500, help='Préstamos por hilo')
+    parser.add_argument('--retencion-ms', type=float, default=1.0, help='Tiempo que se retiene cada conexión')
+    parser.add_argument('--validar-siempre', action='store_true', help='SELECT 1 en cada préstamo')
+    args = parser.parse_args()
+
+    segundos, metricas, errores = ejecutar(args.hilos, args.conexiones, args.prestamos,
+                                           args.retencion_ms, args.validar_siempre)
+    total = args.hilos * args.prestamos
+    histograma = metricas['wait_histogram']
+
+    print(f"📊 {args.hilos} hilos, {args.conexiones} conexiones, {args.prestamos} préstamos/hilo, "
+          f"retención {args.retencion_ms}ms, validación {'en cada préstamo' if args.validar_siempre else 'por inactividad'}")
+    print(f"   Tiempo total:      {segundos:.2f}s ({total / segundos:,.0f} préstamos/s)")
+    print(f"   Esperas:           {metricas['waits']} de {metricas['total_requests']}")
+    print(f"   Espera p50/p95/p99: {histograma['p50_ms']}ms / {histograma['p95_ms']}ms / {histograma['p99_ms']}ms "
+          f"(máx {metricas['max_wait_time'] * 1000:.1f}ms)")
+    print(f"   Validaciones:      {metricas['validations']}")
+    print(f"   Timeouts/errores:  {metricas['timeouts']} / {len(errores)}")
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BENCHMARK DE FILTROS DE FECHA
+=============================
+Compara strftime('%Y', fecha) = ? frente a fecha >= ? AND fecha < ? sobre un
+año sintético de tickets, facturas, proformas y gastos, antes y después de
+aplicar scripts/indices_rangos_fecha.sql.
+
+Uso:
+    python scripts/benchmark_rangos_fecha.py [--documentos 20000] [--repeticiones 20]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils_fechas_optimizadas import (filtro_rango_fecha, generar_where_fecha_optimizada,
+                                      rango_anio, rango_mes)
+
+SCRIPT_INDICES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indices_rangos_fecha.sql')
+
+ESQUEMA = '''
+    CREATE TABLE tickets (id INTEGER PRIMARY KEY, numero TEXT, fecha TEXT, estado TEXT,
+                          formaPago TEXT, total REAL, importe_cobrado REAL);
+    CREATE TABLE factura (id INTEGER PRIMARY KEY, numero TEXT, idContacto INTEGER, fecha TEXT,
+                          estado TEXT, total REAL, importe_cobrado REAL);
+    CREATE TABLE proforma (id INTEGER PRIMARY KEY, numero TEXT, fecha TEXT, estado TEXT, total REAL);
+    CREATE TABLE detalle_proforma (id INTEGER PRIMARY KEY, id_proforma INTEGER, fechaDetalle TEXT,
+                                   total REAL);
+    CREATE TABLE gastos (id INTEGER PRIMARY KEY, fecha_operacion TEXT, fecha_valor TEXT, concepto TEXT,
+                         importe_eur REAL, fecha_operacion_iso TEXT, fecha_valor_iso TEXT);
+'''
+
+FECHA_OPERACION = generar_where_fecha_optimizada('fecha_operacion', 'fecha_operacion_iso')
+FECHA_VALOR = generar_where_fecha_optimizada('fecha_valor')
+
+# (nombre, consulta antigua, parámetros, consulta nueva, parámetros)
+CONSULTAS = [
+    ('Tickets del año',
+     "SELECT COUNT(*), AVG(total), SUM(total) FROM tickets WHERE estado = 'C' AND strftime('%Y', fecha) = ?",
+     ('2025',),
+     "SELECT COUNT(*), AVG(total), SUM(total) FROM tickets WHERE estado = 'C' AND fecha >= ? AND fecha < ?",
+     rango_anio(2025)),
+    ('Facturas del mes',
+     "SELECT COUNT(*), AVG(total), SUM(total) FROM factura "
+     "WHERE estado = 'C' AND strftime('%Y', fecha) = ? AND strftime('%m', fecha) = ?",
+     ('2025', '06'),
+     "SELECT COUNT(*), AVG(total), SUM(total) FROM factura WHERE estado = 'C' AND fecha >= ? AND fecha < ?",
+     rango_mes(2025, 6)),
+    ('Proformas del mes',
+     "SELECT COUNT(DISTINCT p.id), SUM(d.total) FROM proforma p JOIN detalle_proforma d ON p.id = d.id_proforma "
+     "WHERE p.estado = 'A' AND strftime('%Y', d.fechaDetalle) = ? AND strftime('%m', d.fechaDetalle) = ?",
+     ('2025', '06'),
+     "SELECT COUNT(DISTINCT p.id), SUM(d.total) FROM proforma p JOIN detalle_proforma d ON p.id = d.id_proforma "
+     "WHERE p.estado = 'A' AND d.fechaDetalle >= ? AND d.fechaDetalle < ?",
+     rango_mes(2025, 6)),
+    ('Ventas mensuales (tickets)',
+     "SELECT strftime('%m', fecha) as mes, SUM(total) FROM tickets "
+     "WHERE estado = 'C' AND strftime('%Y', fecha) = ? GROUP BY mes",
+     ('2025',),
+     "SELECT strftime('%m', fecha) as mes, SUM(total) FROM tickets "
+     "WHERE estado = 'C' AND fecha >= ? AND fecha < ? GROUP BY mes",
+     rango_anio(2025)),
+    ('Ingresos del mes (gastos.fecha_operacion)',
+     "SELECT SUM(importe_eur) FROM gastos WHERE importe_eur > 0 "
+     "AND substr(fecha_operacion, 4, 2) = ? AND substr(fecha_operacion, 7, 4) = ?",
+     ('06', '2025'),
+     f"SELECT SUM(importe_eur) FROM gastos WHERE importe_eur > 0 AND {filtro_rango_fecha(FECHA_OPERACION)}",
+     rango_mes(2025, 6)),
+    ('Gastos del año (gastos.fecha_valor)',
+     "SELECT SUM(ABS(importe_eur)) FROM gastos WHERE substr(fecha_valor, 7, 4) = ? AND importe_eur < 0",
+     ('2025',),
+     f"SELECT SUM(ABS(importe_eur)) FROM gastos WHERE {filtro_rango_fecha(FECHA_VALOR)} AND importe_eur < 0",
+     rango_anio(2025)),
+]
+
+
+def generar_datos(conn, documentos, anios=(2023, 2024, 2025)):
+    """Genera documentos repartidos entre varios años; el año medido es el último"""
+    aleatorio = random.Random(42)
+    inicio = date(anios[0], 1, 1)
+    dias = (date(anios[-1], 12, 31) - inicio).days
+
+    def fecha_aleatoria():
+        return inicio + timedelta(days=aleatorio.randint(0, dias))
+
+    tickets, facturas, proformas, detalles, gastos = [], [], [], [], []
+    for i in range(documentos * len(anios)):
+        fecha = fecha_aleatoria().isoformat()
+        total = round(aleatorio.uniform(1, 500), 2)
+        tickets.append((f'T{i:06d}', fecha, aleatorio.choice('CCCCP'), 'E', total, total))
+
+        fecha = fecha_aleatoria().isoformat()
+        total = round(aleatorio.uniform(50, 5000), 2)
+        facturas.append((f'F{i:06d}', aleatorio.randint(1, 300), fecha, aleatorio.choice('CCCPV'), total, total))
+
+        if i % 5 == 0:
+            fecha = fecha_aleatoria().isoformat()
+            proformas.append((i // 5 + 1, f'P{i:06d}', fecha, aleatorio.choice('AAC'), total))
+            for _ in range(3):
+                detalles.append((i // 5 + 1, fecha, round(total / 3, 2)))
+
+        fecha = fecha_aleatoria()
+        fecha_banco = fecha.strftime('%d/%m/%Y')
+        gastos.append((fecha_banco, fecha_banco, f'Concepto {i % 200}',
+                       round(aleatorio.uniform(-900, 900), 2), fecha.isoformat(), fecha.isoformat()))
+
+    conn.executemany('INSERT INTO tickets (numero, fecha, estado, formaPago, total, importe_cobrado) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', tickets)
+    conn.executemany('INSERT INTO factura (numero, idContacto, fecha, estado, total, importe_cobrado) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', facturas)
+    conn.executemany('INSERT INTO proforma (id, numero, fecha, estado, total) VALUES (?, ?, ?, ?, ?)', proformas)
+    conn.executemany('INSERT INTO detalle_proforma (id_proforma, fechaDetalle, total) VALUES (?, ?, ?)', detalles)
+    conn.executemany('INSERT INTO gastos (fecha_operacion, fecha_valor, concepto, importe_eur, '
+                     'fecha_operacion_iso, fecha_valor_iso) VALUES (?, ?, ?, ?, ?, ?)', gastos)
+    conn.commit()
+
+
+def aplicar_indices(conn):
+    """Ejecuta el script de migración omitiendo los comandos propios del cliente sqlite3"""
+    with open(SCRIPT_INDICES, encoding='utf-8') as f:
+        sql = '\n'.join(linea for linea in f if not linea.startswith('.'))
+    conn.executescript(sql)
+
+
+def medir(conn, consulta, parametros, repeticiones):
+    """Tiempo medio en ms de una consulta y su resultado"""
+    resultado = conn.execute(consulta, parametros).fetchall()
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        conn.execute(consulta, parametros).fetchall()
+    return (time.perf_counter() - inicio) * 1000 / repeticiones, resultado
+
+
+def _normalizar(filas):
+    """Filas ordenadas con los importes redondeados (el orden de suma cambia con el índice)"""
+    return sorted(tuple(round(v, 2) if isinstance(v, float) else v for v in fila) for fila in filas)
+
+
+def plan(conn, consulta, parametros):
+    """Resumen de EXPLAIN QUERY PLAN en una línea"""
+    filas = conn.execute(f'EXPLAIN QUERY PLAN {consulta}', parametros).fetchall()
+    return ' | '.join(fila[-1] for fila in filas)
+
+
+def ejecutar(documentos, repeticiones):
+    """Mide cada consulta antigua y nueva sin y con los índices de rango"""
+    with tempfile.TemporaryDirectory() as directorio:
+        conn = sqlite3.connect(os.path.join(directorio, 'benchmark.db'))
+        conn.executescript(ESQUEMA)
+        generar_datos(conn, documentos)
+
+        resultados = {}
+        for fase in ('sin_indices', 'con_indices'):
+            if fase == 'con_indices':
+                aplicar_indices(conn)
+            for nombre, antigua, params_antigua, nueva, params_nueva in CONSULTAS:
+                t_antigua, r_antigua = medir(conn, antigua, params_antigua, repeticiones)
+                t_nueva, r_nueva = medir(conn, nueva, params_nueva, repeticiones)
+                if _normalizar(r_antigua) != _normalizar(r_nueva):
+                    raise AssertionError(f'{nombre}: resultados distintos {r_antigua} != {r_nueva}')
+                resultados[(fase, nombre)] = (t_antigua, t_nueva, plan(conn, nueva, params_nueva))
+        conn.close()
+
+    print(f"📊 {documentos} documentos/año por tabla, 3 años, {repeticiones} repeticiones")
+    print(f"{'Consulta':<44}{'strftime':>12}{'rango':>12}{'rango+índice':>15}")
+    for nombre, *_ in CONSULTAS:
+        t_antigua, t_rango, _ = resultados[('sin_indices', nombre)]
+        _, t_indice, plan_indice = resultados[('con_indices', nombre)]
+        print(f"{nombre:<44}{t_antigua:>10.2f}ms{t_rango:>10.2f}ms{t_indice:>13.2f}ms")
+        print(f"    plan: {plan_indice}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de filtros de fecha por rango')
+    parser.add_argument('--documentos', type=int, default=20000)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+    ejecutar(args.documentos, args.repeticiones)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PASO DE EMPRESAS EXISTENTES A LOS DATOS MAESTROS COMPARTIDOS
+============================================================
+Las empresas dadas de alta antes de la plantilla compilada llevan su propia
+copia de provincia y codipostal. Este script genera la BD de maestros
+compartida (si falta) a partir de la plantilla y, con --aplicar, elimina las
+copias de cada empresa cuyos datos coinciden con los compartidos y compacta
+su BD con VACUUM. Sin --aplicar solo informa de lo que haría.
+
+Ejecutar con la aplicación parada: VACUUM necesita acceso exclusivo.
+
+Uso:
+    python scripts/compartir_maestros_empresas.py [--plantilla db/plantilla.db] [--aplicar]
+"""
+
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multiempresa_config import BASE_DIR, PLANTILLA_EMPRESA_CONFIG
+from perfiles_conexion import codigo_empresa
+from plantilla_empresa import preparar_plantilla
+
+
+def _contenido(conn, tabla, esquema='main'):
+    """Filas de la tabla ordenadas, para comparar empresa y maestros"""
+    return sorted(tuple(fila) for fila in conn.execute(f'SELECT * FROM {esquema}."{tabla}"'))
+
+
+def revisar_empresa(db_path, tablas, aplicar):
+    """
+    Comprueba que las tablas maestras de la empresa coinciden con las
+    compartidas y, si se pide, las elimina y compacta la BD.
+
+    Returns:
+        tuple: (estado, bytes antes, bytes después)
+    """
+    antes = os.path.getsize(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        propias = [fila[0] for fila in conn.execute(
+            f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({','.join('?' * len(tablas))})", tablas
+        )]
+        if not propias:
+            return 'ya compartida', antes, antes
+
+        dependientes = [fila[0] for fila in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('view', 'trigger')"
+            " AND (" + ' OR '.join(["sql LIKE ?"] * len(propias)) + ")",
+            [f'%{tabla}%' for tabla in propias]
+        )]
+        if dependientes:
+            return f"usada por {', '.join(dependientes)}", antes, antes
+
+        conn.execute('ATTACH DATABASE ? AS maestros', (PLANTILLA_EMPRESA_CONFIG['BD_MAESTROS'],))
+        for tabla in propias:
+            if _contenido(conn, tabla) != _contenido(conn, tabla, 'maestros'):
+                return f'{tabla} distinta de la compartida', antes, antes
+        conn.execute('DETACH DATABASE maestros')
+
+        if not aplicar:
+            return 'se puede compartir', antes, antes
+
+        for tabla in propias:
+            conn.execute(f'DROP TABLE "{tabla}"')
+        conn.commit()
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    return 'compartida', antes, os.path.getsize(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Paso de empresas existentes a los datos maestros compartidos')
+    parser.add_argument('--plantilla', default=os.path.join(BASE_DIR, 'db', 'plantilla.db'),
+                        help='Plantilla de la que se generan los maestros compartidos')
+    parser.add_argument('--aplicar', action='store_true', help='Eliminar las copias y compactar (si no, solo informa)')
+    args = parser.parse_args()
+
+    if not PLANTILLA_EMPRESA_CONFIG['MAESTROS_COMPARTIDOS']:
+        print("❌ MAESTROS_COMPARTIDOS está desactivado en PLANTILLA_EMPRESA_CONFIG")
+        return 1
+    if not os.path.exists(args.plantilla):
+        print(f"❌ {args.plantilla} no existe")
+        return 1
+    preparar_plantilla(args.plantilla)
+
+    tablas = tuple(PLANTILLA_EMPRESA_CONFIG['TABLAS_MAESTRAS'])
+    rutas = sorted(r for r in glob.glob(os.path.join(BASE_DIR, 'db', '*', '*.db'))
+                   if codigo_empresa(r) == os.path.basename(os.path.dirname(r)))
+    ahorro = 0
+    for ruta in rutas:
+        try:
+            estado, antes, despues = revisar_empresa(ruta, tablas, args.aplicar)
+        except sqlite3.Error as e:
+            estado, antes, despues = f'error: {e}', 0, 0
+        ahorro += antes - despues
+        print(f"   {codigo_empresa(ruta):<12} {estado:<40} {antes / 1024 / 1024:>8.1f} MB -> {despues / 1024 / 1024:.1f} MB")
+
+    if args.aplicar:
+        print(f"✅ {len(rutas)} empresas revisadas, {ahorro / 1024 / 1024:.1f} MB liberados")
+    else:
+        print(f"📊 {len(rutas)} empresas revisadas (sin cambios, usar --aplicar)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
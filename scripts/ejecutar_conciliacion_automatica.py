@@ -13,7 +13,8 @@ from datetime import datetime
 # Añadir directorio padre al path para importar constantes
 sys.path.insert(0, '/var/www/html')
 from constantes import DB_NAME, IP_SERVIDOR
-from config_conciliacion import get_tolerancia_conciliacion
+from config_conciliacion import get_tolerancia_conciliacion, get_presupuesto_combinaciones
+from conciliacion_combinaciones import buscar_combinaciones
 
 # Configuración
 API_URL = f"http://{IP_SERVIDOR}:5001"
@@ -81,7 +82,7 @@ def conciliar(gasto_id, tipo_documento, documento_id):
 def encontrar_mejor_combinacion(documentos, objetivo, tolerancia=None):
     """
     Algoritmo de varita mágica para encontrar la mejor combinación de documentos
-    que sumen el importe objetivo
+    que sumen el importe objetivo (subset-sum exacto en céntimos)
     """
     # Obtener tolerancia desde BD si no se proporciona
     if tolerancia is None:
@@ -90,50 +91,21 @@ def encontrar_mejor_combinacion(documentos, objetivo, tolerancia=None):
     if not documentos:
         return []
     
-    # Ordenar por score descendente
-    documentos_ordenados = sorted(documentos, key=lambda x: x.get('score', 0), reverse=True)
+    presupuesto = get_presupuesto_combinaciones()
+    documentos = documentos[:presupuesto['max_documentos']]
+    combinaciones, _ = buscar_combinaciones(
+        [int(round(doc['importe'] * 100)) for doc in documentos],
+        int(round(objetivo * 100)),
+        int(round(tolerancia * 100)),
+        top_k=1,
+        timeout_ms=presupuesto['timeout_ms']
+    )
     
-    # Intentar encontrar combinación exacta o muy cercana
-    mejor_combinacion = []
-    mejor_diferencia = float('inf')
-    
-    # Probar combinaciones simples primero (1, 2, 3 documentos)
-    for i in range(len(documentos_ordenados)):
-        # Combinación de 1 documento
-        doc = documentos_ordenados[i]
-        diferencia = abs(objetivo - doc['importe'])
-        if diferencia < mejor_diferencia:
-            mejor_diferencia = diferencia
-            mejor_combinacion = [doc]
-            if diferencia < 0.01:  # Coincidencia exacta
-                return mejor_combinacion
-        
-        # Combinación de 2 documentos
-        for j in range(i + 1, len(documentos_ordenados)):
-            total = doc['importe'] + documentos_ordenados[j]['importe']
-            diferencia = abs(objetivo - total)
-            if diferencia < mejor_diferencia:
-                mejor_diferencia = diferencia
-                mejor_combinacion = [doc, documentos_ordenados[j]]
-                if diferencia < 0.01:
-                    return mejor_combinacion
-        
-        # Combinación de 3 documentos
-        for j in range(i + 1, len(documentos_ordenados)):
-            for k in range(j + 1, len(documentos_ordenados)):
-                total = doc['importe'] + documentos_ordenados[j]['importe'] + documentos_ordenados[k]['importe']
-                diferencia = abs(objetivo - total)
-                if diferencia < mejor_diferencia:
-                    mejor_diferencia = diferencia
-                    mejor_combinacion = [doc, documentos_ordenados[j], documentos_ordenados[k]]
-                    if diferencia < 0.01:
-                        return mejor_combinacion
-    
-    # Retornar mejor combinación solo si está dentro de la tolerancia
-    if mejor_diferencia <= tolerancia:
-        return mejor_combinacion
+    if not combinaciones:
+        return []
     
-    return []
+    _, indices = combinaciones[0]
+    return [documentos[idx] for idx in sorted(indices)]
 
 def procesar_conciliacion_automatica():
     """Proceso principal de conciliación automática"""
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ENVÍO EN LOTE DE REGISTROS VERI*FACTU PENDIENTES
+================================================
+Envía a la AEAT los registros de facturas que no constan como enviados
+(PENDIENTE y, salvo --solo-pendientes, ERROR), agrupados por NIF emisor con
+hasta AEAT_CONFIG['max_registros_envio'] registros por envelope. Pensado
+para vaciar los pendientes acumulados al final del día o tras una caída de
+la AEAT.
+
+Uso:
+    python scripts/enviar_pendientes_aeat.py [--empresa CODIGO] [--limite N] [--solo-pendientes]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from facturas_email_pipeline import bd_empresa
+from verifactu.core import enviar_pendientes_aeat
+from verifactu_outbox import empresas_activas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Envío en lote de registros VERI*FACTU pendientes')
+    parser.add_argument('--empresa', help='Código de empresa (por defecto todas las activas)')
+    parser.add_argument('--limite', type=int, help='Máximo de registros por empresa')
+    parser.add_argument('--solo-pendientes', action='store_true', help='No reintentar los registros en ERROR')
+    args = parser.parse_args()
+
+    empresas = [e for e in empresas_activas() if not args.empresa or e['codigo'] == args.empresa]
+    if not empresas:
+        print("❌ No hay empresas que procesar")
+        return 1
+
+    errores = 0
+    for empresa in empresas:
+        if not os.path.exists(empresa['db_path']):
+            continue
+        with bd_empresa(empresa['db_path']):
+            os.environ['EMPRESA_CODIGO'] = empresa['codigo']
+            resumen = enviar_pendientes_aeat(args.limite, reintentar_errores=not args.solo_pendientes)
+        if resumen['total']:
+            print(f"📤 {empresa['codigo']}: {resumen['enviadas']}/{resumen['total']} enviados, {resumen['errores']} con error")
+        errores += resumen['errores']
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+-- =====================================================
+-- ÍNDICES PARA FILTROS POR RANGO DE FECHA
+-- Fecha: 2026-10-17
+-- Descripción: Índices de cobertura para los predicados
+--              fecha >= ? AND fecha < ? del dashboard y de las
+--              estadísticas de gastos (utils_fechas_optimizadas.rango_*)
+-- =====================================================
+
+.echo on
+.headers on
+SELECT '===== ÍNDICES DE RANGO DE FECHA - INICIO =====' as INFO;
+
+-- =====================================================
+-- 1. TICKETS Y FACTURAS (estado, fecha, total)
+-- =====================================================
+-- Resuelven COUNT/AVG/SUM(total) por estado y periodo sin leer la tabla
+
+CREATE INDEX IF NOT EXISTS idx_tickets_estado_fecha_total
+ON tickets(estado, fecha, total);
+
+CREATE INDEX IF NOT EXISTS idx_factura_estado_fecha_total
+ON factura(estado, fecha, total);
+
+-- Ventas por cliente y mes
+CREATE INDEX IF NOT EXISTS idx_factura_contacto_estado_fecha
+ON factura(idContacto, estado, fecha, total);
+
+-- =====================================================
+-- 2. DETALLE DE PROFORMAS (fechaDetalle)
+-- =====================================================
+
+CREATE INDEX IF NOT EXISTS idx_detalle_proforma_fecha
+ON detalle_proforma(fechaDetalle, id_proforma, total);
+
+-- =====================================================
+-- 3. GASTOS (índices de expresión sobre la fecha ISO)
+-- =====================================================
+-- Las expresiones deben coincidir con generar_where_fecha_optimizada()
+-- para que el planificador las use en los rangos.
+
+CREATE INDEX IF NOT EXISTS idx_gastos_fecha_operacion_expr
+ON gastos(
+    COALESCE(fecha_operacion_iso, substr(fecha_operacion, 7, 4) || '-' || substr(fecha_operacion, 4, 2) || '-' || substr(fecha_operacion, 1, 2)),
+    importe_eur
+);
+
+CREATE INDEX IF NOT EXISTS idx_gastos_fecha_valor_optimized
+ON gastos(
+    substr(fecha_valor,7,4) || '-' || substr(fecha_valor,4,2) || '-' || substr(fecha_valor,1,2),
+    importe_eur
+);
+
+-- =====================================================
+-- 4. ESTADÍSTICAS DEL PLANIFICADOR
+-- =====================================================
+
+ANALYZE tickets;
+ANALYZE factura;
+ANALYZE detalle_proforma;
+ANALYZE gastos;
+
+SELECT '===== ÍNDICES DE RANGO DE FECHA - FIN =====' as INFO;
+SELECT name, tbl_name
+FROM sqlite_master
+WHERE type = 'index'
+AND name IN (
+    'idx_tickets_estado_fecha_total', 'idx_factura_estado_fecha_total',
+    'idx_factura_contacto_estado_fecha', 'idx_detalle_proforma_fecha',
+    'idx_gastos_fecha_operacion_expr', 'idx_gastos_fecha_valor_optimized'
+)
+ORDER BY tbl_name, name;
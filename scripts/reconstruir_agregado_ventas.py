@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RECONSTRUCCIÓN DEL AGREGADO MENSUAL DE VENTAS
+=============================================
+Instala (si faltan) la tabla ventas_agregado_mensual y sus triggers y la
+recalcula desde tickets, factura y proformas.
+
+Sin argumentos recorre las BD de todas las empresas activas; también admite
+rutas de BD concretas.
+
+Uso:
+    python scripts/reconstruir_agregado_ventas.py [ruta.db ...]
+"""
+
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multiempresa_config import BASE_DIR, DB_USUARIOS_PATH
+from ventas_agregado import instalar_agregado_ventas
+
+
+def rutas_empresas():
+    """Rutas de las BD de las empresas activas"""
+    conn = sqlite3.connect(DB_USUARIOS_PATH)
+    try:
+        filas = conn.execute('SELECT codigo, db_path FROM empresas WHERE activa = 1').fetchall()
+    finally:
+        conn.close()
+    return [(codigo, db_path if os.path.isabs(db_path) else os.path.join(BASE_DIR, db_path))
+            for codigo, db_path in filas if db_path]
+
+
+def reconstruir(db_path):
+    """Reconstruye el agregado de una BD; devuelve el número de filas"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        instalar_agregado_ventas(conn, reconstruir=True)
+        return conn.execute('SELECT COUNT(*) FROM ventas_agregado_mensual').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main(rutas):
+    objetivos = [(os.path.basename(r), r) for r in rutas] if rutas else rutas_empresas()
+    errores = 0
+    for nombre, db_path in objetivos:
+        if not os.path.exists(db_path):
+            print(f"⚠️  {nombre}: {db_path} no existe")
+            errores += 1
+            continue
+        try:
+            print(f"✅ {nombre}: {reconstruir(db_path)} filas")
+        except Exception as e:
+            print(f"❌ {nombre}: {e}")
+            errores += 1
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
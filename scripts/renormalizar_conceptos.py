@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RECÁLCULO DE CONCEPTOS NORMALIZADOS DE GASTOS
+=============================================
+Instala (si faltan) la columna gastos.concepto_normalizado y la tabla
+reglas_normalizacion_concepto y recalcula el concepto normalizado de todos
+los gastos con las reglas actuales de cada empresa. Útil tras editar las
+reglas sin reiniciar la aplicación: el script guarda la firma de las reglas
+nuevas y los procesos en marcha, al ver que ya no coincide con la suya, las
+vuelven a cargar antes de normalizar más gastos.
+
+Sin argumentos recorre las BD de todas las empresas activas; también admite
+rutas de BD concretas.
+
+Uso:
+    python scripts/renormalizar_conceptos.py [ruta.db ...]
+"""
+
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multiempresa_config import BASE_DIR, DB_USUARIOS_PATH
+from cache_estadisticas import incrementar_version_datos
+from normalizador_conceptos import (Normalizador, cargar_reglas_empresa, instalar_concepto_normalizado,
+                                    rellenar_conceptos_normalizados)
+
+
+def rutas_empresas():
+    """Rutas de las BD de las empresas activas"""
+    conn = sqlite3.connect(DB_USUARIOS_PATH)
+    try:
+        filas = conn.execute('SELECT codigo, db_path FROM empresas WHERE activa = 1').fetchall()
+    finally:
+        conn.close()
+    return [(codigo, db_path if os.path.isabs(db_path) else os.path.join(BASE_DIR, db_path))
+            for codigo, db_path in filas if db_path]
+
+
+def renormalizar(db_path):
+    """Recalcula los conceptos de una BD; devuelve el número de gastos"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        normalizador = Normalizador(cargar_reglas_empresa(conn))
+        if not instalar_concepto_normalizado(conn, normalizador):
+            return 0
+        conn.execute('UPDATE gastos SET concepto_normalizado = NULL')
+        # Las estadísticas agrupadas por concepto cacheadas dejan de valer
+        incrementar_version_datos(conn, 'gastos')
+        return rellenar_conceptos_normalizados(conn, normalizador)
+    finally:
+        conn.close()
+
+
+def main(rutas):
+    objetivos = [(os.path.basename(r), r) for r in rutas] if rutas else rutas_empresas()
+    errores = 0
+    for nombre, db_path in objetivos:
+        if not os.path.exists(db_path):
+            print(f"⚠️  {nombre}: {db_path} no existe")
+            errores += 1
+            continue
+        try:
+            print(f"✅ {nombre}: {renormalizar(db_path)} gastos")
+        except Exception as e:
+            print(f"❌ {nombre}: {e}")
+            errores += 1
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
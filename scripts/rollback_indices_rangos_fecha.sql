@@ -0,0 +1,19 @@
+-- =====================================================
+-- SCRIPT DE ROLLBACK - ÍNDICES DE RANGO DE FECHA
+-- Fecha: 2026-10-17
+-- Descripción: Elimina los índices creados por indices_rangos_fecha.sql
+--              (idx_gastos_fecha_valor_optimized pertenece a indices_optimizados_v2.sql
+--              y se conserva)
+-- =====================================================
+
+.echo on
+.headers on
+SELECT '===== ROLLBACK DE ÍNDICES DE RANGO DE FECHA =====' as INFO;
+
+DROP INDEX IF EXISTS idx_tickets_estado_fecha_total;
+DROP INDEX IF EXISTS idx_factura_estado_fecha_total;
+DROP INDEX IF EXISTS idx_factura_contacto_estado_fecha;
+DROP INDEX IF EXISTS idx_detalle_proforma_fecha;
+DROP INDEX IF EXISTS idx_gastos_fecha_operacion_expr;
+
+SELECT COUNT(*) as Indices_Despues FROM sqlite_master WHERE type = 'index';
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WORKER DE LA OUTBOX VERI*FACTU
+==============================
+Genera el XML Facturae y envía a la AEAT las facturas que crear_factura deja
+en verifactu_outbox, empresa por empresa y en orden de creación. Debe
+ejecutarse un solo worker por servidor (p. ej. como servicio systemd junto
+a Gunicorn). crear_factura solo encola con VERIFACTU_OUTBOX=1
+(VERIFACTU_OUTBOX_CONFIG['ACTIVA']): activarlo únicamente donde este worker
+esté en marcha.
+
+Uso:
+    python scripts/verifactu_worker.py [--una-vez] [--local] [--estado]
+
+    --una-vez   una sola pasada por todas las empresas (cron)
+    --local     usar el stub SOAP local en lugar de la AEAT (pruebas)
+    --estado    mostrar las filas de la outbox por empresa y estado, sin enviar
+"""
+
+import argparse
+import os
+import signal
+import sqlite3
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from verifactu_outbox import WorkerOutbox, empresas_activas, estado_outbox
+
+
+def mostrar_estado():
+    for empresa in empresas_activas():
+        if not os.path.exists(empresa['db_path']):
+            continue
+        conn = sqlite3.connect(empresa['db_path'])
+        try:
+            estados = estado_outbox(conn)
+        finally:
+            conn.close()
+        if estados:
+            resumen = ', '.join(f"{estado}={total}" for estado, total in sorted(estados.items()))
+            print(f"   {empresa['codigo']:<12} {resumen}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker de la outbox de Facturae y VERI*FACTU')
+    parser.add_argument('--una-vez', action='store_true', help='Una sola pasada por todas las empresas')
+    parser.add_argument('--local', action='store_true', help='Stub SOAP local en lugar de la AEAT')
+    parser.add_argument('--estado', action='store_true', help='Mostrar el estado de la outbox y salir')
+    args = parser.parse_args()
+
+    if args.estado:
+        print("📋 Outbox VERI*FACTU")
+        mostrar_estado()
+        return 0
+
+    enviar = None
+    if args.local:
+        from verifactu.soap.stub import enviar_registro_aeat_local
+        enviar = enviar_registro_aeat_local
+    worker = WorkerOutbox(enviar=enviar)
+
+    if args.una_vez:
+        procesadas = worker.vuelta()
+        print(f"✅ {procesadas} facturas procesadas: {worker.get_metrics()}")
+        return 0
+
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    signal.signal(signal.SIGINT, lambda *_: parar.set())
+    print("🚀 Worker VERI*FACTU iniciado")
+    worker.ejecutar(parar)
+    print(f"🛑 Worker VERI*FACTU detenido: {worker.get_metrics()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
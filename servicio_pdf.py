@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SERVICIO DE GENERACIÓN DE PDF
+=============================
+Cada PDF (facturas, presupuestos, cartas de reclamación) se generaba con
+HTML(string=...).write_pdf() en el hilo de la petición: WeasyPrint volvía a
+cargar fuentes y hojas de estilo cada vez y el trabajo de CPU bloqueaba el
+worker web. batchFacturas lanzaba además wkhtmltopdf por factura.
+
+El servicio separa ese trabajo:
+
+- Trabajadores: procesos de larga duración (SERVICIO_PDF_CONFIG['PROCESOS']
+  por proceso web) que importan WeasyPrint, cargan las fuentes y compilan
+  las hojas de estilo habituales al arrancar. Se arrancan al primer uso y
+  se reciclan tras MAX_TRABAJOS documentos
+- Cola: las peticiones esperan un trabajador libre hasta ESPERA_MAX
+  segundos; un documento que tarda más de TIMEOUT mata su trabajador, que
+  se sustituye por otro nuevo
+- Cache por contenido: SHA-256 del HTML, las hojas de estilo, la URL base
+  y la fecha de modificación de los archivos que referencia (logo, CSS).
+  Un documento sin cambios no se vuelve a generar; si dos hilos piden a la
+  vez el mismo, el segundo espera al primero. Los PDF se guardan en un
+  AlmacenLRU (cache_lru), el mismo almacén de la cache de extracciones
+
+Con PROCESOS = 0 se genera en el hilo que lo pide (con la misma cache).
+"""
+
+import atexit
+import hashlib
+import multiprocessing
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+from cache_lru import AlmacenLRU, ProduccionUnica
+from logger_config import get_logger
+from multiempresa_config import SERVICIO_PDF_CONFIG
+
+logger = get_logger(__name__)
+
+# Cambiarla invalida los PDF guardados (p. ej. al actualizar WeasyPrint)
+VERSION_CACHE = '1'
+
+# Referencias a recursos del documento: src/href y url() de CSS
+_RECURSOS = re.compile(r'''(?:src|href)\s*=\s*["']([^"']+)["']|url\(\s*["']?([^"')]+)["']?\s*\)''', re.IGNORECASE)
+
+
+def _ruta_recurso(referencia: str, base_url: Optional[str]) -> Optional[str]:
+    if referencia.startswith('file://'):
+        return referencia[len('file://'):]
+    if re.match(r'^[a-z][a-z0-9+.-]*:|^#', referencia, re.IGNORECASE) or not base_url:
+        return None  # data:, http(s):, mailto:, anclas
+    return os.path.join(base_url, referencia.split('?', 1)[0].lstrip('/'))
+
+
+def huella_documento(html: str, estilos: Optional[str] = None, base_url: Optional[str] = None,
+                     renderizador: str = 'weasyprint') -> str:
+    """
+    Clave de cache del documento. Incluye la fecha de modificación y el
+    tamaño de los archivos locales referenciados: cambiar el logo o el CSS
+    genera un PDF nuevo aunque el HTML sea el mismo.
+    """
+    firma = hashlib.sha256()
+    for parte in (VERSION_CACHE, renderizador, estilos or '', base_url or '', html):
+        firma.update(parte.encode('utf-8'))
+        firma.update(b'\x00')
+    referencias = {a or b for a, b in _RECURSOS.findall(html)}
+    for referencia in sorted(referencias):
+        ruta = _ruta_recurso(referencia.strip(), base_url)
+        if ruta is None:
+            continue
+        try:
+            estado = os.stat(ruta)
+            firma.update(f'{ruta}\x00{estado.st_mtime_ns}\x00{estado.st_size}\x00'.encode('utf-8'))
+        except OSError:
+            firma.update(f'{ruta}\x00-\x00'.encode('utf-8'))
+    return firma.hexdigest()
+
+
+# ============================================================================
+# TRABAJADORES
+# ============================================================================
+
+def _crear_renderizador(nombre: str, latencia: float = 0.0, precargados=()):
+    """
+    Función renderizar(html, estilos, base_url) -> bytes. La de WeasyPrint
+    comparte configuración de fuentes y hojas de estilo compiladas entre
+    documentos del mismo proceso.
+    """
+    if nombre == 'local':
+        def renderizar_local(html, estilos, base_url):
+            if latencia:
+                time.sleep(latencia)
+            contenido = hashlib.sha256(f'{estilos}\x00{base_url}\x00{html}'.encode('utf-8')).hexdigest()
+            return f'%PDF-1.4\n% local {contenido}\n%%EOF\n'.encode('ascii')
+        return renderizar_local
+
+    from weasyprint import CSS, HTML
+    from weasyprint.text.fonts import FontConfiguration
+
+    fuentes = FontConfiguration()
+    hojas = {}
+
+    def hoja(estilos):
+        if estilos not in hojas:
+            hojas[estilos] = CSS(string=estilos, font_config=fuentes)
+        return hojas[estilos]
+
+    def renderizar(html, estilos, base_url):
+        return HTML(string=html, base_url=base_url).write_pdf(
+            stylesheets=[hoja(estilos)] if estilos else None, font_config=fuentes)
+
+    for estilos in precargados:
+        hoja(estilos)
+    # Documento mínimo para cargar Pango y las fuentes antes del primer documento real
+    renderizar('<p>PDF</p>', precargados[0] if precargados else None, None)
+    return renderizar
+
+
+def _bucle_trabajador(conexion, nombre: str, latencia: float, precargados):
+    """Proceso trabajador: recibe (html, estilos, base_url) y responde ('ok', pdf) o ('error', texto)"""
+    try:
+        renderizar = _crear_renderizador(nombre, latencia, precargados)
+    except Exception as e:
+        conexion.send(('error', f'{type(e).__name__}: {e}'))
+        return
+    conexion.send(('listo', os.getpid()))
+    while True:
+        try:
+            trabajo = conexion.recv()
+        except (EOFError, OSError):
+            return
+        if trabajo is None:
+            return
+        try:
+            conexion.send(('ok', renderizar(*trabajo)))
+        except Exception as e:
+            conexion.send(('error', f'{type(e).__name__}: {e}'))
+
+
+class _Trabajador:
+    """Proceso trabajador visto desde el proceso web"""
+
+    def __init__(self, contexto, config: Dict[str, Any]):
+        self.conexion, hijo = contexto.Pipe()
+        self.proceso = contexto.Process(
+            target=_bucle_trabajador, name='pdf-trabajador', daemon=True,
+            args=(hijo, config['RENDERIZADOR'], config['LATENCIA_LOCAL'], tuple(config['ESTILOS_PRECARGADOS']))
+        )
+        self.proceso.start()
+        hijo.close()
+        self.trabajos = 0
+        try:
+            estado, detalle = self._respuesta(config['ARRANQUE'])
+        except Exception:
+            self.detener(forzar=True)
+            raise
+        if estado != 'listo':
+            self.detener(forzar=True)
+            raise RuntimeError(f"No se pudo arrancar el trabajador de PDF: {detalle}")
+
+    def _respuesta(self, timeout: float):
+        if not self.conexion.poll(timeout):
+            raise TimeoutError(f"El trabajador de PDF no respondió en {timeout} s")
+        return self.conexion.recv()
+
+    def vivo(self) -> bool:
+        return self.proceso.is_alive()
+
+    def renderizar(self, html: str, estilos: Optional[str], base_url: Optional[str], timeout: float) -> bytes:
+        self.conexion.send((html, estilos, base_url))
+        estado, resultado = self._respuesta(timeout)
+        self.trabajos += 1
+        if estado != 'ok':
+            raise RuntimeError(f"Error generando PDF: {resultado}")
+        return resultado
+
+    def detener(self, forzar: bool = False):
+        if not forzar:
+            try:
+                self.conexion.send(None)
+                self.proceso.join(2)
+            except (OSError, ValueError):
+                pass
+        if self.proceso.is_alive():
+            self.proceso.kill()
+            self.proceso.join(2)
+        self.conexion.close()
+
+
+class PoolPDF:
+    """
+    Trabajadores de PDF de este proceso. Cada hueco de la cola guarda un
+    trabajador arrancado o None (se arranca al usarlo).
+    """
+
+    def __init__(self, config: Dict[str, Any], metrics: 'ServicioPDFMetrics', lock: threading.Lock):
+        self.config = config
+        self.metrics = metrics
+        self._lock = lock
+        # spawn: el proceso web tiene hilos y conexiones abiertas que no deben heredarse
+        self._contexto = multiprocessing.get_context('spawn')
+        self._pid = None
+        self._libres: queue.Queue = queue.Queue()
+        self._todos = set()
+
+    def _preparar(self):
+        """Huecos del pool; se rehace si el proceso web se ha bifurcado (los trabajadores son del padre)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._libres = queue.Queue()
+                for _ in range(self.config['PROCESOS']):
+                    self._libres.put(None)
+                self._todos = set()
+                self._pid = os.getpid()
+
+    def _contar(self, campo, cantidad=1):
+        with self._lock:
+            setattr(self.metrics, campo, getattr(self.metrics, campo) + cantidad)
+
+    def renderizar(self, html: str, estilos: Optional[str], base_url: Optional[str]) -> bytes:
+        """
+        Raises:
+            TimeoutError: Sin trabajador libre en ESPERA_MAX o documento que supera TIMEOUT
+            RuntimeError: Error de WeasyPrint o trabajador caído
+        """
+        self._preparar()
+        libres = self._libres
+        try:
+            trabajador = libres.get(timeout=self.config['ESPERA_MAX'])
+        except queue.Empty:
+            self._contar('rechazos')
+            raise TimeoutError(f"Ningún trabajador de PDF libre en {self.config['ESPERA_MAX']} s")
+
+        devolver = trabajador
+        try:
+            if trabajador is None or not trabajador.vivo():
+                devolver = None
+                if trabajador is not None:
+                    self._retirar(trabajador, forzar=True)
+                trabajador = _Trabajador(self._contexto, self.config)
+                with self._lock:
+                    self._todos.add(trabajador)
+                    self.metrics.arranques += 1
+                devolver = trabajador
+            pdf = trabajador.renderizar(html, estilos, base_url, self.config['TIMEOUT'])
+            if trabajador.trabajos >= self.config['MAX_TRABAJOS']:
+                devolver = None
+                self._retirar(trabajador)
+                self._contar('reciclados')
+            return pdf
+        except TimeoutError:
+            if devolver is not None:
+                devolver = None
+                self._retirar(trabajador, forzar=True)
+                self._contar('timeouts')
+                logger.error(f"Documento PDF de más de {self.config['TIMEOUT']} s: trabajador reiniciado")
+            raise
+        except (EOFError, OSError) as e:
+            if devolver is not None:
+                devolver = None
+                self._retirar(trabajador, forzar=True)
+            raise RuntimeError(f"Trabajador de PDF caído: {e}") from e
+        finally:
+            libres.put(devolver)
+
+    def _retirar(self, trabajador: _Trabajador, forzar: bool = False):
+        with self._lock:
+            self._todos.discard(trabajador)
+        trabajador.detener(forzar)
+
+    def detener(self):
+        """Detiene los trabajadores de este proceso"""
+        with self._lock:
+            todos = list(self._todos) if self._pid == os.getpid() else []
+            self._todos = set()
+            self._pid = None
+        for trabajador in todos:
+            trabajador.detener()
+
+
+# ============================================================================
+# SERVICIO
+# ============================================================================
+
+@dataclass
+class ServicioPDFMetrics:
+    """Métricas del servicio de PDF"""
+    aciertos: int = 0
+    generados: int = 0
+    esperas: int = 0  # peticiones que esperaron a que otro hilo generase el mismo documento
+    errores: int = 0
+    errores_cache: int = 0
+    timeouts: int = 0
+    rechazos: int = 0  # sin trabajador libre en ESPERA_MAX
+    arranques: int = 0
+    reciclados: int = 0
+    expulsiones: int = 0
+    segundos_generando: float = 0.0
+    segundos_ahorrados: float = 0.0
+
+
+class ServicioPDF:
+    """Generación de PDF con cache por contenido, en trabajadores o en el propio hilo"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = dict(SERVICIO_PDF_CONFIG, **(config or {}))
+        self.metrics = ServicioPDFMetrics()
+        self._lock = threading.Lock()
+        self._produccion = ProduccionUnica()
+        self.pool = PoolPDF(self.config, self.metrics, self._lock) if self.config['PROCESOS'] > 0 else None
+        self.cache = AlmacenLRU(self.config['CACHE_RUTA'], self.config['CACHE_MAX_ENTRADAS'],
+                                self.config['CACHE_MAX_BYTES']) if self.config['CACHE_ACTIVA'] else None
+
+    def _contar(self, campo, cantidad=1):
+        with self._lock:
+            setattr(self.metrics, campo, getattr(self.metrics, campo) + cantidad)
+
+    def _de_cache(self, huella: str) -> Optional[bytes]:
+        if self.cache is None:
+            return None
+        try:
+            guardado = self.cache.obtener(huella)
+        except sqlite3.Error as e:
+            self._contar('errores_cache')
+            logger.error(f"Error leyendo la cache de PDF: {e}")
+            return None
+        if guardado is None:
+            return None
+        with self._lock:
+            self.metrics.aciertos += 1
+            self.metrics.segundos_ahorrados += guardado[1]
+        return guardado[0]
+
+    def _a_cache(self, huella: str, pdf: bytes, segundos: float):
+        if self.cache is None:
+            return
+        try:
+            expulsadas = self.cache.guardar(huella, pdf, segundos)
+        except sqlite3.Error as e:
+            self._contar('errores_cache')
+            logger.error(f"Error guardando en la cache de PDF: {e}")
+            return
+        if expulsadas:
+            self._contar('expulsiones', expulsadas)
+
+    def _generar(self, html: str, estilos: Optional[str], base_url: Optional[str]) -> bytes:
+        if self.pool is not None:
+            return self.pool.renderizar(html, estilos, base_url)
+        renderizar = _crear_renderizador(self.config['RENDERIZADOR'], self.config['LATENCIA_LOCAL'])
+        return renderizar(html, estilos, base_url)
+
+    def _generar_contando(self, html: str, estilos: Optional[str], base_url: Optional[str]):
+        """(pdf, segundos) de _generar, con las métricas de generación y errores"""
+        inicio = time.perf_counter()
+        try:
+            pdf = self._generar(html, estilos, base_url)
+        except Exception:
+            self._contar('errores')
+            raise
+        segundos = time.perf_counter() - inicio
+        with self._lock:
+            self.metrics.generados += 1
+            self.metrics.segundos_generando += segundos
+        return pdf, segundos
+
+    def renderizar(self, html: str, estilos: Optional[str] = None, base_url: Optional[str] = None) -> bytes:
+        """
+        Bytes del PDF de `html`, de la cache si el documento no ha cambiado.
+
+        Raises:
+            TimeoutError: Sin trabajador libre o documento que supera el tiempo máximo
+            RuntimeError: Error de WeasyPrint o del trabajador
+        """
+        huella = huella_documento(html, estilos, base_url, self.config['RENDERIZADOR'])
+        if self.cache is None:
+            # Sin cache no hay nada que compartir con otro hilo que genere el mismo documento
+            return self._generar_contando(html, estilos, base_url)[0]
+
+        def generar():
+            pdf, segundos = self._generar_contando(html, estilos, base_url)
+            self._a_cache(huella, pdf, segundos)
+            return pdf
+
+        return self._produccion.ejecutar(huella, lambda: self._de_cache(huella), generar,
+                                         lambda: self._contar('esperas'))
+
+    def generar(self, html: str, destino: str, estilos: Optional[str] = None, base_url: Optional[str] = None) -> str:
+        """Escribe en `destino` el PDF de `html` (ver renderizar) y devuelve la ruta"""
+        pdf = self.renderizar(html, estilos, base_url)
+        with open(destino, 'wb') as f:
+            f.write(pdf)
+        return destino
+
+    def detener(self):
+        if self.pool is not None:
+            self.pool.detener()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            datos = asdict(self.metrics)
+        datos['segundos_generando'] = round(datos['segundos_generando'], 3)
+        datos['segundos_ahorrados'] = round(datos['segundos_ahorrados'], 3)
+        datos['procesos'] = self.config['PROCESOS']
+        return datos
+
+
+_servicio = None
+_servicio_lock = threading.Lock()
+
+
+def get_servicio_pdf() -> ServicioPDF:
+    """Servicio único por proceso; los trabajadores se detienen al salir"""
+    global _servicio
+    if _servicio is None:
+        with _servicio_lock:
+            if _servicio is None:
+                _servicio = ServicioPDF()
+                atexit.register(_servicio.detener)
+    return _servicio
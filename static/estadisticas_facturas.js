@@ -119,6 +119,7 @@ document.addEventListener('DOMContentLoaded', async () => {
   let ultimoMes = null;
   let ultimoAnio = null;
   let ultimoDatos = null; // cache de último payload para cálculos globales
+  let ultimoResumen = null; // último /api/dashboard/resumen (el modal de gráficos reutiliza cantidad_mes)
   async function recargarEstadisticas() {
     const { mes, anio } = getFechaSeleccionada();
     // Evitar llamadas innecesarias: solo si cambia mes o año
@@ -129,10 +130,13 @@ document.addEventListener('DOMContentLoaded', async () => {
     console.log('[RELOAD] Recargando estadísticas para:', mes, '/', anio);
     
     try {
+      // Un único payload con todas las tarjetas; si falla, cada sección pide su endpoint
+      const resumen = await cargarResumenDashboard(mes, anio);
+      ultimoResumen = resumen;
       // Siempre recargar estadísticas de Ventas
       await Promise.all([
-        cargarEstadisticas(mes, anio),
-        cargarIngresosGastosTotales(mes, anio)
+        cargarEstadisticas(mes, anio, resumen),
+        cargarIngresosGastosTotales(mes, anio, resumen)
       ]);
       
       // Si la pestaña Gastos está activa, recargar sus datos también
@@ -154,6 +158,16 @@ document.addEventListener('DOMContentLoaded', async () => {
     }
   }
   
+  async function cargarResumenDashboard(mes, anio) {
+    try {
+      // Sin parámetro t: el navegador revalida con el ETag y recibe 304 si nada cambió
+      return await fetchConManejadorErrores(buildApiUrl('/api/dashboard/resumen?' + new URLSearchParams({ mes, anio })));
+    } catch (e) {
+      console.warn('[estadisticas] /api/dashboard/resumen no disponible, usando endpoints individuales:', e);
+      return null;
+    }
+  }
+  
   function getFechaSeleccionada() {
     const selector = document.getElementById('selector-fecha');
     if (selector && selector.value) {
@@ -240,13 +254,14 @@ document.addEventListener('DOMContentLoaded', async () => {
   // ==============================
   // CARGA ESTADISTICAS COMPLETAS
   // ==============================
-  async function cargarEstadisticas(mes, anio) {
+  async function cargarEstadisticas(mes, anio, resumen = null) {
     const mesNum = parseInt(mes, 10); // 1-12
     
     const qp = new URLSearchParams({ mes, anio, t: Date.now() });
     let datos;
     try {
-      datos = await fetchConManejadorErrores(buildApiUrl('/api/ventas/media_por_documento?' + qp));
+      datos = resumen?.media_por_documento
+        || await fetchConManejadorErrores(buildApiUrl('/api/ventas/media_por_documento?' + qp));
     } catch (e) {
       console.warn('[estadisticas] Fallback: media_por_documento falló, voy a construir datos desde total_mes', e);
       datos = await construirDatosDesdeTotales(mes, anio);
@@ -382,7 +397,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     if(datos.proformas) ajustarMediaMensual(datos.proformas);
     if(datos.global) ajustarMediaMensual(datos.global);
     // Completar cantidades del mes con la serie total_mes para garantizar media mensual correcta
-    await completarCantidadesMesDesdeTotales(mes, anio, datos);
+    await completarCantidadesMesDesdeTotales(mes, anio, datos, resumen?.total_mes);
     const global = datos.global;
     // cachear para cálculos globales de cantidad vs año pasado
     ultimoDatos = datos;
@@ -396,10 +411,12 @@ document.addEventListener('DOMContentLoaded', async () => {
     actualizarGlobal(global);
   
     // Cargar top clientes y productos desde un único endpoint del backend
-    const topClientes = await fetchConManejadorErrores(buildApiUrl('/api/clientes/top_ventas?' + qp));
+    const topClientes = resumen?.top_clientes
+      || await fetchConManejadorErrores(buildApiUrl('/api/clientes/top_ventas?' + qp));
     actualizarTopClientes(topClientes);
     try {
-      const topProductos = await fetchConManejadorErrores(buildApiUrl('/api/productos/top_ventas?' + qp));
+      const topProductos = resumen?.top_productos
+        || await fetchConManejadorErrores(buildApiUrl('/api/productos/top_ventas?' + qp));
       actualizarTopProductos(topProductos);
     } catch (errorTopProd) {
       console.warn('[estadisticas] Error cargando /productos/top_ventas, usando fallback del payload de clientes:', errorTopProd);
@@ -532,11 +549,12 @@ document.addEventListener('DOMContentLoaded', async () => {
   // Completa las cantidades del mes seleccionado a partir de /api/ventas/total_mes
   // Esto asegura que la 'Media por Ticket/Factura' pueda calcularse como total_mes / cantidad_mes
   // incluso si el endpoint media_por_documento no envía la cantidad mensual.
-  async function completarCantidadesMesDesdeTotales(mes, anio, datos) {
+  async function completarCantidadesMesDesdeTotales(mes, anio, datos, totalesPrecargados = null) {
     try {
       const mesNum = parseInt(mes, 10);
       const keySel = String(mesNum).padStart(2, '0');
-      const totales = await fetchConManejadorErrores(buildApiUrl(`/api/ventas/total_mes?anio=${anio}&t=${Date.now()}`));
+      const totales = totalesPrecargados
+        || await fetchConManejadorErrores(buildApiUrl(`/api/ventas/total_mes?anio=${anio}&t=${Date.now()}`));
       const getCantidadMes = (serie) => {
         if (!serie) return 0;
         const entry = serie[keySel];
@@ -790,8 +808,9 @@ document.addEventListener('DOMContentLoaded', async () => {
   // ==============================
   // INGRESOS & GASTOS TOTALES
   // ==============================
-  async function cargarIngresosGastosTotales(mes, anio){
-    const data = await fetchConManejadorErrores(buildApiUrl(`/api/ingresos_gastos_totales?anio=${anio}&mes=${mes}&t=${Date.now()}`));
+  async function cargarIngresosGastosTotales(mes, anio, resumen = null){
+    const data = resumen?.ingresos_gastos_totales
+      || await fetchConManejadorErrores(buildApiUrl(`/api/ingresos_gastos_totales?anio=${anio}&mes=${mes}&t=${Date.now()}`));
     const ingresos = data.ingresos;
     const gastos   = data.gastos;
     const ingresosEl = document.getElementById('ig-total-ingresos');
@@ -935,25 +954,6 @@ document.addEventListener('DOMContentLoaded', async () => {
     setTimeout(() => { try { chartProducto.resize(); } catch(e){} }, 50);
   }
 
-  // ==============================
-  // TOP GASTOS
-  // ==============================
-  async function cargarTopGastos(anio) {
-    const datos = await fetchConManejadorErrores(buildApiUrl(`/api/gastos/top_gastos?anio=${anio}&t=${Date.now()}`));
-    actualizarTopGastos(datos);
-  }
-  
-  function actualizarTopGastos(datos) {
-    const tbody = document.getElementById('topGastosBody');
-    if (!tbody) return;
-    tbody.innerHTML = '';
-    datos.gastos.forEach(g => {
-      tbody.innerHTML += `<tr><td title="${g.concepto}">${g.concepto.slice(0,25)}${g.concepto.length>25?'...':''}</td>
-        <td>${formatearImporte(g.total_actual)}</td>
-        <td class="${g.porcentaje_diferencia>=0?'positive':'negative'}">${formatearPorcentaje(g.porcentaje_diferencia)}</td></tr>`;
-    });
-  }
-  
   // ==============================
   // EXTRACTO BANCO (ELIMINADO)
   // ==============================
@@ -1099,12 +1099,14 @@ document.addEventListener('DOMContentLoaded', async () => {
       fetchConManejadorErrores(buildApiUrl(`/api/ventas/total_mes?anio=${anio}`)),
       fetchConManejadorErrores(buildApiUrl(`/api/ventas/total_mes?anio=${anioAnterior}`))
     ]);
-    // Serie de CANTIDADES por mes (si el endpoint existe). Fallback seguro a null.
-    let cantidadesActual = null;
-    try {
-      cantidadesActual = await fetchConManejadorErrores(buildApiUrl(`/api/ventas/cantidad_mes?anio=${anio}`));
-    } catch(e) {
-      cantidadesActual = null;
+    // Serie de CANTIDADES por mes: la del resumen ya cargado si es del mismo año. Fallback seguro a null.
+    let cantidadesActual = ultimoResumen && Number(ultimoResumen.anio) === Number(anio) ? ultimoResumen.cantidad_mes : null;
+    if (!cantidadesActual) {
+      try {
+        cantidadesActual = await fetchConManejadorErrores(buildApiUrl(`/api/ventas/cantidad_mes?anio=${anio}`));
+      } catch(e) {
+        cantidadesActual = null;
+      }
     }
   
     const meses = ['Enero','Febrero','Marzo','Abril','Mayo','Junio','Julio','Agosto','Septiembre','Octubre','Noviembre','Diciembre'];
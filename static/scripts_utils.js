@@ -549,62 +549,41 @@ async function aplicarDescuentoPorFranja(precioUnitarioSinIVA, cantidad, product
   calculandoFranjas = true;
 
   try {
-    const response = await originalFetch(buildApiUrl(`/api/productos/${productoId}/franjas_descuento`), {
-      method: 'GET',
+    if (!(cantidad > 0)) {
+      registrarFranjaAplicada(null);
+      return precioUnitarioSinIVA;
+    }
+
+    // El servidor resuelve la franja con su índice de precios (sin recorrer las franjas aquí)
+    const response = await originalFetch(buildApiUrl('/api/productos/precios'), {
+      method: 'POST',
       headers: {
         'Content-Type': 'application/json'
-      }
+      },
+      body: JSON.stringify({ lineas: [{ producto_id: Number(productoId), cantidad }] })
     });
     if (!response.ok) {
-      console.warn(`Error al obtener franjas para producto ${productoId}: ${response.status}`);
+      console.warn(`Error al obtener precio por franja para producto ${productoId}: ${response.status}`);
       registrarFranjaAplicada(null);
-      calculandoFranjas = false;
       return precioUnitarioSinIVA;
     }
 
     const data = await response.json();
-    const franjas = data.franjas || [];
-
-    if (franjas.length === 0) {
-      console.warn(`No hay franjas definidas para producto ${productoId}`);
-      registrarFranjaAplicada(null);
-      calculandoFranjas = false;
-      return precioUnitarioSinIVA;
-    }
+    const linea = (data.lineas || [])[0];
 
-    let descuentoAplicable = 0;
-    let franjaAplicada = null;
-
-    for (const franja of franjas) {
-      if (cantidad >= franja.min_cantidad && cantidad <= franja.max_cantidad) {
-        descuentoAplicable = franja.porcentaje_descuento;
-        franjaAplicada = {
-          min: franja.min_cantidad,
-          max: franja.max_cantidad,
-          descuento: franja.porcentaje_descuento
-        };
-        break;
-      }
-    }
-
-    if (!franjaAplicada && franjas.length > 0) {
-      const ultimaFranja = franjas[franjas.length - 1];
-      if (cantidad > ultimaFranja.max_cantidad) {
-        descuentoAplicable = ultimaFranja.porcentaje_descuento;
-        franjaAplicada = {
-          min: ultimaFranja.min_cantidad,
-          max: ultimaFranja.max_cantidad,
-          descuento: ultimaFranja.porcentaje_descuento
-        };
-      }
-    }
-
-    if (!franjaAplicada) {
+    if (!linea || linea.error || !linea.franja) {
       console.warn(`No se encontró franja para cantidad ${cantidad} en producto ${productoId}`);
       registrarFranjaAplicada(null);
       return precioUnitarioSinIVA;
     }
 
+    const descuentoAplicable = linea.descuento;
+    const franjaAplicada = {
+      min: linea.franja.min,
+      max: linea.franja.max,
+      descuento: linea.descuento
+    };
+
     registrarFranjaAplicada(franjaAplicada);
 
     const factorDescuento = (100 - descuentoAplicable) / 100;
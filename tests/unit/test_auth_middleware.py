@@ -0,0 +1,214 @@
+"""
+Tests unitarios para el módulo auth_middleware.py
+
+Cubre:
+- Cache de permisos por (usuario, empresa)
+- Invalidación explícita de la cache
+- Decorador require_permission
+- Escritor asíncrono de auditoría
+"""
+import pytest
+import sys
+import sqlite3
+from pathlib import Path
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from unittest.mock import patch
+from flask import Flask
+
+import auth_middleware
+from auditoria_writer import AuditoriaWriter
+
+
+@pytest.fixture
+def db_usuarios(tmp_path):
+    """BD de usuarios con permisos de un usuario en una empresa"""
+    db_path = str(tmp_path / 'usuarios_sistema.db')
+    conn = sqlite3.connect(db_path)
+    conn.executescript('''
+        CREATE TABLE permisos_usuario_modulo (
+            usuario_id INTEGER, empresa_id INTEGER, modulo_codigo TEXT,
+            puede_ver INTEGER, puede_crear INTEGER, puede_editar INTEGER,
+            puede_eliminar INTEGER, puede_anular INTEGER, puede_exportar INTEGER,
+            PRIMARY KEY (usuario_id, empresa_id, modulo_codigo)
+        );
+        CREATE TABLE auditoria (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, usuario_id INTEGER, empresa_id INTEGER,
+            accion TEXT, modulo TEXT, descripcion TEXT, ip_address TEXT, user_agent TEXT
+        );
+        INSERT INTO permisos_usuario_modulo VALUES (1, 10, 'facturas', 1, 0, 0, 0, 0, 0);
+        INSERT INTO permisos_usuario_modulo VALUES (1, 10, 'tickets', 1, 1, 1, 1, 1, 1);
+    ''')
+    conn.commit()
+    conn.close()
+
+    auth_middleware.invalidar_cache_permisos()
+    with patch('auth_middleware.DB_USUARIOS_PATH', db_path):
+        yield db_path
+    auth_middleware.invalidar_cache_permisos()
+
+
+@pytest.fixture
+def app():
+    """Aplicación Flask mínima con un endpoint protegido"""
+    app = Flask(__name__)
+    app.secret_key = 'test'
+
+    @app.route('/crear-factura')
+    @auth_middleware.require_permission('facturas', 'crear')
+    def crear_factura():
+        return 'ok'
+
+    @app.route('/ver-factura')
+    @auth_middleware.require_permission('facturas', 'ver')
+    def ver_factura():
+        return 'ok'
+
+    return app
+
+
+class TestCachePermisos:
+    """Tests para la cache de permisos por proceso"""
+
+    def test_carga_matriz_completa(self, db_usuarios):
+        """Test una sola carga devuelve todos los módulos del usuario"""
+        permisos = auth_middleware.obtener_permisos_usuario_empresa(1, 10)
+
+        assert set(permisos) == {'facturas', 'tickets'}
+        assert permisos['facturas']['puede_ver'] == 1
+        assert permisos['facturas']['puede_crear'] == 0
+
+    def test_reutiliza_cache_sin_consultar_bd(self, db_usuarios):
+        """Test la segunda consulta no abre conexión"""
+        auth_middleware.obtener_permisos_usuario_empresa(1, 10)
+
+        with patch('auth_middleware.sqlite3.connect') as mock_connect:
+            permisos = auth_middleware.obtener_permisos_usuario_empresa(1, 10)
+
+        mock_connect.assert_not_called()
+        assert 'tickets' in permisos
+
+    def test_invalidacion_recarga_permisos(self, db_usuarios):
+        """Test invalidar la cache hace visibles los cambios"""
+        auth_middleware.obtener_permisos_usuario_empresa(1, 10)
+
+        conn = sqlite3.connect(db_usuarios)
+        conn.execute("UPDATE permisos_usuario_modulo SET puede_crear = 1 WHERE modulo_codigo = 'facturas'")
+        conn.commit()
+        conn.close()
+
+        assert auth_middleware.obtener_permisos_usuario_empresa(1, 10)['facturas']['puede_crear'] == 0
+
+        auth_middleware.invalidar_cache_permisos(usuario_id=1)
+
+        assert auth_middleware.obtener_permisos_usuario_empresa(1, 10)['facturas']['puede_crear'] == 1
+
+    def test_expira_por_ttl(self, db_usuarios):
+        """Test las entradas caducan al superar el TTL"""
+        with patch.dict(auth_middleware.SECURITY_CONFIG, {'PERMISOS_CACHE_TTL': 0}):
+            auth_middleware.obtener_permisos_usuario_empresa(1, 10)
+
+            with patch('auth_middleware.sqlite3.connect', wraps=sqlite3.connect) as mock_connect:
+                auth_middleware.obtener_permisos_usuario_empresa(1, 10)
+
+        mock_connect.assert_called_once()
+
+
+class TestRequirePermission:
+    """Tests para el decorador require_permission"""
+
+    def _cliente(self, app, usuario_id=1, empresa_id=10):
+        cliente = app.test_client()
+        with cliente.session_transaction() as sesion:
+            sesion['user_id'] = usuario_id
+            sesion['empresa_id'] = empresa_id
+            sesion['username'] = 'test'
+        return cliente
+
+    def test_permiso_concedido(self, app, db_usuarios):
+        """Test acceso con permiso"""
+        respuesta = self._cliente(app).get('/ver-factura')
+
+        assert respuesta.status_code == 200
+
+    def test_permiso_denegado(self, app, db_usuarios):
+        """Test acceso sin permiso devuelve 403"""
+        with patch('auth_middleware.registrar_auditoria'):
+            respuesta = self._cliente(app).get('/crear-factura')
+
+        assert respuesta.status_code == 403
+
+    def test_modulo_sin_permisos(self, app, db_usuarios):
+        """Test usuario sin fila de permisos en la empresa"""
+        with patch('auth_middleware.registrar_auditoria'):
+            respuesta = self._cliente(app, empresa_id=99).get('/ver-factura')
+
+        assert respuesta.status_code == 403
+
+
+
+class TestAuditoriaWriter:
+    """Tests para el escritor de auditoría en segundo plano"""
+
+    def _contar_auditoria(self, db_path):
+        conn = sqlite3.connect(db_path)
+        total = conn.execute('SELECT COUNT(*) FROM auditoria').fetchone()[0]
+        conn.close()
+        return total
+
+    def test_escribe_por_lotes(self, db_usuarios):
+        """Test los registros encolados se escriben en lotes"""
+        writer = AuditoriaWriter(db_usuarios, tamano_lote=10, intervalo_flush_ms=50)
+
+        for i in range(25):
+            assert writer.registrar((1, 10, f'accion_{i}', None, None, '127.0.0.1', 'pytest'))
+        writer.flush()
+
+        metricas = writer.get_metrics()
+        assert self._contar_auditoria(db_usuarios) == 25
+        assert metricas['escritos'] == 25
+        assert metricas['lotes'] >= 3
+        assert metricas['profundidad_cola'] == 0
+        writer.shutdown()
+
+    def test_vacia_cola_al_apagar(self, db_usuarios):
+        """Test shutdown escribe lo pendiente y detiene el hilo"""
+        writer = AuditoriaWriter(db_usuarios, tamano_lote=1000, intervalo_flush_ms=5000)
+
+        for i in range(5):
+            writer.registrar((1, 10, 'login', None, None, '127.0.0.1', 'pytest'))
+        writer.shutdown()
+
+        assert self._contar_auditoria(db_usuarios) == 5
+        assert not writer.get_metrics()['hilo_activo']
+        assert not writer.registrar((1, 10, 'tarde', None, None, '127.0.0.1', 'pytest'))
+
+    def test_descarta_con_cola_llena(self, db_usuarios):
+        """Test con la cola llena se descarta y se contabiliza"""
+        writer = AuditoriaWriter(db_usuarios, max_cola=2)
+
+        with patch.object(writer, '_iniciar'):
+            resultados = [writer.registrar((1, 10, 'x', None, None, '', '')) for _ in range(5)]
+
+        assert resultados == [True, True, False, False, False]
+        assert writer.get_metrics()['descartados'] == 3
+        assert writer.get_metrics()['max_profundidad'] == 2
+
+    def test_registrar_auditoria_encola(self, app, db_usuarios):
+        """Test registrar_auditoria no escribe en la petición, solo encola"""
+        writer = AuditoriaWriter(db_usuarios)
+
+        with app.test_request_context('/', headers={'User-Agent': 'pytest'}):
+            with patch('auth_middleware.get_auditoria_writer', return_value=writer), \
+                 patch.object(writer, '_iniciar'):
+                auth_middleware.registrar_auditoria('logout', descripcion='Logout de test')
+
+        assert writer.get_metrics()['profundidad_cola'] == 1
+        assert self._contar_auditoria(db_usuarios) == 0
+
+
+# Ejecutar tests si se ejecuta directamente
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,146 @@
+"""
+Tests unitarios para cache_estadisticas.py
+"""
+import sqlite3
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from flask import Flask, jsonify
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import cache_estadisticas as ce
+
+
+class _Conexion:
+    """Envoltorio con context manager que no cierra la BD compartida del test"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *args):
+        return False
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conexion = sqlite3.connect(str(tmp_path / 'empresa.db'), check_same_thread=False)
+    conexion.executescript('''
+        CREATE TABLE gastos (id INTEGER PRIMARY KEY, fecha_valor TEXT, concepto TEXT,
+                             importe_eur REAL, puntual INTEGER DEFAULT 0);
+        CREATE TABLE factura (id INTEGER PRIMARY KEY, fecha TEXT, estado TEXT, total REAL);
+        CREATE TABLE tickets (id INTEGER PRIMARY KEY, fecha TEXT, estado TEXT, total REAL);
+        INSERT INTO gastos (fecha_valor, concepto, importe_eur) VALUES ('01/01/2025', 'Luz', -50);
+    ''')
+    conexion.commit()
+    yield conexion
+    conexion.close()
+
+
+def _version(conn, tabla):
+    return dict(ce.obtener_version_datos(conn)[1])[tabla]
+
+
+class TestVersionDatos:
+    """Triggers que incrementan data_version"""
+
+    def test_insert_update_delete(self, conn):
+        inicial = _version(conn, 'gastos')
+        conn.execute("INSERT INTO gastos (fecha_valor, concepto, importe_eur) VALUES ('02/01/2025', 'Agua', -20)")
+        conn.execute("UPDATE gastos SET importe_eur = -25 WHERE concepto = 'Agua'")
+        conn.execute("DELETE FROM gastos WHERE concepto = 'Agua'")
+        conn.commit()
+        assert _version(conn, 'gastos') == inicial + 3
+        assert _version(conn, 'factura') == 0
+
+    def test_update_sin_cambios_no_invalida(self, conn):
+        inicial = _version(conn, 'gastos')
+        conn.execute("UPDATE gastos SET importe_eur = importe_eur")
+        conn.commit()
+        assert _version(conn, 'gastos') == inicial
+
+    def test_puntual_automatico_no_invalida_y_manual_si(self, conn):
+        inicial = _version(conn, 'gastos')
+        conn.execute('UPDATE gastos SET puntual = 1')
+        conn.execute('UPDATE gastos SET puntual = 0')
+        conn.commit()
+        assert _version(conn, 'gastos') == inicial
+        conn.execute('UPDATE gastos SET puntual = 2')
+        conn.commit()
+        assert _version(conn, 'gastos') == inicial + 1
+
+    def test_concepto_normalizado_no_invalida(self, conn):
+        conn.execute('ALTER TABLE gastos ADD COLUMN concepto_normalizado TEXT')
+        ce.instalar_version_datos(conn)
+        inicial = _version(conn, 'gastos')
+        conn.execute("UPDATE gastos SET concepto_normalizado = 'Luz'")
+        conn.commit()
+        assert _version(conn, 'gastos') == inicial
+
+
+    def test_reinstalar_sin_cambios_no_toca_el_esquema(self, conn):
+        ce.instalar_version_datos(conn)
+        esquema = conn.execute('PRAGMA schema_version').fetchone()[0]
+        ce.instalar_version_datos(conn)
+        ce.instalar_version_datos(conn, ('gastos',))
+        assert conn.execute('PRAGMA schema_version').fetchone()[0] == esquema
+        conn.execute('ALTER TABLE factura ADD COLUMN nif TEXT')
+        esquema = conn.execute('PRAGMA schema_version').fetchone()[0]
+        ce.instalar_version_datos(conn)
+        assert conn.execute('PRAGMA schema_version').fetchone()[0] > esquema
+        assert 'OLD."nif"' in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'trg_dv_factura_update'").fetchone()[0]
+
+
+class TestCacheEstadisticas:
+    """LRU y métricas"""
+
+    def test_lru_y_obsoletas(self):
+        cache = ce.CacheEstadisticas(max_entradas=2)
+        cache.guardar('a', 1, b'A', 'application/json')
+        cache.guardar('b', 1, b'B', 'application/json')
+        assert cache.obtener('a', 1) == (b'A', 'application/json')
+        cache.guardar('c', 1, b'C', 'application/json')  # expulsa 'b' (menos reciente)
+        assert cache.obtener('b', 1) is None
+        assert cache.obtener('a', 2) is None  # versión distinta: obsoleta
+        metricas = cache.get_metrics()
+        assert metricas['entradas'] == 1
+        assert metricas['expulsiones'] == 1
+        assert metricas['obsoletas'] == 1
+        assert metricas['aciertos'] == 1 and metricas['fallos'] == 2
+
+
+class TestCachearRespuesta:
+    """Decorador sobre una ruta Flask"""
+
+    def test_sirve_cache_hasta_que_cambian_los_datos(self, conn):
+        app = Flask(__name__)
+        llamadas = []
+
+        @app.route('/informe')
+        @ce.cachear_respuesta('informe')
+        def informe():
+            llamadas.append(1)
+            total = conn.execute('SELECT SUM(importe_eur) FROM gastos').fetchone()[0]
+            return jsonify({'total': total})
+
+        cache = ce.CacheEstadisticas()
+        with patch('cache_estadisticas.get_db_connection', return_value=_Conexion(conn)), \
+             patch('cache_estadisticas.get_cache_estadisticas', return_value=cache):
+            cliente = app.test_client()
+            assert cliente.get('/informe?anio=2025&t=1').get_json() == {'total': -50}
+            assert cliente.get('/informe?anio=2025&t=2').get_json() == {'total': -50}
+            assert len(llamadas) == 1
+
+            conn.execute("INSERT INTO gastos (fecha_valor, concepto, importe_eur) VALUES ('03/01/2025', 'Gas', -10)")
+            conn.commit()
+            assert cliente.get('/informe?anio=2025').get_json() == {'total': -60}
+            assert cliente.get('/informe?anio=2024').get_json() == {'total': -60}
+            assert len(llamadas) == 3
+        assert cache.get_metrics()['aciertos'] == 1
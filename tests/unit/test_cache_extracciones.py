@@ -0,0 +1,114 @@
+"""
+Tests unitarios para cache_extracciones.py
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import cache_extracciones as ce
+from multiempresa_config import CACHE_EXTRACCIONES_CONFIG
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ce.CacheExtracciones(str(tmp_path / 'cache' / 'extracciones.db'), max_entradas=100, max_bytes=10 ** 6)
+    with patch.object(ce, '_cache', cache):
+        yield cache
+
+
+class TestCacheExtracciones:
+    """Resultados por contenido, versión de prompt y parámetros"""
+
+    def test_mismo_documento_no_repite_extraccion(self, cache):
+        llamadas = []
+
+        @ce.cachear_extraccion('factura', 'v1')
+        def extraer(contenido, nif_cliente=None):
+            llamadas.append(contenido)
+            return {'proveedor': {'nif': 'B12345678'}, 'total': 121.0}
+
+        primera = extraer(b'%PDF-1', 'B99999999')
+        primera['_metodo_ocr'] = 'GPT-4 Vision'  # el llamante modifica su copia
+        assert extraer(b'%PDF-1', 'B99999999') == {'proveedor': {'nif': 'B12345678'}, 'total': 121.0}
+        assert len(llamadas) == 1
+
+        # Otro documento u otros parámetros sí extraen
+        extraer(b'%PDF-2', 'B99999999')
+        extraer(b'%PDF-1', nif_cliente='B00000000')
+        assert len(llamadas) == 3
+        assert cache.get_metrics()['aciertos'] == 1
+
+    def test_version_de_prompt_en_la_clave(self, cache):
+        resultado = cache.obtener_o_extraer('contacto', 'v1', b'img', lambda: {'nif': 'A'})
+        assert cache.obtener_o_extraer('contacto', 'v1', b'img', lambda: {'nif': 'B'}) == resultado
+        assert cache.obtener_o_extraer('contacto', 'v2', b'img', lambda: {'nif': 'B'}) == {'nif': 'B'}
+
+    def test_no_guarda_errores_ni_none(self, cache):
+        def falla():
+            raise ValueError('API caída')
+
+        with pytest.raises(ValueError):
+            cache.obtener_o_extraer('factura_email', 'v1', b'pdf', falla)
+        assert cache.obtener_o_extraer('factura_email', 'v1', b'pdf', lambda: None) is None
+        assert cache.obtener_o_extraer('factura_email', 'v1', b'pdf', lambda: {'ok': 1}) == {'ok': 1}
+        assert cache.get_metrics()['entradas'] == 1
+
+    def test_expulsion_lru_por_entradas_y_bytes(self, tmp_path):
+        cache = ce.CacheExtracciones(str(tmp_path / 'lru.db'), max_entradas=3, max_bytes=10 ** 6)
+        for i in range(3):
+            cache.obtener_o_extraer('factura', 'v1', bytes([i]), lambda: {'i': i})
+            time.sleep(0.01)
+        cache.obtener_o_extraer('factura', 'v1', bytes([0]), lambda: None)  # acierto: el 0 pasa a reciente
+        cache.obtener_o_extraer('factura', 'v1', bytes([3]), lambda: {'i': 3})
+        assert cache.obtener_o_extraer('factura', 'v1', bytes([1]), lambda: 'extraida') == 'extraida'
+        assert cache.obtener_o_extraer('factura', 'v1', bytes([0]), lambda: 'extraida') == {'i': 0}
+
+        pequeña = ce.CacheExtracciones(str(tmp_path / 'bytes.db'), max_entradas=100, max_bytes=250)
+        for i in range(5):
+            pequeña.obtener_o_extraer('factura', 'v1', bytes([i]), lambda: 'x' * 100)
+        metricas = pequeña.get_metrics()
+        assert metricas['entradas'] == 2 and metricas['bytes'] <= 250
+        assert metricas['expulsiones'] == 3
+
+    def test_peticiones_simultaneas_extraen_una_vez(self, cache):
+        llamadas = []
+
+        def extraer_lento():
+            llamadas.append(1)
+            time.sleep(0.2)
+            return {'total': 10}
+
+        resultados = []
+        hilos = [threading.Thread(target=lambda: resultados.append(
+            cache.obtener_o_extraer('factura', 'v1', b'mismo', extraer_lento))) for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        assert resultados == [{'total': 10}] * 4
+        assert len(llamadas) == 1
+        assert cache.get_metrics()['esperas'] == 3
+
+    def test_cache_inaccesible_o_desactivada(self, tmp_path):
+        rota = ce.CacheExtracciones(str(tmp_path), max_entradas=10, max_bytes=1000)  # un directorio
+        assert rota.obtener_o_extraer('factura', 'v1', b'pdf', lambda: {'ok': 1}) == {'ok': 1}
+        assert rota.get_metrics()['errores'] >= 1
+
+        llamadas = []
+
+        @ce.cachear_extraccion('factura', 'v1')
+        def extraer(contenido):
+            llamadas.append(contenido)
+            return {'ok': 1}
+
+        with patch.dict(CACHE_EXTRACCIONES_CONFIG, {'ACTIVA': False}):
+            extraer(b'pdf')
+            extraer(b'pdf')
+        assert len(llamadas) == 2
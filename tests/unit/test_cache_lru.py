@@ -0,0 +1,77 @@
+"""
+Tests unitarios para cache_lru.py
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from cache_lru import AlmacenLRU, ProduccionUnica
+
+
+class TestAlmacenLRU:
+    """Valores por clave con expulsión por entradas y bytes"""
+
+    def test_guardar_obtener_y_borrar_por_prefijo(self, tmp_path):
+        almacen = AlmacenLRU(str(tmp_path / 'sub' / 'lru.db'), max_entradas=10, max_bytes=1000)
+        assert almacen.obtener('a:1') is None
+        assert almacen.guardar('a:1', b'uno', 0.5) == 0
+        almacen.guardar('b:1', b'dos', 0.1)
+        assert almacen.obtener('a:1') == (b'uno', 0.5)
+        assert almacen.tamaño() == (2, 6)
+        assert almacen.borrar('a:') == 1
+        assert almacen.obtener('b:1') == (b'dos', 0.1)
+
+    def test_expulsa_las_menos_usadas(self, tmp_path):
+        almacen = AlmacenLRU(str(tmp_path / 'lru.db'), max_entradas=2, max_bytes=1000)
+        almacen.guardar('0', b'x', 0)
+        time.sleep(0.01)
+        almacen.guardar('1', b'x', 0)
+        time.sleep(0.01)
+        almacen.obtener('0')  # el 0 pasa a reciente
+        assert almacen.guardar('2', b'x', 0) == 1
+        assert almacen.obtener('1') is None and almacen.obtener('0') is not None
+
+        pequeño = AlmacenLRU(str(tmp_path / 'bytes.db'), max_entradas=100, max_bytes=250)
+        expulsadas = sum(pequeño.guardar(str(i), b'x' * 100, 0) for i in range(5))
+        assert expulsadas == 3 and pequeño.tamaño() == (2, 200)
+
+
+class TestProduccionUnica:
+    """Generación única por clave entre hilos"""
+
+    def test_hilos_simultaneos_generan_una_vez(self):
+        produccion = ProduccionUnica()
+        guardado, llamadas, esperas = {}, [], []
+
+        def generar():
+            llamadas.append(1)
+            time.sleep(0.2)
+            guardado['k'] = 'valor'
+            return 'valor'
+
+        resultados = []
+        hilos = [threading.Thread(target=lambda: resultados.append(
+            produccion.ejecutar('k', lambda: guardado.get('k'), generar, lambda: esperas.append(1))))
+            for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        assert resultados == ['valor'] * 4
+        assert len(llamadas) == 1 and len(esperas) == 3
+
+    def test_error_deja_generar_al_siguiente(self):
+        produccion = ProduccionUnica()
+
+        def falla():
+            raise ValueError('caída')
+
+        with pytest.raises(ValueError):
+            produccion.ejecutar('k', lambda: None, falla)
+        assert produccion.ejecutar('k', lambda: None, lambda: 'ok') == 'ok'
@@ -340,6 +340,206 @@ class TestConciliacionMultiple:
         assert pendiente == 50.0
 
 
+
+class TestCombinacionesDocumentos:
+    """Tests para el buscador exacto de combinaciones (subset-sum en céntimos)"""
+    
+    def test_combinacion_exacta_que_greedy_no_encuentra(self):
+        """Test combinación exacta con documentos que no están cerca del objetivo"""
+        from conciliacion_combinaciones import buscar_combinaciones
+        
+        importes = [6000, 5000, 4000, 3000, 3000]
+        combinaciones, completo = buscar_combinaciones(importes, 10000, 0)
+        
+        assert completo
+        diferencia, indices = combinaciones[0]
+        assert diferencia == 0
+        assert sum(importes[i] for i in indices) == 10000
+    
+    def test_sin_combinacion_dentro_de_tolerancia(self):
+        """Test sin combinación posible devuelve lista vacía"""
+        from conciliacion_combinaciones import buscar_combinaciones
+        
+        combinaciones, _ = buscar_combinaciones([1000, 2000], 5000, 100)
+        
+        assert combinaciones == []
+    
+    def test_alternativas_ordenadas_por_diferencia(self):
+        """Test top-k alternativas ordenadas por diferencia con el objetivo"""
+        from conciliacion_combinaciones import buscar_combinaciones
+        
+        importes = [1000, 1001, 998, 2000]
+        combinaciones, _ = buscar_combinaciones(importes, 1000, 5, top_k=3)
+        
+        diferencias = [d for d, _ in combinaciones]
+        assert diferencias == sorted(diferencias)
+        assert diferencias[0] == 0
+        assert len(combinaciones) == 3
+    
+    def test_muchos_tickets_dp_bitset(self):
+        """Test liquidación TPV con cientos de tickets (ruta de DP de bitset)"""
+        import random
+        from conciliacion_combinaciones import buscar_combinaciones
+        
+        rng = random.Random(42)
+        importes = [rng.randint(150, 9000) for _ in range(400)]
+        objetivo = sum(rng.sample(importes, 120))
+        
+        combinaciones, completo = buscar_combinaciones(importes, objetivo, 300, timeout_ms=5000)
+        
+        assert completo
+        diferencia, indices = combinaciones[0]
+        assert diferencia == 0
+        assert len(set(indices)) == len(indices)
+        assert sum(importes[i] for i in indices) == objetivo
+    
+    def test_objetivo_mayor_que_mitad_usa_complemento(self):
+        """Test objetivo cercano al total de documentos"""
+        from conciliacion_combinaciones import buscar_combinaciones
+        
+        importes = list(range(100, 100 + 30 * 10, 10))
+        objetivo = sum(importes) - importes[5]
+        
+        combinaciones, _ = buscar_combinaciones(importes, objetivo, 0)
+        
+        diferencia, indices = combinaciones[0]
+        assert diferencia == 0
+        assert sum(importes[i] for i in indices) == objetivo
+
+
+
+def _crear_bd_documentos_conciliacion():
+    """BD en memoria con facturas, tickets y proformas pendientes de conciliar"""
+    import random
+    import sqlite3
+    
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.executescript('''
+        CREATE TABLE factura (id INTEGER PRIMARY KEY, numero TEXT, fecha TEXT, total REAL,
+                              estado TEXT, importe_cobrado REAL, fechaCobro TEXT);
+        CREATE TABLE tickets (id INTEGER PRIMARY KEY, numero TEXT, fecha TEXT, total REAL,
+                              estado TEXT, importe_cobrado REAL);
+        CREATE TABLE proforma (id INTEGER PRIMARY KEY, numero TEXT, fecha TEXT, total REAL,
+                               estado TEXT, importe_cobrado REAL);
+        CREATE TABLE conciliacion_gastos (id INTEGER PRIMARY KEY, gasto_id INTEGER,
+                                          tipo_documento TEXT, documento_id INTEGER);
+    ''')
+    rng = random.Random(7)
+    for i in range(1, 301):
+        fecha = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        total = round(rng.choice([50, 100, 121, 250]) + rng.randint(0, 300) / 100, 2)
+        estado = rng.choice(['C', 'P', 'V', 'A'])
+        conn.execute('INSERT INTO factura VALUES (?, ?, ?, ?, ?, 0, ?)',
+                     (i, f'F24{i:04d}', fecha, total, estado, fecha if estado == 'C' else None))
+        conn.execute('INSERT INTO tickets VALUES (?, ?, ?, ?, ?, 0)',
+                     (i, f'T24{i:04d}', fecha, total, rng.choice(['C', 'P'])))
+        conn.execute('INSERT INTO proforma VALUES (?, ?, ?, ?, ?, 0)',
+                     (i, f'P24{i:04d}', fecha, total, rng.choice(['A', 'F'])))
+    conn.commit()
+    return conn
+
+
+class TestIndiceConciliacion:
+    """Tests para el emparejamiento en lote con el índice en memoria"""
+    
+    def test_indice_coincide_con_busqueda_sql(self):
+        """Test el índice devuelve las mismas coincidencias que la búsqueda por gasto"""
+        import random
+        import conciliacion
+        from conciliacion_indice import IndiceDocumentosConciliacion
+        
+        conn = _crear_bd_documentos_conciliacion()
+        indice = IndiceDocumentosConciliacion.cargar(conn)
+        
+        rng = random.Random(11)
+        gastos = []
+        for gasto_id in range(1, 81):
+            dia = rng.randint(1, 28)
+            mes = rng.randint(1, 12)
+            concepto = rng.choice(['TRANSFERENCIA', f'PAGO F24{rng.randint(1, 300):04d}',
+                                   f'TPV T24{rng.randint(1, 300):04d}'])
+            gastos.append({
+                'id': gasto_id,
+                'fecha_operacion': f'{dia:02d}/{mes:02d}/2024' if gasto_id % 2 else f'2024-{mes:02d}-{dia:02d}',
+                'concepto': concepto,
+                'importe_eur': round(rng.choice([50, 100, 121, 250]) + rng.randint(0, 300) / 100, 2)
+            })
+        
+        conexion_compartida = Mock(wraps=conn)
+        conexion_compartida.close = Mock()
+        with patch('conciliacion.get_db_connection', return_value=conexion_compartida), \
+             patch('conciliacion.get_tolerancia_conciliacion', return_value=3.0):
+            for gasto in gastos:
+                esperado = conciliacion.buscar_coincidencias_automaticas(gasto)
+                obtenido = conciliacion.buscar_coincidencias_en_indice(gasto, indice, 3.0)
+                clave = lambda c: (c['tipo'], c['id'])
+                assert sorted(obtenido, key=clave) == sorted(esperado, key=clave)
+    
+    def test_documento_descartado_no_se_repite(self):
+        """Test un documento conciliado en el lote no vuelve a proponerse"""
+        from conciliacion_indice import IndiceDocumentosConciliacion
+        
+        indice = IndiceDocumentosConciliacion([
+            {'tipo': 'ticket', 'id': 1, 'numero': 'T240001', 'fecha': '2024-10-15',
+             'total': 25.0, 'estado': 'C', 'importe_cobrado': 25.0}
+        ])
+        gasto = {'id': 1, 'fecha_operacion': '15/10/2024', 'concepto': 'TPV', 'importe_eur': 25.0}
+        
+        candidatos, por_numero = indice.candidatos(gasto, 0.5)
+        assert [c['id'] for c in candidatos] == [1]
+        assert not por_numero
+        
+        indice.descartar('ticket', 1)
+        candidatos, _ = indice.candidatos(gasto, 0.5)
+        assert candidatos == []
+
+
+
+class TestScoreLote:
+    """Tests para el score vectorizado de conciliación"""
+    
+    def test_scores_lote_identicos_a_calcular_score(self):
+        """Test el score en lote es idéntico al score par a par"""
+        import random
+        import conciliacion
+        from conciliacion_puntuacion import calcular_scores_lote
+        
+        rng = random.Random(5)
+        gastos = []
+        for gasto_id in range(40):
+            dia = rng.randint(1, 28)
+            gastos.append({
+                'id': gasto_id,
+                'fecha_operacion': f'{dia:02d}/10/2024' if gasto_id % 2 else f'2024-10-{dia:02d}',
+                'concepto': rng.choice(['', None, 'TRANSFERENCIA F240012', 'PAGO 0012', 'REF 240031']),
+                'importe_eur': rng.choice([-1, 1]) * round(100 + rng.randint(0, 400) / 100, 2)
+            })
+        documentos = []
+        for doc_id in range(60):
+            dia = rng.randint(1, 28)
+            documentos.append({
+                'id': doc_id,
+                'numero': rng.choice(['F240012', 'T240031', 'P241234', '', None, 'F12']),
+                'fecha': f'2024-10-{dia:02d}',
+                'fechaCobro': rng.choice([None, f'2024-10-{rng.randint(1, 28):02d}']),
+                'total': round(100 + rng.randint(0, 400) / 100, 2)
+            })
+        pares = [(g, d) for g in range(len(gastos)) for d in range(len(documentos))]
+        
+        scores = calcular_scores_lote(gastos, documentos, pares)
+        
+        esperados = [conciliacion.calcular_score(gastos[g], documentos[d]) for g, d in pares]
+        assert scores == esperados
+        assert 100 in scores
+    
+    def test_scores_lote_vacio(self):
+        """Test lote sin pares"""
+        from conciliacion_puntuacion import calcular_scores_lote
+        
+        assert calcular_scores_lote([], [], []) == []
+
+
 # Ejecutar tests si se ejecuta directamente
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
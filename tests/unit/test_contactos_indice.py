@@ -0,0 +1,141 @@
+"""
+Tests unitarios para contactos_indice.py
+"""
+import os
+import sqlite3
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import contactos
+import contactos_indice as ci
+from multiempresa_config import PLANTILLA_EMPRESA_CONFIG
+from plantilla_empresa import adjuntar_maestros
+
+CALLES = [
+    ('08001', 'Carrer de la Pau'), ('08001', 'Carrer Del Mar'), ('08002', 'carrer de sants'),
+    ('08002', 'CARRER GRAN'), ('08003', 'Avinguda Diagonal'), ('08004', 'Avinguda Diagonal'),
+    ('08005', 'Plaça de Catalunya'), ('08005', 'Passeig de Gràcia'), ('08006', None),
+    ('08006', 'Escultor Llimona'), ('17001', 'Rambla de la Llibertat'), ('17002', 'Carrer 100%'),
+    ('17002', 'Carrer_Major'), ('17003', ''), ('25001', 'Àvila'), ('25001', 'Carrer Sant Antoni'),
+]
+
+
+def _crear_codipostal(ruta, filas=CALLES):
+    conn = sqlite3.connect(str(ruta))
+    conn.executescript('''
+        CREATE TABLE codipostal (idCp INTEGER PRIMARY KEY, cp TEXT NOT NULL, carrer TEXT DEFAULT NULL,
+                                 poblacio NOT NULL, provincia TEXT DEFAULT NULL);
+        CREATE INDEX cp ON codipostal (cp);
+        CREATE INDEX calle ON codipostal (carrer);
+    ''')
+    conn.executemany('INSERT INTO codipostal (cp, carrer, poblacio, provincia) VALUES (?, ?, ?, ?)',
+                     [(cp, carrer, f'POBLACIO {cp}', 'BARCELONA' if cp < '17' else 'GIRONA') for cp, carrer in filas])
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def conn(tmp_path):
+    _crear_codipostal(tmp_path / 'maestros.db')
+    conexion = sqlite3.connect(str(tmp_path / 'maestros.db'))
+    conexion.row_factory = sqlite3.Row
+    yield conexion
+    conexion.close()
+
+
+def _sql_calles(conn, texto):
+    return [{'carrer': fila[0], 'cp': fila[1]} for fila in conn.execute('''
+        SELECT carrer, cp FROM codipostal WHERE LOWER(carrer) LIKE ?
+        ORDER BY CASE WHEN LOWER(carrer) LIKE ? THEN 1 ELSE 3 END, carrer LIMIT ?
+    ''', (f'%{texto}%', f'{texto}%', 10))]
+
+
+class TestMismosResultadosQueSQL:
+    """El índice devuelve lo mismo que las consultas a las que sustituye"""
+
+    @pytest.mark.parametrize('texto', ['carrer', 'c', 'de', 'de la', 'diagonal', 'àvila', 'la ', 'ç', 'r',
+                                       'llimona', 'zzz', 'er d', 'a'])
+    def test_calles(self, conn, texto):
+        assert ci.IndiceCodigosPostales(conn).calles(texto) == _sql_calles(conn, texto)
+
+    def test_limite_con_varias_filas_por_calle(self, conn):
+        indice = ci.IndiceCodigosPostales(conn)
+        assert indice.calles('diagonal', limite=1) == [{'carrer': 'Avinguda Diagonal', 'cp': '08003'}]
+        assert [fila['cp'] for fila in indice.calles('diagonal')] == ['08003', '08004']
+
+    @pytest.mark.parametrize('prefijo', ['0', '08', '0800', '08005', '17', '9'])
+    def test_codigos_postales(self, conn, prefijo):
+        esperado = [dict(fila) for fila in conn.execute(
+            "SELECT cp, poblacio, provincia FROM codipostal WHERE cp LIKE ? || '%' ORDER BY cp LIMIT 20", (prefijo,)
+        )]
+        assert ci.IndiceCodigosPostales(conn).codigos(prefijo) == esperado
+
+    def test_comodines_literales(self, conn):
+        indice = ci.IndiceCodigosPostales(conn)
+        assert indice.calles('100%') == [{'carrer': 'Carrer 100%', 'cp': '17002'}]
+        assert indice.calles('r_m') == [{'carrer': 'Carrer_Major', 'cp': '17002'}]
+
+    def test_datos_cp(self, conn):
+        indice = ci.IndiceCodigosPostales(conn)
+        assert indice.datos_cp('08005') == {'cp': '08005', 'poblacio': 'POBLACIO 08005', 'provincia': 'BARCELONA'}
+        assert indice.datos_cp('99999') is None
+
+
+class TestRegistro:
+    """Un índice por origen de codipostal, construido una vez"""
+
+    def test_maestros_compartidos_y_regeneracion(self, tmp_path):
+        maestros = tmp_path / 'compartida' / 'maestros.db'
+        maestros.parent.mkdir()
+        _crear_codipostal(maestros)
+        registro = ci.RegistroIndices()
+
+        with patch.dict(PLANTILLA_EMPRESA_CONFIG, {'BD_MAESTROS': str(maestros), 'MAESTROS_COMPARTIDOS': True}):
+            for empresa in ('EMPRESA1', 'EMPRESA2'):
+                conexion = sqlite3.connect(str(tmp_path / f'{empresa}.db'))
+                assert adjuntar_maestros(conexion) is True
+                assert registro.obtener(conexion).calles('gran') == [{'carrer': 'CARRER GRAN', 'cp': '08002'}]
+                conexion.close()
+            assert registro.get_metrics()['construcciones'] == 1
+
+            # Se regenera la BD compartida sustituyendo el fichero
+            nueva = tmp_path / 'compartida' / 'nueva.db'
+            _crear_codipostal(nueva, [('43001', 'Rambla Nova')])
+            os.replace(nueva, maestros)
+            conexion = sqlite3.connect(str(tmp_path / 'EMPRESA1.db'))
+            adjuntar_maestros(conexion)
+            assert registro.obtener(conexion).calles('nova') == [{'carrer': 'Rambla Nova', 'cp': '43001'}]
+            conexion.close()
+        assert registro.get_metrics()['construcciones'] == 2
+
+    def test_sin_codipostal_usa_sql(self, tmp_path):
+        conexion = sqlite3.connect(str(tmp_path / 'vacia.db'))
+        assert ci.RegistroIndices().obtener(conexion) is None
+        conexion.close()
+
+
+class TestContactos:
+    """Las funciones de contactos.py sirven desde el índice"""
+
+    def test_sugerencias_y_codigos(self, tmp_path):
+        _crear_codipostal(tmp_path / 'empresa.db')
+
+        def conexion():
+            nueva = sqlite3.connect(str(tmp_path / 'empresa.db'))
+            nueva.row_factory = sqlite3.Row
+            return nueva
+
+        registro = ci.RegistroIndices()
+        with patch.object(contactos, 'get_db_connection', side_effect=conexion), \
+                patch.object(ci, '_registro', registro):
+            assert contactos.obtener_sugerencias_carrer('  Escultor ') == [{'carrer': 'Escultor Llimona', 'cp': '08006'}]
+            assert [fila['cp'] for fila in contactos.buscar_codigos_postales('1700')] == ['17001', '17002', '17002', '17003']
+            assert contactos.obtener_datos_cp('25001') == [{'cp': '25001', 'poblacio': 'POBLACIO 25001', 'provincia': 'GIRONA'}]
+            assert contactos.obtener_datos_cp('00000') == []
+        assert registro.get_metrics()['construcciones'] == 1
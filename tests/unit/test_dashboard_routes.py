@@ -0,0 +1,59 @@
+"""
+Tests unitarios para dashboard_routes.py
+"""
+import sys
+from pathlib import Path
+
+from flask import Flask
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import dashboard_routes as dash
+
+
+class TestRespuestaConEtag:
+    """Tests del ETag de /api/dashboard/resumen"""
+
+    def setup_method(self):
+        self.app = Flask(__name__)
+
+    def test_etag_estable_y_304(self):
+        payload = {'anio': 2025, 'total_mes': {'01': 10.5}, 'top_clientes': {'clientes': []}}
+        with self.app.test_request_context('/api/dashboard/resumen'):
+            respuesta = dash._respuesta_con_etag(payload)
+            etag = respuesta.headers['ETag']
+            assert respuesta.status_code == 200
+            assert respuesta.get_json() == payload
+            assert 'no-cache' in respuesta.headers['Cache-Control']
+
+        with self.app.test_request_context('/api/dashboard/resumen', headers={'If-None-Match': etag}):
+            respuesta = dash._respuesta_con_etag(dict(reversed(list(payload.items()))))
+            assert respuesta.status_code == 304
+
+    def test_etag_cambia_con_los_datos(self):
+        with self.app.test_request_context('/api/dashboard/resumen'):
+            etag_a = dash._respuesta_con_etag({'total': 1}).headers['ETag']
+            etag_b = dash._respuesta_con_etag({'total': 2}).headers['ETag']
+        assert etag_a != etag_b
+
+
+class TestSeriesMensuales:
+    """Payloads de total_mes y cantidad_mes a partir de una única lectura"""
+
+    def test_total_y_cantidad(self):
+        vacio = {'total': 0.0, 'num_documentos': 0}
+        series = {
+            'tickets': {str(m).zfill(2): vacio for m in range(1, 13)},
+            'facturas': {str(m).zfill(2): vacio for m in range(1, 13)},
+        }
+        series['tickets']['03'] = {'total': 10.25, 'num_documentos': 2}
+        series['facturas']['03'] = {'total': 100.0, 'num_documentos': 1}
+
+        totales = dash.calcular_ventas_total_mes(series, 2025)
+        assert totales['global']['03'] == 110.25
+        assert totales['totales_ano'] == {'tickets': 10.25, 'facturas': 100.0, 'global': 110.25}
+
+        cantidades = dash.calcular_ventas_cantidad_mes(series, 2025)
+        assert cantidades['global']['03'] == 3
+        assert cantidades['tickets']['01'] == 0
@@ -0,0 +1,313 @@
+"""
+Tests unitarios para database_pool.py (espera justa, validación perezosa, lectura/escritura y registro de pools)
+"""
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from database_pool import DatabasePool, PoolRegistry, WaitHistogram
+
+
+@pytest.fixture
+def rutas(tmp_path):
+    return [str(tmp_path / f'empresa{i}.db') for i in range(4)]
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = DatabasePool(str(tmp_path / 'empresa.db'), max_connections=1, min_connections=0)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.fixture
+def registro():
+    reg = PoolRegistry(max_pools=2, max_total_connections=2, max_connections_per_pool=2,
+                       min_connections=0, idle_timeout=60)
+    yield reg
+    reg.shutdown()
+
+
+class TestEspera:
+    """Cola de espera FIFO con variables de condición"""
+
+    def test_entrega_en_orden_de_llegada(self, pool):
+        en_uso = pool.get_connection()
+        orden = []
+
+        def esperar(nombre):
+            with pool.get_db_connection():
+                orden.append(nombre)
+
+        hilos = []
+        for nombre in ('primero', 'segundo', 'tercero'):
+            hilo = threading.Thread(target=esperar, args=(nombre,))
+            hilo.start()
+            hilos.append(hilo)
+            while pool.get_metrics()['waiting'] < len(hilos):
+                time.sleep(0.005)
+        en_uso.close()
+        for hilo in hilos:
+            hilo.join(timeout=5)
+        assert orden == ['primero', 'segundo', 'tercero']
+        metricas = pool.get_metrics()
+        assert metricas['waits'] == 3 and metricas['open_connections'] == 1
+
+    def test_segundo_close_tras_entregarla_se_ignora(self, pool):
+        en_uso = pool.get_connection()
+        en_uso.execute('CREATE TABLE t (x INTEGER)')
+        en_uso.commit()
+        b_dentro, b_sigue = threading.Event(), threading.Event()
+        c_obtuvo = threading.Event()
+
+        def b():
+            with pool.get_db_connection() as conn:
+                conn.execute('INSERT INTO t VALUES (1)')
+                b_dentro.set()
+                b_sigue.wait(5)
+                conn.commit()
+
+        def c():
+            with pool.get_db_connection():
+                c_obtuvo.set()
+
+        hilos = [threading.Thread(target=b), threading.Thread(target=c)]
+        for numero, hilo in enumerate(hilos, 1):
+            hilo.start()
+            while pool.get_metrics()['waiting'] < numero:
+                time.sleep(0.005)
+        en_uso.close()  # pasa a B
+        assert b_dentro.wait(5)
+        en_uso.close()  # repetido: no debe deshacer lo de B ni entregarla a C
+        assert not c_obtuvo.wait(0.2)
+        b_sigue.set()
+        for hilo in hilos:
+            hilo.join(timeout=5)
+        assert c_obtuvo.is_set()
+        with pool.get_db_connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 1
+        assert pool.get_metrics()['ignored_returns'] == 1
+
+    def test_timeout_sin_reintentos(self, pool):
+        en_uso = pool.get_connection()
+        inicio = time.monotonic()
+        with pytest.raises(RuntimeError):
+            pool.get_connection(timeout=0.1)
+        assert time.monotonic() - inicio < 1
+        assert pool.get_metrics()['timeouts'] == 1
+        en_uso.close()
+
+    def test_bd_inaccesible_falla_sin_esperar(self, tmp_path):
+        pool = DatabasePool(str(tmp_path / 'no_existe' / 'empresa.db'), max_connections=1, min_connections=0)
+        inicio = time.monotonic()
+        with pytest.raises(sqlite3.OperationalError):
+            pool.get_connection(timeout=5)
+        assert time.monotonic() - inicio < 1
+        assert pool.get_metrics()['open_connections'] == 0
+
+    def test_errores_acotados(self, pool):
+        for i in range(200):
+            pool._record_error(f'error {i}')
+        errores = pool.get_metrics()['recent_errors']
+        assert len(pool.metrics.errors) == pool.metrics.errors.maxlen
+        assert errores[-1].endswith('error 199')
+
+
+class TestValidacion:
+    """SELECT 1 solo tras inactividad o error"""
+
+    def test_reutilizacion_inmediata_no_valida(self, pool):
+        for _ in range(5):
+            with pool.get_db_connection() as conn:
+                conn.execute('SELECT 1')
+        assert pool.get_metrics()['validations'] == 0
+
+    def test_valida_tras_inactividad_o_error(self, pool):
+        with pool.get_db_connection():
+            pass
+        pool._idle[0].returned_at -= pool.validate_after_idle + 1
+        with pytest.raises(Exception):
+            with pool.get_db_connection() as conn:
+                conn.execute('SELECT * FROM tabla_inexistente')
+        with pool.get_db_connection():
+            pass
+        metricas = pool.get_metrics()
+        assert metricas['validations'] == 2
+        assert metricas['discarded_connections'] == 0
+
+
+class TestHistograma:
+    """Percentiles del histograma de espera"""
+
+    def test_percentiles(self):
+        histograma = WaitHistogram()
+        for espera in [0.05] * 90 + [8] * 9 + [7000]:
+            histograma.registrar(espera)
+        datos = histograma.as_dict()
+        assert (datos['p50_ms'], datos['p95_ms'], datos['p99_ms']) == (0.1, 10.0, 10.0)
+        assert histograma.percentil(100) == float('inf')
+        assert datos['buckets']['>5000ms'] == 1
+
+
+class TestCreacionPerezosa:
+    """Los pools se crean sin conexiones"""
+
+    def test_pool_sin_conexiones(self, registro, rutas):
+        pool = registro.get_pool(rutas[0])
+        assert registro.get_pool(rutas[0]) is pool
+        assert registro.get_metrics()['open_connections'] == 0
+        with pool.get_db_connection() as conn:
+            conn.execute('SELECT 1')
+            assert registro.get_metrics()['connections_in_use'] == 1
+        metricas = registro.get_metrics()
+        assert (metricas['open_connections'], metricas['connections_in_use']) == (1, 0)
+
+    def test_doble_devolucion_no_duplica(self, registro, rutas):
+        pool = registro.get_pool(rutas[0])
+        with pool.get_connection() as conn:
+            pass
+        conn.close()
+        assert pool.get_metrics()['connections_available'] == 1
+
+
+class TestPresupuesto:
+    """Límite global de conexiones abiertas"""
+
+    def test_reutiliza_conexion_libre_de_otro_pool(self, registro, rutas):
+        pool_a = registro.get_pool(rutas[0])
+        c1, c2 = pool_a.get_connection(), pool_a.get_connection()
+        c1.close()
+        c2.close()
+
+        with registro.get_pool(rutas[1]).get_db_connection() as conn:
+            conn.execute('SELECT 1')
+        metricas = registro.get_metrics()
+        assert metricas['open_connections'] == 2
+        assert metricas['reclaimed_connections'] == 1
+        assert metricas['per_pool'][rutas[0]]['open_connections'] == 1
+
+    def test_sin_huecos_libres_rechaza(self, registro, rutas):
+        pool_a = registro.get_pool(rutas[0])
+        en_uso = [pool_a.get_connection(), pool_a.get_connection()]
+        pool_b = registro.get_pool(rutas[1])
+        assert registro.reserve_connection(pool_b) is False
+        assert registro.get_metrics()['budget_rejections'] == 1
+        for conn in en_uso:
+            conn.close()
+
+
+class TestExpulsion:
+    """Retirada de pools por LRU e inactividad"""
+
+    def test_lru_respeta_pools_en_uso(self, registro, rutas):
+        en_uso = registro.get_pool(rutas[0]).get_connection()
+        registro.get_pool(rutas[1]).get_connection().close()
+        registro.get_pool(rutas[2])
+        metricas = registro.get_metrics()
+        assert sorted(metricas['per_pool']) == [rutas[0], rutas[2]]
+        assert metricas['lru_evictions'] == 1
+        assert metricas['open_connections'] == 1
+        en_uso.close()
+
+    def test_pool_retirado_sigue_funcionando(self, registro, rutas):
+        pool = registro.get_pool(rutas[0])
+        registro.get_pool(rutas[1])
+        registro.get_pool(rutas[2])
+        with pool.get_db_connection() as conn:
+            assert conn.execute('SELECT 1').fetchone()[0] == 1
+        assert pool.get_metrics()['open_connections'] == 0
+        assert registro.get_metrics()['open_connections'] == 0
+
+    def test_inactividad(self, registro, rutas):
+        registro.get_pool(rutas[0]).get_connection().close()
+        registro.get_pool(rutas[1]).last_used -= 120
+        registro._last_idle_check -= 60
+        registro.get_pool(rutas[0])
+        assert registro.get_metrics()['idle_evictions'] == 1
+        assert list(registro.get_metrics()['per_pool']) == [rutas[0]]
+
+
+@pytest.fixture
+def pool_bd(tmp_path):
+    pool = DatabasePool(str(tmp_path / 'empresa.db'), max_connections=3, min_connections=0)
+    with pool.write_transaction() as conn:
+        conn.execute('CREATE TABLE factura (id INTEGER PRIMARY KEY, total REAL)')
+    yield pool
+    pool.shutdown()
+
+
+class TestLecturaEscritura:
+    """Pool de solo lectura y carril de escritura"""
+
+    def test_lectura_no_escribe_ni_bloquea(self, pool_bd):
+        lector = pool_bd.get_read_connection()
+        lector.execute('BEGIN')
+        assert lector.execute('SELECT COUNT(*) FROM factura').fetchone()[0] == 0
+        with pytest.raises(sqlite3.OperationalError):
+            lector.execute('INSERT INTO factura (total) VALUES (1)')
+
+        # Con una lectura abierta la escritura entra sin esperar al lector
+        with pool_bd.write_transaction(timeout=1) as conn:
+            conn.execute('INSERT INTO factura (total) VALUES (10)')
+        lector.rollback()
+        assert lector.execute('SELECT COUNT(*) FROM factura').fetchone()[0] == 1
+        lector.close()
+        metricas = pool_bd.get_metrics()
+        assert metricas['read_pool']['open_connections'] == 1
+        assert metricas['open_connections'] == 1
+
+    def test_escritores_en_fila_por_la_misma_conexion(self, pool_bd):
+        primera = pool_bd.get_writer_connection()
+        usadas = []
+
+        def escribir():
+            with pool_bd.write_transaction() as conn:
+                usadas.append(conn)
+                conn.execute('INSERT INTO factura (total) VALUES (5)')
+
+        hilo = threading.Thread(target=escribir)
+        hilo.start()
+        while pool_bd.get_metrics()['writer_lane']['waiting'] == 0:
+            time.sleep(0.005)
+        primera.close()
+        hilo.join(timeout=5)
+
+        assert usadas == [primera]
+        carril = pool_bd.get_metrics()['writer_lane']
+        assert (carril['waits'], carril['handoffs'], carril['busy']) == (1, 1, False)
+        assert pool_bd.get_metrics()['connections_checked_out'] == 0
+
+    def test_turno_reentrante_y_timeout(self, pool_bd):
+        conn = pool_bd.get_writer_connection()
+        assert pool_bd.get_writer_connection() is conn
+        errores = []
+
+        def esperar():
+            try:
+                pool_bd.get_writer_connection(timeout=0.1)
+            except RuntimeError as e:
+                errores.append(e)
+
+        hilo = threading.Thread(target=esperar)
+        hilo.start()
+        hilo.join(timeout=5)
+        assert len(errores) == 1
+        conn.close()
+        assert pool_bd.get_metrics()['writer_lane']['busy'] is True
+        conn.close()
+        assert pool_bd.get_metrics()['writer_lane']['busy'] is False
+
+    def test_rollback_si_falla(self, pool_bd):
+        with pytest.raises(ValueError):
+            with pool_bd.write_transaction() as conn:
+                conn.execute('INSERT INTO factura (total) VALUES (7)')
+                raise ValueError('fallo')
+        with pool_bd.get_read_connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM factura').fetchone()[0] == 0
@@ -213,3 +213,50 @@ class TestInicializarCampoPuntual:
         columnas_nombres = [col['name'] for col in columnas]
         
         assert 'puntual' in columnas_nombres
+
+
+class TestRangosFecha:
+    """Tests para los filtros de fecha por rango (utils_fechas_optimizadas)"""
+
+    def test_rangos_anio_y_mes(self):
+        """Test límites semiabiertos de año, mes y acumulado"""
+        from utils_fechas_optimizadas import rango_anio, rango_mes, rango_hasta_mes
+
+        assert rango_anio('2025') == ('2025-01-01', '2026-01-01')
+        assert rango_mes(2025, 2) == ('2025-02-01', '2025-03-01')
+        assert rango_mes(2025, 12) == ('2025-12-01', '2026-01-01')
+        assert rango_hasta_mes(2025, 10) == ('2025-01-01', '2025-11-01')
+
+    def test_filtro_equivale_a_substr(self, test_db, sample_gastos):
+        """Test el rango sobre fecha_valor devuelve lo mismo que los substr anteriores"""
+        from utils_fechas_optimizadas import rango_mes, rango_hasta_mes
+
+        cursor = test_db.cursor()
+        cursor.execute("INSERT INTO gastos (fecha_valor, importe_eur) VALUES ('31/12/2024', -10), ('01/11/2025', -20)")
+
+        cursor.execute(f"SELECT COUNT(*) FROM gastos WHERE {est.FILTRO_FECHA_VALOR}", rango_hasta_mes(2025, 10))
+        acumulado = cursor.fetchone()[0]
+        cursor.execute('''
+            SELECT COUNT(*) FROM gastos
+            WHERE substr(fecha_valor, 7, 4) = '2025' AND CAST(substr(fecha_valor, 4, 2) AS INTEGER) <= 10
+        ''')
+        assert acumulado == cursor.fetchone()[0] == 4
+
+        cursor.execute(f"SELECT COUNT(*) FROM gastos WHERE {est.FILTRO_FECHA_VALOR}", rango_mes(2025, 11))
+        assert cursor.fetchone()[0] == 1
+
+    def test_filtro_usa_indice_de_expresion(self, test_db):
+        """Test el filtro coincide con el índice de expresión sobre fecha_valor"""
+        from utils_fechas_optimizadas import rango_anio
+
+        test_db.execute('''
+            CREATE INDEX idx_gastos_fecha_valor_optimized ON gastos(
+                substr(fecha_valor,7,4) || '-' || substr(fecha_valor,4,2) || '-' || substr(fecha_valor,1,2),
+                importe_eur)
+        ''')
+        plan = test_db.execute(
+            f"EXPLAIN QUERY PLAN SELECT SUM(importe_eur) FROM gastos WHERE {est.FILTRO_FECHA_VALOR}",
+            rango_anio(2025)
+        ).fetchall()
+
+        assert any('idx_gastos_fecha_valor_optimized' in fila[-1] for fila in plan)
@@ -0,0 +1,259 @@
+"""
+Tests unitarios para facturas_email_pipeline.py
+"""
+import base64
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import facturas_email_pipeline as fep
+from multiempresa_config import FACTURAS_EMAIL_CONFIG
+
+TEXTO = b'("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 10 1 NIL NIL NIL NIL)'
+
+
+def _pdf(tamaño, nombre=b'"factura.pdf"'):
+    return (b'("application" "pdf" ("name" ' + nombre + b') NIL NIL "base64" ' + str(tamaño).encode()
+            + b' NIL ("attachment" ("filename" ' + nombre + b')) NIL NIL)')
+
+
+def _mixto(*partes):
+    return b'(' + b''.join(partes) + b' "mixed" ("boundary" "b1") NIL NIL NIL)'
+
+
+class FakeIMAP:
+    """Buzón con las respuestas FETCH que devuelve imaplib"""
+
+    def __init__(self):
+        self.mensajes = {}
+        self.fetches = []
+
+    def añadir(self, uid, destino, pdf=None, remitente='proveedor@ejemplo.com'):
+        cabecera = f'From: {remitente}\r\nSubject: FACTURA {uid}\r\nTo: {destino}\r\n\r\n'.encode()
+        if pdf is None:
+            estructura, partes = TEXTO, {}
+        else:
+            codificado = base64.encodebytes(pdf)
+            estructura, partes = _mixto(TEXTO, _pdf(len(codificado))), {'2': codificado}
+        self.mensajes[uid] = (estructura, cabecera, partes)
+
+    def uid(self, comando, *args):
+        if comando == 'SEARCH':
+            return 'OK', [' '.join(str(uid) for uid in sorted(self.mensajes)).encode()]
+        conjunto, elementos = args
+        self.fetches.append((conjunto, elementos))
+        uids = []
+        for rango in conjunto.split(','):
+            inicio, _, fin = rango.partition(':')
+            uids.extend(range(int(inicio), int(fin or inicio) + 1))
+        datos = []
+        for secuencia, uid in enumerate(uids, 1):
+            estructura, cabecera, partes = self.mensajes[uid]
+            if 'BODYSTRUCTURE' in elementos:
+                prefijo = (f'{secuencia} (UID {uid} RFC822.SIZE {len(cabecera) + 5000} BODYSTRUCTURE '.encode()
+                           + estructura + f' BODY[HEADER.FIELDS (FROM TO)] {{{len(cabecera)}}}'.encode())
+                datos += [(prefijo, cabecera), b')']
+            else:
+                parte = elementos[elementos.index('[') + 1:elementos.index(']')]
+                contenido = partes[parte]
+                datos += [(f'{secuencia} (UID {uid} BODY[{parte}] {{{len(contenido)}}}'.encode(), contenido), b')']
+        return 'OK', datos
+
+
+EMPRESAS = [
+    {'id': 1, 'codigo': 'COPIS', 'nombre': 'Copistería', 'email': 'facturas@copis.es', 'db_path': '/db/COPIS.db'},
+    {'id': 2, 'codigo': 'ALEPH', 'nombre': 'Aleph', 'email': None, 'db_path': '/db/ALEPH.db'},
+]
+
+
+def _pipeline(mail, empresas=EMPRESAS, extraer=fep.extraer_datos_factura_local, procesadas=(), **opciones):
+    guardadas = []
+
+    def guardar(empresa, mensaje, pdf_hash, datos):
+        guardadas.append((empresa['codigo'], mensaje.uid, mensaje.pdf_bytes, threading.current_thread().name))
+        return len(guardadas)
+
+    pipeline = fep.PipelineFacturasEmail(
+        mail, fep.EnrutadorEmpresas(empresas), extraer=extraer,
+        ya_procesada=lambda empresa, pdf_hash: (empresa['id'], pdf_hash) in procesadas,
+        guardar=guardar, calcular_hash=lambda pdf: pdf.hex(), **opciones
+    )
+    return pipeline, guardadas
+
+
+class TestRespuestasIMAP:
+    """Lectura de las respuestas FETCH y del BODYSTRUCTURE"""
+
+    def test_literales_y_cadenas(self):
+        datos = [(b'1 (UID 7 BODYSTRUCTURE ("application" "pdf" ("name" {9}', b'fact.pdf)'),
+                 (b') NIL "con \\"comillas\\"" "base64" 30 NIL NIL NIL NIL) BODY[2] {3}', b'abc'), b')']
+        mensaje, = fep.parsear_fetch(datos)
+        assert mensaje['UID'] == '7'
+        assert mensaje['BODYSTRUCTURE'][2] == ['name', b'fact.pdf)']
+        assert mensaje['BODYSTRUCTURE'][3] is None
+        assert mensaje['BODYSTRUCTURE'][4] == 'con "comillas"'
+        assert mensaje['BODY[2]'] == b'abc'
+
+    def test_partes_pdf(self):
+        mixto, = fep.parsear_fetch([b'1 (BODYSTRUCTURE ' + _mixto(TEXTO, _pdf(100), _pdf(50)) + b')'])
+        assert [p['parte'] for p in fep.partes_pdf(mixto['BODYSTRUCTURE'])] == ['2', '3']
+
+        simple, = fep.parsear_fetch([b'1 (BODYSTRUCTURE ' + _pdf(100) + b')'])
+        assert fep.partes_pdf(simple['BODYSTRUCTURE']) == [
+            {'parte': '1', 'codificacion': 'base64', 'nombre': 'factura.pdf', 'tamaño': 100}]
+
+        # PDF dentro de un email reenviado como adjunto
+        reenviado = (b'("message" "rfc822" NIL NIL NIL "7bit" 900 NIL ' + _mixto(TEXTO, _pdf(300))
+                     + b' 20 NIL NIL NIL NIL)')
+        anidado, = fep.parsear_fetch([b'1 (BODYSTRUCTURE ' + _mixto(TEXTO, reenviado) + b')'])
+        assert [p['parte'] for p in fep.partes_pdf(anidado['BODYSTRUCTURE'])] == ['2.2']
+
+    def test_pdf_por_nombre_de_adjunto(self):
+        octetos = (b'("application" "octet-stream" NIL NIL NIL "base64" 10 NIL '
+                   b'("attachment" ("filename*" "utf-8\'\'Factura%20n%C2%BA1.PDF")) NIL NIL)')
+        mensaje, = fep.parsear_fetch([b'1 (BODYSTRUCTURE ' + _mixto(TEXTO, octetos) + b')'])
+        assert fep.partes_pdf(mensaje['BODYSTRUCTURE'])[0]['nombre'] == 'Factura nº1.PDF'
+        texto, = fep.parsear_fetch([b'1 (BODYSTRUCTURE ' + TEXTO + b')'])
+        assert fep.partes_pdf(texto['BODYSTRUCTURE']) == []
+
+    def test_conjunto_uids(self):
+        assert fep.conjunto_uids(['10', '1', '2', '3', '7', '9']) == '1:3,7,9:10'
+
+
+class TestEnrutador:
+    """Empresa destinataria por dirección"""
+
+    def test_email_y_subdireccion(self):
+        enrutador = fep.EnrutadorEmpresas(EMPRESAS)
+        assert enrutador.empresa_para(['Facturas@Copis.es'])['codigo'] == 'COPIS'
+        assert enrutador.empresa_para(['otra@x.es', 'buzon+aleph@copis.es'])['codigo'] == 'ALEPH'
+        assert enrutador.empresa_para(['otra@x.es']) is None
+
+    def test_empresa_por_defecto(self):
+        assert fep.EnrutadorEmpresas(EMPRESAS, 'aleph').empresa_para(['otra@x.es'])['codigo'] == 'ALEPH'
+        assert fep.EnrutadorEmpresas(EMPRESAS[:1]).empresa_para([])['codigo'] == 'COPIS'
+
+
+class TestPipeline:
+    """Etapas completas contra un buzón simulado"""
+
+    def test_enruta_deduplica_y_guarda(self):
+        mail = FakeIMAP()
+        mail.añadir(1, 'facturas@copis.es', b'%PDF-A')
+        mail.añadir(2, 'buzon+ALEPH@copis.es', b'%PDF-A')  # mismo PDF, otra empresa
+        mail.añadir(3, 'facturas@copis.es', b'%PDF-A')  # repetido en la misma ejecución
+        mail.añadir(4, 'facturas@copis.es')  # sin PDF
+        mail.añadir(5, 'facturas@copis.es', b'%PDF-B')  # ya en la BD
+        mail.añadir(6, 'desconocido@x.es', b'%PDF-C')
+        pipeline, guardadas = _pipeline(mail, procesadas={(1, b'%PDF-B'.hex())}, lote=4)
+
+        resumen = pipeline.ejecutar('ALL')
+
+        assert sorted(g[:3] for g in guardadas) == [('ALEPH', '2', b'%PDF-A'), ('COPIS', '1', b'%PDF-A')]
+        assert all(g[3] == threading.current_thread().name for g in guardadas)
+        assert resumen['mensajes'] == 6
+        assert (resumen['sin_pdf'], resumen['sin_empresa']) == (1, 1)
+        assert resumen['etapas']['deduplicacion'] | {'segundos': 0, 'por_segundo': 0} == {
+            'entradas': 5, 'salidas': 2, 'descartes': 3, 'errores': 0, 'segundos': 0, 'por_segundo': 0}
+        assert resumen['por_empresa'] == {'COPIS': 1, 'ALEPH': 1}
+        assert resumen['bytes_omitidos'] > 0
+
+        # Dos lotes de cabeceras y un FETCH de parte por lote; nunca el mensaje completo
+        assert [f[0] for f in mail.fetches if 'BODYSTRUCTURE' in f[1]] == ['1:4', '5:6']
+        assert [f for f in mail.fetches if 'BODYSTRUCTURE' not in f[1]] == [
+            ('1:3', '(UID BODY.PEEK[2])'), ('5:6', '(UID BODY.PEEK[2])')]
+        assert not any('RFC822)' in f[1] for f in mail.fetches)
+
+    def test_extracciones_concurrentes_y_acotadas(self):
+        mail = FakeIMAP()
+        for uid in range(1, 9):
+            mail.añadir(uid, 'facturas@copis.es', b'%PDF-' + bytes([uid]))
+        activas, maximo = [0], [0]
+        lock = threading.Lock()
+
+        def extraer_lento(pdf_bytes):
+            with lock:
+                activas[0] += 1
+                maximo[0] = max(maximo[0], activas[0])
+            time.sleep(0.1)
+            with lock:
+                activas[0] -= 1
+            return fep.extraer_datos_factura_local(pdf_bytes)
+
+        pipeline, guardadas = _pipeline(mail, extraer=extraer_lento, trabajadores=4, max_pendientes=4)
+        inicio = time.perf_counter()
+        resumen = pipeline.ejecutar('ALL')
+
+        assert len(guardadas) == 8
+        assert maximo[0] == 4
+        assert time.perf_counter() - inicio < 0.6  # en serie serían 0.8 s
+        assert resumen['etapas']['extraccion']['salidas'] == 8
+
+    def test_errores_de_extraccion_y_datos_incompletos(self):
+        mail = FakeIMAP()
+        mail.añadir(1, 'facturas@copis.es', b'%PDF-1')
+        mail.añadir(2, 'facturas@copis.es', b'%PDF-2')
+        mail.añadir(3, 'facturas@copis.es', b'%PDF-3')
+
+        def extraer(pdf_bytes):
+            if pdf_bytes == b'%PDF-1':
+                raise RuntimeError('API caída')
+            if pdf_bytes == b'%PDF-2':
+                return {'numero_factura': 'F1', 'proveedor_nif': None}
+            return fep.extraer_datos_factura_local(pdf_bytes)
+
+        pipeline, guardadas = _pipeline(mail, extraer=extraer)
+        resumen = pipeline.ejecutar('ALL')
+
+        assert [g[1] for g in guardadas] == ['3']
+        assert resumen['etapas']['extraccion']['errores'] == 1
+        assert resumen['etapas']['guardado']['descartes'] == 1
+
+
+class TestExtractorYBD:
+    """Extractor local y BD de empresa para get_db_connection()"""
+
+    def test_extractor_local_determinista(self):
+        with patch.dict(FACTURAS_EMAIL_CONFIG, {'LATENCIA_LOCAL': 0}):
+            datos = fep.extraer_datos_factura_local(b'%PDF-1')
+            assert datos == fep.extraer_datos_factura_local(b'%PDF-1')
+        assert datos['numero_factura'] != fep.extraer_datos_factura_local(b'%PDF-2')['numero_factura']
+        assert datos['proveedor_nif'] and datos['metodo_extraccion'] == 'local'
+
+    def test_bd_empresa_restaura_entorno(self):
+        with patch.dict(os.environ, {'EMPRESA_DB_PATH': '/db/previa.db'}):
+            with fep.bd_empresa('/db/COPIS.db'):
+                assert os.environ['EMPRESA_DB_PATH'] == '/db/COPIS.db'
+            assert os.environ['EMPRESA_DB_PATH'] == '/db/previa.db'
+        with patch.dict(os.environ, clear=False):
+            os.environ.pop('EMPRESA_DB_PATH', None)
+            with pytest.raises(ValueError):
+                with fep.bd_empresa('/db/COPIS.db'):
+                    raise ValueError
+            assert 'EMPRESA_DB_PATH' not in os.environ
+
+    def test_historial_en_la_bd_de_la_empresa(self, tmp_path):
+        import sqlite3
+        import facturas_proveedores
+
+        ruta = str(tmp_path / 'EMPRESA.db')
+        conn = sqlite3.connect(ruta)
+        conn.execute('''CREATE TABLE historial_facturas_proveedores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, factura_id INTEGER NOT NULL, usuario TEXT NOT NULL,
+            accion TEXT NOT NULL, fecha DATETIME DEFAULT CURRENT_TIMESTAMP, datos_anteriores TEXT, datos_nuevos TEXT)''')
+        conn.close()
+
+        with fep.bd_empresa(ruta):
+            facturas_proveedores.registrar_historial(7, 'creada', 'sistema_email', datos_nuevos={'total': 121.0})
+        conn = sqlite3.connect(ruta)
+        assert conn.execute('SELECT factura_id, accion, datos_anteriores, datos_nuevos FROM historial_facturas_proveedores'
+                            ).fetchall() == [(7, 'creada', None, '{"total": 121.0}')]
+        conn.close()
@@ -0,0 +1,140 @@
+"""
+Tests unitarios para motor_plantillas.py
+"""
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from jinja2 import Environment
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import utils_emisor
+from motor_plantillas import (PLANTILLA_FACTURA, PLANTILLA_PRESUPUESTO, MotorPlantillas, contexto_emisor,
+                              preparar_factura, preparar_presupuesto)
+
+FRONTEND = str(Path(__file__).parent.parent.parent / 'frontend')
+
+
+@pytest.fixture
+def motor(tmp_path):
+    return MotorPlantillas({'DIRECTORIO': FRONTEND, 'DIRECTORIO_EMPRESAS': str(tmp_path / 'empresas')})
+
+
+def _contexto_factura(**cambios):
+    contexto = dict(
+        contexto_emisor({'nombre': 'EMISOR SL', 'direccion': 'C/ Mayor 1', 'cp': '28001', 'ciudad': 'Madrid',
+                         'provincia': 'Madrid', 'nif': 'B12345678', 'email': 'emisor@ejemplo.es'}),
+        logo_src='file:///var/www/html/static/img/logo.png',
+        numero='F260007', fecha='15/01/2026', fecha_vencimiento='14/02/2026',
+        razonsocial='CLIENTE SA', direccion=None, cp_localidad='08001, Barcelona', nif='A11111111',
+        lineas=[{'concepto': 'Copias', 'descripcion': 'A4 color', 'cantidad': 3, 'precio': '0,15', 'subtotal': '0,45'}],
+        base='0,45€', iva='0,09€', total='0,54€', forma_pago='Efectivo',
+        mostrar_verifactu=True, hash='HUELLA123', qr_code='UVJQTkc='
+    )
+    contexto.update(cambios)
+    return contexto
+
+
+class TestFactura:
+    """IMPRIMIR_FACTURA.html compilada a partir de sus marcadores"""
+
+    def test_rellena_todos_los_marcadores(self, motor):
+        html = motor.renderizar_factura(_contexto_factura())
+        for texto in ('>F260007</span>', '>15/01/2026</span>', '<p id="emisor-nombre">EMISOR SL</p>',
+                      'Madrid (28001), Madrid, España', '<p id="razonsocial">CLIENTE SA</p>',
+                      '<p id="direccion"></p>', '<span>Copias</span>', "detalle-descripcion'>A4 color",
+                      '<td class="precio">0,15€</td>', 'id="total">0,54€</strong>', '<p id="forma-pago">Efectivo</p>',
+                      'Hash: HUELLA123', 'data:image/png;base64,UVJQTkc=', 'src="file:///var/www/html/static/img/logo.png"'):
+            assert texto in html
+        assert 'imprimir-factura.js' not in html
+        assert 'FACTURA RECTIFICATIVA' not in html
+
+    def test_sin_verifactu_quita_distintivo_y_bloque(self, motor):
+        html = motor.renderizar_factura(_contexto_factura(mostrar_verifactu=False))
+        cuerpo = html[html.index('<body>'):]
+        assert 'VERI*FACTU' not in cuerpo and 'HUELLA123' not in cuerpo
+        assert cuerpo.count('<div') == cuerpo.count('</div>')
+        assert '<strong id="total">0,54€</strong>' in cuerpo
+
+    def test_rectificativa_y_columna_de_iva(self, motor):
+        lineas = [{'concepto': 'X', 'cantidad': 1, 'precio': '1,00', 'impuestos': 21, 'subtotal': '1,00'}]
+        html = motor.renderizar_factura(_contexto_factura(
+            lineas=lineas, rectificativa={'numero': 'F260001', 'fecha': '2026-01-02', 'motivo': 'Error'}))
+        assert 'Nº F260001 de fecha 2026-01-02' in html
+        assert '<td class="precio">21%</td>' in html
+
+    def test_logo_alternativo(self, motor):
+        html = motor.renderizar_factura(_contexto_factura(logo_src=None, logo_alternativo='<div>LOGO</div>'))
+        assert '<div>LOGO</div>' in html and 'id="logo"' not in html
+
+    def test_delimitadores_jinja_de_la_plantilla_se_conservan(self):
+        fuente = '<html><head><style>/* {# no es comentario #} */</style></head><body><span id="numero"></span></body></html>'
+        salida = Environment().from_string(preparar_factura(fuente)).render(numero='N1', estilos_extra='')
+        assert '{# no es comentario #}' in salida and '<span id="numero">N1</span>' in salida
+
+
+class TestCache:
+    """Compilación única con invalidación por cambio del archivo"""
+
+    def test_compila_una_vez(self, motor):
+        for _ in range(3):
+            motor.renderizar_factura(_contexto_factura())
+        metricas = motor.get_metrics()
+        assert metricas['compilaciones'] == 1 and metricas['aciertos'] == 2
+        assert metricas['etapas']['html']['documentos'] == 3
+
+    def test_cambio_del_archivo_recompila(self, tmp_path):
+        ruta = tmp_path / 'plantilla.html'
+        ruta.write_text('Hola {{ nombre }}', encoding='utf-8')
+        motor = MotorPlantillas()
+        assert motor.plantilla(str(ruta)).render(nombre='A') == 'Hola A'
+        ruta.write_text('Adiós {{ nombre }}', encoding='utf-8')
+        estado = os.stat(ruta)
+        os.utime(ruta, ns=(estado.st_atime_ns, estado.st_mtime_ns + 10 ** 9))
+        assert motor.plantilla(str(ruta)).render(nombre='A') == 'Adiós A'
+        assert motor.get_metrics()['compilaciones'] == 2
+
+    def test_plantilla_propia_de_la_empresa(self, motor, tmp_path):
+        propia = tmp_path / 'empresas' / 'CHAPA' / PLANTILLA_FACTURA
+        propia.parent.mkdir(parents=True)
+        propia.write_text('<html><head></head><body><span id="numero"></span></body></html>', encoding='utf-8')
+        assert motor.ruta_plantilla(PLANTILLA_FACTURA, 'CHAPA') == str(propia)
+        assert motor.ruta_plantilla(PLANTILLA_FACTURA, 'OTRA') == os.path.join(FRONTEND, PLANTILLA_FACTURA)
+        html = motor.renderizar_factura(_contexto_factura(), codigo_empresa='CHAPA')
+        assert '<span id="numero">F260007</span>' in html and 'EMISOR SL' not in html
+
+    def test_presupuesto(self, motor):
+        html = motor.renderizar(PLANTILLA_PRESUPUESTO, {'EMISOR_NOMBRE': 'EMISOR SL', 'NUMERO_PRESUPUESTO': 'P26001',
+                                                        'logo_src': 'file:///logo.png'}, preparar_presupuesto)
+        assert 'EMISOR SL' in html and 'P26001' in html and 'src="file:///logo.png"' in html
+        assert '{{' not in html
+
+
+class TestEtapas:
+    def test_tiempos_y_errores_por_etapa(self, motor):
+        with motor.etapa('consulta'):
+            pass
+        with pytest.raises(ValueError):
+            with motor.etapa('pdf'):
+                raise ValueError('fallo')
+        etapas = motor.get_metrics()['etapas']
+        assert etapas['consulta']['documentos'] == 1 and etapas['consulta']['ms_medio'] is not None
+        assert etapas['pdf']['documentos'] == 0 and etapas['pdf']['errores'] == 1
+
+
+class TestEmisor:
+    """utils_emisor reutiliza el JSON del emisor mientras no cambie"""
+
+    def test_json_cacheado_e_invalidado(self, tmp_path):
+        ruta = tmp_path / 'X_emisor.json'
+        ruta.write_text('{"nombre": "A"}', encoding='utf-8')
+        primero = utils_emisor.cargar_json_emisor(str(ruta))
+        primero['nombre'] = 'modificado por quien llama'
+        with patch('builtins.open', side_effect=AssertionError('lectura')):
+            assert utils_emisor.cargar_json_emisor(str(ruta)) == {'nombre': 'A'}
+        ruta.write_text('{"nombre": "BB"}', encoding='utf-8')
+        assert utils_emisor.cargar_json_emisor(str(ruta)) == {'nombre': 'BB'}
@@ -0,0 +1,155 @@
+"""
+Tests unitarios para normalizador_conceptos.py
+"""
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import normalizador_conceptos as nc
+
+
+@pytest.fixture
+def conn():
+    conexion = sqlite3.connect(':memory:')
+    conexion.row_factory = sqlite3.Row
+    conexion.execute('CREATE TABLE gastos (id INTEGER PRIMARY KEY, concepto TEXT, importe_eur REAL)')
+    conexion.executemany('INSERT INTO gastos (concepto, importe_eur) VALUES (?, ?)', [
+        ('Compra Internet En Amazon.es, Tarjeta 4176570108340631 , Comision 0', -20.0),
+        ('Recibo Orange Espagne Sau Nº Recibo: 0049 1234', -45.0),
+        ('Transferencia Inmediata A Favor De Truyol Digital Sl Concepto Factura 12', -300.0),
+        (None, -1.0),
+    ])
+    conexion.commit()
+    yield conexion
+    conexion.close()
+
+
+def _normalizados(conn):
+    return [fila[0] for fila in conn.execute('SELECT concepto_normalizado FROM gastos ORDER BY id')]
+
+
+class TestReglasBase:
+    """Tests de las reglas base compiladas"""
+
+    def test_comercios_conocidos(self):
+        assert nc.normalizar_concepto('Compra Internet En Amazon.es, Tarjeta 4176 , Comision 0') == 'Compra Amazon Business'
+        assert nc.normalizar_concepto('Compra Uber Eats Barcelona, Tarjeta , Comision') == 'Compra Uber Eats'
+        assert nc.normalizar_concepto('Recibo Orange Nº Recibo: 0049 1234') == 'Recibo Orange Espagne'
+
+    def test_transferencia_por_destinatario(self):
+        resultado = nc.normalizar_concepto('Transferencia Inmediata A Favor De Truyol Digital Sl Concepto Factura 12')
+        assert resultado == 'Transferencia A Favor De Truyol Sl'
+
+    def test_concepto_vacio(self):
+        assert nc.normalizar_concepto(None) == ''
+        assert nc.normalizar_concepto('') == ''
+
+
+class TestMemo:
+    """Tests de la memoria LRU por concepto original"""
+
+    def test_aciertos_y_expulsiones(self):
+        normalizador = nc.Normalizador(max_memo=2)
+        for concepto in ('Recibo A 1', 'Recibo A 1', 'Recibo B 2', 'Recibo C 3'):
+            normalizador.normalizar(concepto)
+        metricas = normalizador.get_metrics()
+        assert (metricas['aciertos'], metricas['fallos'], metricas['expulsiones'], metricas['memo']) == (1, 3, 1, 2)
+
+
+class TestReglasEmpresa:
+    """Tests de las reglas propias de cada empresa"""
+
+    def test_fijar_y_sustituir(self):
+        normalizador = nc.Normalizador([
+            ('fijar', r'mercadona', 'Supermercado', True),
+            ('sustituir', r'Gestoria\s+Lopez', 'Asesoria', False),
+        ])
+        assert normalizador.normalizar('Compra Tarjeta MERCADONA 123, Madrid') == 'Supermercado'
+        assert normalizador.normalizar('Recibo Gestoria Lopez 2025') == 'Recibo Asesoria'
+        assert normalizador.firma != nc.NORMALIZADOR_BASE.firma
+
+    def test_carga_descarta_reglas_invalidas(self, conn):
+        nc.instalar_concepto_normalizado(conn, nc.NORMALIZADOR_BASE)
+        conn.executemany('INSERT INTO reglas_normalizacion_concepto (orden, tipo, patron, reemplazo, activa) '
+                         'VALUES (?, ?, ?, ?, ?)', [
+                             (2, 'fijar', 'orange', 'Telefonía', 1),
+                             (1, 'sustituir', '([', 'x', 1),
+                             (3, 'fijar', 'amazon', 'Amazon', 0),
+                         ])
+        assert nc.cargar_reglas_empresa(conn) == (('fijar', 'orange', 'Telefonía', True),)
+
+
+class TestColumnaPersistida:
+    """Tests de gastos.concepto_normalizado"""
+
+    def test_relleno_inicial(self, conn):
+        assert nc.preparar_conceptos_normalizados(conn) == 4
+        assert _normalizados(conn) == [
+            'Compra Amazon Business', 'Recibo Orange Espagne', 'Transferencia A Favor De Truyol Sl', ''
+        ]
+        assert nc.preparar_conceptos_normalizados(conn) == 0
+
+    def test_cambio_de_concepto(self, conn):
+        nc.preparar_conceptos_normalizados(conn)
+        conn.execute("UPDATE gastos SET concepto = 'Recibo Endesa 2025' WHERE id = 2")
+        conn.execute('UPDATE gastos SET importe_eur = -2 WHERE id = 1')
+        assert _normalizados(conn)[:2] == ['Compra Amazon Business', None]
+        assert nc.preparar_conceptos_normalizados(conn) == 1
+        assert _normalizados(conn)[1] == 'Recibo Endesa'
+
+    def test_cambio_de_reglas_recalcula(self, conn):
+        nc.preparar_conceptos_normalizados(conn)
+        conn.execute("INSERT INTO reglas_normalizacion_concepto (tipo, patron, reemplazo) "
+                     "VALUES ('fijar', 'orange', 'Telefonía')")
+        conn.commit()
+        assert nc.preparar_conceptos_normalizados(conn) == 4
+        assert _normalizados(conn)[1] == 'Telefonía'
+
+    def test_cambio_de_reglas_invalida_estadisticas(self, conn):
+        import cache_estadisticas as ce
+        nc.preparar_conceptos_normalizados(conn)
+        ce.instalar_version_datos(conn, ('gastos',))
+        antes = ce.obtener_version_datos(conn, ('gastos',))[1]
+        nc.preparar_conceptos_normalizados(conn)
+        assert ce.obtener_version_datos(conn, ('gastos',))[1] == antes
+        conn.execute("INSERT INTO reglas_normalizacion_concepto (tipo, patron, reemplazo) "
+                     "VALUES ('fijar', 'orange', 'Telefonía')")
+        conn.commit()
+        nc.preparar_conceptos_normalizados(conn)
+        assert ce.obtener_version_datos(conn, ('gastos',))[1] != antes
+
+    def test_reglas_cambiadas_por_otro_proceso(self, tmp_path):
+        ruta = str(tmp_path / 'gastos.db')
+        conexion = sqlite3.connect(ruta)
+        conexion.execute('CREATE TABLE gastos (id INTEGER PRIMARY KEY, concepto TEXT, importe_eur REAL)')
+        conexion.execute("INSERT INTO gastos (concepto, importe_eur) VALUES ('Recibo Orange Espagne', -45)")
+        conexion.commit()
+        try:
+            nc.preparar_conceptos_normalizados(conexion)
+            # Otro proceso añade una regla y recalcula (scripts/renormalizar_conceptos.py)
+            otra = sqlite3.connect(ruta)
+            otra.execute("INSERT INTO reglas_normalizacion_concepto (tipo, patron, reemplazo) "
+                         "VALUES ('fijar', 'orange', 'Telefonía')")
+            otra.commit()
+            normalizador = nc.Normalizador(nc.cargar_reglas_empresa(otra))
+            nc.instalar_concepto_normalizado(otra, normalizador)
+            nc.rellenar_conceptos_normalizados(otra, normalizador)
+            otra.close()
+
+            conexion.execute("INSERT INTO gastos (concepto, importe_eur) VALUES ('Recibo Orange 2', -40)")
+            conexion.commit()
+            assert nc.preparar_conceptos_normalizados(conexion) == 1
+            assert _normalizados(conexion) == ['Telefonía', 'Telefonía']
+        finally:
+            conexion.close()
+            nc.invalidar_normalizador(ruta)
+
+    def test_bd_sin_gastos(self):
+        conexion = sqlite3.connect(':memory:')
+        assert nc.preparar_conceptos_normalizados(conexion) == 0
+        conexion.close()
@@ -0,0 +1,96 @@
+"""
+Tests unitarios para perfiles_conexion.py
+"""
+import sqlite3
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import perfiles_conexion as pc
+from database_pool import DatabasePool
+from multiempresa_config import DATABASE_POOL_CONFIG, PERFILES_CONEXION
+
+
+@pytest.fixture
+def bd(tmp_path):
+    ruta = tmp_path / 'EMPRESA' / 'EMPRESA.db'
+    ruta.parent.mkdir()
+    conn = sqlite3.connect(str(ruta))
+    conn.execute('CREATE TABLE gastos (id INTEGER PRIMARY KEY, importe_eur REAL)')
+    conn.commit()
+    conn.close()
+    return str(ruta)
+
+
+class TestResolverPerfil:
+    """Elección del perfil de cada BD"""
+
+    def test_por_defecto_empresa_y_tamano(self, bd):
+        assert pc.resolver_perfil(bd)[0] == DATABASE_POOL_CONFIG['PERFIL_CONEXION']
+        with patch.dict(DATABASE_POOL_CONFIG, {'PERFILES_EMPRESA': {'EMPRESA': 'basico'}}):
+            assert pc.resolver_perfil(bd) == ('basico', PERFILES_CONEXION['basico'])
+        with patch.dict(DATABASE_POOL_CONFIG, {'UMBRAL_BD_GRANDE_MB': 0}):
+            assert pc.resolver_perfil(bd)[0] == DATABASE_POOL_CONFIG['PERFIL_BD_GRANDE']
+
+    def test_perfil_desconocido(self, bd):
+        assert pc.resolver_perfil(bd, 'inexistente')[0] == DATABASE_POOL_CONFIG['PERFIL_CONEXION']
+
+
+class TestAplicarPerfil:
+    """PRAGMAs de las conexiones del pool"""
+
+    def test_conexiones_con_el_perfil(self, bd):
+        pool = DatabasePool(bd, max_connections=2, min_connections=0, profile='grande')
+        perfil = PERFILES_CONEXION['grande']
+        with pool.get_db_connection() as conn:
+            assert conn.execute('PRAGMA mmap_size').fetchone()[0] == perfil['mmap_size']
+            assert conn.execute('PRAGMA cache_size').fetchone()[0] == perfil['cache_size']
+            assert conn.execute('PRAGMA temp_store').fetchone()[0] == 2  # MEMORY
+            assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == perfil['busy_timeout_ms']
+        with pool.get_read_connection() as conn:
+            assert conn.execute('PRAGMA mmap_size').fetchone()[0] == perfil['mmap_size']
+            assert conn.execute('PRAGMA query_only').fetchone()[0] == 1
+        assert pool.get_metrics()['profile'] == 'grande'
+        pool.shutdown()
+
+    def test_perfil_no_valido(self):
+        conn = sqlite3.connect(':memory:')
+        with pytest.raises(ValueError):
+            pc.aplicar_perfil(conn, dict(PERFILES_CONEXION['estandar'], temp_store='RAM; DROP TABLE x'))
+        conn.close()
+
+
+class TestMantenimiento:
+    """PRAGMA optimize + checkpoint de las BD usadas"""
+
+    def test_solo_bd_usadas(self, bd):
+        pool = DatabasePool(bd, max_connections=2, min_connections=0)
+        assert pool.run_maintenance() is False
+        with pool.write_transaction() as conn:
+            conn.execute('INSERT INTO gastos (importe_eur) VALUES (1)')
+        ultimo_uso = pool.last_used
+        assert pool.run_maintenance() is True
+        assert pool.last_used == ultimo_uso
+        assert pool.get_metrics()['last_checkpoint']['busy'] == 0
+        assert pool.run_maintenance() is False
+        pool.shutdown()
+
+
+class TestBenchmark:
+    """Medición de lectura/escritura por perfil"""
+
+    def test_copia_sin_tocar_el_origen(self, bd):
+        informe = pc.benchmark_perfiles(bd, ['basico', 'estandar'], segundos=0.1, filas=500, hilos=2)
+        assert list(informe['perfiles']) == ['basico', 'estandar']
+        assert all(r['lecturas_s'] > 0 and r['escrituras_s'] > 0 for r in informe['perfiles'].values())
+        assert pc.get_metrics()['ultimo_benchmark'] is informe
+
+        conn = sqlite3.connect(bd)
+        tablas = [fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        conn.close()
+        assert tablas == ['gastos']
@@ -0,0 +1,105 @@
+"""
+Tests unitarios para plantilla_empresa.py
+"""
+import os
+import sqlite3
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import plantilla_empresa as pe
+from database_pool import DatabasePool
+from multiempresa_config import PLANTILLA_EMPRESA_CONFIG
+
+
+@pytest.fixture
+def plantilla(tmp_path):
+    ruta = tmp_path / 'plantilla.db'
+    conn = sqlite3.connect(str(ruta))
+    conn.executescript('''
+        CREATE TABLE productos (id INTEGER PRIMARY KEY AUTOINCREMENT, nombre TEXT);
+        CREATE INDEX idx_productos_nombre ON productos (nombre);
+        CREATE TABLE provincia (provinciaid INTEGER NOT NULL, provincia TEXT NOT NULL);
+        CREATE TABLE codipostal (idCp INTEGER PRIMARY KEY, cp TEXT NOT NULL, poblacio TEXT, provincia TEXT);
+        CREATE INDEX cp ON codipostal (cp);
+        INSERT INTO productos (nombre) VALUES ('Dato de la plantilla');
+        INSERT INTO provincia VALUES (8, 'BARCELONA');
+        INSERT INTO codipostal (cp, poblacio, provincia) VALUES ('08001', 'BARCELONA', 'BARCELONA');
+    ''')
+    conn.commit()
+    conn.close()
+    with patch.dict(PLANTILLA_EMPRESA_CONFIG, {'BD_MAESTROS': str(tmp_path / 'maestros.db'),
+                                               'MAESTROS_COMPARTIDOS': True}):
+        yield str(ruta)
+
+
+def _tablas(ruta):
+    conn = sqlite3.connect(ruta)
+    tablas = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    return tablas
+
+
+class TestPlantillaCompilada:
+    """Alta de la BD de empresa desde la plantilla compilada"""
+
+    def test_esquema_sin_datos_ni_maestros(self, plantilla, tmp_path):
+        destino = str(tmp_path / 'EMPRESA.db')
+        pe.crear_bd_desde_plantilla(plantilla, destino)
+
+        assert _tablas(destino) == {'productos', 'sqlite_sequence'}
+        conn = sqlite3.connect(destino)
+        assert conn.execute('SELECT COUNT(*) FROM productos').fetchone()[0] == 0
+        conn.close()
+        assert _tablas(PLANTILLA_EMPRESA_CONFIG['BD_MAESTROS']) == {'provincia', 'codipostal'}
+
+    def test_se_regenera_al_cambiar_el_esquema(self, plantilla, tmp_path):
+        compilada = pe.preparar_plantilla(plantilla)
+        generada = os.path.getmtime(compilada)
+        assert pe.preparar_plantilla(plantilla) == compilada
+        assert os.path.getmtime(compilada) == generada
+
+        conn = sqlite3.connect(plantilla)
+        conn.execute('CREATE TABLE tickets (id INTEGER PRIMARY KEY, total REAL)')
+        conn.close()
+        pe.preparar_plantilla(plantilla)
+        assert 'tickets' in _tablas(compilada)
+
+    def test_maestros_en_la_propia_bd_si_no_se_comparten(self, plantilla, tmp_path):
+        destino = str(tmp_path / 'EMPRESA.db')
+        with patch.dict(PLANTILLA_EMPRESA_CONFIG, {'MAESTROS_COMPARTIDOS': False}):
+            pe.crear_bd_desde_plantilla(plantilla, destino)
+        conn = sqlite3.connect(destino)
+        assert conn.execute('SELECT COUNT(*) FROM codipostal').fetchone()[0] == 1
+        conn.close()
+
+
+class TestMaestrosCompartidos:
+    """BD de maestros adjunta a las conexiones del pool"""
+
+    def test_consultas_sin_cambios_y_solo_lectura(self, plantilla, tmp_path):
+        destino = str(tmp_path / 'EMPRESA.db')
+        pe.crear_bd_desde_plantilla(plantilla, destino)
+
+        pool = DatabasePool(destino, max_connections=2, min_connections=0)
+        with pool.get_db_connection() as conn:
+            assert conn.execute("SELECT poblacio FROM codipostal WHERE cp = '08001'").fetchone()[0] == 'BARCELONA'
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute('DELETE FROM provincia')
+        with pool.get_read_connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM provincia').fetchone()[0] == 1
+        with pool.write_transaction() as conn:
+            conn.execute("INSERT INTO productos (nombre) VALUES ('Copia')")
+        assert pool.run_maintenance() is True
+        pool.shutdown()
+
+    def test_no_adjunta_si_la_empresa_tiene_sus_maestros(self, plantilla):
+        pe.preparar_plantilla(plantilla)
+        conn = sqlite3.connect(plantilla)
+        assert pe.adjuntar_maestros(conn) is False
+        conn.close()
@@ -323,6 +323,89 @@ class TestReemplazarFranjas:
         assert resultado == True
 
 
+class TestFranjasLote:
+    """Tests para la generación y escritura en lote de franjas"""
+
+    CFG = {'bandas': 50, 'ancho': 10, 'descuento_inicial': 0.0, 'incremento': 60.0 / 49}
+
+    @pytest.fixture
+    def conn(self):
+        import sqlite3
+        conexion = sqlite3.connect(':memory:')
+        conexion.execute("""
+            CREATE TABLE descuento_producto_franja (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                producto_id INTEGER NOT NULL,
+                min_cantidad INTEGER NOT NULL,
+                max_cantidad INTEGER NOT NULL,
+                porcentaje_descuento REAL NOT NULL,
+                UNIQUE(producto_id, min_cantidad, max_cantidad)
+            )
+        """)
+        conexion.execute(
+            'CREATE INDEX idx_desc_franja_producto ON descuento_producto_franja (producto_id, min_cantidad, max_cantidad)'
+        )
+        yield conexion
+        conexion.close()
+
+    @pytest.mark.parametrize('cfg', [
+        CFG,
+        {'bandas': 5, 'ancho': 10, 'descuento_inicial': 5.0, 'incremento': 3.0},
+        {'bandas': 20, 'ancho': 10, 'descuento_inicial': 10.0, 'incremento': 10.0},
+        {'bandas': 7, 'ancho': 3, 'descuento_inicial': 5.0, 'incremento': 0.0},
+    ])
+    def test_lote_identico_al_generador_por_producto(self, cfg):
+        """Test que el lote produce las mismas franjas que _generar_franjas_automaticas"""
+        from productos_franjas_lote import generar_franjas_lote
+
+        subtotales = [100.0, 0.35, 12345.678, 0.0, -2.5, 0.001, 19.99]
+        ivas = [21.0, 10.0, 4.0, 21.0, 21.0, 0.0, -5.0]
+
+        lote = generar_franjas_lote(subtotales, ivas, cfg)
+
+        assert lote == [productos._generar_franjas_automaticas(s, i, cfg) for s, i in zip(subtotales, ivas)]
+
+    def test_solo_reescribe_productos_con_cambios(self, conn):
+        """Test que la segunda pasada no reescribe y un cambio de franjas solo afecta a su producto"""
+        from productos_franjas_lote import escribir_franjas_lote, generar_franjas_lote
+
+        franjas = dict(zip([1, 2, 3], generar_franjas_lote([10.0, 20.0, 30.0], [21.0] * 3, self.CFG)))
+        primera = escribir_franjas_lote(conn, franjas)
+        assert primera['actualizados'] == [1, 2, 3]
+        assert primera['franjas_insertadas'] == conn.execute('SELECT COUNT(*) FROM descuento_producto_franja').fetchone()[0]
+
+        segunda = escribir_franjas_lote(conn, franjas)
+        assert segunda['actualizados'] == []
+        assert segunda['sin_cambios'] == 3
+
+        franjas[2] = generar_franjas_lote([20.0], [21.0], dict(self.CFG, bandas=10))[0]
+        tercera = escribir_franjas_lote(conn, franjas)
+        assert tercera['actualizados'] == [2]
+        assert tercera['franjas_eliminadas'] == 50
+        assert tercera['franjas_insertadas'] == 10
+
+    def test_recrea_indice_en_lotes_grandes(self, conn):
+        """Test que el índice secundario existe tras un lote por encima del umbral"""
+        import productos_franjas_lote
+        from productos_franjas_lote import escribir_franjas_lote
+
+        with patch.object(productos_franjas_lote, 'UMBRAL_RECREAR_INDICE', 1):
+            escribir_franjas_lote(conn, {1: [{'min': 1, 'max': 10, 'descuento': 70.0}]})
+
+        indices = [fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        assert 'idx_desc_franja_producto' in indices
+        assert conn.execute('SELECT porcentaje_descuento FROM descuento_producto_franja').fetchone()[0] == 60.0
+
+    def test_franja_invalida_no_escribe_nada(self, conn):
+        """Test que una franja inválida aborta el lote antes de escribir"""
+        from productos_franjas_lote import escribir_franjas_lote
+
+        with pytest.raises(ValueError):
+            escribir_franjas_lote(conn, {1: [{'min': 1, 'max': 10, 'descuento': 0}], 2: [{'min': 5, 'max': 1, 'descuento': 0}]})
+
+        assert conn.execute('SELECT COUNT(*) FROM descuento_producto_franja').fetchone()[0] == 0
+
+
 # Ejecutar tests si se ejecuta directamente
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
@@ -0,0 +1,113 @@
+"""
+Tests unitarios para productos_precios.py
+"""
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import cache_estadisticas as ce
+import productos_precios as pp
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conexion = sqlite3.connect(str(tmp_path / 'empresa.db'), check_same_thread=False)
+    conexion.executescript('''
+        CREATE TABLE productos (id INTEGER PRIMARY KEY, nombre TEXT, subtotal REAL, impuestos INTEGER);
+        CREATE TABLE descuento_producto_franja (id INTEGER PRIMARY KEY, producto_id INTEGER, min_cantidad INTEGER,
+                                                max_cantidad INTEGER, porcentaje_descuento REAL);
+        CREATE TABLE gastos (id INTEGER PRIMARY KEY, importe_eur REAL);
+        INSERT INTO productos VALUES (1, 'Copia A4', 10.0, 21), (2, 'Encuadernación', 2.5, 21);
+        INSERT INTO descuento_producto_franja (producto_id, min_cantidad, max_cantidad, porcentaje_descuento)
+        VALUES (1, 1, 10, 0), (1, 11, 20, 5), (1, 31, 40, 10);
+    ''')
+    conexion.commit()
+    yield conexion
+    conexion.close()
+
+
+class TestFranja:
+    """Búsqueda de la franja de una cantidad"""
+
+    def test_reglas_del_tpv(self):
+        precio = pp.PrecioProducto(10.0, 21, (1, 11, 31), (10, 20, 40), (0.0, 5.0, 10.0))
+        assert precio.franja(1) == 0
+        assert precio.franja(15.5) == 1
+        assert precio.franja(25) is None  # hueco entre franjas
+        assert precio.franja(500) == 2  # por encima de la última
+        assert pp.PrecioProducto(10.0, 21, (), (), ()).franja(5) is None
+
+
+class TestCesta:
+    """Precio de cestas completas"""
+
+    def test_lineas_y_producto_inexistente(self, conn):
+        indice = pp.IndicePrecios()
+        lineas = indice.precios_cesta(conn, [(1, 12), (2, 3), (99, 1), (1, 25)])
+
+        assert lineas[0]['descuento'] == 5.0
+        assert lineas[0]['franja'] == {'min': 11, 'max': 20}
+        assert lineas[0]['precio_unitario'] == 9.5
+        assert (lineas[0]['subtotal'], lineas[0]['iva'], lineas[0]['total']) == (114.0, 23.94, 137.94)
+        assert lineas[1]['descuento'] == 0.0 and lineas[1]['franja'] is None
+        assert lineas[2] == {'producto_id': 99, 'cantidad': 1, 'error': 'Producto no encontrado'}
+        assert lineas[3]['descuento'] == 0.0
+
+        metricas = indice.get_metrics()
+        assert metricas['cargados'] == 2 and metricas['lineas'] == 4
+
+    def test_segunda_cesta_sin_cargar(self, conn):
+        indice = pp.IndicePrecios()
+        indice.precios_cesta(conn, [(1, 5)])
+        indice.precios_cesta(conn, [(1, 15), (1, 35)])
+        assert indice.get_metrics()['cargados'] == 1
+        assert indice.get_metrics()['aciertos'] == 1
+
+
+class TestInvalidacion:
+    """Cambios de productos o franjas desde cualquier conexión"""
+
+    def test_cambio_de_franjas_y_de_precio(self, conn, tmp_path):
+        indice = pp.IndicePrecios()
+        assert indice.precios_cesta(conn, [(1, 15)])[0]['descuento'] == 5.0
+
+        otra = sqlite3.connect(str(tmp_path / 'empresa.db'))
+        otra.execute('UPDATE descuento_producto_franja SET porcentaje_descuento = 7 WHERE min_cantidad = 11')
+        otra.commit()
+        assert indice.precios_cesta(conn, [(1, 15)])[0]['descuento'] == 7.0
+
+        otra.execute('UPDATE productos SET subtotal = 20 WHERE id = 1')
+        otra.commit()
+        otra.close()
+        assert indice.precios_cesta(conn, [(1, 15)])[0]['precio_base'] == 20.0
+        assert indice.get_metrics()['invalidaciones'] == 2
+
+    def test_no_afecta_a_la_cache_de_estadisticas(self, conn):
+        pp.IndicePrecios().precios_cesta(conn, [(1, 1)])
+        antes = ce.obtener_version_datos(conn, ('gastos',))[1]
+        conn.execute('UPDATE productos SET subtotal = 11 WHERE id = 1')
+        conn.commit()
+        assert ce.obtener_version_datos(conn, ('gastos',))[1] == antes
+
+
+class TestFranjasProducto:
+    """GET de franjas servido desde el índice"""
+
+    def test_mismo_formato_que_la_consulta_directa(self, conn, monkeypatch):
+        monkeypatch.setattr(pp, 'get_db_connection', lambda: conn)
+        monkeypatch.setattr(pp, '_indice', pp.IndicePrecios())
+
+        assert pp.franjas_producto(1) == [
+            {'min_cantidad': 1, 'max_cantidad': 10, 'porcentaje_descuento': 0.0},
+            {'min_cantidad': 11, 'max_cantidad': 20, 'porcentaje_descuento': 5.0},
+            {'min_cantidad': 31, 'max_cantidad': 40, 'porcentaje_descuento': 10.0}
+        ]
+        assert pp.franjas_producto(2) == []
+        assert pp.franjas_producto(99) == []
+        pp.franjas_producto(1)
+        assert pp.get_indice_precios().get_metrics()['cargados'] == 2
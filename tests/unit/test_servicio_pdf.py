@@ -0,0 +1,130 @@
+"""
+Tests unitarios para servicio_pdf.py
+"""
+import os
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from servicio_pdf import ServicioPDF, huella_documento
+
+
+def _servicio(tmp_path, **config):
+    """Servicio con el renderizador local (sin WeasyPrint) y cache en tmp_path"""
+    base = {'RENDERIZADOR': 'local', 'PROCESOS': 1, 'TIMEOUT': 10, 'ARRANQUE': 30, 'ESPERA_MAX': 10,
+            'CACHE_RUTA': str(tmp_path / 'cache_pdf.db')}
+    base.update(config)
+    return ServicioPDF(base)
+
+
+@pytest.fixture
+def servicio(tmp_path):
+    servicio = _servicio(tmp_path)
+    yield servicio
+    servicio.detener()
+
+
+class TestHuella:
+    """Clave de cache por contenido"""
+
+    def test_cambia_con_recursos_locales(self, tmp_path):
+        logo = tmp_path / 'logo.png'
+        logo.write_bytes(b'A')
+        html = '<img src="logo.png"><img src="data:image/png;base64,AAAA">'
+        primera = huella_documento(html, None, str(tmp_path))
+        assert huella_documento(html, None, str(tmp_path)) == primera
+        estado = os.stat(logo)
+        os.utime(logo, ns=(estado.st_atime_ns, estado.st_mtime_ns + 10 ** 9))
+        assert huella_documento(html, None, str(tmp_path)) != primera
+
+    def test_ruta_file_y_estilos(self, tmp_path):
+        css = tmp_path / 'f.css'
+        css.write_text('p {}', encoding='utf-8')
+        html = f'<link href="file://{css}">'
+        primera = huella_documento(html)
+        css.write_text('p { color: red }', encoding='utf-8')
+        assert huella_documento(html) != primera
+        assert huella_documento(html, '@page { margin: 1cm }') != huella_documento(html)
+
+
+class TestCache:
+    def test_documento_sin_cambios_no_se_regenera(self, servicio, tmp_path):
+        destino = tmp_path / 'factura.pdf'
+        for _ in range(3):
+            servicio.generar('<p>Factura F260001</p>', str(destino))
+        assert destino.read_bytes().startswith(b'%PDF')
+        metricas = servicio.get_metrics()
+        assert metricas['generados'] == 1 and metricas['aciertos'] == 2
+        assert metricas['arranques'] == 1
+
+    def test_cache_persistente_entre_servicios(self, tmp_path):
+        primero = _servicio(tmp_path, PROCESOS=0)
+        pdf = primero.renderizar('<p>X</p>')
+        segundo = _servicio(tmp_path, PROCESOS=0)
+        assert segundo.renderizar('<p>X</p>') == pdf
+        assert segundo.get_metrics()['generados'] == 0
+
+    def test_expulsion_lru(self, tmp_path):
+        servicio = _servicio(tmp_path, PROCESOS=0, CACHE_MAX_ENTRADAS=2)
+        for numero in range(3):
+            servicio.renderizar(f'<p>{numero}</p>')
+        assert servicio.get_metrics()['expulsiones'] == 1
+        servicio.renderizar('<p>0</p>')
+        assert servicio.get_metrics()['generados'] == 4
+
+    def test_peticiones_simultaneas_generan_una_vez(self, tmp_path):
+        servicio = _servicio(tmp_path, PROCESOS=0, LATENCIA_LOCAL=0.3)
+        resultados = []
+        hilos = [threading.Thread(target=lambda: resultados.append(servicio.renderizar('<p>Mismo</p>')))
+                 for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        assert len(set(resultados)) == 1 and len(resultados) == 4
+        metricas = servicio.get_metrics()
+        assert metricas['generados'] == 1 and metricas['esperas'] == 3
+
+
+class TestTrabajadores:
+    def test_timeout_reinicia_el_trabajador(self, tmp_path):
+        servicio = _servicio(tmp_path, LATENCIA_LOCAL=2, TIMEOUT=0.5, CACHE_ACTIVA=False)
+        try:
+            with pytest.raises(TimeoutError):
+                servicio.renderizar('<p>Lento</p>')
+            servicio.pool.config['TIMEOUT'] = 10
+            assert servicio.renderizar('<p>Siguiente</p>').startswith(b'%PDF')
+            metricas = servicio.get_metrics()
+            assert metricas['timeouts'] == 1 and metricas['arranques'] == 2 and metricas['errores'] == 1
+        finally:
+            servicio.detener()
+
+    def test_reciclado_tras_max_trabajos(self, tmp_path):
+        servicio = _servicio(tmp_path, MAX_TRABAJOS=2, CACHE_ACTIVA=False)
+        try:
+            for numero in range(3):
+                servicio.renderizar(f'<p>{numero}</p>')
+            metricas = servicio.get_metrics()
+            assert metricas['reciclados'] == 1 and metricas['arranques'] == 2
+        finally:
+            servicio.detener()
+
+    def test_sin_trabajador_libre_rechaza(self, tmp_path):
+        servicio = _servicio(tmp_path, LATENCIA_LOCAL=1, ESPERA_MAX=0.1, CACHE_ACTIVA=False)
+        try:
+            lento = threading.Thread(target=servicio.renderizar, args=('<p>Ocupa</p>',))
+            lento.start()
+            # Esperar a que el primer hilo tenga el único trabajador
+            while servicio.get_metrics()['arranques'] == 0:
+                threading.Event().wait(0.05)
+            with pytest.raises(TimeoutError):
+                servicio.renderizar('<p>Otro</p>')
+            lento.join()
+            assert servicio.get_metrics()['rechazos'] == 1
+        finally:
+            servicio.detener()
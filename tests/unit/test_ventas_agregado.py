@@ -0,0 +1,154 @@
+"""
+Tests unitarios para ventas_agregado.py (agregado mensual mantenido por triggers)
+"""
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import ventas_agregado as va
+
+
+ESQUEMA = '''
+    CREATE TABLE tickets (id INTEGER PRIMARY KEY, numero TEXT, fecha TEXT, estado TEXT DEFAULT 'P',
+                          total REAL NOT NULL);
+    CREATE TABLE factura (id INTEGER PRIMARY KEY, numero TEXT, fecha TEXT, estado TEXT DEFAULT 'P',
+                          total REAL NOT NULL);
+    CREATE TABLE proforma (id INTEGER PRIMARY KEY, numero TEXT, fecha TEXT, estado TEXT DEFAULT 'A',
+                           total REAL NOT NULL);
+    CREATE TABLE detalle_proforma (id INTEGER PRIMARY KEY, id_proforma INTEGER, total REAL,
+                                   fechaDetalle TEXT);
+'''
+
+
+@pytest.fixture
+def conn():
+    conexion = sqlite3.connect(':memory:')
+    conexion.executescript(ESQUEMA)
+    conexion.executemany('INSERT INTO tickets (numero, fecha, estado, total) VALUES (?, ?, ?, ?)', [
+        ('T1', '2025-01-10', 'C', 10.0),
+        ('T2', '2025-01-10', 'C', 20.0),
+        ('T3', '2025-02-01', 'C', 30.0),
+        ('T4', '2025-02-02', 'P', 40.0),
+    ])
+    conexion.execute("INSERT INTO factura (numero, fecha, estado, total) VALUES ('F1', '2025-03-05', 'C', 100.0)")
+    conexion.execute("INSERT INTO proforma (id, numero, fecha, estado, total) VALUES (1, 'P1', '2025-04-01', 'A', 0)")
+    conexion.executemany('INSERT INTO detalle_proforma (id_proforma, total, fechaDetalle) VALUES (?, ?, ?)', [
+        (1, 5.0, '2025-04-01'), (1, 7.0, '2025-04-15'), (1, 9.0, '2025-05-01'),
+    ])
+    conexion.commit()
+    va.instalar_agregado_ventas(conexion)
+    yield conexion
+    conexion.close()
+
+
+def _filas(conn):
+    return [
+        (tipo, anio, mes, estado, docs, round(total, 2), dias)
+        for tipo, anio, mes, estado, docs, total, dias in conn.execute(
+            'SELECT * FROM ventas_agregado_mensual WHERE num_documentos != 0 OR total != 0 OR num_dias != 0 '
+            'ORDER BY tipo, anio, mes, estado'
+        )
+    ]
+
+
+def _reconstruido(conn):
+    """Agregado recalculado desde cero sobre una copia de la BD"""
+    conn.commit()
+    copia = sqlite3.connect(':memory:')
+    conn.backup(copia)
+    va.reconstruir_agregado_ventas(copia)
+    filas = _filas(copia)
+    copia.close()
+    return filas
+
+
+class TestCargaInicial:
+    """Tests de la carga inicial y las lecturas"""
+
+    def test_carga_inicial(self, conn):
+        assert ('ticket', 2025, 1, 'C', 2, 30.0, 1) in _filas(conn)
+        assert ('proforma', 2025, 4, 'A', 1, 12.0, 0) in _filas(conn)
+
+    def test_resumen_anual_y_mensual(self, conn):
+        assert va.obtener_resumen_ventas(conn, 'ticket', 2025) == {'num_documentos': 3, 'media': 20.0, 'total': 60.0}
+        assert va.obtener_resumen_ventas(conn, 'ticket', 2025, 2)['total'] == 30.0
+        assert va.obtener_resumen_ventas(conn, 'proforma', 2025, 5, estado='A')['num_documentos'] == 1
+        assert va.obtener_resumen_ventas(conn, 'factura', 2024)['media'] == 0
+
+    def test_ventas_mensuales(self, conn):
+        meses = va.obtener_ventas_mensuales(conn, 'ticket', 2025)
+        assert sorted(meses) == ['01', '02']
+        assert meses['01'] == {'num_documentos': 2, 'total': 30.0, 'num_dias': 1}
+
+
+class TestTriggers:
+    """El agregado mantenido por triggers coincide con una reconstrucción"""
+
+    def test_insert_mismo_dia(self, conn):
+        conn.execute("INSERT INTO tickets (numero, fecha, estado, total) VALUES ('T5', '2025-01-10', 'C', 5)")
+        conn.execute("INSERT INTO tickets (numero, fecha, estado, total) VALUES ('T6', '2025-01-11', 'C', 5)")
+        assert va.obtener_ventas_mensuales(conn, 'ticket', 2025)['01']['num_dias'] == 2
+        assert _filas(conn) == _reconstruido(conn)
+
+    def test_anular_y_cobrar(self, conn):
+        conn.execute("UPDATE tickets SET estado = 'A' WHERE numero = 'T1'")
+        conn.execute("UPDATE tickets SET estado = 'C' WHERE numero = 'T4'")
+        assert va.obtener_resumen_ventas(conn, 'ticket', 2025)['total'] == 90.0
+        assert _filas(conn) == _reconstruido(conn)
+
+    def test_update_masivo_fecha_y_total(self, conn):
+        conn.execute("UPDATE tickets SET fecha = '2025-06-30', total = total + 1 WHERE estado = 'C'")
+        conn.execute("UPDATE factura SET total = 150")
+        assert _filas(conn) == _reconstruido(conn)
+
+    def test_delete(self, conn):
+        conn.execute("DELETE FROM tickets WHERE numero IN ('T1', 'T3')")
+        conn.execute('DELETE FROM factura')
+        assert va.obtener_ventas_mensuales(conn, 'factura', 2025) == {}
+        assert _filas(conn) == _reconstruido(conn)
+
+    def test_conversion_proforma(self, conn):
+        conn.execute("UPDATE proforma SET estado = 'F' WHERE id = 1")
+        assert va.obtener_resumen_ventas(conn, 'proforma', 2025, estado='A')['num_documentos'] == 0
+        assert va.obtener_resumen_ventas(conn, 'proforma', 2025, 4, estado='F')['total'] == 12.0
+        assert _filas(conn) == _reconstruido(conn)
+
+    def test_lineas_proforma(self, conn):
+        conn.execute("INSERT INTO detalle_proforma (id_proforma, total, fechaDetalle) VALUES (1, 3, '2025-06-01')")
+        conn.execute("UPDATE detalle_proforma SET fechaDetalle = '2025-06-02' WHERE total = 9")
+        conn.execute('DELETE FROM detalle_proforma WHERE total = 5')
+        assert _filas(conn) == _reconstruido(conn)
+        conn.execute('DELETE FROM proforma WHERE id = 1')
+        assert [f for f in _filas(conn) if f[0] == 'proforma'] == []
+
+    def test_fechas_no_iso_se_ignoran(self, conn):
+        conn.execute("INSERT INTO tickets (numero, fecha, estado, total) VALUES ('T7', '10/01/2025', 'C', 99)")
+        conn.execute("INSERT INTO tickets (numero, fecha, estado, total) VALUES ('T8', NULL, 'C', 99)")
+        assert va.obtener_resumen_ventas(conn, 'ticket', 2025)['total'] == 60.0
+        assert _filas(conn) == _reconstruido(conn)
+
+
+    def test_subconsulta_del_dia_usa_indice(self, conn):
+        for tabla in ('tickets', 'factura'):
+            plan = ' '.join(fila[3] for fila in conn.execute(
+                f'EXPLAIN QUERY PLAN SELECT 1 FROM {tabla} otro '
+                'WHERE otro.estado = ? AND otro.fecha = ? AND otro.id != ?', ('C', '2025-01-10', 1)))
+            assert f'idx_{tabla}_estado_fecha_total' in plan
+
+
+class TestResumenEnMemoria:
+    """resumir_ventas sobre obtener_agregado_anios equivale a obtener_resumen_ventas"""
+
+    def test_resumir_ventas(self, conn):
+        conn.execute("INSERT INTO tickets (numero, fecha, estado, total) VALUES ('T9', '2024-02-01', 'C', 8)")
+        filas = va.obtener_agregado_anios(conn, (2025, 2024))
+        for tipo, anio, mes, estado in (('ticket', 2025, None, 'C'), ('ticket', 2025, 1, 'C'),
+                                        ('ticket', 2024, 2, 'C'), ('proforma', 2025, 4, 'A'),
+                                        ('factura', 2024, None, 'C')):
+            assert va.resumir_ventas(filas, tipo, anio, mes, estado) == \
+                va.obtener_resumen_ventas(conn, tipo, anio, mes, estado)
@@ -0,0 +1,198 @@
+"""
+Tests unitarios para verifactu/hash/cadena.py
+"""
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import verifactu.core as core
+import verifactu.db.registro as registro
+from verifactu.hash.cadena import ServicioCadena, verificar_cadena
+from verifactu.hash.sha256 import calcular_hash_encadenado, contenido_hash_factura, generar_hash_factura
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """BD de empresa con el esquema de registro_facturacion, activa vía EMPRESA_DB_PATH"""
+    ruta = str(tmp_path / 'EMPRESA.db')
+    conn = sqlite3.connect(ruta)
+    conn.executescript('''
+        CREATE TABLE factura (id INTEGER PRIMARY KEY AUTOINCREMENT, numero TEXT, fecha TEXT, nif TEXT,
+                              idContacto INTEGER, total REAL, importe_impuestos REAL, hash_factura TEXT,
+                              estado TEXT, tipo TEXT);
+        CREATE TABLE contactos (idContacto INTEGER PRIMARY KEY, identificador TEXT, razonsocial TEXT);
+        CREATE TABLE registro_facturacion (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, factura_id INTEGER, ticket_id INTEGER, nif_emisor TEXT,
+            nif_receptor TEXT, fecha_emision TEXT, total REAL, hash TEXT, codigo_qr BLOB, marca_temporal TEXT,
+            enviado_aeat INTEGER DEFAULT 0, numero_factura TEXT, serie_factura TEXT, tipo_factura TEXT,
+            cuota_impuestos REAL, estado_envio TEXT, id_envio_aeat TEXT, fecha_envio TEXT, huella_aeat TEXT,
+            primer_registro TEXT, csv TEXT, errores TEXT, nombre_sistema TEXT, id_sistema TEXT,
+            version_sistema TEXT, numero_instalacion TEXT);
+        INSERT INTO contactos VALUES (1, 'A11111111', 'CLIENTE');
+    ''')
+    conn.close()
+    monkeypatch.setenv('EMPRESA_DB_PATH', ruta)
+    return ruta
+
+
+def _insertar(conn, numero, huella, fecha='2026-01-15'):
+    conn.execute(
+        'INSERT INTO registro_facturacion (factura_id, nif_emisor, nif_receptor, fecha_emision, numero_factura, '
+        'total, hash) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (int(numero[1:]), 'B12345678', 'A11111111', fecha, numero, 121.0, huella)
+    )
+
+
+def _contenido(numero, fecha='2026-01-15'):
+    return contenido_hash_factura('B12345678', 'A11111111', fecha, numero, 121.0)
+
+
+def _anexar(servicio, numero):
+    return servicio.anexar(_contenido(numero), lambda conn, huella: _insertar(conn, numero, huella), numero)
+
+
+def _hashes(db_path):
+    conn = sqlite3.connect(db_path)
+    hashes = [fila[0] for fila in conn.execute('SELECT hash FROM registro_facturacion ORDER BY id')]
+    conn.close()
+    return hashes
+
+
+def _hashes_conn(conn):
+    return [fila[0] for fila in conn.execute('SELECT hash FROM registro_facturacion ORDER BY id')]
+
+
+class TestAnexar:
+    def test_encadena_con_la_cabeza_en_memoria(self, db_path):
+        servicio = ServicioCadena()
+        primera = _anexar(servicio, 'F1')
+        segunda = _anexar(servicio, 'F2')
+        assert primera == generar_hash_factura(_contenido('F1'))
+        assert segunda == generar_hash_factura(_contenido('F2'), primera)
+        assert _hashes(db_path) == [primera, segunda]
+        metricas = servicio.get_metrics()
+        assert metricas['anexados'] == 2 and metricas['aciertos'] == 1 and metricas['relecturas'] == 1
+
+    def test_registro_de_otro_proceso_invalida_la_cabeza(self, db_path):
+        servicio = ServicioCadena()
+        _anexar(servicio, 'F1')
+        # Otro proceso (otra cabeza en memoria) añade un registro
+        externa = _anexar(ServicioCadena(), 'F2')
+        tercera = _anexar(servicio, 'F3')
+        assert tercera == generar_hash_factura(_contenido('F3'), externa)
+        assert servicio.get_metrics()['relecturas'] == 2
+        assert verificar_cadena(sqlite3.connect(db_path))['roturas'] == 0
+
+    def test_error_al_registrar_no_guarda_nada(self, db_path):
+        servicio = ServicioCadena()
+        primera = _anexar(servicio, 'F1')
+
+        def registrar(conn, huella):
+            conn.execute('UPDATE registro_facturacion SET estado_envio = ?', ('X',))
+            raise sqlite3.IntegrityError('fallo')
+
+        with pytest.raises(sqlite3.IntegrityError):
+            servicio.anexar(_contenido('F2'), registrar)
+        assert _hashes(db_path) == [primera]
+        assert servicio.cabeza().hash == primera
+
+    def test_anexos_concurrentes_no_comparten_predecesor(self, db_path):
+        # Cada hilo con su propio servicio: como dos procesos con su cabeza en memoria
+        def anexar_serie(prefijo):
+            servicio = ServicioCadena()
+            for i in range(15):
+                _anexar(servicio, f'{prefijo}{i + 1:03d}')
+
+        hilos = [threading.Thread(target=anexar_serie, args=(prefijo,)) for prefijo in ('A', 'B')]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        resultado = verificar_cadena(sqlite3.connect(db_path))
+        assert resultado['registros'] == 30 and resultado['roturas'] == 0
+
+
+class TestVerificarCadena:
+    @pytest.fixture
+    def cadena(self, db_path):
+        conn = sqlite3.connect(db_path)
+        anterior = None
+        for i in range(1, 11):
+            anterior = calcular_hash_encadenado(_contenido(f'F{i}'), anterior)
+            _insertar(conn, f'F{i}', anterior)
+        conn.commit()
+        return conn
+
+    def test_cadena_intacta(self, cadena):
+        resultado = verificar_cadena(cadena, lote=3)
+        assert resultado['registros'] == 10 and resultado['roturas'] == 0
+        assert resultado['ultimo_hash'] == _hashes_conn(cadena)[-1]
+
+    def test_registro_alterado(self, cadena):
+        cadena.execute("UPDATE registro_facturacion SET total = 1.0 WHERE id = 4")
+        resultado = verificar_cadena(cadena, lote=3)
+        assert resultado['roturas'] == 1 and resultado['detalle'][0]['registro_id'] == 4
+
+    def test_huella_alterada_rompe_dos_eslabones(self, cadena):
+        cadena.execute("UPDATE registro_facturacion SET hash = 'X' WHERE id = 6")
+        resultado = verificar_cadena(cadena)
+        assert [rotura['registro_id'] for rotura in resultado['detalle']] == [6, 7]
+
+    def test_ticket_sin_receptor(self, cadena):
+        ultimo = _hashes_conn(cadena)[-1]
+        huella = calcular_hash_encadenado('B123456782026-01-16T11121.0', ultimo)
+        cadena.execute(
+            "INSERT INTO registro_facturacion (factura_id, ticket_id, nif_emisor, fecha_emision, numero_factura, "
+            "total, hash) VALUES (1, 1, 'B12345678', '2026-01-16', 'T11', 121.0, ?)", (huella,)
+        )
+        assert verificar_cadena(cadena)['roturas'] == 0
+
+
+class TestPrimerRegistro:
+    def test_nif_encadenado_no_se_vuelve_a_consultar(self, db_path):
+        conn = sqlite3.connect(db_path)
+        _insertar(conn, 'F1', 'H1')
+        conn.execute("UPDATE registro_facturacion SET huella_aeat = 'H1'")
+        conn.commit()
+        conn.close()
+        servicio = ServicioCadena()
+        with patch.object(registro, 'get_servicio_cadena', return_value=servicio):
+            assert registro.calcular_primer_registro_exacto('B99999999', '', '') == 'S'
+            assert registro.calcular_primer_registro_exacto('b12345678', '', '') == 'N'
+            with patch.object(registro, 'get_db_connection', side_effect=AssertionError('consulta')):
+                assert registro.es_primer_registro_factura('B12345678', '', '') == 'N'
+        assert servicio.get_metrics()['primer_registro_memoria'] == 1
+
+
+class TestGenerarDatos:
+    """generar_datos_verifactu_para_factura encadena por el servicio"""
+
+    def test_facturas_encadenadas_verificables(self, db_path):
+        conn = sqlite3.connect(db_path)
+        for i in range(1, 4):
+            conn.execute("INSERT INTO factura (numero, fecha, nif, idContacto, total, importe_impuestos, estado) "
+                         "VALUES (?, '2026-01-15', 'B12345678', 1, 121.0, 21.0, 'C')", (f'F26000{i}',))
+        conn.commit()
+        conn.close()
+
+        servicio = ServicioCadena()
+        with patch.object(core, 'get_servicio_cadena', return_value=servicio):
+            for factura_id in (1, 2, 3):
+                resultado = core.generar_datos_verifactu_para_factura(
+                    factura_id, enviar=lambda fid: {'success': False, 'mensaje': 'sin envío'})
+                assert resultado['success']
+
+        conn = sqlite3.connect(db_path)
+        assert verificar_cadena(conn)['roturas'] == 0
+        filas = conn.execute('SELECT f.hash_factura, r.hash FROM factura f JOIN registro_facturacion r '
+                             'ON r.factura_id = f.id ORDER BY f.id').fetchall()
+        assert len(filas) == 3 and all(h_factura == h_registro for h_factura, h_registro in filas)
+        assert servicio.get_metrics()['anexados'] == 3
@@ -0,0 +1,250 @@
+"""
+Tests unitarios del envío en lote de registros VERI*FACTU
+(verifactu.soap.client.enviar_registros_aeat_lote y verifactu.core.enviar_pendientes_aeat)
+"""
+import sqlite3
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+import requests
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import verifactu.core as core
+import verifactu.db.registro as registro
+import verifactu.db.respuesta_xml as respuesta_xml
+from verifactu.soap import client
+
+NS_R = 'https://www2.agenciatributaria.gob.es/static_files/common/internet/dep/aplicaciones/es/aeat/tike/cont/ws/RespuestaSuministro.xsd'
+NS_SF = 'https://www2.agenciatributaria.gob.es/static_files/common/internet/dep/aplicaciones/es/aeat/tike/cont/ws/SuministroInformacion.xsd'
+
+
+def respuesta_aeat(lineas, estado_envio='Correcto', csv='A-CSV123'):
+    """XML de respuesta con una RespuestaLinea por (numero, fecha, estado[, codigo])"""
+    cuerpo = ''
+    for numero, fecha, estado, *codigo in lineas:
+        error = f'<tikR:CodigoErrorRegistro>{codigo[0]}</tikR:CodigoErrorRegistro>' \
+                f'<tikR:DescripcionErrorRegistro>Error {codigo[0]}</tikR:DescripcionErrorRegistro>' if codigo else ''
+        cuerpo += (
+            f'<tikR:RespuestaLinea><tikR:IDFactura><sf:IDEmisorFactura>B12345678</sf:IDEmisorFactura>'
+            f'<sf:NumSerieFactura>{numero}</sf:NumSerieFactura>'
+            f'<sf:FechaExpedicionFactura>{fecha}</sf:FechaExpedicionFactura></tikR:IDFactura>'
+            f'<tikR:EstadoRegistro>{estado}</tikR:EstadoRegistro>{error}</tikR:RespuestaLinea>'
+        )
+    return (
+        f'<env:Envelope xmlns:env="http://schemas.xmlsoap.org/soap/envelope/" xmlns:tikR="{NS_R}" xmlns:sf="{NS_SF}">'
+        f'<env:Body><tikR:RespuestaRegFactuSistemaFacturacion><tikR:CSV>{csv}</tikR:CSV>'
+        f'<tikR:EstadoEnvio>{estado_envio}</tikR:EstadoEnvio>{cuerpo}'
+        f'</tikR:RespuestaRegFactuSistemaFacturacion></env:Body></env:Envelope>'
+    )
+
+
+class Respuesta:
+    def __init__(self, texto, status_code=200):
+        self.text = texto
+        self.status_code = status_code
+
+
+class SesionFalsa:
+    """Guarda los envelopes recibidos y responde con la función indicada"""
+
+    def __init__(self, responder):
+        self.responder = responder
+        self.envelopes = []
+
+    def post(self, url, data=None, timeout=None):
+        envelope = data.decode('utf-8')
+        self.envelopes.append(envelope)
+        return self.responder(envelope)
+
+
+def _fila(numero, nif='B12345678', fecha='2026-01-15'):
+    return {'numero_factura': numero, 'fecha_emision': fecha, 'importe_total': 121.0, 'hash_factura': 'h' * 64,
+            'nif_emisor': nif, 'nif_receptor': 'A11111111', 'nombre_receptor': 'CLIENTE', 'huella_aeat': None,
+            'hash_anterior': 'a' * 64}
+
+
+@pytest.fixture
+def entorno(tmp_path):
+    """Certificados presentes y BD de registro sustituida por llamadas registradas"""
+    (tmp_path / 'cert_real.pem').write_text('cert')
+    (tmp_path / 'clave_real.pem').write_text('clave')
+    llamadas = {'huella': [], 'csv': [], 'primer': []}
+    with patch.object(client, 'rutas_certificado_aeat',
+                      return_value=(str(tmp_path), str(tmp_path / 'cert_real.pem'), str(tmp_path / 'clave_real.pem'))), \
+            patch.object(client, '_cargar_config_emisor', return_value={'nombre': 'EMISOR'}), \
+            patch.object(client, '_guardar_respuesta_fichero'), \
+            patch.object(registro, 'calcular_primer_registro_exacto', return_value='S'), \
+            patch.object(registro, 'actualizar_huella_primer_registro'), \
+            patch.object(registro, 'actualizar_primer_registro_por_id',
+                         side_effect=lambda fid, primer: llamadas['primer'].append((fid, primer))), \
+            patch.object(registro, 'guardar_huella_aeat_por_id',
+                         side_effect=lambda fid, huella: llamadas['huella'].append(fid)), \
+            patch.object(registro, 'guardar_csv_aeat', side_effect=lambda fid, csv: llamadas['csv'].append(fid)), \
+            patch.object(respuesta_xml, 'guardar_respuesta_xml'):
+        yield llamadas
+
+
+def _enviar(filas, sesion, **kwargs):
+    with patch.object(client, '_leer_facturas_lote', return_value=filas), \
+            patch.object(client, 'obtener_sesion_aeat', return_value=sesion):
+        return client.enviar_registros_aeat_lote(list(filas), **kwargs)
+
+
+class TestParsearLineas:
+    def test_identifica_cada_registro(self):
+        datos = client.parsear_respuesta_aeat(respuesta_aeat([
+            ('F260001', '15-01-2026', 'Correcto'),
+            ('F260002', '15-01-2026', 'Incorrecto', '1100'),
+        ], estado_envio='ParcialmenteCorrecto'))
+        assert datos['estado_envio'] == 'ParcialmenteCorrecto'
+        assert [(l['num_serie_factura'], l['estado_registro']) for l in datos['lineas']] == [
+            ('F260001', 'Correcto'), ('F260002', 'Incorrecto')]
+        assert datos['lineas'][1]['codigo_error_registro'] == '1100'
+        assert datos['lineas'][0]['fecha_expedicion'] == '15-01-2026'
+
+
+class TestEnvioLote:
+    def test_un_envelope_por_nif_con_todos_los_registros(self, entorno):
+        filas = {1: _fila('F260001'), 2: _fila('F260002'), 3: _fila('F260003', nif='b99999999')}
+        sesion = SesionFalsa(lambda env: Respuesta(respuesta_aeat([
+            (n, '15-01-2026', 'Correcto') for n in ('F260001', 'F260002', 'F260003') if n in env])))
+        resultados = _enviar(filas, sesion)
+
+        assert len(sesion.envelopes) == 2
+        primero, segundo = sesion.envelopes
+        assert primero.count('<lr:RegistroFactura>') == 2 and '<sf:NIF>B12345678</sf:NIF>' in primero
+        assert segundo.count('<lr:RegistroFactura>') == 1 and '<sf:NIF>B99999999</sf:NIF>' in segundo
+        assert all(r['success'] and r['csv'] == 'A-CSV123' for r in resultados.values())
+        assert entorno['huella'] == [1, 2, 3]
+
+    def test_solo_el_primero_del_nif_es_primer_registro(self, entorno):
+        filas = {1: _fila('F260001'), 2: _fila('F260002')}
+        sesion = SesionFalsa(lambda env: Respuesta(respuesta_aeat([])))
+        _enviar(filas, sesion)
+        assert entorno['primer'] == [(1, 'S'), (2, 'N')]
+        assert sesion.envelopes[0].count('<sf:PrimerRegistro>S</sf:PrimerRegistro>') == 1
+
+    def test_trocea_por_limite_del_servicio(self, entorno):
+        filas = {i: _fila(f'F26000{i}') for i in range(1, 6)}
+        sesion = SesionFalsa(lambda env: Respuesta(respuesta_aeat([])))
+        resultados = _enviar(filas, sesion, max_registros=2)
+        assert [env.count('<lr:RegistroFactura>') for env in sesion.envelopes] == [2, 2, 1]
+        assert len(resultados) == 5
+
+    def test_cada_linea_vuelve_a_su_factura(self, entorno):
+        filas = {1: _fila('F260001'), 2: _fila('F260002'), 3: _fila('F260003')}
+        sesion = SesionFalsa(lambda env: Respuesta(respuesta_aeat([
+            ('F260003', '15-01-2026', 'AceptadoConErrores'),
+            ('F260002', '15-01-2026', 'Incorrecto', '1100'),
+            ('F260001', '15-01-2026', 'Correcto'),
+        ], estado_envio='ParcialmenteCorrecto')))
+        resultados = _enviar(filas, sesion)
+
+        assert resultados[1]['success'] and resultados[3]['success']
+        assert not resultados[2]['success'] and resultados[2]['csv'] is None
+        assert resultados[2]['errores'][0]['codigo'] == '1100'
+        # La huella del rechazado no pasa a la cadena
+        assert entorno['huella'] == [1, 3]
+
+    def test_registro_sin_linea_depende_del_estado_del_envio(self, entorno):
+        filas = {1: _fila('F260001')}
+        sesion = SesionFalsa(lambda env: Respuesta(respuesta_aeat([], estado_envio='Incorrecto')))
+        assert not _enviar(filas, sesion)[1]['success']
+
+    def test_fallo_http_falla_todo_el_envelope(self, entorno):
+        filas = {1: _fila('F260001'), 2: _fila('F260002')}
+        resultados = _enviar(filas, SesionFalsa(lambda env: Respuesta('Service Unavailable', 503)))
+        assert {r['status_code'] for r in resultados.values()} == {503}
+        assert entorno['huella'] == []
+
+    def test_error_de_red(self, entorno):
+        def caida(env):
+            raise requests.ConnectionError('sin conexión')
+
+        resultados = _enviar({1: _fila('F260001')}, SesionFalsa(caida))
+        assert resultados[1]['success'] is False and 'sin conexión' in resultados[1]['message']
+
+    def test_factura_inexistente(self, entorno):
+        sesion = SesionFalsa(lambda env: Respuesta(respuesta_aeat([])))
+        with patch.object(client, '_leer_facturas_lote', return_value={}), \
+                patch.object(client, 'obtener_sesion_aeat', return_value=sesion):
+            resultados = client.enviar_registros_aeat_lote([7])
+        assert resultados[7]['success'] is False and sesion.envelopes == []
+
+
+class TestSesion:
+    def test_una_sesion_por_certificado(self):
+        sesion = client.obtener_sesion_aeat('/tmp/c.pem', '/tmp/k.pem')
+        assert client.obtener_sesion_aeat('/tmp/c.pem', '/tmp/k.pem') is sesion
+        assert sesion.cert == ('/tmp/c.pem', '/tmp/k.pem')
+        assert sesion.headers['SOAPAction'] == '""'
+
+
+class TestEnviarPendientes:
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        ruta = str(tmp_path / 'EMPRESA.db')
+        conn = sqlite3.connect(ruta)
+        conn.executescript('''
+            CREATE TABLE factura (id INTEGER PRIMARY KEY, numero TEXT, fecha TEXT, total REAL, nif TEXT);
+            CREATE TABLE registro_facturacion (id INTEGER PRIMARY KEY AUTOINCREMENT, factura_id INTEGER,
+                                               estado_envio TEXT, id_envio_aeat TEXT, fecha_envio TEXT,
+                                               errores TEXT, enviado_aeat INTEGER, codigo_qr TEXT, csv TEXT);
+            CREATE TABLE verifactu_outbox (factura_id INTEGER, estado TEXT, bloqueado_hasta REAL);
+            INSERT INTO factura VALUES (1, 'F260001', '2026-01-15', 121.0, 'B12345678'),
+                                       (2, 'F260002', '2026-01-15', 121.0, 'B12345678'),
+                                       (3, 'F260003', '2026-01-15', 121.0, 'B12345678'),
+                                       (4, 'F260004', '2026-01-15', 121.0, 'B12345678');
+            INSERT INTO registro_facturacion (factura_id, estado_envio) VALUES
+                (2, 'ERROR'), (1, NULL), (3, 'ENVIADO'), (4, 'PENDIENTE');
+            INSERT INTO verifactu_outbox VALUES (4, 'pendiente', 9999999999);
+        ''')
+        conn.close()
+        return ruta
+
+    def _enviar(self, db_path, **kwargs):
+        def conexion():
+            conn = sqlite3.connect(db_path)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        enviados = []
+
+        def enviar_lote(factura_ids):
+            enviados.append(list(factura_ids))
+            return {fid: {'success': fid == 1, 'errores': [{'codigo': '1100', 'descripcion': 'X'}]}
+                    for fid in factura_ids}
+
+        with patch.object(core, 'get_db_connection', side_effect=conexion), \
+                patch.object(core, '_ensure_column_exists'):
+            resumen = core.enviar_pendientes_aeat(enviar_lote=enviar_lote, **kwargs)
+        return resumen, enviados
+
+    def _estados(self, db_path):
+        conn = sqlite3.connect(db_path)
+        estados = dict(conn.execute('SELECT factura_id, estado_envio FROM registro_facturacion'))
+        conn.close()
+        return estados
+
+    def test_envia_pendientes_y_errores_en_una_llamada(self, db_path):
+        resumen, enviados = self._enviar(db_path)
+        # Orden de registro; la 3 ya está enviada y la 4 la tiene reservada el worker
+        assert enviados == [[2, 1]]
+        assert resumen == {'total': 2, 'enviadas': 1, 'errores': 1}
+        assert self._estados(db_path) == {1: 'ENVIADO', 2: 'ERROR', 3: 'ENVIADO', 4: 'PENDIENTE'}
+
+    def test_solo_pendientes(self, db_path):
+        resumen, enviados = self._enviar(db_path, reintentar_errores=False)
+        assert enviados == [[1]] and resumen['enviadas'] == 1
+
+    def test_nada_que_enviar(self, db_path):
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE registro_facturacion SET estado_envio = 'ENVIADO'")
+        conn.commit()
+        conn.close()
+        resumen, enviados = self._enviar(db_path)
+        assert enviados == [] and resumen['total'] == 0
@@ -0,0 +1,288 @@
+"""
+Tests unitarios para verifactu_outbox.py
+"""
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from flask import jsonify
+
+# Añadir directorio raíz al path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import factura
+import verifactu_outbox as vo
+from multiempresa_config import VERIFACTU_OUTBOX_CONFIG
+from verifactu.soap.stub import enviar_registro_aeat_local
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    ruta = str(tmp_path / 'EMPRESA.db')
+    conn = sqlite3.connect(ruta)
+    conn.executescript('''
+        CREATE TABLE factura (id INTEGER PRIMARY KEY AUTOINCREMENT, numero TEXT, fecha TEXT, fvencimiento TEXT,
+                              estado TEXT, idContacto INTEGER, nif TEXT, total REAL, formaPago TEXT,
+                              importe_bruto REAL, importe_impuestos REAL, importe_cobrado REAL, timestamp TEXT,
+                              tipo TEXT, presentar_face INTEGER, fechaCobro TEXT);
+        CREATE TABLE detalle_factura (id INTEGER PRIMARY KEY AUTOINCREMENT, id_factura INTEGER, concepto TEXT,
+                                      descripcion TEXT, cantidad REAL, precio REAL, impuestos REAL, total REAL,
+                                      productoId INTEGER, fechaDetalle TEXT);
+        CREATE TABLE registro_facturacion (id INTEGER PRIMARY KEY AUTOINCREMENT, factura_id INTEGER,
+                                           estado_envio TEXT);
+    ''')
+    conn.close()
+    return ruta
+
+
+def _encolar(db_path, *facturas):
+    conn = sqlite3.connect(db_path)
+    for factura_id in facturas:
+        vo.encolar_factura(conn, factura_id, {'data': {'numero': f'F{factura_id}'}, 'presentar_face': 0})
+    conn.commit()
+    conn.close()
+
+
+def _filas(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    filas = {fila['factura_id']: dict(fila) for fila in conn.execute('SELECT * FROM verifactu_outbox')}
+    conn.close()
+    return filas
+
+
+class ProcesarFalso:
+    """Registra las llamadas y falla las veces indicadas por factura"""
+
+    def __init__(self, fallos=None):
+        self.fallos = dict(fallos or {})
+        self.llamadas = []
+
+    def __call__(self, codigo, factura_id, payload, intentos):
+        self.llamadas.append((factura_id, intentos))
+        if self.fallos.get(factura_id, 0) > 0:
+            self.fallos[factura_id] -= 1
+            return 'AEAT no disponible'
+        return None
+
+
+def _worker(procesar, **kwargs):
+    opciones = {'espera_base': 60, 'espera_max': 600, 'max_intentos': 3, **kwargs}
+    return vo.WorkerOutbox(procesar=procesar, **opciones)
+
+
+def _adelantar_reintentos(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE verifactu_outbox SET proximo_intento = 0')
+    conn.commit()
+    conn.close()
+
+
+class TestEncolar:
+    """La fila de la outbox va en la transacción de la factura"""
+
+    def test_rollback_descarta_la_fila(self, db_path):
+        conn = sqlite3.connect(db_path)
+        vo.encolar_factura(conn, 1, {'data': {}})
+        conn.rollback()
+        conn.close()
+        assert _filas(db_path) == {}
+
+    def test_idempotente_por_factura(self, db_path):
+        _encolar(db_path, 1, 1)
+        assert len(_filas(db_path)) == 1
+
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE verifactu_outbox SET estado = 'enviado'")
+        vo.encolar_factura(conn, 1, {'data': {'numero': 'OTRA'}})
+        conn.commit()
+        conn.close()
+        fila = _filas(db_path)[1]
+        assert fila['estado'] == 'enviado'
+        assert json.loads(fila['payload'])['data'] == {'numero': 'F1'}
+
+
+class TestWorker:
+    """Orden por empresa, reintentos e idempotencia"""
+
+    def test_envia_en_orden(self, db_path):
+        _encolar(db_path, 3, 1, 2)
+        procesar = ProcesarFalso()
+        assert _worker(procesar).procesar_empresa('EMPRESA', db_path) == 3
+        assert [factura_id for factura_id, _ in procesar.llamadas] == [3, 1, 2]
+        assert {fila['estado'] for fila in _filas(db_path).values()} == {'enviado'}
+
+    def test_reintento_bloquea_las_siguientes(self, db_path):
+        _encolar(db_path, 1, 2)
+        procesar = ProcesarFalso({1: 1})
+        worker = _worker(procesar)
+
+        antes = time.time()
+        assert worker.procesar_empresa('EMPRESA', db_path) == 1
+        fila = _filas(db_path)[1]
+        assert fila['estado'] == 'pendiente' and fila['intentos'] == 1
+        assert fila['ultimo_error'] == 'AEAT no disponible'
+        assert fila['proximo_intento'] >= antes + 60
+        # La 2 no se envía antes que la 1 aunque esté lista
+        assert worker.procesar_empresa('EMPRESA', db_path) == 0
+        assert procesar.llamadas == [(1, 0)]
+
+        _adelantar_reintentos(db_path)
+        assert worker.procesar_empresa('EMPRESA', db_path) == 2
+        assert procesar.llamadas == [(1, 0), (1, 1), (2, 0)]
+        assert worker.get_metrics()['reintentos'] == 1
+
+    def test_reintento_con_registro_no_bloquea(self, db_path):
+        _encolar(db_path, 1, 2)
+        # La 1 ya tiene su hash encadenado y su registro: solo falló el envío
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO registro_facturacion (factura_id, estado_envio) VALUES (1, 'ERROR')")
+        conn.commit()
+        conn.close()
+        procesar = ProcesarFalso({1: 1})
+        worker = _worker(procesar)
+        assert worker.procesar_empresa('EMPRESA', db_path) == 2
+        assert procesar.llamadas == [(1, 0), (2, 0)]
+        filas = _filas(db_path)
+        assert filas[1]['estado'] == 'pendiente' and filas[2]['estado'] == 'enviado'
+
+    def test_rechazo_aeat_pasa_a_error_sin_reintento(self, db_path):
+        _encolar(db_path, 1, 2)
+
+        def procesar(codigo, factura_id, payload, intentos):
+            if factura_id == 1:
+                raise vo.RechazoAEAT('1100: NIF del destinatario no identificado')
+
+        worker = _worker(procesar)
+        assert worker.procesar_empresa('EMPRESA', db_path) == 2
+        filas = _filas(db_path)
+        assert filas[1]['estado'] == 'error' and filas[1]['intentos'] == 1
+        assert filas[1]['ultimo_error'] == '1100: NIF del destinatario no identificado'
+        assert filas[2]['estado'] == 'enviado'
+        assert worker.get_metrics()['rechazadas'] == 1 and worker.get_metrics()['reintentos'] == 0
+
+    def test_rechazo_definitivo(self):
+        rechazo = {'success': False, 'status_code': 200, 'estado_envio': 'Incorrecto',
+                   'errores': [{'codigo': '1100', 'descripcion': 'NIF', 'resultado': 'Incorrecto'}]}
+        assert vo.rechazo_definitivo(rechazo)
+        assert not vo.rechazo_definitivo({'success': False, 'message': 'ConnectionError'})
+        assert not vo.rechazo_definitivo({'success': False, 'status_code': 503, 'response': ''})
+        assert not vo.rechazo_definitivo({**rechazo, 'errores': [{'codigo': 'env:Server', 'resultado': 'Fault'}]})
+        assert not vo.rechazo_definitivo({**rechazo, 'success': True})
+
+    def test_espera_exponencial_acotada(self):
+        worker = _worker(ProcesarFalso())
+        assert [worker.espera(intentos) for intentos in (1, 2, 3, 4, 5)] == [60, 120, 240, 480, 600]
+
+    def test_agotar_intentos_deja_error_y_sigue(self, db_path):
+        _encolar(db_path, 1, 2)
+        procesar = ProcesarFalso({1: 99})
+        worker = _worker(procesar)
+        for _ in range(3):
+            worker.procesar_empresa('EMPRESA', db_path)
+            _adelantar_reintentos(db_path)
+        filas = _filas(db_path)
+        assert filas[1]['estado'] == 'error' and filas[1]['intentos'] == 3
+        assert filas[2]['estado'] == 'enviado'
+        assert worker.get_metrics()['errores'] == 1
+
+    def test_excepcion_cuenta_como_fallo(self, db_path):
+        _encolar(db_path, 1)
+
+        def procesar(codigo, factura_id, payload, intentos):
+            raise RuntimeError('certificado caducado')
+
+        _worker(procesar).procesar_empresa('EMPRESA', db_path)
+        fila = _filas(db_path)[1]
+        assert fila['estado'] == 'pendiente' and fila['ultimo_error'] == 'certificado caducado'
+
+    def test_registro_ya_enviado_no_se_reenvia(self, db_path):
+        _encolar(db_path, 1)
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO registro_facturacion (factura_id, estado_envio) VALUES (1, 'ENVIADO')")
+        conn.commit()
+        conn.close()
+        procesar = ProcesarFalso()
+        worker = _worker(procesar)
+        assert worker.procesar_empresa('EMPRESA', db_path) == 1
+        assert procesar.llamadas == []
+        assert _filas(db_path)[1]['estado'] == 'enviado'
+        assert worker.get_metrics()['ya_enviadas'] == 1
+
+    def test_fila_reservada_por_otro_worker(self, db_path):
+        _encolar(db_path, 1)
+        conn = sqlite3.connect(db_path)
+        conn.execute('UPDATE verifactu_outbox SET bloqueado_hasta = ?', (time.time() + 300,))
+        conn.commit()
+        conn.close()
+        procesar = ProcesarFalso()
+        assert _worker(procesar).procesar_empresa('EMPRESA', db_path) == 0
+        assert procesar.llamadas == []
+
+    def test_empresa_sin_outbox(self, tmp_path):
+        ruta = str(tmp_path / 'VACIA.db')
+        sqlite3.connect(ruta).close()
+        worker = _worker(ProcesarFalso())
+        assert worker.vuelta([{'codigo': 'VACIA', 'db_path': ruta}]) == 0
+        assert vo.estado_outbox(sqlite3.connect(ruta)) == {}
+
+
+class TestStub:
+    def test_respuesta_de_aceptacion(self):
+        resultado = enviar_registro_aeat_local(42)
+        assert resultado['success'] is True
+        assert resultado['csv'].startswith('LOCAL') and resultado['csv'] == enviar_registro_aeat_local(42)['csv']
+
+
+class TestCrearFactura:
+    """crear_factura encola en lugar de enviar dentro de la petición"""
+
+    DATOS = {
+        'numero': 'F260001', 'fecha': '2026-01-15', 'estado': 'C', 'idContacto': 1, 'total': 121.0,
+        'importe_bruto': 100.0, 'importe_impuestos': 21.0,
+        'detalles': [{'concepto': 'Copias', 'cantidad': 1, 'precio': 100.0, 'impuestos': 21.0, 'total': 121.0}]
+    }
+
+    def _crear(self, db_path, datos, numerador=1):
+        def conexion():
+            conn = sqlite3.connect(db_path)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        with factura.app.test_request_context(), \
+                patch.object(factura, 'get_db_write_connection', side_effect=conexion), \
+                patch.object(factura, 'verificar_numero_factura', side_effect=lambda numero: jsonify({'existe': False})), \
+                patch.object(factura, 'actualizar_numerador', return_value=numerador), \
+                patch.object(factura, 'cargar_datos_emisor', return_value={'nif': 'B12345678'}), \
+                patch.object(factura, 'generar_facturae_factura') as facturae, \
+                patch.object(factura, 'enviar_verifactu_factura') as envio, \
+                patch.dict(VERIFACTU_OUTBOX_CONFIG, {'ACTIVA': True}):
+            respuesta = factura.crear_factura(dict(datos))
+            assert not facturae.called and not envio.called
+        return respuesta
+
+    def test_cobrada_se_encola(self, db_path):
+        respuesta = self._crear(db_path, self.DATOS)
+        assert respuesta.get_json()['datos_adicionales'] == {'verifactu': 'pendiente'}
+        fila = _filas(db_path)[respuesta.get_json()['id']]
+        assert fila['estado'] == 'pendiente'
+        assert json.loads(fila['payload'])['data']['numero'] == 'F260001'
+
+    def test_pendiente_no_se_encola(self, db_path):
+        self._crear(db_path, {**self.DATOS, 'estado': 'P'})
+        assert vo.estado_outbox(sqlite3.connect(db_path)) == {}
+
+    def test_fallo_de_la_factura_no_deja_fila(self, db_path):
+        respuesta, codigo = self._crear(db_path, self.DATOS, numerador=None)
+        assert codigo == 500
+        assert vo.estado_outbox(sqlite3.connect(db_path)) == {}
+
+    def test_fallo_al_encolar_no_guarda_la_factura(self, db_path):
+        with patch.object(factura, 'encolar_factura', side_effect=sqlite3.OperationalError('database is locked')):
+            respuesta, codigo = self._crear(db_path, self.DATOS)
+        assert codigo == 500
+        assert sqlite3.connect(db_path).execute('SELECT COUNT(*) FROM factura').fetchone()[0] == 0
@@ -11,9 +11,10 @@ from decimal import Decimal, ROUND_HALF_UP
 from format_utils import format_currency_es_two, format_total_es_two, format_number_es_max5, format_percentage
 
 from flask import jsonify, request
-from db_utils import get_db_connection, formatear_numero_documento
+from db_utils import get_db_connection, get_db_write_connection, formatear_numero_documento
 from verifactu.core import generar_datos_verifactu_para_ticket
 from logger_config import get_tickets_logger
+from ventas_agregado import obtener_resumen_ventas, obtener_ventas_mensuales
 
 # Inicializar logger
 logger = get_tickets_logger()
@@ -287,7 +288,8 @@ def guardar_ticket(data=None):
                 }
             }), 400
         
-        conn = get_db_connection()
+        # Carril de escritura: espera su turno en lugar de chocar con otras escrituras
+        conn = get_db_write_connection()
         cursor = conn.cursor()
         
         try:
@@ -577,23 +579,9 @@ def total_tickets_cobrados_ano_actual():
         año_anterior = año_actual - 1
 
         try:
-            # Consulta para el año actual
-            cursor.execute('''
-                SELECT COALESCE(SUM(total), 0) as total
-                FROM tickets
-                WHERE estado = 'C'
-                AND strftime('%Y', fecha) = ?
-            ''', (str(año_actual),))
-            total_actual = cursor.fetchone()['total'] or 0
-
-            # Consulta para el año anterior
-            cursor.execute('''
-                SELECT COALESCE(SUM(total), 0) as total
-                FROM tickets
-                WHERE estado = 'C'
-                AND strftime('%Y', fecha) = ?
-            ''', (str(año_anterior),))
-            total_anterior = cursor.fetchone()['total'] or 0
+            # Totales de ambos años desde el agregado mensual de ventas
+            total_actual = obtener_resumen_ventas(conn, 'ticket', año_actual)['total']
+            total_anterior = obtener_resumen_ventas(conn, 'ticket', año_anterior)['total']
 
             # Calcular el porcentaje de diferencia
             if float(total_anterior) > 0:
@@ -627,19 +615,9 @@ def media_ventas_mensual():
         cursor = conn.cursor()
         
         try:
-            # Consulta simplificada
-            cursor.execute('''
-                SELECT COALESCE(AVG(total_mensual), 0) as media
-                FROM (
-                    SELECT SUM(total) as total_mensual
-                    FROM tickets
-                    WHERE estado = 'C'
-                    AND strftime('%Y', fecha) = strftime('%Y', 'now')
-                    GROUP BY strftime('%m', fecha)
-                )
-            ''')
-            resultado = cursor.fetchone()
-            media = float(resultado['media'] if resultado['media'] is not None else 0)
+            # Media de los meses con ventas del año actual
+            meses = obtener_ventas_mensuales(conn, 'ticket', datetime.now().year)
+            media = sum(m['total'] for m in meses.values()) / len(meses) if meses else 0.0
 
             return jsonify({"media_ventas_mensual": media})
 
@@ -663,19 +641,10 @@ def media_ventas_diaria():
         cursor = conn.cursor()
 
         try:
-            # Consulta simplificada
-            cursor.execute('''
-                SELECT COALESCE(AVG(total_diario), 0) as media
-                FROM (
-                    SELECT SUM(total) as total_diario
-                    FROM tickets
-                    WHERE estado = 'C'
-                    AND strftime('%Y', fecha) = strftime('%Y', 'now')
-                    GROUP BY fecha
-                )
-            ''')
-            resultado = cursor.fetchone()
-            media = float(resultado['media'] if resultado['media'] is not None else 0)
+            # Media de los días con ventas del año actual
+            meses = obtener_ventas_mensuales(conn, 'ticket', datetime.now().year)
+            dias = sum(m['num_dias'] for m in meses.values())
+            media = sum(m['total'] for m in meses.values()) / dias if dias else 0.0
 
             return jsonify({"media_ventas_diaria": media})
 
@@ -699,19 +668,9 @@ def media_gasto_por_ticket():
         cursor = conn.cursor()
 
         try:
-            # Consulta simplificada
-            cursor.execute('''
-                SELECT 
-                    COALESCE(AVG(total), 0) as media_gasto,
-                    COUNT(*) as num_tickets
-                FROM tickets
-                WHERE estado = 'C'
-                AND strftime('%Y', fecha) = strftime('%Y', 'now')
-            ''')
-            resultado = cursor.fetchone()
-            
-            media_gasto = float(resultado['media_gasto'] if resultado['media_gasto'] is not None else 0)
-            num_tickets = int(resultado['num_tickets'])
+            resumen = obtener_resumen_ventas(conn, 'ticket', datetime.now().year)
+            media_gasto = float(resumen['media'])
+            num_tickets = resumen['num_documentos']
 
             return jsonify({
                 'media_gasto': media_gasto,
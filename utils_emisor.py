@@ -1,23 +1,53 @@
+import copy
 import json
 import os
 import sqlite3
+import threading
 from flask import session
 
+# JSON de emisores ya leídos: ruta -> ((mtime_ns, tamaño), datos)
+_cache_json = {}
+_cache_json_lock = threading.Lock()
+
+
+def cargar_json_emisor(ruta):
+    """
+    Lee un JSON de datos del emisor reutilizando la lectura anterior mientras
+    el archivo no cambie (fecha de modificación y tamaño).
+
+    Devuelve una copia: quien la reciba puede modificarla sin afectar a la cache.
+
+    Raises:
+        OSError: Si el archivo no existe o no se puede leer
+        ValueError: Si el contenido no es JSON válido
+    """
+    estado = os.stat(ruta)
+    firma = (estado.st_mtime_ns, estado.st_size)
+    with _cache_json_lock:
+        guardado = _cache_json.get(ruta)
+    if guardado is None or guardado[0] != firma:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+        guardado = (firma, datos)
+        with _cache_json_lock:
+            _cache_json[ruta] = guardado
+    return copy.deepcopy(guardado[1])
+
 
 def cargar_datos_emisor(codigo_empresa=None):
     """
     Carga los datos del emisor desde el archivo JSON de la empresa.
-    
+
     Args:
         codigo_empresa: Código de la empresa. Si no se proporciona, se obtiene de la sesión.
-        
+
     Returns:
         dict: Diccionario con los datos del emisor.
     """
     # Si no se proporciona código, intentar obtenerlo de la sesión
     if codigo_empresa is None:
         codigo_empresa = session.get('codigo_empresa', '')
-        
+
     if not codigo_empresa:
         # Fallback: intentar obtener de empresa_id
         empresa_id = session.get('empresa_id')
@@ -34,15 +64,14 @@ def cargar_datos_emisor(codigo_empresa=None):
                     codigo_empresa = row['codigo']
             except Exception:
                 pass
-    
+
     # Construir ruta al archivo JSON del emisor
     base_dir = os.path.dirname(os.path.abspath(__file__))
     emisor_path = os.path.join(base_dir, 'emisores', f'{codigo_empresa}_emisor.json')
-    
+
     if os.path.exists(emisor_path):
-        with open(emisor_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    
+        return cargar_json_emisor(emisor_path)
+
     # Si no existe el archivo JSON, retornar datos vacíos
     return {
         'nombre': '',
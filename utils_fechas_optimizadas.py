@@ -58,3 +58,41 @@ CAMPOS_ISO = {
 def get_campo_iso(tabla, campo):
     """Obtiene el nombre del campo ISO para una tabla y campo dados"""
     return CAMPOS_ISO.get(tabla, {}).get(campo)
+
+# =====================================================
+# RANGOS DE FECHAS (predicados que pueden usar índices)
+# =====================================================
+# strftime('%Y', fecha) = ? obliga a evaluar la función en cada fila; con
+# fecha >= ? AND fecha < ? SQLite recorre solo el tramo del índice sobre fecha
+# (o sobre la expresión ISO, si el índice es de expresión).
+
+def filtro_rango_fecha(expr_fecha):
+    """
+    Genera el predicado semiabierto [inicio, fin) sobre una expresión de fecha ISO
+
+    Args:
+        expr_fecha: Columna ISO (p.ej. 'f.fecha') o expresión de generar_where_fecha_optimizada
+
+    Returns:
+        str: Predicado SQL con dos parámetros (inicio, fin)
+    """
+    return f"{expr_fecha} >= ? AND {expr_fecha} < ?"
+
+def _inicio_mes(anio, mes):
+    """Primer día del mes en formato YYYY-MM-DD, admitiendo mes 13 como enero siguiente"""
+    anio, mes = int(anio), int(mes)
+    if mes > 12:
+        anio, mes = anio + 1, mes - 12
+    return f"{anio:04d}-{mes:02d}-01"
+
+def rango_anio(anio):
+    """Rango [1 de enero, 1 de enero siguiente) de un año"""
+    return _inicio_mes(anio, 1), _inicio_mes(int(anio) + 1, 1)
+
+def rango_mes(anio, mes):
+    """Rango [día 1 del mes, día 1 del mes siguiente)"""
+    return _inicio_mes(anio, mes), _inicio_mes(anio, int(mes) + 1)
+
+def rango_hasta_mes(anio, mes):
+    """Rango acumulado del año hasta el mes indicado incluido"""
+    return _inicio_mes(anio, 1), _inicio_mes(anio, int(mes) + 1)
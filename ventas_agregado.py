@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AGREGADO MENSUAL DE VENTAS
+==========================
+Tabla ventas_agregado_mensual con (tipo, año, mes, estado) -> número de
+documentos, suma de totales y días con ventas, para que el dashboard lea
+O(meses) filas en lugar de recorrer todos los tickets, facturas y proformas.
+
+El agregado se mantiene con triggers sobre tickets, factura, proforma y
+detalle_proforma, de modo que cualquier alta, edición, anulación, cambio de
+estado (cobro, conciliación, conversión de proforma) o borrado lo actualiza
+en la misma transacción que el documento. Cada empresa tiene su propia BD,
+así que la empresa queda implícita en el fichero.
+
+Las proformas se agregan por el mes de fechaDetalle (igual que el dashboard);
+su número de documentos es el de proformas distintas con líneas en ese mes.
+"""
+
+import threading
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+TABLA_AGREGADO = 'ventas_agregado_mensual'
+
+ESQUEMA_AGREGADO = '''
+    CREATE TABLE IF NOT EXISTS ventas_agregado_mensual (
+        tipo TEXT NOT NULL,
+        anio INTEGER NOT NULL,
+        mes INTEGER NOT NULL,
+        estado TEXT NOT NULL,
+        num_documentos INTEGER NOT NULL DEFAULT 0,
+        total REAL NOT NULL DEFAULT 0,
+        num_dias INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (tipo, anio, mes, estado)
+    ) WITHOUT ROWID
+'''
+
+# Solo se agregan fechas ISO (YYYY-MM-DD...), las mismas que aceptaba strftime
+FECHA_ISO = "GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-*'"
+
+UPSERT = '''
+    ON CONFLICT (tipo, anio, mes, estado) DO UPDATE SET
+        num_documentos = num_documentos + excluded.num_documentos,
+        total = total + excluded.total,
+        num_dias = num_dias + excluded.num_dias
+'''
+
+# Tablas de documento con una fila por documento: tipo -> tabla
+TABLAS_DOCUMENTO = {'ticket': 'tickets', 'factura': 'factura'}
+
+# Índices que usan los NOT EXISTS de los triggers; sin ellos cada alta o
+# cambio de documento recorre la tabla entera dentro de la transacción.
+# Mismos nombres que scripts/indices_rangos_fecha.sql y
+# scripts/optimizar_indices_database.sql (IF NOT EXISTS: no se duplican)
+INDICES_TRIGGERS = (
+    'CREATE INDEX IF NOT EXISTS idx_tickets_estado_fecha_total ON tickets(estado, fecha, total)',
+    'CREATE INDEX IF NOT EXISTS idx_factura_estado_fecha_total ON factura(estado, fecha, total)',
+    'CREATE INDEX IF NOT EXISTS idx_detalle_proforma_proforma_id ON detalle_proforma(id_proforma)',
+)
+
+
+def _delta_documento(tipo, tabla, fila, signo):
+    """
+    INSERT ... ON CONFLICT que suma (signo=1) o resta (signo=-1) un documento.
+    El día cuenta si no queda otro documento del mismo estado en esa fecha.
+    """
+    return f'''
+        INSERT INTO ventas_agregado_mensual (tipo, anio, mes, estado, num_documentos, total, num_dias)
+        SELECT '{tipo}',
+               CAST(substr({fila}.fecha, 1, 4) AS INTEGER),
+               CAST(substr({fila}.fecha, 6, 2) AS INTEGER),
+               COALESCE({fila}.estado, ''),
+               {signo},
+               {signo} * COALESCE({fila}.total, 0),
+               {signo} * NOT EXISTS (
+                   SELECT 1 FROM {tabla} otro
+                   WHERE otro.estado = {fila}.estado AND otro.fecha = {fila}.fecha AND otro.id != {fila}.id
+               )
+        WHERE {fila}.fecha {FECHA_ISO}
+        {UPSERT};
+    '''
+
+
+def _delta_detalle_proforma(fila, signo):
+    """Suma o resta una línea de proforma; la proforma cuenta una vez por mes"""
+    return f'''
+        INSERT INTO ventas_agregado_mensual (tipo, anio, mes, estado, num_documentos, total, num_dias)
+        SELECT 'proforma',
+               CAST(substr({fila}.fechaDetalle, 1, 4) AS INTEGER),
+               CAST(substr({fila}.fechaDetalle, 6, 2) AS INTEGER),
+               COALESCE(p.estado, ''),
+               {signo} * NOT EXISTS (
+                   SELECT 1 FROM detalle_proforma otro
+                   WHERE otro.id_proforma = {fila}.id_proforma AND otro.id != {fila}.id
+                   AND substr(otro.fechaDetalle, 1, 7) = substr({fila}.fechaDetalle, 1, 7)
+               ),
+               {signo} * COALESCE({fila}.total, 0),
+               0
+        FROM proforma p
+        WHERE p.id = {fila}.id_proforma AND {fila}.fechaDetalle {FECHA_ISO}
+        {UPSERT};
+    '''
+
+
+def _delta_proforma(fila, signo):
+    """Suma o resta todas las líneas de una proforma bajo su estado (cambio de estado o borrado)"""
+    return f'''
+        INSERT INTO ventas_agregado_mensual (tipo, anio, mes, estado, num_documentos, total, num_dias)
+        SELECT 'proforma',
+               CAST(substr(fechaDetalle, 1, 4) AS INTEGER) AS anio_detalle,
+               CAST(substr(fechaDetalle, 6, 2) AS INTEGER) AS mes_detalle,
+               COALESCE({fila}.estado, ''),
+               {signo},
+               {signo} * COALESCE(SUM(total), 0),
+               0
+        FROM detalle_proforma
+        WHERE id_proforma = {fila}.id AND fechaDetalle {FECHA_ISO}
+        GROUP BY anio_detalle, mes_detalle
+        {UPSERT};
+    '''
+
+
+def _sql_triggers():
+    """Sentencias CREATE TRIGGER que mantienen el agregado"""
+    sentencias = []
+    for tipo, tabla in TABLAS_DOCUMENTO.items():
+        sentencias.append(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_vam_{tabla}_insert AFTER INSERT ON {tabla}
+            BEGIN {_delta_documento(tipo, tabla, 'NEW', 1)} END
+        ''')
+        sentencias.append(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_vam_{tabla}_update AFTER UPDATE OF fecha, estado, total ON {tabla}
+            BEGIN {_delta_documento(tipo, tabla, 'OLD', -1)} {_delta_documento(tipo, tabla, 'NEW', 1)} END
+        ''')
+        sentencias.append(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_vam_{tabla}_delete AFTER DELETE ON {tabla}
+            BEGIN {_delta_documento(tipo, tabla, 'OLD', -1)} END
+        ''')
+
+    sentencias.append(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_vam_detalle_proforma_insert AFTER INSERT ON detalle_proforma
+        BEGIN {_delta_detalle_proforma('NEW', 1)} END
+    ''')
+    sentencias.append(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_vam_detalle_proforma_update
+        AFTER UPDATE OF fechaDetalle, total, id_proforma ON detalle_proforma
+        BEGIN {_delta_detalle_proforma('OLD', -1)} {_delta_detalle_proforma('NEW', 1)} END
+    ''')
+    sentencias.append(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_vam_detalle_proforma_delete AFTER DELETE ON detalle_proforma
+        BEGIN {_delta_detalle_proforma('OLD', -1)} END
+    ''')
+    sentencias.append(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_vam_proforma_update AFTER UPDATE OF estado ON proforma
+        WHEN OLD.estado IS NOT NEW.estado
+        BEGIN {_delta_proforma('OLD', -1)} {_delta_proforma('NEW', 1)} END
+    ''')
+    sentencias.append(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_vam_proforma_delete AFTER DELETE ON proforma
+        BEGIN {_delta_proforma('OLD', -1)} END
+    ''')
+    return sentencias
+
+
+RECONSTRUIR_DOCUMENTOS = '''
+    INSERT INTO ventas_agregado_mensual (tipo, anio, mes, estado, num_documentos, total, num_dias)
+    SELECT ?, CAST(substr(fecha, 1, 4) AS INTEGER) AS anio_doc, CAST(substr(fecha, 6, 2) AS INTEGER) AS mes_doc,
+           COALESCE(estado, '') AS estado_doc, COUNT(*), COALESCE(SUM(total), 0), COUNT(DISTINCT fecha)
+    FROM {tabla}
+    WHERE fecha {fecha_iso}
+    GROUP BY anio_doc, mes_doc, estado_doc
+'''
+
+RECONSTRUIR_PROFORMAS = '''
+    INSERT INTO ventas_agregado_mensual (tipo, anio, mes, estado, num_documentos, total, num_dias)
+    SELECT 'proforma', CAST(substr(d.fechaDetalle, 1, 4) AS INTEGER) AS anio_doc,
+           CAST(substr(d.fechaDetalle, 6, 2) AS INTEGER) AS mes_doc,
+           COALESCE(p.estado, '') AS estado_doc, COUNT(DISTINCT p.id), COALESCE(SUM(d.total), 0), 0
+    FROM proforma p
+    JOIN detalle_proforma d ON p.id = d.id_proforma
+    WHERE d.fechaDetalle {fecha_iso}
+    GROUP BY anio_doc, mes_doc, estado_doc
+'''
+
+
+def reconstruir_agregado_ventas(conn):
+    """
+    Recalcula ventas_agregado_mensual desde las tablas de documentos.
+
+    No hace commit: el llamador decide la transacción (así la creación de
+    triggers y la carga inicial son atómicas).
+
+    Returns:
+        int: Número de filas del agregado
+    """
+    cursor = conn.cursor()
+    cursor.execute(ESQUEMA_AGREGADO)
+    cursor.execute('DELETE FROM ventas_agregado_mensual')
+    for tipo, tabla in TABLAS_DOCUMENTO.items():
+        cursor.execute(RECONSTRUIR_DOCUMENTOS.format(tabla=tabla, fecha_iso=FECHA_ISO), (tipo,))
+    cursor.execute(RECONSTRUIR_PROFORMAS.format(fecha_iso=FECHA_ISO))
+    cursor.execute('SELECT COUNT(*) FROM ventas_agregado_mensual')
+    return cursor.fetchone()[0]
+
+
+def instalar_agregado_ventas(conn, reconstruir=False):
+    """
+    Crea la tabla, los triggers y los índices que estos necesitan si faltan
+    y, si la tabla es nueva (o se pide), la carga desde los documentos
+    existentes. Hace commit.
+    """
+    cursor = conn.cursor()
+    if conn.in_transaction:
+        conn.commit()
+
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABLA_AGREGADO,))
+        existia = cursor.fetchone() is not None
+        cursor.execute(ESQUEMA_AGREGADO)
+        for sentencia in INDICES_TRIGGERS + tuple(_sql_triggers()):
+            cursor.execute(sentencia)
+        if reconstruir or not existia:
+            filas = reconstruir_agregado_ventas(conn)
+            logger.info(f"Agregado mensual de ventas reconstruido: {filas} filas")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+_bases_preparadas = set()
+_preparar_lock = threading.Lock()
+
+
+def preparar_agregado_ventas(conn):
+    """
+    Garantiza (una vez por BD y proceso) que el agregado y sus triggers existen
+    antes de leerlo. Con una conexión de solo lectura del pool la instalación
+    se hace por el carril de escritura de su BD.
+    """
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA database_list')
+    db_path = cursor.fetchone()[2]
+    if db_path in _bases_preparadas:
+        return
+
+    with _preparar_lock:
+        if db_path in _bases_preparadas:
+            return
+        if conn.execute('PRAGMA query_only').fetchone()[0]:
+            with conn.pool.get_writer_connection() as escritor:
+                instalar_agregado_ventas(escritor)
+        else:
+            instalar_agregado_ventas(conn)
+        if db_path:  # las BD en memoria no tienen ruta y no se recuerdan
+            _bases_preparadas.add(db_path)
+
+
+def obtener_resumen_ventas(conn, tipo, anio, mes=None, estado='C'):
+    """
+    Número de documentos, total y media de un tipo en un año (o mes).
+
+    Args:
+        conn: Conexión a la BD de la empresa
+        tipo: 'ticket', 'factura' o 'proforma'
+        anio: Año
+        mes: Mes (opcional)
+        estado: Estado del documento ('C' cobrado por defecto)
+
+    Returns:
+        dict: {'num_documentos', 'media', 'total'}
+    """
+    preparar_agregado_ventas(conn)
+    consulta = '''
+        SELECT COALESCE(SUM(num_documentos), 0) as num_documentos, COALESCE(SUM(total), 0) as total
+        FROM ventas_agregado_mensual
+        WHERE tipo = ? AND estado = ? AND anio = ?
+    '''
+    parametros = [tipo, estado, int(anio)]
+    if mes is not None:
+        consulta += ' AND mes = ?'
+        parametros.append(int(mes))
+
+    cursor = conn.cursor()
+    cursor.execute(consulta, parametros)
+    fila = cursor.fetchone()
+    num_documentos = int(fila[0] or 0)
+    total = float(fila[1] or 0)
+    return {
+        'num_documentos': num_documentos,
+        'media': total / num_documentos if num_documentos else 0,
+        'total': total
+    }
+
+
+def obtener_ventas_mensuales(conn, tipo, anio, estado='C'):
+    """
+    Documentos, total y días con ventas de cada mes con actividad.
+
+    Returns:
+        dict: {'01': {'num_documentos', 'total', 'num_dias'}, ...} solo meses con documentos
+    """
+    preparar_agregado_ventas(conn)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT mes, num_documentos, total, num_dias
+        FROM ventas_agregado_mensual
+        WHERE tipo = ? AND estado = ? AND anio = ? AND num_documentos > 0
+        ORDER BY mes
+    ''', (tipo, estado, int(anio)))
+    return {
+        str(fila[0]).zfill(2): {
+            'num_documentos': int(fila[1]),
+            'total': float(fila[2] or 0),
+            'num_dias': int(fila[3] or 0)
+        }
+        for fila in cursor.fetchall()
+    }
+
+
+def obtener_agregado_anios(conn, anios):
+    """
+    Filas del agregado de varios años en una sola consulta, para resumir en memoria.
+
+    Returns:
+        list[dict]: {'tipo', 'anio', 'mes', 'estado', 'num_documentos', 'total'}
+    """
+    preparar_agregado_ventas(conn)
+    anios = [int(anio) for anio in anios]
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT tipo, anio, mes, estado, num_documentos, total
+        FROM ventas_agregado_mensual
+        WHERE anio IN ({', '.join('?' * len(anios))}) AND num_documentos > 0
+    ''', anios)
+    return [
+        {'tipo': f[0], 'anio': f[1], 'mes': f[2], 'estado': f[3], 'num_documentos': int(f[4]), 'total': float(f[5] or 0)}
+        for f in cursor.fetchall()
+    ]
+
+
+def resumir_ventas(filas, tipo, anio, mes=None, estado='C'):
+    """Mismo resultado que obtener_resumen_ventas a partir de filas de obtener_agregado_anios"""
+    num_documentos = 0
+    total = 0.0
+    for fila in filas:
+        if (fila['tipo'] == tipo and fila['estado'] == estado and fila['anio'] == int(anio)
+                and (mes is None or fila['mes'] == int(mes))):
+            num_documentos += fila['num_documentos']
+            total += fila['total']
+    return {
+        'num_documentos': num_documentos,
+        'media': total / num_documentos if num_documentos else 0,
+        'total': total
+    }
@@ -33,6 +33,7 @@ AEAT_CONFIG = {
     # Configuración
     'timeout': 30,  # segundos
     'reintentos': 3,  # Número de reintentos ante fallos
+    'max_registros_envio': 1000,  # Registros por envelope admitidos por el servicio VERI*FACTU
     'entorno': 'test',  # Forzamos el entorno de pruebas
     'usar_sello': False,  # True para usar certificado de sello
     'verificar_ssl': True,  # Verificación SSL del servidor
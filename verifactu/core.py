@@ -10,18 +10,149 @@ para generar, registrar y enviar facturas a AEAT
 import base64
 import json
 import os
+import time
 from datetime import datetime
 
 from .config import AEAT_CONFIG, VERIFACTU_CONSTANTS, logger
 from .db.registro import (_ensure_column_exists, actualizar_factura_con_hash,
-                          crear_registro_facturacion)
+                          asegurar_columnas_registro, crear_registro_facturacion)
 from .db.utils import get_db_connection, redondear_importe
-from .hash.sha256 import generar_hash_factura, obtener_ultimo_hash
+from .hash.cadena import get_servicio_cadena
+from .hash.sha256 import (contenido_hash_factura, contenido_hash_ticket,
+                          generar_hash_factura, obtener_ultimo_hash)
 from .qr.generator import generar_qr_verifactu
-from .soap.client import enviar_registro_aeat
+from .soap.client import enviar_registro_aeat, enviar_registros_aeat_lote
 
 
-def generar_datos_verifactu_para_factura(factura_id, empresa_codigo=None):
+def registrar_resultado_envio(conn, factura_id, factura, resultado_envio):
+    """
+    Guarda en registro_facturacion el resultado del envío de una factura a
+    la AEAT: estado, identificador del envío y, si hay CSV, el QR con el CSV.
+
+    Args:
+        conn: Conexión a la BD de la empresa
+        factura_id: ID de la factura
+        factura: Fila con nif_emisor, numero, fecha y total de la factura
+        resultado_envio: dict devuelto por enviar_registro_aeat o por el envío en lote
+
+    Returns:
+        str: CSV guardado o None
+    """
+    cursor = conn.cursor()
+    csv_final = None
+    try:
+        # Verificar si se recibió un CSV (código seguro verificación) de AEAT
+        if resultado_envio.get('success'):
+            logger.info(f"Factura {factura_id} enviada correctamente a AEAT")
+
+            # --- Actualizar campos de envío en BD ---
+            _ensure_column_exists('id_envio_aeat')
+            _ensure_column_exists('fecha_envio')
+            _ensure_column_exists('estado_envio')
+
+            estado_envio_bd = 'ENVIADO'
+            id_envio_aeat = resultado_envio.get('id_verificacion') or resultado_envio.get('id_envio_aeat')
+            fecha_envio = datetime.now().isoformat()
+
+            if True:
+
+                cursor.execute(
+                    """
+                    UPDATE registro_facturacion
+                       SET estado_envio = ?,
+                           id_envio_aeat = ?,
+                           fecha_envio  = ?
+                     WHERE factura_id  = ?
+                    """,
+                    (estado_envio_bd, id_envio_aeat, fecha_envio, factura_id)
+                )
+                conn.commit()
+
+            # Si se recibió un CSV, actualizar el código QR para incluir el CSV en la URL de cotejo
+            if resultado_envio.get('csv'):
+                csv = resultado_envio['csv']
+                logger.info(f"CSV recibido de AEAT: {csv}")
+
+                # Formatear el total correctamente para el QR (2 decimales)
+                total_formateado = redondear_importe(factura['total'])
+
+                # Generar nuevo código QR que incluya el CSV
+                nuevo_qr_data = generar_qr_verifactu(
+                    nif=factura['nif_emisor'],
+                    numero_factura=factura['numero'],
+                    serie_factura="", # No hay columna serie en la tabla factura
+                    fecha_factura=factura['fecha'],
+                    total_factura=total_formateado,
+                    csv=csv  # Añadir CSV al QR (el CSV es proporcionado por AEAT y se usa solo en el QR, no se guarda en la BD)
+                )
+
+                if nuevo_qr_data:
+                    # Actualizar QR y CSV en base de datos
+                    qr_base64 = base64.b64encode(nuevo_qr_data).decode('utf-8') if nuevo_qr_data else None
+
+                    # Actualizar registro_facturacion con el nuevo QR y CSV
+                    _ensure_column_exists('csv')
+                    csv_final = csv
+                    cursor.execute(
+                        'UPDATE registro_facturacion SET codigo_qr = ?, csv = ?, estado_envio = ?, id_envio_aeat = ?, fecha_envio = ? WHERE factura_id = ?',
+                        (qr_base64, csv_final, 'ENVIADO', id_envio_aeat or 'SIMULADO', datetime.now().isoformat(), factura_id)
+                    )
+                    conn.commit()
+                    logger.info(f"Código QR actualizado con CSV para factura {factura_id}")
+        else:
+            # Error de AEAT - marcar como ERROR y guardar mensaje
+            logger.error(f"Error al enviar factura {factura_id} a AEAT: {resultado_envio.get('mensaje')}")
+
+            _ensure_column_exists('estado_envio')
+            _ensure_column_exists('errores')
+            _ensure_column_exists('fecha_envio')
+
+            # Construir mensaje de error desde los errores devueltos
+            mensaje_error = resultado_envio.get('mensaje', 'Error desconocido')
+            if resultado_envio.get('errores'):
+                errores_str = ' | '.join([
+                    f"{err.get('codigo', 'N/A')}: {err.get('descripcion', 'Sin descripción')}"
+                    for err in resultado_envio['errores']
+                ])
+                mensaje_error = errores_str
+
+            cursor.execute(
+                """
+                UPDATE registro_facturacion
+                   SET estado_envio = 'ERROR',
+                       errores = ?,
+                       fecha_envio = ?,
+                       enviado_aeat = 0
+                 WHERE factura_id = ?
+                """,
+                (mensaje_error, datetime.now().isoformat(), factura_id)
+            )
+            conn.commit()
+            logger.info(f"Estado ERROR registrado para factura {factura_id}")
+
+    except Exception as e:
+        logger.error(f"Error procesando respuesta AEAT: {e}")
+
+        # Marcar como ERROR también en caso de excepción
+        try:
+            _ensure_column_exists('estado_envio')
+            _ensure_column_exists('errores')
+            cursor.execute(
+                """
+                UPDATE registro_facturacion
+                   SET estado_envio = 'ERROR',
+                       errores = ?
+                 WHERE factura_id = ?
+                """,
+                (f"Excepción al procesar: {str(e)}", factura_id)
+            )
+            conn.commit()
+        except Exception as e2:
+            logger.error(f"No se pudo registrar el error: {e2}")
+    return csv_final
+
+
+def generar_datos_verifactu_para_factura(factura_id, empresa_codigo=None, enviar=None):
     """
     Flujo completo de VERI*FACTU para una factura:
     - Calcula hash encadenado
@@ -33,6 +164,8 @@ def generar_datos_verifactu_para_factura(factura_id, empresa_codigo=None):
     Args:
         factura_id: ID de la factura
         empresa_codigo: Código de empresa (opcional, se establece en env)
+        enviar: Función de envío f(factura_id) -> dict (opcional, por defecto
+            enviar_registro_aeat; el worker de la outbox puede usar el stub local)
         
     Returns:
         dict: Datos VERI*FACTU para incluir en la factura (QR, etc)
@@ -73,21 +206,11 @@ def generar_datos_verifactu_para_factura(factura_id, empresa_codigo=None):
         # 2. Calcular hash SHA-256 encadenado si no existe
         hash_factura = factura['hash_factura']
         
-        if not hash_factura:
-            # Obtener el hash de la factura anterior
-            hash_anterior = obtener_ultimo_hash()
-            
-            # Generar contenido para hash (campos relevantes de la factura)
-            contenido_hash = f"{factura['nif_emisor']}{factura['nif_receptor']}{factura['fecha']}{factura['numero']}{factura['total']}"
-            
-            # Calcular el nuevo hash
-            hash_factura = generar_hash_factura(contenido_hash, hash_anterior)
-            
-            # Actualizar la factura con el hash calculado
-            actualizar_factura_con_hash(factura_id, hash_factura)
-        
-        # 3. Verificar si ya existe registro de facturación
-        if not factura['registro_id']:
+        # Generar contenido para hash (campos relevantes de la factura)
+        contenido_hash = contenido_hash_factura(factura['nif_emisor'], factura['nif_receptor'],
+                                                factura['fecha'], factura['numero'], factura['total'])
+
+        def registrar(conn_cadena=None, huella=None):
             # Crear registro de facturación
             crear_registro_facturacion(
                 factura_id=factura_id,
@@ -95,12 +218,34 @@ def generar_datos_verifactu_para_factura(factura_id, empresa_codigo=None):
                 nif_receptor=factura['nif_receptor'],
                 fecha=factura['fecha'],
                 total=factura['total'],
-                hash_factura=hash_factura,
+                hash_factura=huella or hash_factura,
                 qr_data=None,  # Se actualizará después
                 numero_factura=factura['numero'],
                 serie_factura="", # No hay columna serie en la tabla factura
-                cuota_impuestos=factura['cuota_impuestos']
+                cuota_impuestos=factura['cuota_impuestos'],
+                conn=conn_cadena
             )
+
+        if not hash_factura and not factura['registro_id']:
+            # 2-3. Hash, factura y registro en una transacción sobre la cabeza de la cadena:
+            # otro proceso no puede encadenar a la vez sobre el mismo registro anterior
+            asegurar_columnas_registro()
+
+            def anexar(conn_cadena, huella):
+                conn_cadena.execute('UPDATE factura SET hash_factura = ? WHERE id = ?', (huella, factura_id))
+                registrar(conn_cadena, huella)
+
+            hash_factura = get_servicio_cadena().anexar(contenido_hash, anexar, factura['numero'], factura['fecha'])
+            logger.info(f"Factura ID {factura_id} encadenada con hash {hash_factura[:10]}...")
+        else:
+            if not hash_factura:
+                # Registro ya creado sin hash: se calcula sobre el último hash
+                hash_factura = generar_hash_factura(contenido_hash, obtener_ultimo_hash())
+                actualizar_factura_con_hash(factura_id, hash_factura)
+
+            # 3. Verificar si ya existe registro de facturación
+            if not factura['registro_id']:
+                registrar()
         
         # 4. Inicializar variable QR (se generará después del envío a AEAT)
         qr_data = None
@@ -113,116 +258,11 @@ def generar_datos_verifactu_para_factura(factura_id, empresa_codigo=None):
         resultado_envio = {'success': False, 'mensaje': 'No se ha realizado el envío'}
         
         try:
-            resultado_envio = enviar_registro_aeat(factura_id)
-            
-            # Verificar si se recibió un CSV (código seguro verificación) de AEAT
-            if resultado_envio.get('success'):
-                logger.info(f"Factura {factura_id} enviada correctamente a AEAT")
-
-                # --- Actualizar campos de envío en BD ---
-                _ensure_column_exists('id_envio_aeat')
-                _ensure_column_exists('fecha_envio')
-                _ensure_column_exists('estado_envio')
-
-                estado_envio_bd = 'ENVIADO'
-                id_envio_aeat = resultado_envio.get('id_verificacion') or resultado_envio.get('id_envio_aeat')
-                fecha_envio = datetime.now().isoformat()
-
-                if True:
-
-                    cursor.execute(
-                        """
-                        UPDATE registro_facturacion
-                           SET estado_envio = ?,
-                               id_envio_aeat = ?,
-                               fecha_envio  = ?
-                         WHERE factura_id  = ?
-                        """,
-                        (estado_envio_bd, id_envio_aeat, fecha_envio, factura_id)
-                    )
-                    conn.commit()
-                
-                # Si se recibió un CSV, actualizar el código QR para incluir el CSV en la URL de cotejo
-                if resultado_envio.get('csv'):
-                    csv = resultado_envio['csv']
-                    logger.info(f"CSV recibido de AEAT: {csv}")
-                    
-                    # Formatear el total correctamente para el QR (2 decimales)
-                    total_formateado = redondear_importe(factura['total'])
-                    
-                    # Generar nuevo código QR que incluya el CSV
-                    nuevo_qr_data = generar_qr_verifactu(
-                        nif=factura['nif_emisor'],
-                        numero_factura=factura['numero'],
-                        serie_factura="", # No hay columna serie en la tabla factura
-                        fecha_factura=factura['fecha'],
-                        total_factura=total_formateado,
-                        csv=csv  # Añadir CSV al QR (el CSV es proporcionado por AEAT y se usa solo en el QR, no se guarda en la BD)
-                    )
-                    
-                    if nuevo_qr_data:
-                        # Actualizar QR y CSV en base de datos
-                        qr_base64 = base64.b64encode(nuevo_qr_data).decode('utf-8') if nuevo_qr_data else None
-                        
-                        # Actualizar registro_facturacion con el nuevo QR y CSV
-                        _ensure_column_exists('csv')
-                        csv_final = csv
-                        cursor.execute(
-                            'UPDATE registro_facturacion SET codigo_qr = ?, csv = ?, estado_envio = ?, id_envio_aeat = ?, fecha_envio = ? WHERE factura_id = ?',
-                            (qr_base64, csv_final, 'ENVIADO', id_envio_aeat or 'SIMULADO', datetime.now().isoformat(), factura_id)
-                        )
-                        conn.commit()
-                        logger.info(f"Código QR actualizado con CSV para factura {factura_id}")
-            else:
-                # Error de AEAT - marcar como ERROR y guardar mensaje
-                logger.error(f"Error al enviar factura {factura_id} a AEAT: {resultado_envio.get('mensaje')}")
-                
-                _ensure_column_exists('estado_envio')
-                _ensure_column_exists('errores')
-                _ensure_column_exists('fecha_envio')
-                
-                # Construir mensaje de error desde los errores devueltos
-                mensaje_error = resultado_envio.get('mensaje', 'Error desconocido')
-                if resultado_envio.get('errores'):
-                    errores_str = ' | '.join([
-                        f"{err.get('codigo', 'N/A')}: {err.get('descripcion', 'Sin descripción')}"
-                        for err in resultado_envio['errores']
-                    ])
-                    mensaje_error = errores_str
-                
-                cursor.execute(
-                    """
-                    UPDATE registro_facturacion
-                       SET estado_envio = 'ERROR',
-                           errores = ?,
-                           fecha_envio = ?,
-                           enviado_aeat = 0
-                     WHERE factura_id = ?
-                    """,
-                    (mensaje_error, datetime.now().isoformat(), factura_id)
-                )
-                conn.commit()
-                logger.info(f"Estado ERROR registrado para factura {factura_id}")
-                
+            resultado_envio = (enviar or enviar_registro_aeat)(factura_id)
         except Exception as e:
-            logger.error(f"Error procesando respuesta AEAT: {e}")
-            
-            # Marcar como ERROR también en caso de excepción
-            try:
-                _ensure_column_exists('estado_envio')
-                _ensure_column_exists('errores')
-                cursor.execute(
-                    """
-                    UPDATE registro_facturacion
-                       SET estado_envio = 'ERROR',
-                           errores = ?
-                     WHERE factura_id = ?
-                    """,
-                    (f"Excepción al procesar: {str(e)}", factura_id)
-                )
-                conn.commit()
-            except Exception as e2:
-                logger.error(f"No se pudo registrar el error: {e2}")
+            logger.error(f"Error enviando factura {factura_id} a AEAT: {e}")
+            resultado_envio = {'success': False, 'mensaje': f"Excepción al enviar: {str(e)}"}
+        csv_final = registrar_resultado_envio(conn, factura_id, factura, resultado_envio)
                         
 #                         # Actualizar QR en la factura principal
 #                         cursor.execute(
@@ -293,6 +333,66 @@ def generar_datos_verifactu_para_factura(factura_id, empresa_codigo=None):
         logger.error("No se pudo crear la tabla tickets: %s", exc)
 
 
+def enviar_pendientes_aeat(limite=None, reintentar_errores=True, enviar_lote=None):
+    """
+    Envía en lote a la AEAT los registros de facturas que no constan como
+    enviados, en orden de registro: los pendientes acumulados (p. ej. tras
+    una caída de la AEAT) salen en unas pocas llamadas en lugar de una por
+    factura. Las facturas que el worker de la outbox tiene reservadas en
+    ese momento se dejan para él.
+
+    Args:
+        limite: Máximo de registros a enviar (opcional)
+        reintentar_errores: Incluir también los registros en estado ERROR
+        enviar_lote: Función f(factura_ids) -> {factura_id: resultado}
+            (opcional, por defecto enviar_registros_aeat_lote)
+
+    Returns:
+        dict: {'total': n, 'enviadas': n, 'errores': n}
+    """
+    estados = ('PENDIENTE', 'ERROR') if reintentar_errores else ('PENDIENTE',)
+    resumen = {'total': 0, 'enviadas': 0, 'errores': 0}
+    _ensure_column_exists('estado_envio')
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        sql = f'''
+            SELECT r.factura_id, f.nif AS nif_emisor, f.numero, f.fecha, f.total
+            FROM registro_facturacion r
+            JOIN factura f ON f.id = r.factura_id
+            WHERE COALESCE(r.estado_envio, 'PENDIENTE') IN ({','.join('?' * len(estados))})
+            ORDER BY r.id
+        '''
+        parametros = list(estados)
+        if limite:
+            sql += ' LIMIT ?'
+            parametros.append(limite)
+        facturas = {fila['factura_id']: fila for fila in cursor.execute(sql, parametros).fetchall()}
+
+        try:
+            reservadas = {fila[0] for fila in cursor.execute(
+                "SELECT factura_id FROM verifactu_outbox WHERE estado = 'pendiente' AND bloqueado_hasta > ?",
+                (time.time(),)
+            )}
+        except Exception:
+            reservadas = set()  # Empresa sin outbox
+        for factura_id in reservadas:
+            facturas.pop(factura_id, None)
+        if not facturas:
+            return resumen
+
+        logger.info(f"Enviando en lote {len(facturas)} registros pendientes a AEAT")
+        resultados = (enviar_lote or enviar_registros_aeat_lote)(list(facturas))
+        for factura_id, factura in facturas.items():
+            resultado = resultados.get(factura_id) or {'success': False, 'mensaje': 'Sin resultado del envío en lote'}
+            registrar_resultado_envio(conn, factura_id, factura, resultado)
+            resumen['enviadas' if resultado.get('success') else 'errores'] += 1
+        resumen['total'] = len(facturas)
+        return resumen
+    finally:
+        conn.close()
+
+
 def generar_datos_verifactu_para_ticket(ticket_id: int, push_notif=None, empresa_codigo=None):
     """Flujo VERI*FACTU adaptado a tickets.
     Genera hash encadenado, QR y crea registro en registro_facturacion con
@@ -349,27 +449,30 @@ def generar_datos_verifactu_para_ticket(ticket_id: int, push_notif=None, empresa
             except Exception as e_json:
                 logger.warning(f"No se pudo cargar JSON directamente: {e_json}")
 
-        # 1. Calcular hash encadenado (cadena común con facturas)
-        hash_anterior = obtener_ultimo_hash()
-        contenido_hash = f"{nif_emisor}{ticket['fecha']}{ticket['numero']}{ticket['total']}"
-        hash_ticket = generar_hash_factura(contenido_hash, hash_anterior)
-
-        # 2. Crear registro_facturacion
-        crear_registro_facturacion(
-            factura_id=ticket_id,
-            ticket_id=ticket_id,
-            nif_emisor=nif_emisor,
-            nif_receptor=None,
-            fecha=ticket['fecha'],
-            total=ticket['total'],
-            hash_factura=hash_ticket,
-            qr_data=None,
-            numero_factura=ticket['numero'],
-            serie_factura='',
-            tipo_factura='F2',
-            cuota_impuestos=ticket['importe_impuestos'] or 0.0,
-            estado_envio='PENDIENTE'
-        )
+        # 1-2. Calcular hash encadenado (cadena común con facturas) y crear
+        #      registro_facturacion en la misma transacción
+        contenido_hash = contenido_hash_ticket(nif_emisor, ticket['fecha'], ticket['numero'], ticket['total'])
+        asegurar_columnas_registro()
+
+        def registrar(conn_cadena, huella):
+            crear_registro_facturacion(
+                factura_id=ticket_id,
+                ticket_id=ticket_id,
+                nif_emisor=nif_emisor,
+                nif_receptor=None,
+                fecha=ticket['fecha'],
+                total=ticket['total'],
+                hash_factura=huella,
+                qr_data=None,
+                numero_factura=ticket['numero'],
+                serie_factura='',
+                tipo_factura='F2',
+                cuota_impuestos=ticket['importe_impuestos'] or 0.0,
+                estado_envio='PENDIENTE',
+                conn=conn_cadena
+            )
+
+        hash_ticket = get_servicio_cadena().anexar(contenido_hash, registrar, ticket['numero'], ticket['fecha'])
 
         # 3. Enviar registro a AEAT antes de generar QR
         from verifactu.soap.ticket import enviar_registro_aeat_ticket
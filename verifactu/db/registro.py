@@ -13,13 +13,14 @@ import json
 from datetime import datetime
 
 from ..config import VERIFACTU_CONSTANTS, logger
+from ..hash.cadena import get_servicio_cadena
 from .utils import get_db_connection
 
 
 def crear_registro_facturacion(factura_id=None, nif_emisor=None, nif_receptor=None, fecha=None, total=0.0,
                                hash_factura=None, qr_data=None, firmado=False, numero_factura=None,
                                serie_factura=None, tipo_factura=None, cuota_impuestos=0.0,
-                               estado_envio='PENDIENTE', ticket_id=None):
+                               estado_envio='PENDIENTE', ticket_id=None, conn=None):
     """
     Crea un registro de facturación para VERI*FACTU.
     
@@ -38,17 +39,19 @@ def crear_registro_facturacion(factura_id=None, nif_emisor=None, nif_receptor=No
         cuota_impuestos: Importe total de impuestos (IVA)
         estado_envio: Estado del envío a AEAT ('PENDIENTE', 'ENVIADO', 'RECHAZADO')
         ticket_id: ID del ticket
+        conn: Conexión con una transacción abierta (anexo a la cadena). Se
+            usa sin confirmar ni cerrar, los errores se propagan y las
+            columnas deben existir antes (asegurar_columnas_registro)
         
     Returns:
         bool: True si se creó correctamente, False en caso contrario
     """
-    conn = None
+    externa = conn is not None
     try:
-        conn = get_db_connection()
+        if not externa:
+            conn = get_db_connection()
+            asegurar_columnas_registro()
         cursor = conn.cursor()
-        
-        # Asegurarnos de que exista la columna ticket_id
-        _ensure_column_exists('ticket_id', 'INTEGER')
 
         # Verificar si ya existe un registro para esta factura o ticket
         if factura_id:
@@ -107,9 +110,6 @@ def crear_registro_facturacion(factura_id=None, nif_emisor=None, nif_receptor=No
         }
         
         metadatos_json = json.dumps(metadatos)
-        # Garantizar columnas de identificación de sistema
-        for _col in ("nombre_sistema", "id_sistema", "version_sistema", "numero_instalacion"):
-            _ensure_column_exists(_col)
         nombre_sistema = VERIFACTU_CONSTANTS.get("nombre_sistema", "VerifactuApp")
         id_sistema = VERIFACTU_CONSTANTS.get("id_sistema", "01")
         version_sistema = VERIFACTU_CONSTANTS.get("version_sistema", "1.0")
@@ -130,21 +130,32 @@ def crear_registro_facturacion(factura_id=None, nif_emisor=None, nif_receptor=No
             timestamp, nombre_sistema, id_sistema, version_sistema, numero_instalacion
         ))
         
-        conn.commit()
+        if not externa:
+            conn.commit()
         
         logger.info(f"Registro de facturación VERI*FACTU creado para factura ID {factura_id}")
         return True
         
     except Exception as e:
         logger.error(f"Error al crear registro de facturación: {e}")
+        if externa:
+            raise
         if conn:
             conn.rollback()
         return False
         
     finally:
-        if conn:
+        if conn and not externa:
             conn.close()
 
+
+def asegurar_columnas_registro():
+    """Columnas que crear_registro_facturacion necesita además de las del esquema original"""
+    _ensure_column_exists('ticket_id', 'INTEGER')
+    # Columnas de identificación de sistema
+    for _col in ("nombre_sistema", "id_sistema", "version_sistema", "numero_instalacion"):
+        _ensure_column_exists(_col)
+
 def actualizar_factura_con_hash(factura_id, hash_factura):
     """
     Actualiza una factura con su hash calculado.
@@ -263,29 +274,7 @@ def es_primer_registro_factura(
     Esta variante evita la sobre-selección por prefijo y es más eficiente
     gracias al uso de ``EXISTS`` (termina en la primera coincidencia).
     """
-    _ensure_column_exists("primer_registro")
-    _ensure_column_exists("huella_aeat")
-
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-             SELECT 1 FROM registro_facturacion
-              WHERE nif_emisor = ?
-                AND huella_aeat IS NOT NULL
-               LIMIT 1
-             """,
-            (nif_emisor.upper(),),
-        )
-        row = cur.fetchone()
-        return "S" if row is None else "N"
-    except Exception as exc:
-        logger.error("Error comprobando primer_registro (factura): %s", exc)
-        return "S"  # fallback conservador
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
+    return calcular_primer_registro_exacto(nif_emisor, numero_factura, serie_factura)
 
 
 
@@ -304,7 +293,13 @@ def calcular_primer_registro_exacto(
     """Devuelve 'S' si la factura indicada aún no ha sido registrada.
 
     Consulta por NIF, número y serie en la tabla ``registro_facturacion``.
+    Un NIF con registros aceptados lo sigue teniendo, así que la respuesta
+    'N' se recuerda en el servicio de cadena y no se vuelve a consultar.
     """
+    cadena = get_servicio_cadena()
+    if cadena.nif_encadenado(nif_emisor):
+        return "N"
+
     _ensure_column_exists("primer_registro")
     _ensure_column_exists("huella_aeat")
 
@@ -321,7 +316,10 @@ def calcular_primer_registro_exacto(
             """,
             (nif_emisor.upper(),),
         )
-        return "S" if cur.fetchone() is None else "N"
+        if cur.fetchone() is None:
+            return "S"
+        cadena.marcar_nif_encadenado(nif_emisor)
+        return "N"
     except Exception as exc:
         logger.error("Error calculando primer_registro_exacto: %s", exc)
         return "S"
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cabeza de la cadena de huellas VERI*FACTU por empresa
+
+Cada registro de facturación encadena con la huella del registro anterior
+(el último de registro_facturacion). Leer esa huella, calcular la nueva e
+insertar el registro en pasos separados permite que dos procesos encadenen
+sobre el mismo predecesor. Aquí se hace todo en una transacción BEGIN
+IMMEDIATE por el carril de escritura de la BD:
+
+- Dentro del proceso los anexos de una empresa esperan turno en el carril;
+  entre procesos (workers de Gunicorn, worker de la outbox) los ordena el
+  bloqueo RESERVED de SQLite que toma BEGIN IMMEDIATE
+- La última cabeza (id, huella, número, fecha) se guarda en memoria y solo
+  se comprueba que MAX(id) sigue siendo el mismo; si otro proceso ha
+  añadido registros se vuelve a leer
+- Los NIF que ya tienen un registro aceptado por la AEAT (huella_aeat) se
+  recuerdan: dejan de ser PrimerRegistro para siempre
+
+verificar_cadena() recalcula todas las huellas de registro_facturacion en
+un solo recorrido para localizar roturas de la cadena.
+"""
+
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from db_utils import _ruta_bd_actual, get_db_read_connection, get_db_write_transaction
+
+from ..config import logger
+from .sha256 import calcular_hash_encadenado, contenido_hash_factura, contenido_hash_ticket
+
+# Roturas que se devuelven con detalle (el total se cuenta siempre)
+MAX_ROTURAS_DETALLE = 100
+
+
+@dataclass
+class CabezaCadena:
+    """Último registro de la cadena de una empresa"""
+    registro_id: Optional[int]
+    hash: Optional[str]
+    numero: Optional[str] = None
+    fecha: Optional[str] = None
+
+
+@dataclass
+class CadenaMetrics:
+    """Métricas del servicio de cadena"""
+    anexados: int = 0
+    aciertos: int = 0     # cabeza servida desde memoria
+    relecturas: int = 0   # cabeza leída de la BD (primera vez o cambiada por otro proceso)
+    primer_registro_memoria: int = 0
+
+
+class ServicioCadena:
+    """Cabezas de cadena y NIF ya encadenados, por BD de empresa"""
+
+    def __init__(self):
+        self.metrics = CadenaMetrics()
+        self._lock = threading.Lock()
+        self._cabezas: Dict[str, CabezaCadena] = {}
+        self._nifs_encadenados: Dict[str, set] = {}
+
+    @staticmethod
+    def _clave() -> str:
+        return os.path.abspath(_ruta_bd_actual())
+
+    def _contar(self, campo, cantidad=1):
+        with self._lock:
+            setattr(self.metrics, campo, getattr(self.metrics, campo) + cantidad)
+
+    def _leer_cabeza(self, conn, clave: str) -> CabezaCadena:
+        ultimo_id = conn.execute('SELECT MAX(id) FROM registro_facturacion').fetchone()[0]
+        with self._lock:
+            cabeza = self._cabezas.get(clave)
+        if cabeza is not None and cabeza.registro_id == ultimo_id:
+            self._contar('aciertos')
+            return cabeza
+
+        self._contar('relecturas')
+        fila = conn.execute(
+            'SELECT id, hash, numero_factura, fecha_emision FROM registro_facturacion WHERE id = ?',
+            (ultimo_id,)
+        ).fetchone()
+        if fila is None:
+            return CabezaCadena(None, None)
+        return CabezaCadena(fila[0], fila[1], fila[2], fila[3])
+
+    def cabeza(self) -> CabezaCadena:
+        """Cabeza actual de la empresa activa (lectura, sin reservar la cadena)"""
+        conn = get_db_read_connection()
+        try:
+            return self._leer_cabeza(conn, self._clave())
+        finally:
+            conn.close()
+
+    def anexar(self, contenido: str, registrar: Callable[[Any, str], Any],
+               numero: str = None, fecha: str = None) -> str:
+        """
+        Calcula la huella de `contenido` encadenada con la cabeza y llama a
+        registrar(conn, huella), que debe insertar el registro en esa misma
+        conexión. Huella y registro se confirman juntos; si registrar lanza
+        una excepción no se guarda nada.
+
+        Las columnas que registrar necesite deben existir antes: un ALTER
+        TABLE desde otra conexión esperaría a que terminase esta transacción.
+
+        Returns:
+            str: Huella calculada
+        """
+        clave = self._clave()
+        with get_db_write_transaction() as conn:
+            anterior = self._leer_cabeza(conn, clave)
+            huella = calcular_hash_encadenado(contenido, anterior.hash)
+            registrar(conn, huella)
+            nuevo_id = conn.execute('SELECT MAX(id) FROM registro_facturacion').fetchone()[0]
+
+        if nuevo_id != anterior.registro_id:
+            with self._lock:
+                actual = self._cabezas.get(clave)
+                # Los id solo crecen: una cabeza más antigua nunca sustituye a otra más nueva
+                if actual is None or actual.registro_id is None or actual.registro_id < nuevo_id:
+                    self._cabezas[clave] = CabezaCadena(nuevo_id, huella, numero, fecha)
+                self.metrics.anexados += 1
+        else:
+            logger.warning("registrar no ha añadido ningún registro; la cabeza de la cadena no cambia")
+        return huella
+
+    def nif_encadenado(self, nif_emisor: str) -> bool:
+        """True si ya consta que el NIF tiene registros aceptados (no es PrimerRegistro)"""
+        with self._lock:
+            encontrado = (nif_emisor or '').upper() in self._nifs_encadenados.get(self._clave(), ())
+            if encontrado:
+                self.metrics.primer_registro_memoria += 1
+        return encontrado
+
+    def marcar_nif_encadenado(self, nif_emisor: str):
+        with self._lock:
+            self._nifs_encadenados.setdefault(self._clave(), set()).add((nif_emisor or '').upper())
+
+    def olvidar(self):
+        """Descarta lo memorizado de la empresa activa (p. ej. tras restaurar su BD)"""
+        clave = self._clave()
+        with self._lock:
+            self._cabezas.pop(clave, None)
+            self._nifs_encadenados.pop(clave, None)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'empresas': len(self._cabezas),
+                'anexados': self.metrics.anexados,
+                'aciertos': self.metrics.aciertos,
+                'relecturas': self.metrics.relecturas,
+                'primer_registro_memoria': self.metrics.primer_registro_memoria
+            }
+
+
+_servicio = None
+_servicio_lock = threading.Lock()
+
+
+def get_servicio_cadena() -> ServicioCadena:
+    """Servicio único por proceso"""
+    global _servicio
+    if _servicio is None:
+        with _servicio_lock:
+            if _servicio is None:
+                _servicio = ServicioCadena()
+    return _servicio
+
+
+def verificar_cadena(conn=None, lote: int = 5000) -> Dict[str, Any]:
+    """
+    Recalcula en orden de id la huella de cada registro de
+    registro_facturacion a partir de sus propios campos y de la huella
+    guardada en el registro anterior, leyendo por bloques de `lote` filas.
+
+    Un registro alterado da una rotura; una huella alterada da dos (la suya
+    y la del siguiente, que encadenaba con la original).
+
+    Args:
+        conn: Conexión a usar (por defecto, de lectura a la BD de la empresa activa)
+        lote: Filas por lectura
+
+    Returns:
+        dict: {'registros', 'roturas', 'detalle': [{'registro_id', 'factura_id',
+               'ticket_id', 'hash', 'esperado'}, ...], 'ultimo_hash'}
+    """
+    propia = conn is None
+    if propia:
+        conn = get_db_read_connection()
+    try:
+        columnas = {fila[1] for fila in conn.execute('PRAGMA table_info(registro_facturacion)')}
+        ticket = 'ticket_id' if 'ticket_id' in columnas else 'NULL'
+        cursor = conn.execute(f'''
+            SELECT id, factura_id, {ticket}, nif_emisor, nif_receptor, fecha_emision,
+                   numero_factura, total, hash
+              FROM registro_facturacion
+             ORDER BY id
+        ''')
+        registros = 0
+        roturas = 0
+        detalle = []
+        anterior = None
+        while True:
+            filas = cursor.fetchmany(lote)
+            if not filas:
+                break
+            for registro_id, factura_id, ticket_id, nif_emisor, nif_receptor, fecha, numero, total, huella in filas:
+                if ticket_id:
+                    contenido = contenido_hash_ticket(nif_emisor, fecha, numero, total)
+                else:
+                    contenido = contenido_hash_factura(nif_emisor, nif_receptor, fecha, numero, total)
+                esperado = calcular_hash_encadenado(contenido, anterior)
+                if esperado != huella:
+                    roturas += 1
+                    if len(detalle) < MAX_ROTURAS_DETALLE:
+                        detalle.append({'registro_id': registro_id, 'factura_id': factura_id,
+                                        'ticket_id': ticket_id, 'hash': huella, 'esperado': esperado})
+                anterior = huella
+            registros += len(filas)
+    finally:
+        if propia:
+            conn.close()
+
+    if roturas:
+        logger.warning("Cadena VERI*FACTU con %s roturas en %s registros", roturas, registros)
+    return {'registros': registros, 'roturas': roturas, 'detalle': detalle, 'ultimo_hash': anterior}
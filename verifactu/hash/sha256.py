@@ -14,6 +14,21 @@ from ..config import logger
 from ..db.utils import get_db_connection
 
 
+def contenido_hash_factura(nif_emisor, nif_receptor, fecha, numero, total):
+    """Campos de la factura que entran en su huella, en el orden del encadenamiento"""
+    return f"{nif_emisor}{nif_receptor}{fecha}{numero}{total}"
+
+
+def contenido_hash_ticket(nif_emisor, fecha, numero, total):
+    """Campos del ticket que entran en su huella (sin receptor)"""
+    return f"{nif_emisor}{fecha}{numero}{total}"
+
+
+def calcular_hash_encadenado(contenido, hash_anterior=None):
+    """SHA-256 en mayúsculas de hash_anterior + contenido, sin trazas (recorridos masivos)"""
+    return hashlib.sha256(((hash_anterior or "") + str(contenido)).encode('utf-8')).hexdigest().upper()
+
+
 def generar_hash_factura(contenido_factura, hash_anterior=None):
     """
     Genera un hash SHA-256 para la factura, encadenado con el hash anterior.
@@ -26,16 +41,8 @@ def generar_hash_factura(contenido_factura, hash_anterior=None):
         str: Hash SHA-256 hexadecimal
     """
     try:
-        # Si no hay hash anterior, usar una cadena vacía como inicio
-        if not hash_anterior:
-            hash_anterior = ""
-            
-        # Concatenar el hash anterior con el contenido de la factura
-        contenido_completo = hash_anterior + str(contenido_factura)
-        
-        # Calcular el hash SHA-256
-        hash_object = hashlib.sha256(contenido_completo.encode('utf-8'))
-        hash_resultado = hash_object.hexdigest().upper()
+        # Sin hash anterior la cadena empieza con una cadena vacía
+        hash_resultado = calcular_hash_encadenado(contenido_factura, hash_anterior)
         
         logger.info(f"Hash SHA-256 generado: {hash_resultado[:10]}...")
         return hash_resultado
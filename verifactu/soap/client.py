@@ -15,11 +15,15 @@ import os
 from constantes import DB_NAME
 import re
 import sqlite3
+import threading
 from datetime import datetime
+from functools import lru_cache
 
 import requests
 from lxml import etree
 
+from ..config import AEAT_CONFIG
+
 logger = logging.getLogger('verifactu')
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
@@ -69,6 +73,82 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '
 # Directorio por defecto para certificados SSL
 cert_dir = os.path.join(BASE_DIR, 'certs')
 
+SOAP_HEADERS = {
+    'Content-Type': 'text/xml;charset=UTF-8',
+    'SOAPAction': '""'
+}
+
+_sesiones_aeat = {}
+_sesiones_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _directorio_certificados(cert_dir_env, base_dir):
+    if cert_dir_env:
+        return cert_dir_env
+    for cand in ('/var/www/html/certs', os.path.join(base_dir, 'certs')):
+        if os.path.exists(cand):
+            return cand
+    return os.path.join(base_dir, 'certs')
+
+
+def rutas_certificado_aeat():
+    """
+    Directorio, certificado y clave PEM del cliente. El directorio se
+    resuelve una vez por proceso y valor de VERIFACTU_CERT_DIR.
+    """
+    directorio = _directorio_certificados(os.environ.get('VERIFACTU_CERT_DIR'), BASE_DIR)
+    return directorio, os.path.join(directorio, 'cert_real.pem'), os.path.join(directorio, 'clave_real.pem')
+
+
+def obtener_sesion_aeat(cert_path, key_path) -> requests.Session:
+    """
+    Sesión HTTP con el certificado cliente cargado, una por certificado y
+    proceso: los envíos reutilizan la conexión TLS en lugar de negociarla y
+    volver a leer el certificado en cada llamada.
+    """
+    clave = (cert_path, key_path)
+    with _sesiones_lock:
+        sesion = _sesiones_aeat.get(clave)
+        if sesion is None:
+            sesion = requests.Session()
+            sesion.cert = clave
+            sesion.verify = True
+            sesion.headers.update(SOAP_HEADERS)
+            _sesiones_aeat[clave] = sesion
+    return sesion
+
+
+def _guardar_respuesta_fichero(nombre, texto):
+    """Copia de la respuesta en aeat_responses/EMPRESA/AAAA/MM y en /tmp/aeat_last.xml"""
+    now = datetime.now()
+    base_dir = "/var/www/html/aeat_responses"
+    # Obtener empresa_id de la sesión o usar por defecto
+    empresa_id = os.environ.get('EMPRESA_CODIGO', 'caca')
+    # Organizar por empresa/año/mes: aeat_responses/empresa_id/YYYY/MM
+    resp_dir = os.path.join(base_dir, str(empresa_id), now.strftime("%Y"), now.strftime("%m"))
+    try:
+        os.makedirs(resp_dir, mode=0o777, exist_ok=True)
+        file_path = os.path.join(resp_dir, f"{nombre}_{now.strftime('%Y%m%d%H%M%S')}.xml")
+        with open(file_path, "w", encoding="utf-8") as fh:
+            fh.write(texto)
+        logger.info("Respuesta AEAT guardada en %s", file_path)
+    except Exception as exc:
+        logger.warning("No se pudo guardar respuesta AEAT en %s: %s", resp_dir, exc)
+
+    # Copia rápida en /tmp para depuración
+    try:
+        with open('/tmp/aeat_last.xml', 'w', encoding='utf-8') as fh:
+            fh.write(texto)
+    except Exception:
+        pass
+
+
+
+def _texto_local(elem, nombre):
+    """Texto del primer descendiente con ese nombre local, sea cual sea su namespace"""
+    encontrados = elem.xpath(f'.//*[local-name()="{nombre}"]')
+    return encontrados[0].text if encontrados else None
 
 
 def parsear_respuesta_aeat(xml_text):
@@ -155,43 +235,18 @@ def parsear_respuesta_aeat(xml_text):
             'resultado': resultado_elem.text if resultado_elem is not None else None,
             'codigo_error': codigo_elem.text if codigo_elem is not None else None,
             'descripcion_error': desc_elem.text if desc_elem is not None else None,
+            # Identificación del registro, para los envíos con varios registros
+            'num_serie_factura': _texto_local(linea, 'NumSerieFactura'),
+            'fecha_expedicion': _texto_local(linea, 'FechaExpedicionFactura'),
+            'estado_registro': _texto_local(linea, 'EstadoRegistro'),
+            'codigo_error_registro': _texto_local(linea, 'CodigoErrorRegistro'),
+            'descripcion_error_registro': _texto_local(linea, 'DescripcionErrorRegistro'),
         })
     
     return {'estado_envio': estado_envio, 'csv': csv, 'errores': errores, 'lineas': lineas}
 
-def crear_envelope_soap(
-    operacion: str,           # NO se usa, pero se conserva la firma pública
-    cabecera: dict,           #   »   »      »      »
-    registro_factura: dict,
-    nif_emisor: str,
-    factura_firmada_b64: str | None = None,
-    huella_anterior: str | None = None,
-    primer_registro: str | None = None,
-    ajuste_fecha_minuto: bool = False,
-    huella_fija: str | None = None,
-) -> tuple[str, str]:  # Devuelve (envelope_xml, huella)
-    """
-    Devuelve el envelope SOAP con el **orden exacto de nodos** que
-    exige el XSD de VERI*FACTU (evita el 4102 “Falta informar campo
-    obligatorio: Encadenamiento / Desglose”).
-
-    Únicamente genera el XML; la lógica de BD, red, certificados, etc.
-    permanece intacta.
-    """
-    # ------------------------------------------------------------------ #
-    #  Namespaces
-    # ------------------------------------------------------------------ #
-    ns_soap = "http://schemas.xmlsoap.org/soap/envelope/"
-    ns_lr   = ("https://www2.agenciatributaria.gob.es/static_files/common/"
-               "internet/dep/aplicaciones/es/aeat/tike/cont/ws/SuministroLR.xsd")
-    ns_sf   = ("https://www2.agenciatributaria.gob.es/static_files/common/"
-               "internet/dep/aplicaciones/es/aeat/tike/cont/ws/SuministroInformacion.xsd")
-
-    # ------------------------------------------------------------------ #
-    #  Datos básicos - saneo y cálculos
-    # ------------------------------------------------------------------ #
-    nif = nif_emisor.strip().upper()
-
+def _cargar_config_emisor() -> dict:
+    """Datos del emisor: de la sesión o, sin contexto Flask, del JSON de EMPRESA_CODIGO"""
     # ------------------------------------------------------------------ #
     #  Cargar datos del emisor desde emisor_config.json, si existe
     # ------------------------------------------------------------------ #
@@ -213,9 +268,23 @@ def crear_envelope_soap(
         except Exception as e_json:
             logger.warning(f"No se pudo cargar JSON directamente: {e_json}")
             cfg_emisor = {}
+    return cfg_emisor
 
-    # Prioridad: valor explícito en registro_factura > configuración JSON > valor por defecto
-    nombre = registro_factura.get("nombre_emisor", cfg_emisor.get("nombre", "EMISOR VERIFACTU"))
+
+def _registro_alta(
+    registro_factura: dict,
+    nif: str,
+    nombre: str,
+    factura_firmada_b64: str | None = None,
+    huella_anterior: str | None = None,
+    primer_registro: str | None = None,
+    huella_fija: str | None = None,
+) -> tuple[str, str, str, str]:
+    """
+    Bloque <lr:RegistroFactura> de un registro de alta.
+    Devuelve (xml, huella, NumSerieFactura, FechaExpedicionFactura); los dos
+    últimos identifican la RespuestaLinea de la AEAT que le corresponde.
+    """
     # Tipo de factura (F1 completa, F2 simplificada tipo ticket)
     tipo_factura = registro_factura.get("tipo_factura", "F1")
 
@@ -344,21 +413,7 @@ def crear_envelope_soap(
             "</sf:Encadenamiento>"
         )
 
-    # ------------------------------------------------------------------ #
-    #  Envelope
-    # ------------------------------------------------------------------ #
-    envelope = f"""<?xml version="1.0" encoding="UTF-8"?>
-<soapenv:Envelope xmlns:soapenv="{ns_soap}" xmlns:lr="{ns_lr}" xmlns:sf="{ns_sf}">
-  <soapenv:Header/>
-  <soapenv:Body>
-    <lr:RegFactuSistemaFacturacion>
-      <lr:Cabecera>
-        <sf:ObligadoEmision>
-          <sf:NombreRazon>{nombre}</sf:NombreRazon>
-          <sf:NIF>{nif}</sf:NIF>
-        </sf:ObligadoEmision>
-      </lr:Cabecera>
-      <lr:RegistroFactura>
+    registro_xml = f"""      <lr:RegistroFactura>
         <sf:RegistroAlta>
           <!-- 1 -->
           <sf:IDVersion>1.0</sf:IDVersion>
@@ -409,11 +464,63 @@ def crear_envelope_soap(
           <sf:Huella>{huella}</sf:Huella>{"" if not factura_firmada_b64 else f"""
           <sf:FacturaFirmada>{factura_firmada_b64}</sf:FacturaFirmada>"""}
         </sf:RegistroAlta>
-      </lr:RegistroFactura>
+      </lr:RegistroFactura>"""
+    logger.info("[SOAP] PrimerRegistro=%s, HuellaAnterior=%s", primer_val, (huella_anterior[:10] + '...') if huella_anterior else None)
+    return registro_xml, huella, f"{serie}{numero}", fecha_exp
+
+
+def _envelope_soap(nombre: str, nif: str, registros_xml: list[str]) -> str:
+    """Envelope RegFactuSistemaFacturacion con una cabecera y los registros indicados"""
+    ns_soap = "http://schemas.xmlsoap.org/soap/envelope/"
+    ns_lr   = ("https://www2.agenciatributaria.gob.es/static_files/common/"
+               "internet/dep/aplicaciones/es/aeat/tike/cont/ws/SuministroLR.xsd")
+    ns_sf   = ("https://www2.agenciatributaria.gob.es/static_files/common/"
+               "internet/dep/aplicaciones/es/aeat/tike/cont/ws/SuministroInformacion.xsd")
+    registros = "\n".join(registros_xml)
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="{ns_soap}" xmlns:lr="{ns_lr}" xmlns:sf="{ns_sf}">
+  <soapenv:Header/>
+  <soapenv:Body>
+    <lr:RegFactuSistemaFacturacion>
+      <lr:Cabecera>
+        <sf:ObligadoEmision>
+          <sf:NombreRazon>{nombre}</sf:NombreRazon>
+          <sf:NIF>{nif}</sf:NIF>
+        </sf:ObligadoEmision>
+      </lr:Cabecera>
+{registros}
     </lr:RegFactuSistemaFacturacion>
   </soapenv:Body>
 </soapenv:Envelope>"""
-    logger.info("[SOAP] PrimerRegistro=%s, HuellaAnterior=%s", primer_val, (huella_anterior[:10] + '...') if huella_anterior else None)
+
+
+def crear_envelope_soap(
+    operacion: str,           # NO se usa, pero se conserva la firma pública
+    cabecera: dict,           #   »   »      »      »
+    registro_factura: dict,
+    nif_emisor: str,
+    factura_firmada_b64: str | None = None,
+    huella_anterior: str | None = None,
+    primer_registro: str | None = None,
+    ajuste_fecha_minuto: bool = False,
+    huella_fija: str | None = None,
+) -> tuple[str, str]:  # Devuelve (envelope_xml, huella)
+    """
+    Devuelve el envelope SOAP con el **orden exacto de nodos** que
+    exige el XSD de VERI*FACTU (evita el 4102 “Falta informar campo
+    obligatorio: Encadenamiento / Desglose”).
+
+    Únicamente genera el XML; la lógica de BD, red, certificados, etc.
+    permanece intacta.
+    """
+    nif = nif_emisor.strip().upper()
+    cfg_emisor = _cargar_config_emisor()
+    # Prioridad: valor explícito en registro_factura > configuración JSON > valor por defecto
+    nombre = registro_factura.get("nombre_emisor", cfg_emisor.get("nombre", "EMISOR VERIFACTU"))
+    registro_xml, huella, _, _ = _registro_alta(
+        registro_factura, nif, nombre, factura_firmada_b64, huella_anterior, primer_registro, huella_fija
+    )
+    envelope = _envelope_soap(nombre, nif, [registro_xml])
     logger.info("[SOAP] Envelope generado (primeros 500 chars): %s", envelope[:500].replace('\n',''))
     return envelope, huella
 
@@ -583,36 +690,17 @@ def enviar_registro_aeat(factura_id: int) -> dict:
         'https://prewww1.aeat.es/wlpl/TIKE-CONT/ws/SistemaFacturacion/VerifactuSOAP'
     )
 
-    cert_dir = os.environ.get('VERIFACTU_CERT_DIR')
-    if not cert_dir:
-        for cand in ('/var/www/html/certs', os.path.join(base_dir, 'certs')):
-            if os.path.exists(cand):
-                cert_dir = cand
-                break
-        else:
-            cert_dir = os.path.join(base_dir, 'certs')
-    
-    cert_path = os.path.join(cert_dir, 'cert_real.pem')
-    key_path = os.path.join(cert_dir, 'clave_real.pem')
+    cert_dir, cert_path, key_path = rutas_certificado_aeat()
 
     if not (os.path.exists(cert_path) and os.path.exists(key_path)):
         logger.error("Certificados SSL no encontrados dentro de %s", cert_dir)
         return {'success': False, 'message': 'Certificados SSL no encontrados', 'cert_dir': cert_dir}
 
-    headers = {
-        'Content-Type': 'text/xml;charset=UTF-8',
-        'SOAPAction': '""'
-    }
-
     try:
-        logger.info("requests.post real function: %s (module %s)", requests.post, getattr(requests.post, '__module__', 'unknown'))
-        response = requests.post(
+        response = obtener_sesion_aeat(cert_path, key_path).post(
             service_url,
             data=envelope_xml.encode('utf-8'),
-            headers=headers,
-            cert=(cert_path, key_path),
             timeout=10,  # Reducido de 60s a 10s para mejor UX
-            verify=True
         )
         logger.info("AEAT raw response object: %s - type=%s - has_status=%s", repr(response)[:300] if response is not None else 'None', type(response).__name__ if response is not None else 'NoneType', hasattr(response, 'status_code'))
     except requests.RequestException as exc:
@@ -637,30 +725,7 @@ def enviar_registro_aeat(factura_id: int) -> dict:
 
     logger.info("Envío completado correctamente (HTTP 200)")
     # --- Guardado de la respuesta SOAP ---
-    now = datetime.now()
-    timestamp = now.strftime("%Y%m%d%H%M%S")
-    base_dir = "/var/www/html/aeat_responses"
-    # Obtener empresa_id de la sesión o usar por defecto
-    empresa_id = os.environ.get('EMPRESA_CODIGO', 'caca')
-    # Organizar por empresa/año/mes: aeat_responses/empresa_id/YYYY/MM
-    empresa_dir = os.path.join(base_dir, str(empresa_id))
-    year_dir = os.path.join(empresa_dir, now.strftime("%Y"))
-    resp_dir = os.path.join(year_dir, now.strftime("%m"))
-    try:
-        os.makedirs(resp_dir, mode=0o777, exist_ok=True)
-        file_path = os.path.join(resp_dir, f"factura_{factura_id}_{timestamp}.xml")
-        with open(file_path, "w", encoding="utf-8") as fh:
-            fh.write(response.text)
-        logger.info("Respuesta AEAT guardada en %s", file_path)
-    except Exception as exc:
-        logger.warning("No se pudo guardar respuesta AEAT en %s: %s", resp_dir, exc)
-
-    # Copia rápida en /tmp para depuración
-    try:
-        with open('/tmp/aeat_last.xml', 'w', encoding='utf-8') as fh:
-            fh.write(response.text)
-    except Exception:
-        pass
+    _guardar_respuesta_fichero(f"factura_{factura_id}", response.text)
 
     # Guardar también en la base de datos
     try:
@@ -720,6 +785,218 @@ def enviar_registro_aeat(factura_id: int) -> dict:
         'response': response.text
     }
 
+def _nif_emisor_configurado():
+    """NIF del JSON del emisor de EMPRESA_CODIGO, para facturas sin NIF emisor"""
+    try:
+        import json
+        empresa_codigo = os.environ.get('EMPRESA_CODIGO', 'caca')
+        emisor_path = f'/var/www/html/emisores/{empresa_codigo}_emisor.json'
+        if os.path.exists(emisor_path):
+            with open(emisor_path, 'r') as f:
+                return json.load(f).get('nif', '').strip().upper()
+    except Exception as e:
+        logger.error(f"Error obteniendo NIF del emisor desde configuración: {e}")
+    return ''
+
+
+def _leer_facturas_lote(factura_ids):
+    """Datos de envío de las facturas y de su registro, con una sola conexión"""
+    from db_utils import get_db_connection
+    from verifactu.db.registro import _ensure_column_exists
+    _ensure_column_exists("huella_aeat")
+    filas = {}
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        for i in range(0, len(factura_ids), 500):
+            bloque = factura_ids[i:i + 500]
+            cur.execute(
+                f"""
+                SELECT f.id, f.numero AS numero_factura, f.fecha AS fecha_emision, f.total AS importe_total,
+                       f.hash_factura, f.nif AS nif_emisor, c.identificador AS nif_receptor,
+                       c.razonsocial AS nombre_receptor, r.huella_aeat,
+                       (SELECT a.hash FROM registro_facturacion a
+                         WHERE substr(a.fecha_emision, 1, 10) = substr(f.fecha, 1, 10) AND a.id < r.id
+                         ORDER BY a.id DESC LIMIT 1) AS hash_anterior
+                  FROM factura f
+                  INNER JOIN contactos c ON f.idContacto = c.idContacto
+                  LEFT JOIN registro_facturacion r ON r.factura_id = f.id
+                 WHERE f.id IN ({','.join('?' * len(bloque))})
+                """,
+                bloque
+            )
+            for row in cur.fetchall():
+                filas[row['id']] = dict(row)
+    finally:
+        conn.close()
+    return filas
+
+
+def enviar_registros_aeat_lote(factura_ids, max_registros=None) -> dict:
+    """
+    Envía a la AEAT los registros de varias facturas: se agrupan por NIF
+    emisor y cada envelope lleva hasta `max_registros` registros (límite del
+    servicio). Los datos se leen con una sola consulta y todos los envíos
+    usan la sesión HTTP con el certificado ya cargado.
+
+    Cada RegistroAlta se prepara como en enviar_registro_aeat, salvo la
+    huella anterior: es la del registro previo del mismo día de esa factura,
+    no la del último registro de la BD, porque el lote puede incluir
+    facturas antiguas.
+
+    Args:
+        factura_ids (list[int]): Facturas a enviar, en orden de encadenamiento.
+        max_registros (int): Registros por envelope (por defecto AEAT_CONFIG).
+
+    Returns:
+        dict: {factura_id: resultado}, cada resultado con el formato de enviar_registro_aeat.
+    """
+    max_registros = max_registros or AEAT_CONFIG['max_registros_envio']
+    factura_ids = list(dict.fromkeys(factura_ids))
+    resultados = {}
+    if not factura_ids:
+        return resultados
+
+    try:
+        filas = _leer_facturas_lote(factura_ids)
+    except Exception as e:
+        logger.error("Error obteniendo facturas del lote: %s", e)
+        return {fid: {'success': False, 'message': f'Error de base de datos: {str(e)}'} for fid in factura_ids}
+
+    # Agrupar por NIF emisor conservando el orden recibido
+    grupos = {}
+    nif_configurado = None
+    for factura_id in factura_ids:
+        row = filas.get(factura_id)
+        if row is None:
+            resultados[factura_id] = {'success': False, 'message': f'No existe la factura con id {factura_id}'}
+            continue
+        nif = (row['nif_emisor'] or '').strip().upper()
+        if not nif:
+            if nif_configurado is None:
+                nif_configurado = _nif_emisor_configurado()
+            nif = nif_configurado
+        if not nif:
+            resultados[factura_id] = {'success': False, 'message': 'No se pudo determinar el NIF del emisor'}
+            continue
+        grupos.setdefault(nif, []).append(factura_id)
+
+    cert_dir, cert_path, key_path = rutas_certificado_aeat()
+    if not (os.path.exists(cert_path) and os.path.exists(key_path)):
+        logger.error("Certificados SSL no encontrados dentro de %s", cert_dir)
+        for ids in grupos.values():
+            for factura_id in ids:
+                resultados[factura_id] = {'success': False, 'message': 'Certificados SSL no encontrados', 'cert_dir': cert_dir}
+        return resultados
+
+    sesion = obtener_sesion_aeat(cert_path, key_path)
+    cfg_emisor = _cargar_config_emisor()
+    nombre = cfg_emisor.get("nombre", "EMISOR VERIFACTU")
+    for nif, ids in grupos.items():
+        for i in range(0, len(ids), max_registros):
+            resultados.update(_enviar_lote_nif(sesion, nif, nombre, [(fid, filas[fid]) for fid in ids[i:i + max_registros]]))
+    return resultados
+
+
+def _enviar_lote_nif(sesion, nif, nombre, facturas):
+    """Un envelope con los registros de un NIF emisor; devuelve {factura_id: resultado}"""
+    from verifactu.db.registro import (actualizar_huella_primer_registro,
+                                       actualizar_primer_registro_por_id,
+                                       calcular_primer_registro_exacto,
+                                       guardar_csv_aeat, guardar_huella_aeat_por_id)
+    from verifactu.db.respuesta_xml import guardar_respuesta_xml
+
+    # Solo el primer registro de un NIF sin registros aceptados es PrimerRegistro
+    primer_nif = calcular_primer_registro_exacto(nif, '', '')
+    registros = []
+    for factura_id, row in facturas:
+        serie, numero_factura = procesar_serie_numero(row['numero_factura'])
+        primer_registro = primer_nif if not registros else 'N'
+        huella_anterior = row['hash_anterior'] if primer_registro == 'N' else None
+        try:
+            actualizar_huella_primer_registro(nif, serie, numero_factura, None, primer_registro)
+        except Exception as exc:
+            logger.warning("No se pudo actualizar primer_registro en BD: %s", exc)
+        registro_factura = {
+            'numero_factura': numero_factura,
+            'serie_factura': serie,
+            'fecha_emision': row['fecha_emision'],
+            'importe_total': row['importe_total'],
+            'hash_factura': row['hash_factura'],
+            'nif_receptor': (row['nif_receptor'] or '').strip().upper(),
+            'nombre_receptor': row['nombre_receptor'] or '',
+        }
+        xml, huella, num_serie, fecha_exp = _registro_alta(
+            registro_factura, nif, nombre, None, huella_anterior, primer_registro, row['huella_aeat']
+        )
+        registros.append((factura_id, xml, huella, num_serie, fecha_exp, primer_registro))
+
+    envelope_xml = _envelope_soap(nombre, nif, [registro[1] for registro in registros])
+    service_url = os.environ.get(
+        'AEAT_VERIFACTU_URL',
+        'https://prewww1.aeat.es/wlpl/TIKE-CONT/ws/SistemaFacturacion/VerifactuSOAP'
+    )
+    logger.info("Enviando %s registros del NIF %s a AEAT (VERI*FACTU) en un envelope", len(registros), nif)
+
+    fallo = None
+    try:
+        response = sesion.post(service_url, data=envelope_xml.encode('utf-8'), timeout=AEAT_CONFIG['timeout'])
+        if response.status_code != 200:
+            logger.error("Respuesta HTTP %s de AEAT", response.status_code)
+            fallo = {'success': False, 'status_code': response.status_code, 'response': response.text[:500]}
+    except requests.RequestException as exc:
+        logger.exception("Error de red al enviar lote a AEAT: %s", exc)
+        fallo = {'success': False, 'message': repr(exc)}
+    if fallo:
+        return {registro[0]: dict(fallo) for registro in registros}
+
+    _guardar_respuesta_fichero(f"lote_{nif}", response.text)
+    datos_resp = parsear_respuesta_aeat(response.text)
+    estado_envio_ws = datos_resp.get('estado_envio')
+    csv = datos_resp.get('csv')
+    lineas = {(l.get('num_serie_factura'), l.get('fecha_expedicion')): l for l in datos_resp.get('lineas', [])}
+
+    resultados = {}
+    for factura_id, _, huella, num_serie, fecha_exp, primer_registro in registros:
+        linea = lineas.get((num_serie, fecha_exp))
+        if linea is not None:
+            estado_registro = linea.get('estado_registro') or linea.get('resultado')
+            aceptado = estado_registro in ('Correcto', 'AceptadoConErrores')
+            errores = []
+            if linea.get('codigo_error_registro') or linea.get('descripcion_error_registro'):
+                errores.append({
+                    'codigo': linea.get('codigo_error_registro'),
+                    'descripcion': linea.get('descripcion_error_registro'),
+                    'resultado': estado_registro,
+                })
+        else:
+            # Sin línea para el registro: solo vale si el envío entero es correcto
+            estado_registro = None
+            aceptado = estado_envio_ws == 'Correcto'
+            errores = [] if aceptado else (datos_resp.get('errores') or [{'codigo': None, 'descripcion': 'Registro sin respuesta de la AEAT', 'resultado': None}])
+
+        try:
+            guardar_respuesta_xml(factura_id, response.text)
+            actualizar_primer_registro_por_id(factura_id, primer_registro)
+            if aceptado:
+                # La huella solo encadena si la AEAT ha aceptado el registro
+                guardar_huella_aeat_por_id(factura_id, huella)
+                if csv:
+                    guardar_csv_aeat(factura_id, csv)
+        except Exception as exc:
+            logger.warning("No se pudo guardar la respuesta AEAT de la factura %s: %s", factura_id, exc)
+
+        resultados[factura_id] = {
+            'success': aceptado,
+            'status_code': 200,
+            'errores': errores,
+            'csv': csv if aceptado else None,
+            'huella': huella,
+            'estado_envio': estado_envio_ws,
+            'estado_registro': estado_registro,
+        }
+    return resultados
+
 def obtener_nif_certificado(cert_path):
     """
     Extrae el NIF del certificado digital
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stub local del servicio SOAP de la AEAT para VERI*FACTU.
+
+Sustituye a `verifactu.soap.client.enviar_registro_aeat` en pruebas y
+entornos de desarrollo (VERIFACTU_OUTBOX_CONFIG['ENVIO'] = 'local'): no sale
+a red ni necesita certificados y responde como una aceptación de la AEAT,
+con un CSV derivado del id de la factura.
+"""
+
+import hashlib
+import logging
+import time
+
+from multiempresa_config import VERIFACTU_OUTBOX_CONFIG
+
+logger = logging.getLogger('verifactu')
+
+
+def enviar_registro_aeat_local(factura_id: int) -> dict:
+    """
+    Simula el envío del registro de la factura a la AEAT.
+
+    Args:
+        factura_id (int): Identificador de la factura almacenada en la BD.
+
+    Returns:
+        dict: Mismo formato que enviar_registro_aeat en caso de éxito.
+    """
+    latencia = VERIFACTU_OUTBOX_CONFIG['LATENCIA_LOCAL']
+    if latencia:
+        time.sleep(latencia)
+    csv = 'LOCAL' + hashlib.sha256(str(factura_id).encode()).hexdigest()[:11].upper()
+    logger.info("Envío simulado de la factura %s (stub local): CSV=%s", factura_id, csv)
+    return {
+        'success': True,
+        'csv': csv,
+        'id_verificacion': csv,
+        'estado_envio': 'Correcto',
+        'mensaje': 'Registro aceptado por el stub local'
+    }
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OUTBOX DE FACTURAE Y VERI*FACTU
+===============================
+crear_factura generaba y firmaba el XML Facturae, encadenaba el hash
+VERI*FACTU, generaba el QR y enviaba el registro a la AEAT dentro de la
+petición HTTP: varios segundos por factura, y un fallo de red dejaba la
+factura sin enviar hasta que alguien la reenviaba a mano.
+
+Ahora crear_factura solo inserta una fila en verifactu_outbox, en la misma
+transacción que la factura, y un worker aparte (scripts/verifactu_worker.py)
+vacía la tabla de cada empresa:
+- idempotencia: una fila por factura_id; si el registro de facturación ya
+  consta como ENVIADO la fila se cierra sin volver a enviar
+- orden por empresa: las filas se procesan por id. Una fila a la espera de
+  reintento solo bloquea a las siguientes mientras su factura no tiene
+  registro_facturacion: el hash se encadena y el registro se inserta antes
+  del envío, así que a partir de ahí el orden de la cadena ya está fijado
+- reintentos con espera exponencial hasta MAX_INTENTOS; después la fila
+  queda en 'error' para revisarla y la cola sigue. Un rechazo de la AEAT
+  por el contenido del registro no se reintenta: pasa a 'error' al momento
+- reserva con caducidad: si el worker muere a mitad de una fila, se retoma
+  cuando caduca la reserva
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from facturas_email_pipeline import bd_empresa
+from logger_config import get_logger
+from multiempresa_config import DB_USUARIOS_PATH, VERIFACTU_OUTBOX_CONFIG
+
+logger = get_logger(__name__)
+
+ESQUEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS verifactu_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        factura_id INTEGER NOT NULL UNIQUE,
+        payload TEXT NOT NULL,
+        estado TEXT NOT NULL DEFAULT 'pendiente',  -- pendiente, enviado, error
+        intentos INTEGER NOT NULL DEFAULT 0,
+        proximo_intento REAL NOT NULL DEFAULT 0,
+        bloqueado_hasta REAL NOT NULL DEFAULT 0,
+        ultimo_error TEXT,
+        creado TEXT NOT NULL,
+        actualizado TEXT NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_verifactu_outbox_estado ON verifactu_outbox (estado, id)'
+)
+
+
+def crear_tabla(conn: sqlite3.Connection):
+    """Crea la tabla si no existe. Sin executescript: no cierra la transacción abierta"""
+    for sentencia in ESQUEMA:
+        conn.execute(sentencia)
+
+
+def encolar_factura(conn: sqlite3.Connection, factura_id: int, payload: Dict[str, Any]):
+    """
+    Añade la factura a la outbox dentro de la transacción abierta en conn; el
+    commit es del llamante. Si la factura ya estaba en cola y no se ha enviado,
+    se actualizan sus datos y vuelve a pendiente.
+    """
+    crear_tabla(conn)
+    ahora = datetime.now().isoformat()
+    conn.execute(
+        '''
+        INSERT INTO verifactu_outbox (factura_id, payload, creado, actualizado) VALUES (?, ?, ?, ?)
+        ON CONFLICT (factura_id) DO UPDATE SET
+            payload = excluded.payload, estado = 'pendiente', intentos = 0, proximo_intento = 0,
+            ultimo_error = NULL, actualizado = excluded.actualizado
+        WHERE verifactu_outbox.estado != 'enviado'
+        ''',
+        (factura_id, json.dumps(payload, ensure_ascii=False, default=str), ahora, ahora)
+    )
+
+
+def estado_outbox(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Filas de la outbox por estado ({} si la empresa aún no tiene tabla)"""
+    try:
+        return dict(conn.execute('SELECT estado, COUNT(*) FROM verifactu_outbox GROUP BY estado').fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+
+def empresas_activas() -> List[Dict[str, Any]]:
+    """Código y ruta de BD de las empresas activas"""
+    try:
+        conn = sqlite3.connect(DB_USUARIOS_PATH)
+        try:
+            filas = conn.execute('SELECT codigo, db_path FROM empresas WHERE activa = 1 ORDER BY id').fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Error obteniendo empresas: {e}")
+        return []
+    return [{'codigo': codigo, 'db_path': db_path} for codigo, db_path in filas if db_path]
+
+
+def obtener_envio() -> Callable[[int], dict]:
+    """Función de envío a la AEAT según VERIFACTU_OUTBOX_CONFIG['ENVIO']"""
+    if VERIFACTU_OUTBOX_CONFIG['ENVIO'] == 'local':
+        from verifactu.soap.stub import enviar_registro_aeat_local
+        return enviar_registro_aeat_local
+    from verifactu.soap.client import enviar_registro_aeat
+    return enviar_registro_aeat
+
+
+class RechazoAEAT(Exception):
+    """La AEAT ha rechazado el registro por su contenido: reenviarlo igual no sirve"""
+
+
+def rechazo_definitivo(resultado_envio: Optional[dict]) -> bool:
+    """
+    True si la AEAT respondió (HTTP 200, sin SOAP Fault) y rechazó el registro.
+    Los errores de red, HTTP distinto de 200 o Fault se reintentan.
+    """
+    if not resultado_envio or resultado_envio.get('success') or resultado_envio.get('status_code') != 200:
+        return False
+    if any((error or {}).get('resultado') == 'Fault' for error in resultado_envio.get('errores') or []):
+        return False
+    return resultado_envio.get('estado_envio') == 'Incorrecto'
+
+
+def procesar_factura(codigo: str, factura_id: int, payload: Dict[str, Any], intentos: int,
+                     enviar: Callable[[int], dict]) -> Optional[str]:
+    """
+    Facturae y VERI*FACTU de una factura. Devuelve None si el registro ha
+    quedado enviado o el motivo del fallo. El XML Facturae solo se genera en
+    el primer intento: sus errores se registran pero no se reintentan, igual
+    que cuando se generaba dentro de la petición.
+
+    Raises:
+        RechazoAEAT: Si la AEAT ha rechazado el registro (no se reintenta)
+    """
+    # factura importa este módulo: importación diferida
+    from factura import generar_facturae_factura
+    from utils_emisor import cargar_datos_emisor
+    from verifactu.core import generar_datos_verifactu_para_factura
+
+    def push_notif(msg, tipo='info', scope='factura'):
+        logger.info(f"[OUTBOX][{codigo}][{factura_id}][{tipo}] {msg}")
+
+    if intentos == 0:
+        generar_facturae_factura(factura_id, payload['data'], payload.get('presentar_face', 0), push_notif,
+                                 emisor=cargar_datos_emisor(codigo))
+
+    respuestas = []
+
+    def enviar_registrando(id_factura):
+        respuestas.append(enviar(id_factura))
+        return respuestas[-1]
+
+    resultado = generar_datos_verifactu_para_factura(factura_id, empresa_codigo=codigo, enviar=enviar_registrando) or {}
+    datos = resultado.get('datos') or {}
+    if resultado.get('success') and datos.get('estado_envio') == 'ENVIADO':
+        return None
+    motivo = datos.get('mensaje_error') or resultado.get('mensaje') or 'Envío a la AEAT no confirmado'
+    if respuestas and rechazo_definitivo(respuestas[-1]):
+        errores = ' | '.join(f"{error.get('codigo', 'N/A')}: {error.get('descripcion', 'Sin descripción')}"
+                             for error in respuestas[-1].get('errores') or [])
+        raise RechazoAEAT(errores or motivo)
+    return motivo
+
+
+@dataclass
+class OutboxMetrics:
+    """Métricas del worker de la outbox"""
+    vueltas: int = 0
+    procesadas: int = 0
+    enviadas: int = 0
+    ya_enviadas: int = 0  # cerradas sin reenviar: el registro ya constaba como ENVIADO
+    reintentos: int = 0
+    errores: int = 0  # filas que agotaron los intentos
+    rechazadas: int = 0  # filas rechazadas por la AEAT, sin reintento
+    segundos: float = 0.0
+
+
+class WorkerOutbox:
+    """
+    Vacía la outbox de cada empresa. Un único hilo: get_db_connection() y
+    VERI*FACTU eligen la BD por EMPRESA_DB_PATH / EMPRESA_CODIGO, que son
+    globales del proceso.
+
+    procesar(codigo, factura_id, payload, intentos) -> None | motivo del fallo
+    sustituye a procesar_factura (pruebas); puede lanzar RechazoAEAT.
+    """
+
+    def __init__(self, procesar: Callable = None, enviar: Callable[[int], dict] = None,
+                 max_intentos: int = None, espera_base: float = None, espera_max: float = None,
+                 bloqueo: float = None, lote: int = None):
+        envio = enviar or obtener_envio()
+        self.procesar = procesar or (
+            lambda codigo, factura_id, payload, intentos: procesar_factura(codigo, factura_id, payload, intentos, envio)
+        )
+        self.max_intentos = max_intentos or VERIFACTU_OUTBOX_CONFIG['MAX_INTENTOS']
+        self.espera_base = espera_base if espera_base is not None else VERIFACTU_OUTBOX_CONFIG['ESPERA_BASE']
+        self.espera_max = espera_max if espera_max is not None else VERIFACTU_OUTBOX_CONFIG['ESPERA_MAX']
+        self.bloqueo = bloqueo or VERIFACTU_OUTBOX_CONFIG['BLOQUEO']
+        self.lote = lote or VERIFACTU_OUTBOX_CONFIG['LOTE']
+        self.metrics = OutboxMetrics()
+
+    def espera(self, intentos: int) -> float:
+        """Segundos hasta el siguiente intento tras `intentos` fallos"""
+        return min(self.espera_base * 2 ** (intentos - 1), self.espera_max)
+
+    def procesar_empresa(self, codigo: str, db_path: str) -> int:
+        """Procesa hasta LOTE filas de la empresa, en orden; devuelve cuántas"""
+        conn = sqlite3.connect(db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        procesadas = 0
+        try:
+            if not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'verifactu_outbox'"
+            ).fetchone():
+                return 0
+            with bd_empresa(db_path):
+                while procesadas < self.lote:
+                    fila = self._reservar(conn)
+                    if fila is None:
+                        break
+                    self._ejecutar(conn, codigo, fila)
+                    procesadas += 1
+        finally:
+            conn.close()
+        return procesadas
+
+    def _pendientes(self, conn):
+        """Filas pendientes por id, indicando si su factura ya tiene registro de facturación"""
+        try:
+            return conn.execute(
+                "SELECT o.*, EXISTS (SELECT 1 FROM registro_facturacion r WHERE r.factura_id = o.factura_id)"
+                " AS registrada FROM verifactu_outbox o WHERE o.estado = 'pendiente' ORDER BY o.id"
+            )
+        except sqlite3.OperationalError:
+            # Empresa sin registro_facturacion: ninguna factura encadenada todavía
+            return conn.execute(
+                "SELECT *, 0 AS registrada FROM verifactu_outbox WHERE estado = 'pendiente' ORDER BY id"
+            )
+
+    def _reservar(self, conn) -> Optional[sqlite3.Row]:
+        """
+        Primera fila pendiente de la empresa a la que ya le toca. Una fila que
+        espera reintento o está reservada bloquea a las de detrás solo si su
+        factura aún no tiene registro (su hash no está encadenado); si ya lo
+        tiene, se salta.
+        """
+        ahora = time.time()
+        fila = None
+        pendientes = self._pendientes(conn)
+        try:
+            for candidata in pendientes:
+                if candidata['proximo_intento'] <= ahora and candidata['bloqueado_hasta'] <= ahora:
+                    fila = candidata
+                    break
+                if not candidata['registrada']:
+                    break
+        finally:
+            pendientes.close()
+        if fila is None:
+            return None
+        # Reserva atómica: si otro worker la ha cogido entre medias, no se toca
+        reservada = conn.execute(
+            "UPDATE verifactu_outbox SET bloqueado_hasta = ?"
+            " WHERE id = ? AND estado = 'pendiente' AND bloqueado_hasta = ?",
+            (ahora + self.bloqueo, fila['id'], fila['bloqueado_hasta'])
+        ).rowcount
+        conn.commit()
+        return fila if reservada else None
+
+    def _ya_enviada(self, conn, factura_id: int) -> bool:
+        try:
+            fila = conn.execute(
+                'SELECT estado_envio FROM registro_facturacion WHERE factura_id = ?', (factura_id,)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            return False
+        return fila is not None and fila[0] == 'ENVIADO'
+
+    def _ejecutar(self, conn, codigo: str, fila: sqlite3.Row):
+        factura_id = fila['factura_id']
+        inicio = time.perf_counter()
+        rechazo = None
+        if self._ya_enviada(conn, factura_id):
+            error = None
+            self.metrics.ya_enviadas += 1
+        else:
+            try:
+                error = self.procesar(codigo, factura_id, json.loads(fila['payload']), fila['intentos'])
+            except RechazoAEAT as e:
+                error = rechazo = str(e) or 'Registro rechazado por la AEAT'
+            except Exception as e:
+                logger.error(f"[OUTBOX][{codigo}] Error procesando factura {factura_id}: {e}", exc_info=True)
+                error = str(e) or type(e).__name__
+            if error is None:
+                self.metrics.enviadas += 1
+        self.metrics.procesadas += 1
+        self.metrics.segundos += time.perf_counter() - inicio
+
+        intentos = fila['intentos'] + 1
+        ahora = datetime.now().isoformat()
+        if error is None:
+            conn.execute(
+                "UPDATE verifactu_outbox SET estado = 'enviado', intentos = ?, bloqueado_hasta = 0,"
+                " ultimo_error = NULL, actualizado = ? WHERE id = ?", (intentos, ahora, fila['id'])
+            )
+            logger.info(f"[OUTBOX][{codigo}] Factura {factura_id} enviada")
+        elif rechazo is not None or intentos >= self.max_intentos:
+            conn.execute(
+                "UPDATE verifactu_outbox SET estado = 'error', intentos = ?, bloqueado_hasta = 0,"
+                " ultimo_error = ?, actualizado = ? WHERE id = ?", (intentos, error, ahora, fila['id'])
+            )
+            if rechazo is not None:
+                self.metrics.rechazadas += 1
+                logger.error(f"[OUTBOX][{codigo}] Factura {factura_id} rechazada por la AEAT, sin reintento: {error}")
+            else:
+                self.metrics.errores += 1
+                logger.error(f"[OUTBOX][{codigo}] Factura {factura_id} sin enviar tras {intentos} intentos: {error}")
+        else:
+            espera = self.espera(intentos)
+            conn.execute(
+                "UPDATE verifactu_outbox SET intentos = ?, proximo_intento = ?, bloqueado_hasta = 0,"
+                " ultimo_error = ?, actualizado = ? WHERE id = ?",
+                (intentos, time.time() + espera, error, ahora, fila['id'])
+            )
+            self.metrics.reintentos += 1
+            logger.warning(f"[OUTBOX][{codigo}] Factura {factura_id}: {error}. Reintento {intentos} en {espera:.0f}s")
+        conn.commit()
+
+    def vuelta(self, empresas: List[Dict[str, Any]] = None) -> int:
+        """Una pasada por todas las empresas; devuelve las filas procesadas"""
+        procesadas = 0
+        anterior = os.environ.get('EMPRESA_CODIGO')
+        try:
+            for empresa in empresas if empresas is not None else empresas_activas():
+                try:
+                    procesadas += self.procesar_empresa(empresa['codigo'], empresa['db_path'])
+                except sqlite3.Error as e:
+                    logger.error(f"[OUTBOX][{empresa['codigo']}] Error de BD: {e}")
+        finally:
+            # generar_datos_verifactu_para_factura fija EMPRESA_CODIGO
+            if anterior is None:
+                os.environ.pop('EMPRESA_CODIGO', None)
+            else:
+                os.environ['EMPRESA_CODIGO'] = anterior
+        self.metrics.vueltas += 1
+        return procesadas
+
+    def ejecutar(self, parar: threading.Event = None, intervalo: float = None):
+        """Vueltas hasta que se active `parar`; espera `intervalo` cuando no hay trabajo"""
+        parar = parar or threading.Event()
+        intervalo = intervalo if intervalo is not None else VERIFACTU_OUTBOX_CONFIG['INTERVALO']
+        while not parar.is_set():
+            if not self.vuelta():
+                parar.wait(intervalo)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        metricas = asdict(self.metrics)
+        metricas['segundos'] = round(metricas['segundos'], 3)
+        return metricas